@@ -0,0 +1,183 @@
+import threading
+import time
+
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+DEFAULT_BATCH_SIZE      = 100;
+DEFAULT_BATCH_MAX_AGE   = 1.0;
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def getBatchPayload(values, timestamps):
+    """
+        Get a dictionary instance representing a batch device event payload.
+
+        The payload is columnar: the values and their time offsets are sent as
+        two parallel arrays. The offsets are expressed in milliseconds relative
+        to the timestamp of the first value.
+
+        Args:
+            values:     A list instance containing the numbers of the batch.
+            timestamps: A list instance containing the epoch timestamps (in seconds) of the numbers.
+
+        Returns:
+            A dictionary instance representing the device event payload.
+
+        Raises:
+            None.
+    """
+    firstTimestamp = timestamps[0];
+
+    return {
+        "numbers"   : values,
+        "t0"        : firstTimestamp,
+        "dt"        : [int(round((timestamp - firstTimestamp) * 1000)) for timestamp in timestamps]
+    };
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+class EventBatcher(object):
+    """
+        Thread-safe accumulator flushing readings as a single batch device event
+        when the batch is full or when its oldest reading is too old.
+    """
+
+    def __init__(self, flushFunction, maxCount = DEFAULT_BATCH_SIZE, maxAge = DEFAULT_BATCH_MAX_AGE):
+        """
+            Initialize the batcher and start its age timer thread.
+
+            Args:
+                flushFunction:  A callable publishing a batch device event payload.
+                maxCount:       An integer representing the maximum number of readings of a batch.
+                maxAge:         A float representing the maximum number of seconds a reading waits to be flushed.
+
+            Returns:
+                None.
+
+            Raises:
+                ValueError if one of the arguments is invalid.
+        """
+        if maxCount < 1:
+            raise ValueError("The batch size should be positive, not %d." % maxCount);
+
+        if maxAge <= 0:
+            raise ValueError("The batch maximum age should be positive.");
+
+        self.flushFunction  = flushFunction;
+        self.maxCount       = maxCount;
+        self.maxAge         = maxAge;
+
+        self.flushedBatches = 0;
+        self.flushedValues  = 0;
+
+        self._values        = [];
+        self._timestamps    = [];
+        self._deadline      = None;
+        self._closed        = False;
+        self._condition     = threading.Condition(threading.Lock());
+        self._flushLock     = threading.Lock();
+
+        self._thread        = threading.Thread(target=self._flushExpiredBatches, name="batcher");
+        self._thread.daemon = True;
+        self._thread.start();
+
+    def add(self, value, timestamp = None):
+        """
+            Add a reading to the current batch, flushing the batch if it is full.
+
+            Args:
+                value:      The reading.
+                timestamp:  A float representing the epoch timestamp of the reading in seconds,
+                            or None to use the current time.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        with self._condition:
+            # Start the age timer of the batch
+            if not self._values:
+                self._deadline = time.monotonic() + self.maxAge;
+                self._condition.notify();
+
+            self._values.append(value);
+            self._timestamps.append(time.time() if timestamp is None else timestamp);
+
+            isFull = len(self._values) >= self.maxCount;
+
+        if isFull:
+            self.flush();
+
+    def flush(self):
+        """
+            Publish the current batch, if it is not empty.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        # Batches are published one at a time so that they are received in order
+        with self._flushLock:
+            with self._condition:
+                values, timestamps  = self._values, self._timestamps;
+
+                self._values        = [];
+                self._timestamps    = [];
+                self._deadline      = None;
+
+            if values:
+                self.flushFunction(getBatchPayload(values, timestamps));
+
+                self.flushedBatches += 1;
+                self.flushedValues  += len(values);
+
+    def close(self):
+        """
+            Stop the age timer thread and publish the current batch.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        with self._condition:
+            self._closed = True;
+            self._condition.notify();
+
+        self._thread.join();
+
+        self.flush();
+
+    def _flushExpiredBatches(self):
+        """
+            Flush the current batch when its oldest reading reaches the maximum age.
+        """
+        while True:
+            with self._condition:
+                while not self._closed and (self._deadline is None or time.monotonic() < self._deadline):
+                    self._condition.wait(None if self._deadline is None else self._deadline - time.monotonic());
+
+                if self._closed:
+                    return;
+
+            self.flush();
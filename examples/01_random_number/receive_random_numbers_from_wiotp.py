@@ -1,58 +1,84 @@
 #!/usr/bin/env python
 
-import argparse
+import json
+import os
 import sys
 
-import ibmiotf.application
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir));
+
+from common.event_dispatcher import BLOCK_POLICY, DeviceEventHandlerIndex, ShardedEventDispatcher
+from common.event_log import openEventLog
+from common.event_sink import (DEFAULT_SINK_DIRECTORY, DEFAULT_SINK_FLUSH_INTERVAL, DEFAULT_SINK_FLUSH_SIZE, 
+                               DEFAULT_SINK_FSYNC_INTERVAL, DEFAULT_SINK_SEGMENT_SIZE, EVENT_SINK_TYPES, createEventSink)
+from common.latency import LatencyRecorder
+from common.metrics import startMetricsServer
+from common.profiler import startProfiler
+from common.runtime import APPLICATION_CLIENT, createArgumentParser, initAppClient, lazyImport, parseArguments
+from stream_statistics import (DEFAULT_SKETCH_ACCURACY, DEFAULT_STATISTICS_INTERVAL, StreamStatistics, 
+                               parseWindowSpecification)
+
+numpy = lazyImport("numpy");
 
 
 # -----------------------------------------------------------------------------
 # Functions
 # -----------------------------------------------------------------------------
 
-def initAppClient(organizationId, applicationId, authMethod, authKey, authToken):
+def receivedDeviceEventCallback(deviceEvent):
     """
-        Initialize the application client.
+        Callback executed when a device event is received.
 
         Args:
-            organizationId: A string instance representing the organization id.
-            applicationId:  A string instance representing the application id.
-            authMethod:     A string instance representing the authentication method.
-            authKey:        A string instance representing the authentication key.
-            authToken:      A string instance representing the authentication token.
+            deviceEvent: The device event.
 
         Returns:
-            An instance of ibmiotf.application.Client representing the application client.
+            None.
 
         Raises:
             None.
     """
-    # Initialize the application client.
-    try:
-        appOptions = {
-            "org"           : organizationId, 
-            "id"            : applicationId, 
-            "auth-method"   : authMethod, 
-            "auth-key"      : authKey, 
-            "auth-token"    : authToken
-        };
+    # Ignore the statistics published by this application
+    if options.statisticsEvent and deviceEvent.event == options.statisticsEvent:
+        return;
 
-        print("Creating application client using options: %s" % str(appOptions));
+    # Record the delivery latency of benchmark events
+    if latencyRecorder is not None:
+        latencyRecorder.recordPayload(deviceEvent.device, deviceEvent.data);
 
-        appClient = ibmiotf.application.Client(appOptions);
+    data = deviceEvent.data;
 
-        return appClient;
-    except Exception as exception:
-        print("Failed to create application client: %s" % str(exception));
+    # Aggregate the numbers per device instead of printing them, if requested
+    if streamStatistics is not None:
+        if "numbers" in data:
+            streamStatistics.addValues(deviceEvent.device, getBatchArrays(data)[0]);
+        else:
+            streamStatistics.add(deviceEvent.device, data["number"]);
 
-        sys.exit(1);
+    # Persist the event instead of printing it, if requested
+    if eventSink is not None:
+        eventSink.write(deviceEvent.device, deviceEvent.event, deviceEvent.format, deviceEvent.payload);
 
-def receivedDeviceEventCallback(deviceEvent):
+    if streamStatistics is not None or eventSink is not None:
+        return;
+
+    print("Received device event %s at %s for %s." % (deviceEvent.event, deviceEvent.timestamp.isoformat(), deviceEvent.device));
+
+    # Batched numbers are unpacked at once
+    if "numbers" in data:
+        numbers, timestamps = getBatchArrays(data);
+
+        print("Received %d numbers over %.3f s: min %d, max %d, mean %.1f" % (len(numbers), timestamps[-1] - timestamps[0], 
+              numbers.min(), numbers.max(), numbers.mean()));
+    else:
+        print("Received number: %d" % data["number"]);
+
+def publishStatistics(summary):
     """
-        Callback executed when a device event is received.
+        Print the statistics of a device over a completed window, and publish
+        them as an event of the device if requested.
 
         Args:
-            deviceEvent: The device event.
+            summary: A dictionary instance representing the window statistics.
 
         Returns:
             None.
@@ -60,11 +86,30 @@ def receivedDeviceEventCallback(deviceEvent):
         Raises:
             None.
     """
-    print("Received device event %s at %s for %s." % (deviceEvent.event, deviceEvent.timestamp.isoformat(), deviceEvent.device));
+    print(json.dumps(summary, sort_keys=True));
 
-    data = deviceEvent.data;
+    if options.statisticsEvent:
+        deviceType, deviceId = summary["device"].split(":", 1);
+
+        appClient.publishEvent(deviceType, deviceId, options.statisticsEvent, "json", summary);
+
+def getBatchArrays(data):
+    """
+        Get the numbers and timestamps stored in a batch device event payload.
+
+        Args:
+            data: A dictionary instance representing the batch device event payload.
+
+        Returns:
+            A (numbers, timestamps) tuple of numpy.ndarray instances. The timestamps are epoch timestamps in seconds.
+
+        Raises:
+            None.
+    """
+    numbers     = numpy.asarray(data["numbers"], dtype=numpy.int64);
+    timestamps  = data["t0"] + numpy.asarray(data["dt"], dtype=numpy.float64) / 1000.0;
 
-    print("Received number: %d" % data["number"]);
+    return numbers, timestamps;
 
 def parseCommandLineOptions():
     """
@@ -79,20 +124,30 @@ def parseCommandLineOptions():
         Raises:
             argparse.error if one of the required command line options is missing.
     """
-    parser = argparse.ArgumentParser();
-
-    parser.add_argument("-o", "--organization-id", action="store", required=True, dest="organizationId");
-    parser.add_argument("-p", "--application-id", action="store", required=True, dest="applicationId");
-    parser.add_argument("-m", "--auth-method", action="store", required=True, dest="authMethod");
-    parser.add_argument("-k", "--auth-key", action="store", required=True, dest="authKey");
-    parser.add_argument("-a", "--auth-token", action="store", required=True, dest="authToken");
-    parser.add_argument("-t", "--device-type", action="store", required=True, dest="deviceType");
-    parser.add_argument("-i", "--device-id", action="store", required=True, dest="deviceId");
-    parser.add_argument("-e", "--device-event-name", action="store", required=True, dest="deviceEventName");
-    parser.add_argument("-f", "--device-event-format", action="store", required=True, dest="deviceEventFormat");
+    parser = createArgumentParser(APPLICATION_CLIENT, "Receive random numbers from the IBM Watson IoT Platform.");
+
+    parser.add_argument("--benchmark-report", action="store", default=None, dest="benchmarkReport");
+    parser.add_argument("--sink", action="store", choices=EVENT_SINK_TYPES, default=None, dest="sinkType");
+    parser.add_argument("--sink-directory", action="store", default=DEFAULT_SINK_DIRECTORY, dest="sinkDirectory");
+    parser.add_argument("--sink-segment-size", action="store", type=int, default=DEFAULT_SINK_SEGMENT_SIZE, dest="sinkSegmentSize");
+    parser.add_argument("--sink-flush-size", action="store", type=int, default=DEFAULT_SINK_FLUSH_SIZE, dest="sinkFlushSize");
+    parser.add_argument("--sink-flush-interval", action="store", type=float, default=DEFAULT_SINK_FLUSH_INTERVAL, dest="sinkFlushInterval");
+    parser.add_argument("--sink-fsync-interval", action="store", type=float, default=DEFAULT_SINK_FSYNC_INTERVAL, dest="sinkFsyncInterval");
+    parser.add_argument("--statistics-window", action="store", nargs="+", default=None, dest="statisticsWindows");
+    parser.add_argument("--statistics-interval", action="store", type=float, default=DEFAULT_STATISTICS_INTERVAL, dest="statisticsInterval");
+    parser.add_argument("--statistics-accuracy", action="store", type=float, default=DEFAULT_SKETCH_ACCURACY, dest="statisticsAccuracy");
+    parser.add_argument("--statistics-event", action="store", default=None, dest="statisticsEvent");
+
+    # Every number counts, hence the events are handled in order by a worker behind a bounded blocking FIFO
+    parser.set_defaults(dispatchShards=1, dispatchPolicy=BLOCK_POLICY);
 
     # Parse command line options
-    options = parser.parse_args();
+    options = parseArguments(parser);
+
+    try:
+        options.statisticsWindows = [parseWindowSpecification(window) for window in options.statisticsWindows or []];
+    except ValueError as exception:
+        parser.error("Invalid statistics window: %s" % str(exception));
 
     return options;
 
@@ -104,9 +159,40 @@ def parseCommandLineOptions():
 # Parse the command line options
 options = parseCommandLineOptions();
 
+# Serve the metrics on a local HTTP endpoint, if requested
+metricsServer = startMetricsServer(options.metricsPort);
+
+# Profile the processing stages, and sample the functions of all the threads, if requested
+profiler = startProfiler(options.profile, options.profileOutput, options.profileInterval, options.profileSampling, options.profileTop);
+
 # Create application client
 appClient = initAppClient(options.organizationId, options.applicationId, options.authMethod, 
-                          options.authKey, options.authToken);
+                          options.authKey, options.authToken, options.broker);
+
+# Record the benchmark events if requested
+latencyRecorder = LatencyRecorder() if options.benchmarkReport else None;
+
+# Write the received events to the event sink, if requested
+eventSink = None;
+
+if options.sinkType:
+    eventSink = createEventSink(options.sinkType, options.sinkDirectory, options.sinkSegmentSize, 
+                                options.sinkFlushSize, options.sinkFlushInterval, options.sinkFsyncInterval);
+
+# Aggregate the numbers over the requested windows
+streamStatistics = None;
+
+if options.statisticsWindows:
+    streamStatistics = StreamStatistics(publishStatistics, options.statisticsWindows, options.statisticsInterval, 
+                                        options.statisticsAccuracy);
+
+# Route the events of the subscribed devices to the callback
+handlerIndex = DeviceEventHandlerIndex();
+
+handlerIndex.addHandler(receivedDeviceEventCallback, options.deviceType, options.deviceId, options.deviceEventName);
+
+eventDispatcher = ShardedEventDispatcher(handlerIndex, options.dispatchShards, options.dispatchQueueSize, 
+                                         options.dispatchReportInterval, options.dispatchPolicy, options.dispatchSampleInterval);
 
 # Connect application client
 appClient.connect();
@@ -115,11 +201,59 @@ appClient.connect();
 appClient.subscribeToDeviceEvents(options.deviceType, options.deviceId, options.deviceEventName, 
                                   options.deviceEventFormat);
 
-# Set the callback for device events
-appClient.deviceEventCallback = receivedDeviceEventCallback;
+# Dispatch the device events to their handlers, sharded by device. The time spent by the client thread
+# queuing the events is profiled, the handlers being timed by the dispatcher.
+deviceEventCallback = eventDispatcher.dispatch;
+
+if profiler is not None:
+    deviceEventCallback = profiler.wrap("dispatch", deviceEventCallback);
+
+# Log the received events, if requested
+eventLog = openEventLog(options.eventLog);
+
+if eventLog is not None:
+    deviceEventCallback = eventLog.wrapDeviceEventCallback(deviceEventCallback);
+
+appClient.deviceEventCallback = deviceEventCallback;
 
 # While a key was not pressed wait for new device events
 sys.stdin.readline();
 
-# Disconnect device client
+# Stop dispatching the received events. The client stays connected until the final statistics are published.
+appClient.deviceEventCallback = None;
+
+# Handle the queued events and report the dispatch statistics
+eventDispatcher.close();
+
+print(eventDispatcher.getStatisticsReport());
+
+# Publish the statistics of the last completed and partial windows, once all the events are counted
+if streamStatistics is not None:
+    streamStatistics.close();
+
+# Disconnect application client
 appClient.disconnect();
+
+# Write the logged events
+if eventLog is not None:
+    eventLog.close();
+
+    print(eventLog.getStatisticsReport());
+
+# Write the buffered events
+if eventSink is not None:
+    eventSink.close();
+
+    print(eventSink.getStatisticsReport());
+
+# Write the latency, loss and reordering report
+if latencyRecorder is not None:
+    latencyRecorder.writeReport(options.benchmarkReport);
+
+# Write the profile of the whole run
+if profiler is not None:
+    profiler.close();
+
+# Stop serving the metrics
+if metricsServer is not None:
+    metricsServer.close();
@@ -1,72 +1,104 @@
 #!/usr/bin/env python
 
-import argparse
+import collections
+import itertools
+import os
 import random
 import sys
+import time
 
-import ibmiotf.device
+from event_batcher import DEFAULT_BATCH_MAX_AGE, EventBatcher
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir));
+
+from common.event_log import openEventLog
+from common.gateway_publisher import AttachedDevice, openDeviceRegistry
+from common.latency import stampPayload
+from common.message_codecs import getMessageCodec
+from common.metrics import startMetricsServer
+from common.outbox import DEFAULT_OUTBOX_DRAIN_RATE, DEFAULT_OUTBOX_MAX_SIZE, DEFAULT_OUTBOX_SEGMENT_SIZE, openDeviceClientOutbox
+from common.profiler import startProfiler
+from common.rate_scheduler import DEFAULT_SCHEDULE_POLICY, DEFAULT_SPIN_THRESHOLD, SCHEDULE_POLICIES, RateScheduler
+from common.runtime import DEVICE_CLIENT, addGatewayArguments, createArgumentParser, initDeviceClient, initGatewayClient, parseArguments
+from common.windowed_publisher import openDeviceClientPublisher, openGatewayClientPublisher
 
 
 # -----------------------------------------------------------------------------
 # Functions
 # -----------------------------------------------------------------------------
 
-def initDeviceClient(organizationId, deviceTypeId, deviceId, authMethod, authToken):
+def getDeviceEventPayload(verbose = True):
     """
-        Initialize the device client.
+        Get a dictionary instance representing the device event payload.
 
         Args:
-            organizationId: A string instance representing the organization id.
-            deviceTypeId:   A string instance representing the device type id.
-            deviceId:       A string instance representing the device id.
-            authMethod:     A string instance representing the authentication method.
-            authToken:      A string instance representing the authentication token.
+            verbose: A boolean indicating whether the payload is printed.
 
         Returns:
-            An instance of ibmiotf.device representing the device client.
+            A dictionary instance representing the device event payload.
 
         Raises:
             None.
     """
-    # Initialize the device client.
-    try:
-        deviceOptions = {
-            "org"           : organizationId, 
-            "type"          : deviceTypeId, 
-            "id"            : deviceId, 
-            "auth-method"   : authMethod, 
-            "auth-token"    : authToken
-        };
+    randomNumber = random.randint(0, 1000000);
+    data         = {"number" : randomNumber};
 
-        print("Creating device client using options: %s" % str(deviceOptions));
+    if verbose:
+        print("Payload to be sent: %d" % randomNumber);
 
-        deviceClient = ibmiotf.device.Client(deviceOptions);
+    return data;
 
-        return deviceClient;
-    except Exception as exception:
-        print("Failed to create device client: %s" % str(exception));
+def publishDeviceEvent(data, devicePublisher = None):
+    """
+        Publish a device event through the windowed publisher, embedding the benchmark
+        fields in benchmark mode and going through the outbox if it is enabled.
 
-        sys.exit(1);
+        Args:
+            data:               A dictionary instance representing the device event payload.
+            devicePublisher:    An optional AttachedDevice instance publishing the event on behalf of an
+                                attached device in gateway mode, the device client publisher if None.
+
+        Returns:
+            None.
 
-def getDeviceEventPayload():
+        Raises:
+            None.
     """
-        Get a dictionary instance representing the device event payload.
+    devicePublisher = publisher if devicePublisher is None else devicePublisher;
+
+    # The sequence numbers are counted per device, as the receivers do. The number of events of
+    # a device is only known without batching, since a batch may be flushed before it is full.
+    if options.benchmark:
+        stampPayload(data, next(benchmarkSequences[devicePublisher]), options.sendCount if eventBatcher is None else None);
+
+    if outbox is not None:
+        outbox.publish(options.deviceEventName, options.deviceEventFormat, data);
+    else:
+        devicePublisher.publishEvent(options.deviceEventName, options.deviceEventFormat, data);
+
+def sendNumber(verbose = True):
+    """
+        Send a random number, or add it to the current batch. In gateway mode, a random
+        number is sent for each attached device.
 
         Args:
-            None.
+            verbose: A boolean indicating whether the payloads are printed.
 
         Returns:
-            A dictionary instance representing the device event payload.
+            None.
 
         Raises:
             None.
     """
-    randomNumber = random.randint(0, 1000000);
-    data         = {"number" : randomNumber};
+    for devicePublisher in devicePublishers:
+        # Prepare data to be sent
+        data = getDeviceEventPayload(verbose);
 
-    sys.stdout.write("Payload to be sent: %d" % randomNumber);
-
-    return data;
+        # Send data, or add it to the current batch
+        if eventBatcher is not None:
+            eventBatcher.add(data["number"]);
+        else:
+            publishDeviceEvent(data, devicePublisher);
 
 def parseCommandLineOptions():
     """
@@ -81,18 +113,54 @@ def parseCommandLineOptions():
         Raises:
             arparse.error if one of the required command line options is missing.
     """
-    parser = argparse.ArgumentParser();
-
-    parser.add_argument("-o", "--organization-id", action="store", required=True, dest="organizationId");
-    parser.add_argument("-t", "--device-type", action="store", required=True, dest="deviceType");
-    parser.add_argument("-i", "--device-id", action="store", required=True, dest="deviceId");
-    parser.add_argument("-m", "--auth-method", action="store", required=True, dest="authMethod");
-    parser.add_argument("-a", "--auth-token", action="store", required=True, dest="authToken");
-    parser.add_argument("-e", "--device-event-name", action="store", required=True, dest="deviceEventName");
-    parser.add_argument("-f", "--device-event-format", action="store", required=True, dest="deviceEventFormat");
+    parser = createArgumentParser(DEVICE_CLIENT, "Send random numbers to the IBM Watson IoT Platform.");
+
+    parser.add_argument("-b", "--batch-size", action="store", type=int, default=1, dest="batchSize");
+    parser.add_argument("--batch-max-age", action="store", type=float, default=DEFAULT_BATCH_MAX_AGE, dest="batchMaxAge");
+    parser.add_argument("--outbox", action="store", default=None, dest="outboxDirectory");
+    parser.add_argument("--outbox-max-size", action="store", type=int, default=DEFAULT_OUTBOX_MAX_SIZE, dest="outboxMaxSize");
+    parser.add_argument("--outbox-segment-size", action="store", type=int, default=DEFAULT_OUTBOX_SEGMENT_SIZE, dest="outboxSegmentSize");
+    parser.add_argument("--outbox-drain-rate", action="store", type=float, default=DEFAULT_OUTBOX_DRAIN_RATE, dest="outboxDrainRate");
+    parser.add_argument("--benchmark", action="store_true", default=False, dest="benchmark");
+    parser.add_argument("--benchmark-events", action="store", type=int, default=1000, dest="benchmarkEvents");
+    parser.add_argument("--benchmark-rate", action="store", type=float, default=100.0, dest="benchmarkRate");
+    parser.add_argument("--rate", action="store", type=float, default=None, dest="sendRate");
+    parser.add_argument("--count", action="store", type=int, default=0, dest="sendCount");
+    parser.add_argument("--schedule-policy", action="store", choices=SCHEDULE_POLICIES, default=DEFAULT_SCHEDULE_POLICY, 
+                        dest="schedulePolicy");
+    parser.add_argument("--schedule-spin", action="store", type=float, default=DEFAULT_SPIN_THRESHOLD, dest="scheduleSpin");
+    parser.add_argument("--schedule-report-interval", action="store", type=float, default=0.0, dest="scheduleReportInterval");
+
+    addGatewayArguments(parser);
 
     # Parse command line options
-    options = parser.parse_args();
+    options = parseArguments(parser);
+
+    # The benchmark events are sent by the timer, at their own rate
+    if options.benchmark:
+        if options.sendRate is not None:
+            parser.error("The benchmark mode sends --benchmark-events numbers at --benchmark-rate numbers per second.");
+
+        options.sendRate    = options.benchmarkRate;
+        options.sendCount   = options.benchmarkEvents;
+
+    if options.sendRate is not None and not 0 < options.sendRate < float("inf"):
+        parser.error("The rate should be positive.");
+
+    if options.sendCount < 0 or options.scheduleSpin < 0 or options.scheduleReportInterval < 0:
+        parser.error("The count, the spin threshold and the report interval should not be negative.");
+
+    # The batches and the outbox hold the events of a single device
+    if options.gateway:
+        if not options.attachedDevices:
+            parser.error("The gateway mode needs at least one attached device.");
+
+        if options.batchSize > 1 or options.outboxDirectory:
+            parser.error("The batches and the outbox are not supported in gateway mode.");
+
+    # The device event payloads are dictionaries, which the raw format cannot carry
+    if not getMessageCodec(options.deviceEventFormat).structured:
+        parser.error("The %s device event format only carries bytes." % options.deviceEventFormat);
 
     return options;
 
@@ -104,20 +172,126 @@ def parseCommandLineOptions():
 # Parse command line options
 options = parseCommandLineOptions();
 
-# Create device client
-deviceClient = initDeviceClient(options.organizationId, options.deviceType, options.deviceId, 
-                                options.authMethod, options.authToken);
+# Serve the metrics on a local HTTP endpoint, if requested
+metricsServer = startMetricsServer(options.metricsPort);
+
+# Profile the processing stages, and sample the functions of all the threads, if requested
+profiler = startProfiler(options.profile, options.profileOutput, options.profileInterval, options.profileSampling, options.profileTop);
+
+# Create device client, or a gateway client publishing the events of the attached devices
+if options.gateway:
+    client = initGatewayClient(options.organizationId, options.deviceType, options.deviceId, 
+                               options.authMethod, options.authToken, options.broker);
+else:
+    client = initDeviceClient(options.organizationId, options.deviceType, options.deviceId, 
+                              options.authMethod, options.authToken, options.broker);
+
+# Connect client
+client.connect();
+
+# Log the published events, if requested
+eventLog = openEventLog(options.eventLog);
+
+# Publish the events at the requested quality of service, with a bounded number of events in flight
+deviceRegistry = None;
+
+if options.gateway:
+    publisher = openGatewayClientPublisher(client, options.publishWindow, options.qos, options.ackTimeout, eventLog);
+
+    # Register the attached devices which are not cached, if requested
+    if options.registerDevices:
+        deviceRegistry  = openDeviceRegistry(client, options.deviceRegistry);
+        failedCount     = deviceRegistry.registerDevices(options.attachedDevices);
+
+        if failedCount:
+            print("%d attached devices are not registered, their registration will be attempted again." % failedCount);
+
+    devicePublishers = [AttachedDevice(publisher, deviceType, deviceId, deviceRegistry) 
+                        for deviceType, deviceId in options.attachedDevices];
+
+    print("Publishing on behalf of %d attached devices." % len(devicePublishers));
+else:
+    publisher           = openDeviceClientPublisher(client, options.publishWindow, options.qos, options.ackTimeout, eventLog);
+    devicePublishers    = [publisher];
+
+# Store the events in the outbox while disconnected, if requested
+outbox = None;
+
+if options.outboxDirectory:
+    outbox = openDeviceClientOutbox(client, options.outboxDirectory, options.outboxMaxSize,
+                                    options.outboxSegmentSize, options.outboxDrainRate, publisher);
+
+# Time the payload creation, the publication being timed by the publisher
+if profiler is not None:
+    getDeviceEventPayload = profiler.wrap("payload", getDeviceEventPayload);
+
+# Batch the numbers if requested, such that several numbers are sent in a single event
+eventBatcher        = None;
+benchmarkSequences  = collections.defaultdict(itertools.count);
+
+if options.batchSize > 1:
+    eventBatcher = EventBatcher(publishDeviceEvent, options.batchSize, options.batchMaxAge);
+
+if options.sendRate is not None:
+    # Send the numbers at a fixed rate until the count is reached or the sender is interrupted. The payloads
+    # are not printed, writing to the terminal thousands of times per second would delay the ticks.
+    scheduler       = RateScheduler(options.sendRate, options.schedulePolicy, options.scheduleSpin);
+    nextReportTime  = time.monotonic() + options.scheduleReportInterval;
+
+    try:
+        for _ in scheduler.ticks(options.sendCount or None):
+            sendNumber(False);
+
+            # Report the jitter and the achieved rate
+            if options.scheduleReportInterval and time.monotonic() >= nextReportTime:
+                print(scheduler.getStatisticsReport());
+
+                nextReportTime += options.scheduleReportInterval;
+    except KeyboardInterrupt:
+        pass;
+
+    print(scheduler.getStatisticsReport());
+else:
+    # Send data whenever the user presses a key different from "q"
+    while sys.stdin.readline() != "q\n":
+        sendNumber();
+
+# Send the numbers which were not sent yet
+if eventBatcher is not None:
+    eventBatcher.close();
+
+    print("Sent %d numbers in %d events." % (eventBatcher.flushedValues, eventBatcher.flushedBatches));
+
+# Close the outbox, the events which were not forwarded are kept for the next run
+if outbox is not None:
+    outbox.close();
+
+    print(outbox.getStatisticsReport());
+
+# Wait for the acknowledgement of the events in flight
+publisher.flush();
+
+print(publisher.getStatisticsReport());
+
+# Disconnect client
+client.disconnect();
+
+# Close the device registry cache
+if deviceRegistry is not None:
+    deviceRegistry.close();
+
+    print(deviceRegistry.getStatisticsReport());
 
-# Connect device client
-deviceClient.connect();
+# Write the logged events
+if eventLog is not None:
+    eventLog.close();
 
-# Send data whenever the user presses a key different from "q"
-while sys.stdin.readline() != "q\n":
-    # Prepare data to be sent
-    data = getDeviceEventPayload();
+    print(eventLog.getStatisticsReport());
 
-    # Send data
-    deviceClient.publishEvent(options.deviceEventName, options.deviceEventFormat, data);
+# Write the profile of the whole run
+if profiler is not None:
+    profiler.close();
 
-# Disconnect device client
-deviceClient.disconnect();
+# Stop serving the metrics
+if metricsServer is not None:
+    metricsServer.close();
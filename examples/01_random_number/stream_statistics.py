@@ -0,0 +1,870 @@
+import math
+import threading
+import time
+
+from common.runtime import lazyImport
+
+numpy = lazyImport("numpy");
+
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+DEFAULT_STATISTICS_INTERVAL     = 10.0;
+DEFAULT_SKETCH_ACCURACY         = 0.01;
+DEFAULT_SKETCH_MAX_BUCKETS      = 1024;
+
+# Number of buckets first allocated by the sketch stores
+SKETCH_INITIAL_BUCKETS = 32;
+
+# Quantiles included in the window summaries
+REPORTED_QUANTILES = (0.5, 0.9, 0.99);
+
+# Values whose magnitude is below this limit are counted in the zero bucket of the sketches
+SKETCH_MIN_INDEXABLE_VALUE = 1e-9;
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def parseWindowSpecification(specification):
+    """
+        Parse a window given as "length" (tumbling window) or "length:slide" (sliding window), in seconds.
+
+        Args:
+            specification: A string instance representing the window.
+
+        Returns:
+            A (windowLength, slideInterval) tuple of floats.
+
+        Raises:
+            ValueError if the window is invalid or if its length is not a multiple of its slide interval.
+    """
+    windowLength, _, slideInterval = specification.partition(":");
+    windowLength    = float(windowLength);
+    slideInterval   = float(slideInterval) if slideInterval else windowLength;
+
+    if windowLength <= 0 or slideInterval <= 0:
+        raise ValueError("The window length and slide interval should be positive: %s." % specification);
+
+    paneCount = windowLength / slideInterval;
+
+    if abs(paneCount - round(paneCount)) > 1e-9:
+        raise ValueError("The window length should be a multiple of the slide interval: %s." % specification);
+
+    return windowLength, slideInterval;
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+class DenseBucketStore(object):
+    """
+        Counts of consecutive integer sketch buckets kept in an array sized
+        after the span of the keys. When the keys span more than maxBuckets
+        buckets, the lowest buckets are collapsed into the lowest kept bucket,
+        hence the memory used is bounded whatever the number of values.
+    """
+
+    def __init__(self, maxBuckets):
+        """
+            Initialize an empty store. The array is only allocated by the first count.
+
+            Args:
+                maxBuckets: An integer representing the maximum number of buckets of the array.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self.maxBuckets = maxBuckets;
+        self.count      = 0;
+
+        self._counts    = None;
+        self._offset    = 0;
+        self._minKey    = None;
+        self._maxKey    = None;
+
+    def add(self, key, count = 1):
+        """
+            Count a key.
+
+            Args:
+                key:    An integer representing the bucket key.
+                count:  An integer representing the number of occurrences.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self._extendRange(key, key);
+
+        self._counts[max(0, key - self._offset)] += count;
+        self.count += count;
+
+    def addKeys(self, keys):
+        """
+            Count an array of keys.
+
+            Args:
+                keys: A non-empty numpy.ndarray instance of integer bucket keys.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self._extendRange(int(keys.min()), int(keys.max()));
+
+        indexes = numpy.maximum(keys - self._offset, 0);
+
+        self._counts += numpy.bincount(indexes, minlength=len(self._counts)).astype(self._counts.dtype);
+        self.count   += len(keys);
+
+    def merge(self, other):
+        """
+            Add the counts of another store.
+
+            Args:
+                other: A DenseBucketStore instance.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        if not other.count:
+            return;
+
+        self._extendRange(other._minKey, other._maxKey);
+
+        keys    = numpy.arange(other._minKey, other._maxKey + 1);
+        indexes = numpy.maximum(keys - self._offset, 0);
+
+        numpy.add.at(self._counts, indexes, other._counts[keys - other._offset]);
+
+        self.count += other.count;
+
+    def getKeyCounts(self, descending = False):
+        """
+            Get the non-empty buckets in key order.
+
+            Args:
+                descending: A boolean indicating whether the greatest keys come first.
+
+            Returns:
+                A list of (key, count) tuples.
+
+            Raises:
+                None.
+        """
+        if not self.count:
+            return [];
+
+        indexes     = numpy.flatnonzero(self._counts);
+        keyCounts   = [(int(index) + self._offset, int(self._counts[index])) for index in indexes];
+
+        return keyCounts[::-1] if descending else keyCounts;
+
+    def clear(self):
+        """
+            Remove all the counts, keeping the allocated array.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        if self._counts is not None and self.count:
+            self._counts.fill(0);
+
+        self.count      = 0;
+        self._minKey    = None;
+        self._maxKey    = None;
+
+    def _extendRange(self, minKey, maxKey):
+        """Make the array cover the given keys, growing, moving or collapsing the buckets if needed."""
+        size = len(self._counts) if self._counts is not None else 0;
+
+        if self._minKey is None:
+            newMinKey, newMaxKey = minKey, maxKey;
+        else:
+            newMinKey = min(self._minKey, minKey);
+            newMaxKey = max(self._maxKey, maxKey);
+
+            if newMinKey >= self._offset and newMaxKey < self._offset + size:
+                self._minKey, self._maxKey = newMinKey, newMaxKey;
+
+                return;
+
+        # Grow the array by a quarter more than needed, up to maxBuckets
+        span = newMaxKey - newMinKey + 1;
+
+        if span > size:
+            size = min(self.maxBuckets, max(SKETCH_INITIAL_BUCKETS, span + span // 4));
+
+        # Center the keys in the array, or keep the greatest keys if they do not fit
+        if span <= size:
+            newOffset = newMinKey - (size - span) // 2;
+        else:
+            newOffset = newMaxKey - size + 1;
+
+        # Reuse the array cleared by clear() when it is large enough
+        if self._minKey is None and self._counts is not None and len(self._counts) == size:
+            newCounts = self._counts;
+        else:
+            newCounts = numpy.zeros(size, dtype=numpy.int32);
+
+        if self._minKey is not None:
+            keys = numpy.arange(self._minKey, self._maxKey + 1);
+
+            numpy.add.at(newCounts, numpy.maximum(keys - newOffset, 0), self._counts[keys - self._offset]);
+
+        self._counts    = newCounts;
+        self._offset    = newOffset;
+        self._minKey    = max(newMinKey, newOffset);
+        self._maxKey    = newMaxKey;
+
+
+class DDSketch(object):
+    """
+        Quantile sketch with a relative accuracy guarantee (DDSketch, Masson
+        et al., VLDB 2019). The values are counted in logarithmic buckets, so
+        that any quantile is estimated within relativeAccuracy of its exact
+        value as long as the lowest buckets were not collapsed.
+    """
+
+    def __init__(self, relativeAccuracy = DEFAULT_SKETCH_ACCURACY, maxBuckets = DEFAULT_SKETCH_MAX_BUCKETS):
+        """
+            Initialize an empty sketch.
+
+            Args:
+                relativeAccuracy:   A float between 0 and 1 representing the relative accuracy of the quantiles.
+                maxBuckets:         An integer representing the maximum number of buckets of the positive and
+                                    negative values.
+
+            Returns:
+                None.
+
+            Raises:
+                ValueError if the relative accuracy is not between 0 and 1.
+        """
+        if relativeAccuracy <= 0 or relativeAccuracy >= 1:
+            raise ValueError("The relative accuracy should be between 0 and 1.");
+
+        self.relativeAccuracy   = relativeAccuracy;
+        self.gamma              = (1 + relativeAccuracy) / (1 - relativeAccuracy);
+        self.zeroCount          = 0;
+
+        self._logGamma          = math.log(self.gamma);
+        self._positive          = DenseBucketStore(maxBuckets);
+        self._negative          = DenseBucketStore(maxBuckets);
+
+    @property
+    def count(self):
+        """
+            The number of values added to the sketch.
+        """
+        return self._positive.count + self._negative.count + self.zeroCount;
+
+    def add(self, value):
+        """
+            Add a value.
+
+            Args:
+                value: A number.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        if value > SKETCH_MIN_INDEXABLE_VALUE:
+            self._positive.add(int(math.ceil(math.log(value) / self._logGamma)));
+        elif value < -SKETCH_MIN_INDEXABLE_VALUE:
+            self._negative.add(int(math.ceil(math.log(-value) / self._logGamma)));
+        else:
+            self.zeroCount += 1;
+
+    def addValues(self, values):
+        """
+            Add an array of values.
+
+            Args:
+                values: A numpy.ndarray instance.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        values      = numpy.asarray(values, dtype=numpy.float64);
+        positive    = values[values > SKETCH_MIN_INDEXABLE_VALUE];
+        negative    = -values[values < -SKETCH_MIN_INDEXABLE_VALUE];
+
+        if len(positive):
+            self._positive.addKeys(numpy.ceil(numpy.log(positive) / self._logGamma).astype(numpy.int64));
+
+        if len(negative):
+            self._negative.addKeys(numpy.ceil(numpy.log(negative) / self._logGamma).astype(numpy.int64));
+
+        self.zeroCount += len(values) - len(positive) - len(negative);
+
+    def merge(self, other):
+        """
+            Add the values of another sketch with the same relative accuracy.
+
+            Args:
+                other: A DDSketch instance.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self._positive.merge(other._positive);
+        self._negative.merge(other._negative);
+
+        self.zeroCount += other.zeroCount;
+
+    def getQuantile(self, quantile):
+        """
+            Estimate a quantile of the values.
+
+            Args:
+                quantile: A float between 0 and 1.
+
+            Returns:
+                A float representing the estimated quantile, or None if the sketch is empty.
+
+            Raises:
+                None.
+        """
+        count = self.count;
+
+        if not count:
+            return None;
+
+        rank        = quantile * (count - 1);
+        cumulative  = 0;
+
+        # The values are ordered from the most negative to the most positive
+        for key, keyCount in self._negative.getKeyCounts(descending=True):
+            cumulative += keyCount;
+
+            if cumulative > rank:
+                return -self._getBucketValue(key);
+
+        cumulative += self.zeroCount;
+
+        if cumulative > rank:
+            return 0.0;
+
+        for key, keyCount in self._positive.getKeyCounts():
+            cumulative += keyCount;
+
+            if cumulative > rank:
+                return self._getBucketValue(key);
+
+        return self._getBucketValue(self._positive.getKeyCounts()[-1][0]);
+
+    def clear(self):
+        """
+            Remove all the values.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self._positive.clear();
+        self._negative.clear();
+
+        self.zeroCount = 0;
+
+    def _getBucketValue(self, key):
+        """Get the value representing a bucket, within the relative accuracy of all its values."""
+        return 2 * self.gamma ** key / (self.gamma + 1);
+
+
+class RunningStatistics(object):
+    """
+        Constant-memory count, minimum, maximum, mean and variance (Welford's
+        online algorithm) and quantile sketch of a stream of numbers.
+    """
+
+    def __init__(self, relativeAccuracy = DEFAULT_SKETCH_ACCURACY, maxBuckets = DEFAULT_SKETCH_MAX_BUCKETS):
+        """
+            Initialize empty statistics.
+
+            Args:
+                relativeAccuracy:   A float representing the relative accuracy of the quantiles.
+                maxBuckets:         An integer representing the maximum number of buckets of the sketch.
+
+            Returns:
+                None.
+
+            Raises:
+                ValueError if the relative accuracy is not between 0 and 1.
+        """
+        self.sketch = DDSketch(relativeAccuracy, maxBuckets);
+
+        self.clear();
+
+    @property
+    def variance(self):
+        """
+            The sample variance of the numbers.
+        """
+        return self._m2 / (self.count - 1) if self.count > 1 else 0.0;
+
+    def add(self, value):
+        """
+            Add a number.
+
+            Args:
+                value: A number.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self.count  += 1;
+        delta       = value - self.mean;
+        self.mean   += delta / self.count;
+        self._m2    += delta * (value - self.mean);
+
+        if value < self.minimum:
+            self.minimum = value;
+
+        if value > self.maximum:
+            self.maximum = value;
+
+        self.sketch.add(value);
+
+    def addValues(self, values):
+        """
+            Add an array of numbers at once.
+
+            Args:
+                values: A non-empty numpy.ndarray instance.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        values = numpy.asarray(values, dtype=numpy.float64);
+
+        self._combine(len(values), float(values.mean()), float(((values - values.mean()) ** 2).sum()),
+                      float(values.min()), float(values.max()));
+
+        self.sketch.addValues(values);
+
+    def merge(self, other):
+        """
+            Add the numbers of other statistics.
+
+            Args:
+                other: A RunningStatistics instance.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        if other.count:
+            self._combine(other.count, other.mean, other._m2, other.minimum, other.maximum);
+
+            self.sketch.merge(other.sketch);
+
+    def clear(self):
+        """
+            Remove all the numbers.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self.count      = 0;
+        self.minimum    = float("inf");
+        self.maximum    = float("-inf");
+        self.mean       = 0.0;
+        self._m2        = 0.0;
+
+        self.sketch.clear();
+
+    def getSummary(self):
+        """
+            Get a dictionary instance summarizing the numbers.
+
+            Args:
+                None.
+
+            Returns:
+                A dictionary instance with the count, min, max, mean, variance and reported quantiles.
+
+            Raises:
+                None.
+        """
+        summary = {
+            "count"     : self.count,
+            "min"       : self.minimum,
+            "max"       : self.maximum,
+            "mean"      : self.mean,
+            "variance"  : self.variance
+        };
+
+        for quantile in REPORTED_QUANTILES:
+            summary["p%g" % (100 * quantile)] = self.sketch.getQuantile(quantile);
+
+        return summary;
+
+    def _combine(self, count, mean, m2, minimum, maximum):
+        """Combine the moments of another set of numbers (Chan et al. parallel algorithm)."""
+        totalCount  = self.count + count;
+        delta       = mean - self.mean;
+
+        self._m2    += m2 + delta * delta * self.count * count / totalCount;
+        self.mean   += delta * count / totalCount;
+        self.count  = totalCount;
+
+        self.minimum = min(self.minimum, minimum);
+        self.maximum = max(self.maximum, maximum);
+
+
+class WindowedStatistics(object):
+    """
+        Per-device statistics over a window of windowLength seconds sliding
+        every slideInterval seconds (a tumbling window when both are equal).
+
+        The window is split in panes of slideInterval seconds. Each device
+        keeps a ring of the panes of one window, the current pane and the
+        panes of the windows which may complete between two calls to
+        takeCompletedWindowSummaries, so its memory does not depend on the
+        number of events. Devices without events in the ring are forgotten.
+        The windows are aligned on the epoch time at which the events are
+        received. Not thread-safe.
+    """
+
+    def __init__(self, windowLength, slideInterval, relativeAccuracy = DEFAULT_SKETCH_ACCURACY,
+                 maxBuckets = DEFAULT_SKETCH_MAX_BUCKETS, takeInterval = 0.0):
+        """
+            Initialize the windowed statistics.
+
+            Args:
+                windowLength:       A float representing the length of the window in seconds.
+                slideInterval:      A float representing the number of seconds between two windows.
+                relativeAccuracy:   A float representing the relative accuracy of the quantiles.
+                maxBuckets:         An integer representing the maximum number of buckets of the sketches.
+                takeInterval:       A float representing the number of seconds between two calls to
+                                    takeCompletedWindowSummaries, such that the windows completed in
+                                    between are all returned.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self.windowLength       = windowLength;
+        self.slideInterval      = slideInterval;
+        self.relativeAccuracy   = relativeAccuracy;
+        self.maxBuckets         = maxBuckets;
+        self.paneCount          = int(round(windowLength / slideInterval));
+
+        # Number of windows which may complete between two calls, one more covering the timer delays
+        self.pendingWindowCount = int(math.ceil(takeInterval / slideInterval)) + 1;
+
+        # Device -> [index of its newest pane, list of paneCount + pendingWindowCount RunningStatistics instances]
+        self._devices           = {};
+        self._lastWindowIndex   = None;
+
+    def add(self, device, value, timestamp):
+        """
+            Add a number received from a device.
+
+            Args:
+                device:     A string instance identifying the device.
+                value:      A number.
+                timestamp:  A float representing the epoch receive time.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self._getPane(device, timestamp).add(value);
+
+    def addValues(self, device, values, timestamp):
+        """
+            Add an array of numbers received from a device.
+
+            Args:
+                device:     A string instance identifying the device.
+                values:     A non-empty numpy.ndarray instance.
+                timestamp:  A float representing the epoch receive time.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self._getPane(device, timestamp).addValues(values);
+
+    def takeCompletedWindowSummaries(self, timestamp, partial = False):
+        """
+            Get the summaries of the windows completed before a time which were
+            not returned yet, i.e. the latest completed window on the first call.
+
+            Args:
+                timestamp:  A float representing the current epoch time.
+                partial:    A boolean indicating whether the window ending with the current pane, which
+                            is not complete yet, is also returned, e.g. when the stream stops.
+
+            Returns:
+                A list of dictionary instances, one per window and device with events in the window,
+                in the order the windows end. The summaries of a partial window end at the given time
+                and have a true "partial" field.
+
+            Raises:
+                None.
+        """
+        currentPaneIndex    = int(timestamp // self.slideInterval);
+        lastWindowIndex     = currentPaneIndex + 1 if partial else currentPaneIndex;
+
+        # The windows whose panes were recycled in the meantime cannot be computed anymore
+        if self._lastWindowIndex is None:
+            firstWindowIndex = currentPaneIndex;
+        else:
+            firstWindowIndex = max(self._lastWindowIndex + 1, currentPaneIndex - self.pendingWindowCount + 1);
+
+        self._lastWindowIndex   = currentPaneIndex;
+        summaries               = [];
+
+        for windowIndex in range(firstWindowIndex, lastWindowIndex + 1):
+            for device, (newestPaneIndex, panes) in self._devices.items():
+                paneIndexes = range(max(windowIndex - self.paneCount, newestPaneIndex - len(panes) + 1),
+                                    min(windowIndex, newestPaneIndex + 1));
+
+                if not paneIndexes:
+                    continue;
+
+                if len(paneIndexes) == 1:
+                    statistics = panes[paneIndexes[0] % len(panes)];
+                else:
+                    statistics = RunningStatistics(self.relativeAccuracy, self.maxBuckets);
+
+                    for paneIndex in paneIndexes:
+                        statistics.merge(panes[paneIndex % len(panes)]);
+
+                if not statistics.count:
+                    continue;
+
+                summary             = statistics.getSummary();
+                summary["device"]   = device;
+                summary["window"]   = self.windowLength;
+                summary["slide"]    = self.slideInterval;
+                summary["start"]    = windowIndex * self.slideInterval - self.windowLength;
+                summary["end"]      = windowIndex * self.slideInterval;
+
+                if windowIndex > currentPaneIndex:
+                    summary["end"]      = timestamp;
+                    summary["partial"]  = True;
+
+                summaries.append(summary);
+
+        # Forget the devices which did not send events during the latest window and the current pane
+        for device in [device for device, (newestPaneIndex, _) in self._devices.items()
+                       if newestPaneIndex < currentPaneIndex - self.paneCount]:
+            del self._devices[device];
+
+        return summaries;
+
+    def _getPane(self, device, timestamp):
+        """Get the statistics of the pane of a device containing a time, recycling the expired panes."""
+        paneIndex   = int(timestamp // self.slideInterval);
+        deviceState = self._devices.get(device);
+
+        if deviceState is None:
+            deviceState = [paneIndex, [RunningStatistics(self.relativeAccuracy, self.maxBuckets)
+                                       for _ in range(self.paneCount + self.pendingWindowCount)]];
+
+            self._devices[device] = deviceState;
+        elif paneIndex > deviceState[0]:
+            panes = deviceState[1];
+
+            for expiredPaneIndex in range(max(deviceState[0] + 1, paneIndex - len(panes) + 1), paneIndex + 1):
+                panes[expiredPaneIndex % len(panes)].clear();
+
+            deviceState[0] = paneIndex;
+
+        return deviceState[1][paneIndex % len(deviceState[1])];
+
+
+class StreamStatistics(object):
+    """
+        Thread-safe streaming statistics stage computing per-device aggregates
+        over several windows and publishing the summaries of the windows
+        completed since the previous publication at a fixed interval from a
+        timer thread. The last completed and partial windows are published
+        when the stage is closed.
+    """
+
+    def __init__(self, publishFunction, windows, publishInterval = DEFAULT_STATISTICS_INTERVAL,
+                 relativeAccuracy = DEFAULT_SKETCH_ACCURACY, maxBuckets = DEFAULT_SKETCH_MAX_BUCKETS):
+        """
+            Initialize the stage and start its timer thread.
+
+            Args:
+                publishFunction:    A callable publishing a window summary dictionary instance.
+                windows:            A list of (windowLength, slideInterval) tuples returned by parseWindowSpecification.
+                publishInterval:    A float representing the number of seconds between two publications.
+                relativeAccuracy:   A float representing the relative accuracy of the quantiles.
+                maxBuckets:         An integer representing the maximum number of buckets of the sketches.
+
+            Returns:
+                None.
+
+            Raises:
+                ValueError if the publish interval is not positive.
+        """
+        if publishInterval <= 0:
+            raise ValueError("The statistics interval should be positive.");
+
+        self.publishFunction    = publishFunction;
+        self.publishInterval    = publishInterval;
+        self.windows            = [WindowedStatistics(windowLength, slideInterval, relativeAccuracy, maxBuckets, publishInterval)
+                                   for windowLength, slideInterval in windows];
+
+        self.valueCount         = 0;
+        self.publishedCount     = 0;
+
+        self._lock              = threading.Lock();
+        self._stopEvent         = threading.Event();
+
+        self._thread            = threading.Thread(target=self._publishSummaries, name="statistics");
+        self._thread.daemon     = True;
+        self._thread.start();
+
+    def add(self, device, value):
+        """
+            Add a number received from a device.
+
+            Args:
+                device: A string instance identifying the device.
+                value:  A number.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        timestamp = time.time();
+
+        with self._lock:
+            for window in self.windows:
+                window.add(device, value, timestamp);
+
+            self.valueCount += 1;
+
+    def addValues(self, device, values):
+        """
+            Add an array of numbers received from a device, e.g. a batch.
+
+            Args:
+                device: A string instance identifying the device.
+                values: A numpy.ndarray instance.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        if not len(values):
+            return;
+
+        timestamp = time.time();
+
+        with self._lock:
+            for window in self.windows:
+                window.addValues(device, values, timestamp);
+
+            self.valueCount += len(values);
+
+    def close(self):
+        """
+            Stop the timer thread, then publish the summaries of the windows completed since the
+            previous publication and of the partial windows ending now.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self._stopEvent.set();
+        self._thread.join();
+
+        self._publishWindowSummaries(True);
+
+    def _publishSummaries(self):
+        """
+            Publish the summaries of the windows completed since the previous publication, periodically.
+        """
+        while not self._stopEvent.wait(self.publishInterval):
+            self._publishWindowSummaries(False);
+
+    def _publishWindowSummaries(self, partial):
+        """
+            Publish the summaries of the windows completed since the previous publication, and of
+            the partial windows ending now if requested.
+        """
+        timestamp = time.time();
+
+        with self._lock:
+            summaries = [summary for window in self.windows for summary in window.takeCompletedWindowSummaries(timestamp, partial)];
+
+        for summary in summaries:
+            try:
+                self.publishFunction(summary);
+
+                self.publishedCount += 1;
+            except Exception as exception:
+                print("Failed to publish the statistics of %s: %s" % (summary["device"], str(exception)));
@@ -0,0 +1,442 @@
+import threading
+import time
+
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+DEFAULT_CONTROL_INTERVAL    = 1.0;
+DEFAULT_LATENCY_TARGET      = 0.5;
+DEFAULT_QUEUE_DEPTH_TARGET  = 2;
+DEFAULT_MIN_FRAME_RATE      = 0.2;
+DEFAULT_MIN_SCALE           = 0.05;
+DEFAULT_MIN_QUALITY         = 30;
+
+# Number of (scale, quality) detail levels between the maximum and the minimum settings
+DETAIL_LEVELS = 8;
+
+# Factor applied to the frame rate when the link is congested
+BACKOFF_FACTOR = 0.5;
+
+# Fraction of the bandwidth budget the controller aims at, leaving room for bursts
+TARGET_UTILIZATION = 0.9;
+
+# Fraction of the bandwidth budget below which the controller probes upward
+PROBE_UTILIZATION = 0.75;
+
+# Number of consecutive uncongested control intervals required before probing upward
+PROBE_INTERVALS = 3;
+
+# Number of latency targets after which a pending publication is considered lost, e.g. by a reconnection
+LOST_PUBLISH_LATENCY_FACTOR = 10;
+
+# Weight of the last control interval in the smoothed number of bytes per frame
+BYTES_PER_FRAME_SMOOTHING = 0.5;
+
+# Fraction of the maximum frame rate added at each upward probe
+PROBE_FRAME_RATE_STEP = 0.1;
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+class AdaptiveStreamController(object):
+    """
+        Feedback controller adjusting the frame rate, scale and encode quality
+        of the images sent by a device so that its stream fits the link.
+
+        Every control interval the controller compares the bytes published per
+        second, estimated as the smoothed bytes per frame times the frame rate
+        so that slow streams are not seen as bursts, with the bandwidth
+        budget, the publish completion latency (the
+        time until the client wrote the event to its socket, including the
+        age of the publications still pending) with the latency target, and
+        the outbound queue depth with the queue depth target.
+
+        When one of them is exceeded the link is congested and the controller
+        backs off multiplicatively: it cuts the frame rate (to the rate fitting
+        the budget, or by half), and steps down to the next (scale, quality)
+        detail level once the frame rate is at its minimum. The latency only
+        triggers another backoff once the publications started after the
+        previous decision are late too, and the queue depth once it stopped
+        decreasing, so that the controller does not keep backing off while the
+        backlog drains. After
+        PROBE_INTERVALS intervals with headroom, it probes upward one step at a
+        time, restoring the detail level first and then the frame rate, within
+        the budget estimated from the measured bytes per frame.
+    """
+
+    def __init__(self, applyFunction, queueDepthFunction, bandwidthBudget = 0, maxFrameRate = 1.0, maxScale = 0.1, maxQuality = 80,
+                 minFrameRate = DEFAULT_MIN_FRAME_RATE, minScale = DEFAULT_MIN_SCALE, minQuality = DEFAULT_MIN_QUALITY,
+                 latencyTarget = DEFAULT_LATENCY_TARGET, queueDepthTarget = DEFAULT_QUEUE_DEPTH_TARGET,
+                 controlInterval = DEFAULT_CONTROL_INTERVAL):
+        """
+            Initialize the controller at the maximum settings.
+
+            Args:
+                applyFunction:      A callable taking the frame rate, scale and quality, called whenever they change.
+                queueDepthFunction: A callable returning the number of events waiting to be sent.
+                bandwidthBudget:    An integer representing the maximum number of bytes published per second,
+                                    or 0 to only react to the latency and the queue depth.
+                maxFrameRate:       A float representing the maximum number of frames per second.
+                maxScale:           A float representing the maximum factor applied to the image size.
+                maxQuality:         An integer between 0 and 100 representing the maximum encode quality.
+                minFrameRate:       A float representing the minimum number of frames per second.
+                minScale:           A float representing the minimum factor applied to the image size.
+                minQuality:         An integer between 0 and 100 representing the minimum encode quality.
+                latencyTarget:      A float representing the maximum publish completion latency in seconds.
+                queueDepthTarget:   An integer representing the maximum number of events waiting to be sent.
+                controlInterval:    A float representing the number of seconds between two decisions.
+
+            Returns:
+                None.
+
+            Raises:
+                ValueError if one of the bounds is invalid.
+        """
+        if not 0 < minFrameRate <= maxFrameRate:
+            raise ValueError("The frame rate bounds should satisfy 0 < minimum <= maximum.");
+
+        if not 0 < minScale <= maxScale:
+            raise ValueError("The scale bounds should satisfy 0 < minimum <= maximum.");
+
+        if not 0 <= minQuality <= maxQuality <= 100:
+            raise ValueError("The quality bounds should satisfy 0 <= minimum <= maximum <= 100.");
+
+        if bandwidthBudget < 0:
+            raise ValueError("The bandwidth budget should not be negative.");
+
+        self.applyFunction       = applyFunction;
+        self.queueDepthFunction  = queueDepthFunction;
+        self.bandwidthBudget     = bandwidthBudget;
+        self.minFrameRate        = minFrameRate;
+        self.maxFrameRate        = maxFrameRate;
+        self.latencyTarget       = latencyTarget;
+        self.queueDepthTarget    = queueDepthTarget;
+        self.controlInterval     = controlInterval;
+
+        self.detailLevels        = getDetailLevels(minScale, maxScale, minQuality, maxQuality);
+
+        self.frameRate           = maxFrameRate;
+        self.detailLevel         = 0;
+        self.bytesPerFrame       = None;
+        self.backoffCount        = 0;
+        self.probeCount          = 0;
+        self.lostCount           = 0;
+
+        self._lock               = threading.Lock();
+        self._nextPublishId      = 0;
+        self._pendingPublishes   = {};
+        self._intervalBytes      = 0;
+        self._intervalCount      = 0;
+        self._intervalLatencies  = [];
+        self._decisionPublishId  = 0;
+        self._decisionQueueDepth = 0;
+        self._uncongestedCount   = 0;
+        self._lastMeasurement    = None;
+
+        self._stopEvent          = threading.Event();
+        self._thread             = None;
+
+    @property
+    def scale(self):
+        """
+            The factor currently applied to the image size.
+        """
+        return self.detailLevels[self.detailLevel][0];
+
+    @property
+    def quality(self):
+        """
+            The encode quality currently used.
+        """
+        return self.detailLevels[self.detailLevel][1];
+
+    def start(self):
+        """
+            Apply the initial settings and start the control thread.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self.applyFunction(self.frameRate, self.scale, self.quality);
+
+        self._stopEvent.clear();
+
+        self._thread        = threading.Thread(target=self._control, name="adaptive-controller");
+        self._thread.daemon = True;
+        self._thread.start();
+
+    def stop(self):
+        """
+            Stop the control thread.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self._stopEvent.set();
+
+        if self._thread is not None:
+            self._thread.join();
+
+            self._thread = None;
+
+    def startPublish(self, payloadSize):
+        """
+            Record a device event handed to the client. This method is thread-safe.
+
+            Args:
+                payloadSize: An integer representing the number of bytes of the payload.
+
+            Returns:
+                An integer identifying the publication, to be given to completePublish.
+
+            Raises:
+                None.
+        """
+        with self._lock:
+            publishId = self._nextPublishId;
+
+            self._nextPublishId                 += 1;
+            self._intervalBytes                 += payloadSize;
+            self._intervalCount                 += 1;
+            self._pendingPublishes[publishId]   = time.monotonic();
+
+        return publishId;
+
+    def completePublish(self, publishId):
+        """
+            Record that a device event was sent. This method is thread-safe.
+
+            Args:
+                publishId: An integer returned by startPublish.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        with self._lock:
+            startTime = self._pendingPublishes.pop(publishId, None);
+
+            if startTime is not None:
+                self._intervalLatencies.append((publishId, time.monotonic() - startTime));
+
+    def update(self):
+        """
+            Measure the stream since the previous update and adjust the settings.
+
+            Args:
+                None.
+
+            Returns:
+                A string instance describing the decision, or None if the settings did not change.
+
+            Raises:
+                None.
+        """
+        queueDepth = self.queueDepthFunction();
+
+        with self._lock:
+            now         = time.monotonic();
+            latencies   = self._intervalLatencies + [(publishId, now - startTime) for publishId, startTime in self._pendingPublishes.items()];
+
+            # The publications queued by the client when it lost its connection never complete
+            for publishId, startTime in list(self._pendingPublishes.items()):
+                if now - startTime > LOST_PUBLISH_LATENCY_FACTOR * self.latencyTarget:
+                    del self._pendingPublishes[publishId];
+
+                    self.lostCount += 1;
+
+            # A publication still pending is at least as late as its age. Only the publications
+            # started since the last decision tell whether the decision relieved the link.
+            latency         = max([latency for _, latency in latencies] or [0.0]);
+            recentLatencies = [latency for publishId, latency in latencies if publishId >= self._decisionPublishId];
+
+            if self._intervalCount:
+                bytesPerFrame       = self._intervalBytes / self._intervalCount;
+                self.bytesPerFrame  = bytesPerFrame if self.bytesPerFrame is None else (
+                    BYTES_PER_FRAME_SMOOTHING * bytesPerFrame + (1 - BYTES_PER_FRAME_SMOOTHING) * self.bytesPerFrame);
+
+            self._intervalBytes     = 0;
+            self._intervalCount     = 0;
+            self._intervalLatencies = [];
+
+        bytesPerFrame   = self.bytesPerFrame or 0.0;
+        bytesRate       = bytesPerFrame * self.frameRate;
+
+        self._lastMeasurement = (bytesRate, latency, queueDepth);
+
+        reasons = [];
+
+        if self.bandwidthBudget and bytesRate > self.bandwidthBudget:
+            reasons.append("%.1f KB/s > budget %.1f KB/s" % (bytesRate / 1024, self.bandwidthBudget / 1024));
+
+        if recentLatencies and max(recentLatencies) > self.latencyTarget:
+            reasons.append("latency %.0f ms > %.0f ms" % (1000 * max(recentLatencies), 1000 * self.latencyTarget));
+
+        if queueDepth > max(self.queueDepthTarget, self._decisionQueueDepth - 1):
+            reasons.append("queue %d > %d" % (queueDepth, self.queueDepthTarget));
+
+        if reasons:
+            self._uncongestedCount = 0;
+
+            return self._backOff(", ".join(reasons), bytesPerFrame);
+
+        # Probe upward only once the link showed headroom for a few intervals
+        hasHeadroom = (
+            (not self.bandwidthBudget or (bytesPerFrame and bytesRate < PROBE_UTILIZATION * self.bandwidthBudget))
+            and latency <= self.latencyTarget / 2
+            and queueDepth == 0
+        );
+
+        if not hasHeadroom:
+            self._uncongestedCount = 0;
+
+            return None;
+
+        self._uncongestedCount += 1;
+
+        if self._uncongestedCount < PROBE_INTERVALS:
+            return None;
+
+        self._uncongestedCount = 0;
+
+        return self._probe(bytesRate, bytesPerFrame);
+
+    def getStatisticsReport(self):
+        """
+            Get a one line report of the current settings and of the last measurement.
+
+            Args:
+                None.
+
+            Returns:
+                A string instance representing the report.
+
+            Raises:
+                None.
+        """
+        bytesRate, latency, queueDepth = self._lastMeasurement or (0.0, 0.0, 0);
+
+        return "adaptive: %.2f fps, scale %.3f, quality %d (level %d/%d) | %.1f KB/s, latency %.0f ms, queue %d | %d backoffs, %d probes, %d lost" % (
+            self.frameRate, self.scale, self.quality, self.detailLevel, len(self.detailLevels) - 1,
+            bytesRate / 1024, 1000 * latency, queueDepth, self.backoffCount, self.probeCount, self.lostCount
+        );
+
+    def _backOff(self, reason, bytesPerFrame):
+        """Cut the frame rate, or the detail level once the frame rate is at its minimum."""
+        frameRate = self.frameRate * BACKOFF_FACTOR;
+
+        # Jump straight to the frame rate fitting the budget if it is lower
+        if self.bandwidthBudget and bytesPerFrame:
+            frameRate = min(frameRate, TARGET_UTILIZATION * self.bandwidthBudget / bytesPerFrame);
+
+        frameRate = max(frameRate, self.minFrameRate);
+
+        if frameRate < self.frameRate:
+            return self._apply("congested (%s)" % reason, frameRate, self.detailLevel, backoff=True);
+
+        if self.detailLevel < len(self.detailLevels) - 1:
+            return self._apply("congested (%s)" % reason, self.frameRate, self.detailLevel + 1, backoff=True);
+
+        return None;
+
+    def _probe(self, bytesRate, bytesPerFrame):
+        """Restore one detail level, or raise the frame rate once the detail level is at its maximum."""
+        if self.detailLevel > 0:
+            return self._apply("headroom (%.1f KB/s)" % (bytesRate / 1024), self.frameRate, self.detailLevel - 1, backoff=False);
+
+        frameRate = min(self.frameRate + PROBE_FRAME_RATE_STEP * self.maxFrameRate, self.maxFrameRate);
+
+        # Do not probe beyond the frame rate fitting the budget
+        if self.bandwidthBudget and bytesPerFrame:
+            frameRate = min(frameRate, max(self.frameRate, TARGET_UTILIZATION * self.bandwidthBudget / bytesPerFrame));
+
+        if frameRate > self.frameRate:
+            return self._apply("headroom (%.1f KB/s)" % (bytesRate / 1024), frameRate, self.detailLevel, backoff=False);
+
+        return None;
+
+    def _apply(self, reason, frameRate, detailLevel, backoff):
+        """Change the settings, apply them and log the decision."""
+        decision = "Adaptive %s: %s -> %.2f fps, scale %.3f, quality %d" % (
+            "backoff" if backoff else "probe", reason, frameRate, self.detailLevels[detailLevel][0], self.detailLevels[detailLevel][1]);
+
+        # The bytes per frame of the new detail level are unknown until its first frames are published
+        if detailLevel != self.detailLevel:
+            self.bytesPerFrame = None;
+
+        self.frameRate      = frameRate;
+        self.detailLevel    = detailLevel;
+
+        with self._lock:
+            self._decisionPublishId = self._nextPublishId;
+
+        self._decisionQueueDepth = self._lastMeasurement[2] if self._lastMeasurement else 0;
+
+        if backoff:
+            self.backoffCount += 1;
+        else:
+            self.probeCount += 1;
+
+        self.applyFunction(self.frameRate, self.scale, self.quality);
+
+        print(decision);
+
+        return decision;
+
+    def _control(self):
+        """
+            Update the settings every control interval until the controller is stopped.
+        """
+        while not self._stopEvent.wait(self.controlInterval):
+            self.update();
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def getDetailLevels(minScale, maxScale, minQuality, maxQuality, count = DETAIL_LEVELS):
+    """
+        Get the (scale, quality) detail levels of the controller, from the most to the least detailed.
+
+        The scale decreases geometrically, hence each level divides the number of
+        pixels by the same factor, while the quality decreases linearly.
+
+        Args:
+            minScale:   A float representing the minimum factor applied to the image size.
+            maxScale:   A float representing the maximum factor applied to the image size.
+            minQuality: An integer representing the minimum encode quality.
+            maxQuality: An integer representing the maximum encode quality.
+            count:      An integer representing the number of levels.
+
+        Returns:
+            A list of (scale, quality) tuples.
+
+        Raises:
+            None.
+    """
+    if count < 2 or (minScale == maxScale and minQuality == maxQuality):
+        return [(maxScale, maxQuality)];
+
+    return [
+        (maxScale * (minScale / maxScale) ** (level / (count - 1.0)), int(round(maxQuality - (maxQuality - minQuality) * level / (count - 1.0))))
+        for level in range(count)
+    ];
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir));
+
+from capture_profiles import getCameraSettings, getCaptureProfile, openCamera, readJpegFrame
+from image_codecs import DEFAULT_IMAGE_QUALITY, encodeImage, encodeImagePayload, packImageBytes
+
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+# Seed used to generate the synthetic camera frames
+SYNTHETIC_FRAMES_SEED = 42;
+
+# Quality at which the synthetic camera compresses its frames, as a typical MJPG webcam
+SYNTHETIC_CAMERA_QUALITY = 90;
+
+# Capture modes of the sender
+TRANSCODE_MODE      = "transcode";
+PASSTHROUGH_MODE    = "passthrough";
+
+CAPTURE_MODES = [TRANSCODE_MODE, PASSTHROUGH_MODE];
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def getSyntheticCameraFrames(width, height, frameCount):
+    """
+        Get the JPEG frames of a synthetic MJPG camera filming a static scene
+        with sensor noise and a small moving object.
+
+        Args:
+            width:      An integer representing the width of the frames.
+            height:     An integer representing the height of the frames.
+            frameCount: An integer representing the number of frames.
+
+        Returns:
+            A list of bytes instances representing the JPEG frames.
+
+        Raises:
+            None.
+    """
+    randomState = numpy.random.RandomState(SYNTHETIC_FRAMES_SEED);
+    background  = cv2.GaussianBlur(randomState.randint(0, 256, (height, width, 3)).astype(numpy.uint8), (31, 31), 0);
+    objectSize  = max(4, min(width, height) // 8);
+    frames      = [];
+
+    for index in range(frameCount):
+        frame = background.copy();
+
+        x = int((index * 3) % max(1, width - objectSize));
+        y = int((index * 2) % max(1, height - objectSize));
+
+        cv2.rectangle(frame, (x, y), (x + objectSize, y + objectSize), (0, 0, 255), -1);
+
+        frame = numpy.clip(frame + randomState.randint(-2, 3, frame.shape), 0, 255).astype(numpy.uint8);
+
+        frames.append(encodeImage(frame, "jpeg", SYNTHETIC_CAMERA_QUALITY));
+
+    return frames;
+
+def getFrameReader(options, profile, mode):
+    """
+        Get a callable reading the next frame as the sender would in a capture mode.
+
+        Args:
+            options:    A argparse.Namespace instance representing the command line options.
+            profile:    A CaptureProfile instance.
+            mode:       A string instance representing the capture mode.
+
+        Returns:
+            A (description, read callable, release callable) tuple. The read callable returns the next frame,
+            i.e. a numpy.ndarray instance in transcode mode or a bytes instance in passthrough mode, or None.
+
+        Raises:
+            ValueError if the camera could not be opened or does not deliver JPEG frames.
+    """
+    if options.cameraIndex is not None:
+        cameraClient = openCamera(options.cameraIndex, profile, mode == PASSTHROUGH_MODE);
+
+        if mode == PASSTHROUGH_MODE:
+            return getCameraSettings(cameraClient), lambda: readJpegFrame(cameraClient), cameraClient.release;
+
+        return getCameraSettings(cameraClient), lambda: cameraClient.read()[1], cameraClient.release;
+
+    # The synthetic camera delivers JPEG frames, which OpenCV decodes to BGR unless they are passed through
+    width   = profile.width or options.width;
+    height  = profile.height or options.height;
+    frames  = getSyntheticCameraFrames(width, height, min(options.frameCount, 30));
+    indexes = iter(range(options.frameCount + 1));
+
+    if mode == PASSTHROUGH_MODE:
+        return "synthetic %dx%d" % (width, height), lambda: frames[next(indexes) % len(frames)], lambda: None;
+
+    return "synthetic %dx%d" % (width, height), lambda: cv2.imdecode(numpy.frombuffer(frames[next(indexes) % len(frames)], dtype = numpy.uint8), cv2.IMREAD_COLOR), lambda: None;
+
+def getPayload(frame, mode, scale, quality):
+    """
+        Convert a frame into a device event payload as the sender would in a capture mode.
+
+        Args:
+            frame:      A numpy.ndarray or bytes instance returned by a frame reader.
+            mode:       A string instance representing the capture mode.
+            scale:      A float representing the factor applied to the image size in transcode mode.
+            quality:    An integer representing the encode quality in transcode mode.
+
+        Returns:
+            A dictionary instance representing the device event payload.
+
+        Raises:
+            ValueError if the image could not be encoded.
+    """
+    if mode == PASSTHROUGH_MODE:
+        return {"img" : packImageBytes(frame, True), "codec" : "jpeg"};
+
+    if scale != 1.0:
+        frame = cv2.resize(frame, None, fx = scale, fy = scale, interpolation = cv2.INTER_CUBIC);
+
+    return encodeImagePayload(frame, "jpeg", quality, True);
+
+def benchmarkCaptureMode(options, profile, mode):
+    """
+        Measure the CPU time, wall time and payload size per frame of a capture mode.
+
+        Args:
+            options:    A argparse.Namespace instance representing the command line options.
+            profile:    A CaptureProfile instance.
+            mode:       A string instance representing the capture mode.
+
+        Returns:
+            A (description, frames, CPU seconds per frame, wall seconds per frame, bytes per frame) tuple.
+
+        Raises:
+            ValueError if the camera could not be opened or does not deliver JPEG frames.
+    """
+    description, readFrame, releaseCamera = getFrameReader(options, profile, mode);
+
+    frameCount      = 0;
+    payloadBytes    = 0;
+    startCpuTime    = time.process_time();
+    startTime       = time.perf_counter();
+
+    for _ in range(options.frameCount):
+        frame = readFrame();
+
+        if frame is None:
+            continue;
+
+        payloadBytes    += len(getPayload(frame, mode, options.scale, options.imageQuality)["img"]);
+        frameCount      += 1;
+
+    cpuTime     = time.process_time() - startCpuTime;
+    wallTime    = time.perf_counter() - startTime;
+
+    releaseCamera();
+
+    if not frameCount:
+        return description, 0, 0.0, 0.0, 0.0;
+
+    return description, frameCount, cpuTime / frameCount, wallTime / frameCount, payloadBytes / float(frameCount);
+
+def parseCommandLineOptions():
+    """
+        Parse the given command line options.
+
+        Args:
+            None.
+
+        Returns:
+            options: A argparse.Namespace instance representing the parsed command line options.
+
+        Raises:
+            argparse.error if one of the command line options is invalid.
+    """
+    parser = argparse.ArgumentParser(description="Report the CPU time per frame of the capture profiles and modes of the webcam sender.");
+
+    parser.add_argument("--camera", action="store", type=int, default=None, dest="cameraIndex");
+    parser.add_argument("-p", "--profiles", action="store", nargs="+", default=["mjpg-640x480-30", "mjpg-320x240-15"], dest="profiles");
+    parser.add_argument("-m", "--modes", action="store", nargs="+", choices=CAPTURE_MODES, default=CAPTURE_MODES, dest="modes");
+    parser.add_argument("-n", "--frames", action="store", type=int, default=200, dest="frameCount");
+    parser.add_argument("-x", "--scale", action="store", type=float, default=0.1, dest="scale");
+    parser.add_argument("-q", "--image-quality", action="store", type=int, default=DEFAULT_IMAGE_QUALITY, dest="imageQuality");
+    parser.add_argument("-W", "--width", action="store", type=int, default=640, dest="width");
+    parser.add_argument("-H", "--height", action="store", type=int, default=480, dest="height");
+
+    # Parse command line options
+    options = parser.parse_args();
+
+    try:
+        options.profiles = [getCaptureProfile(profile) for profile in options.profiles];
+    except ValueError as exception:
+        parser.error(str(exception));
+
+    return options;
+
+
+# -----------------------------------------------------------------------------
+# Main
+# -----------------------------------------------------------------------------
+
+# Parse command line options
+options = parseCommandLineOptions();
+
+print("%-18s %-12s %-32s %8s %12s %12s %12s" % ("profile", "mode", "source", "frames", "CPU ms", "wall ms", "bytes"));
+
+for profile in options.profiles:
+    for mode in options.modes:
+        try:
+            description, frameCount, cpuTime, wallTime, payloadBytes = benchmarkCaptureMode(options, profile, mode);
+        except ValueError as exception:
+            print("%-18s %-12s %s" % (profile, mode, str(exception)));
+
+            continue;
+
+        print("%-18s %-12s %-32s %8d %12.3f %12.3f %12.0f" % (profile, mode, description, frameCount, 1000 * cpuTime, 1000 * wallTime, payloadBytes));
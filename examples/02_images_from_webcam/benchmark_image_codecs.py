@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+
+import argparse
+import base64
+import json
+import os
+import pickle
+import sys
+import timeit
+
+import cv2
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir));
+
+from image_codecs import DEFAULT_IMAGE_QUALITY, IMAGE_CODECS, decodeImage, encodeImage
+
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+# Seed used to generate the fixed set of test images
+TEST_IMAGES_SEED = 42;
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def getTestImages(width, height):
+    """
+        Get a fixed set of synthetic test images.
+
+        The images cover the cases relevant for a webcam stream: a smooth
+        gradient, a scene made of flat shapes, a textured scene and pure noise
+        (the worst case for every codec).
+
+        Args:
+            width:  An integer representing the width of the images.
+            height: An integer representing the height of the images.
+
+        Returns:
+            A list of (name, numpy.ndarray) tuples representing the test images.
+
+        Raises:
+            None.
+    """
+    randomState = numpy.random.RandomState(TEST_IMAGES_SEED);
+
+    # Smooth horizontal and vertical gradient
+    xs          = numpy.linspace(0, 255, width, dtype = numpy.float32);
+    ys          = numpy.linspace(0, 255, height, dtype = numpy.float32);
+    gradient    = numpy.dstack([numpy.add.outer(ys, xs) / 2, numpy.tile(xs, (height, 1)), numpy.tile(ys, (width, 1)).T]);
+    gradient    = gradient.astype(numpy.uint8);
+
+    # Flat shapes on a uniform background
+    shapes = numpy.full((height, width, 3), 200, dtype = numpy.uint8);
+
+    for _ in range(20):
+        color   = tuple(int(c) for c in randomState.randint(0, 256, 3));
+        center  = (int(randomState.randint(0, width)), int(randomState.randint(0, height)));
+        radius  = int(randomState.randint(1, max(2, min(width, height) // 4)));
+
+        cv2.circle(shapes, center, radius, color, -1);
+
+    # Gradient with moderate sensor-like noise
+    textured = numpy.clip(gradient.astype(numpy.int16) + randomState.randint(-20, 21, gradient.shape), 0, 255).astype(numpy.uint8);
+
+    # Uniform noise
+    noise = randomState.randint(0, 256, (height, width, 3)).astype(numpy.uint8);
+
+    return [("gradient", gradient), ("shapes", shapes), ("textured", textured), ("noise", noise)];
+
+def loadImages(imagesDir):
+    """
+        Load the images stored in the given directory.
+
+        Args:
+            imagesDir: A string instance representing the directory path.
+
+        Returns:
+            A list of (name, numpy.ndarray) tuples representing the loaded images.
+
+        Raises:
+            None.
+    """
+    images = [];
+
+    for fileName in sorted(os.listdir(imagesDir)):
+        image = cv2.imread(os.path.join(imagesDir, fileName), cv2.IMREAD_COLOR);
+
+        if image is not None:
+            images.append((fileName, image));
+
+    return images;
+
+def timeCall(function, repeat):
+    """
+        Get the best execution time of the given function.
+
+        Args:
+            function:   A callable taking no arguments.
+            repeat:     An integer representing the number of timed executions.
+
+        Returns:
+            A float representing the best execution time in milliseconds.
+
+        Raises:
+            None.
+    """
+    return min(timeit.repeat(function, number = 1, repeat = repeat)) * 1000;
+
+def benchmarkLegacyPayload(image, repeat):
+    """
+        Benchmark the former payload format, i.e. a pickled raw image sent as a JSON string.
+
+        Args:
+            image:  A numpy.ndarray instance representing the image.
+            repeat: An integer representing the number of timed executions.
+
+        Returns:
+            A (bytes per frame, encode ms, decode ms) tuple.
+
+        Raises:
+            None.
+    """
+    # Python 3 pickles are binary, therefore they are escaped as latin-1 text as JSON would require
+    encode  = lambda: json.dumps({"img" : pickle.dumps(image).decode("latin-1")});
+    payload = encode();
+    decode  = lambda: pickle.loads(json.loads(payload)["img"].encode("latin-1"));
+
+    return len(payload.encode("utf-8")), timeCall(encode, repeat), timeCall(decode, repeat);
+
+def benchmarkCodec(image, codecName, quality, repeat):
+    """
+        Benchmark the given codec on the given image.
+
+        Args:
+            image:      A numpy.ndarray instance representing the image.
+            codecName:  A string instance representing the codec name.
+            quality:    An integer between 0 and 100 representing the encode quality.
+            repeat:     An integer representing the number of timed executions.
+
+        Returns:
+            A (bytes per frame, encode ms, decode ms) tuple. The size includes the
+            base64 overhead of the JSON device event payload.
+
+        Raises:
+            None.
+    """
+    encodedImage = encodeImage(image, codecName, quality);
+
+    encodeTime = timeCall(lambda: encodeImage(image, codecName, quality), repeat);
+    decodeTime = timeCall(lambda: decodeImage(encodedImage), repeat);
+
+    return len(base64.b64encode(encodedImage)), encodeTime, decodeTime;
+
+def parseCommandLineOptions():
+    """
+        Parse the given command line options.
+
+        Args:
+            None.
+
+        Returns:
+            options: A argparse.Namespace instance representing the parsed command line options.
+
+        Raises:
+            argparse.error if one of the command line options is invalid.
+    """
+    parser = argparse.ArgumentParser(description="Report bytes per frame and encode/decode time per image codec.");
+
+    parser.add_argument("-c", "--image-codecs", action="store", nargs="+", choices=sorted(IMAGE_CODECS), default=sorted(IMAGE_CODECS), dest="imageCodecs");
+    parser.add_argument("-q", "--image-qualities", action="store", nargs="+", type=int, default=[50, DEFAULT_IMAGE_QUALITY, 95], dest="imageQualities");
+    parser.add_argument("-W", "--width", action="store", type=int, default=64, dest="width");
+    parser.add_argument("-H", "--height", action="store", type=int, default=48, dest="height");
+    parser.add_argument("-d", "--images-dir", action="store", default=None, dest="imagesDir");
+    parser.add_argument("-r", "--repeat", action="store", type=int, default=20, dest="repeat");
+
+    # Parse command line options
+    options = parser.parse_args();
+
+    return options;
+
+
+# -----------------------------------------------------------------------------
+# Main
+# -----------------------------------------------------------------------------
+
+# Parse command line options
+options = parseCommandLineOptions();
+
+# Load the test images
+if options.imagesDir:
+    images = loadImages(options.imagesDir);
+else:
+    images = getTestImages(options.width, options.height);
+
+if not images:
+    print("No test images available.");
+
+    sys.exit(1);
+
+# Benchmark every codec and quality on every image
+rowFormat = "%-16s %-8s %7s %12s %12s %12s";
+
+print(rowFormat % ("image", "codec", "quality", "bytes/frame", "encode ms", "decode ms"));
+
+for imageName, image in images:
+    bytesPerFrame, encodeTime, decodeTime = benchmarkLegacyPayload(image, options.repeat);
+
+    print(rowFormat % (imageName, "pickle", "-", bytesPerFrame, "%.3f" % encodeTime, "%.3f" % decodeTime));
+
+    for codecName in options.imageCodecs:
+        for quality in options.imageQualities:
+            bytesPerFrame, encodeTime, decodeTime = benchmarkCodec(image, codecName, quality, options.repeat);
+
+            print(rowFormat % (imageName, codecName, quality, bytesPerFrame, "%.3f" % encodeTime, "%.3f" % decodeTime));
@@ -0,0 +1,519 @@
+#!/usr/bin/env python
+
+import argparse
+import asyncio
+import itertools
+import os
+import sys
+import threading
+import time
+
+import paho.mqtt.client
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir));
+
+from common.latency import LatencyRecorder, formatReportSummary, stampPayload
+from common.message_codecs import MESSAGE_CODECS, getMessageCodec
+from common.mqtt_lite import MqttBroker
+from common.runtime import initDeviceClient
+
+from chunked_transfer import ChunkReassembler, ChunkSplitter, isChunk
+from frame_pipeline import FrameDecoderPool, FramePipeline
+from frame_sources import openFrameSource
+from image_codecs import DEFAULT_IMAGE_CODEC, DEFAULT_IMAGE_QUALITY, DEFAULT_IMAGE_SCALE, IMAGE_CODECS, decodeImagePayload, getDeviceEventPayload
+from tile_delta import DEFAULT_DELTA_THRESHOLD, DEFAULT_KEYFRAME_INTERVAL, DEFAULT_TILE_SIZE, KEYFRAME_COMMAND, KEYFRAME_REQUEST_INTERVAL, KeyframeRequiredError, TileDeltaDecoder, TileDeltaEncoder, isTileDeltaPayload
+
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+# Identity of the sender, which connects to the in-process broker as a device
+ORGANIZATION_ID     = "local";
+DEVICE_TYPE         = "benchmark";
+DEVICE_ID           = "camera";
+DEVICE_EVENT_NAME   = "image";
+
+# Topic of the device events received by the benchmark receiver
+DEVICE_EVENTS_TOPIC = "iot-2/type/+/id/+/evt/+/fmt/+";
+
+# Number of seconds to wait for the receiver to connect and subscribe
+CONNECT_TIMEOUT = 5.0;
+
+# Number of seconds during which the events sent before the end of the run may still be received
+DRAIN_TIMEOUT   = 2.0;
+DRAIN_INTERVAL  = 0.1;
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+class StageCpuTimer(object):
+    """
+        CPU time spent in a stage of the pipeline, summed over the threads
+        running it.
+
+        The time is measured by the thread CPU clock around each call of the
+        stage function, hence the time a thread spends waiting for a queue or
+        the network is not counted.
+    """
+
+    def __init__(self, name):
+        """
+            Initialize the timer.
+
+            Args:
+                name: A string instance representing the stage name.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self.name       = name;
+        self.callCount  = 0;
+        self.cpuTime    = 0.0;
+
+        self._lock      = threading.Lock();
+
+    def wrap(self, function):
+        """
+            Get a callable calling a stage function and measuring its CPU time.
+
+            Args:
+                function: A callable.
+
+            Returns:
+                A callable taking the same arguments and returning the same value as the function.
+
+            Raises:
+                None.
+        """
+        def timedFunction(*arguments):
+            startTime = time.thread_time();
+
+            try:
+                return function(*arguments);
+            finally:
+                cpuTime = time.thread_time() - startTime;
+
+                with self._lock:
+                    self.callCount  += 1;
+                    self.cpuTime    += cpuTime;
+
+        return timedFunction;
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def startBroker():
+    """
+        Start the in-process broker on a free port, in a background event loop.
+
+        Args:
+            None.
+
+        Returns:
+            A (MqttBroker instance, asyncio event loop, threading.Thread instance, port) tuple.
+
+        Raises:
+            OSError if the broker could not listen.
+    """
+    broker  = MqttBroker();
+    loop    = asyncio.new_event_loop();
+    port    = loop.run_until_complete(broker.start("127.0.0.1", 0));
+
+    brokerThread = threading.Thread(target=loop.run_forever, name="broker");
+    brokerThread.daemon = True;
+    brokerThread.start();
+
+    return broker, loop, brokerThread, port;
+
+def stopBroker(broker, loop, brokerThread):
+    """
+        Stop the in-process broker started by startBroker.
+
+        Args:
+            broker:         A MqttBroker instance.
+            loop:           The asyncio event loop running the broker.
+            brokerThread:   The threading.Thread instance running the event loop.
+
+        Returns:
+            None.
+
+        Raises:
+            None.
+    """
+    asyncio.run_coroutine_threadsafe(broker.stop(), loop).result();
+
+    loop.call_soon_threadsafe(loop.stop);
+    brokerThread.join();
+    loop.close();
+
+def getThreadCpuTime(thread):
+    """
+        Get the CPU time consumed by a thread.
+
+        Args:
+            thread: A started threading.Thread instance.
+
+        Returns:
+            A float representing the number of CPU seconds, or None if the platform cannot measure it.
+
+        Raises:
+            None.
+    """
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(thread.ident));
+    except (AttributeError, OSError):
+        return None;
+
+def decodeDeviceEventData(device, data):
+    """
+        Get the image stored in the event data received from a device.
+
+        Args:
+            device: A string instance identifying the device.
+            data:   A dictionary or bytes instance representing the device event payload.
+
+        Returns:
+            A numpy.ndarray instance representing the image, or None if the image is a delta which
+            cannot be applied until the next keyframe.
+
+        Raises:
+            ValueError if the payload does not contain a valid image.
+    """
+    # Ask the sender for a keyframe, through the broker, when a delta cannot be applied, and skip the
+    # following deltas until the keyframe is received
+    if isTileDeltaPayload(data):
+        try:
+            return tileDeltaDecoder.decodePayload(device, data);
+        except KeyframeRequiredError:
+            now = time.monotonic();
+
+            if now - keyframeRequestTimes.get(device, -KEYFRAME_REQUEST_INTERVAL) >= KEYFRAME_REQUEST_INTERVAL:
+                keyframeRequestTimes[device] = now;
+
+                deviceType, deviceId = device.split(":", 1);
+
+                appClient.publish("iot-2/type/%s/id/%s/cmd/%s/fmt/json" % (deviceType, deviceId, KEYFRAME_COMMAND), "{}");
+
+            return None;
+
+    return decodeImagePayload(data);
+
+def receiveDeviceEvent(client, userData, message):
+    """
+        Callback executed by the MQTT client of the receiver when a device event is received.
+
+        Args:
+            client:     The paho.mqtt.client.Client instance.
+            userData:   The user data of the client.
+            message:    A paho.mqtt.client.MQTTMessage instance.
+
+        Returns:
+            None.
+
+        Raises:
+            None.
+    """
+    topicLevels = message.topic.split("/");
+    data        = MESSAGE_CODECS[topicLevels[-1]].decodePayload(message.payload);
+    device      = "%s:%s" % (topicLevels[2], topicLevels[4]);
+
+    receivedBytes[0] += len(message.payload);
+
+    # The chunks of the large payloads are reassembled before being decoded
+    if isChunk(data):
+        chunkReassembler.submit(device, topicLevels[-1], data);
+
+        return;
+
+    if isinstance(data, dict):
+        latencyRecorder.recordPayload(device, data);
+
+    decoderPool.submit(device, data);
+
+def reassembledPayloadCallback(device, messageFormat, payload):
+    """
+        Callback executed by the chunk reassembler when the payload of a chunked device event is complete.
+
+        Args:
+            device:         A string instance identifying the device.
+            messageFormat:  A string instance representing the device event format.
+            payload:        A bytes-like object representing the payload, only valid during the call.
+
+        Returns:
+            None.
+
+        Raises:
+            ValueError if the payload cannot be decoded.
+    """
+    data = MESSAGE_CODECS[messageFormat].decodePayload(payload);
+
+    latencyRecorder.recordPayload(device, data);
+
+    decoderPool.submit(device, data);
+
+def receivedCommandCallback(command):
+    """
+        Callback executed when the sender receives a device command.
+
+        Args:
+            command: The device command.
+
+        Returns:
+            None.
+
+        Raises:
+            None.
+    """
+    if command.command == KEYFRAME_COMMAND and tileDeltaEncoder is not None:
+        tileDeltaEncoder.requestKeyframe();
+
+def publishDeviceEvent(data):
+    """
+        Publish a device event, stamped to measure its delivery latency if the device event format allows it.
+
+        Args:
+            data: A dictionary or bytes instance representing the device event payload.
+
+        Returns:
+            None.
+
+        Raises:
+            None.
+    """
+    if messageCodec.structured:
+        stampPayload(data, next(benchmarkSequence));
+
+    # The payloads exceeding the chunk size are published as a series of chunk events
+    if chunkSplitter is not None:
+        payload = messageCodec.encodePayload(data);
+
+        if not isinstance(payload, bytes):
+            payload = payload.encode("utf-8");
+
+        if len(payload) > chunkSplitter.chunkSize:
+            for chunk in chunkSplitter.split(payload):
+                deviceClient.publishEvent(DEVICE_EVENT_NAME, options.deviceEventFormat, chunk);
+
+            return;
+
+    deviceClient.publishEvent(DEVICE_EVENT_NAME, options.deviceEventFormat, data);
+
+def getPendingFrameCount():
+    """
+        Get the number of published frames which were neither decoded nor lost yet.
+
+        Args:
+            None.
+
+        Returns:
+            An integer.
+
+        Raises:
+            None.
+    """
+    lostCount = (chunkReassembler.timedOutCount + chunkReassembler.evictedCount + chunkReassembler.rejectedCount +
+                 chunkReassembler.corruptedCount + decoderPool.errorCount + decoderPool.skippedCount +
+                 sum(payloadQueue.droppedCount for payloadQueue in decoderPool.payloadQueues));
+
+    return publishTimer.callCount - decoderPool.decodedCount - lostCount;
+
+def parseCommandLineOptions():
+    """
+        Parse the given command line options.
+
+        Args:
+            None.
+
+        Returns:
+            options: A argparse.Namespace instance representing the parsed command line options.
+
+        Raises:
+            argparse.error if one of the command line options is invalid.
+    """
+    parser = argparse.ArgumentParser(description="Run the image pipeline (capture, encode, publish, receive, decode) against an "
+                                                 "in-process broker and report the frame rate and CPU time per frame.");
+
+    parser.add_argument("--source", action="store", default="synthetic", dest="frameSource");
+    parser.add_argument("-f", "--format", action="store", choices=sorted(MESSAGE_CODECS), default="json", dest="deviceEventFormat");
+    parser.add_argument("-c", "--image-codec", action="store", choices=sorted(IMAGE_CODECS), default=DEFAULT_IMAGE_CODEC, dest="imageCodec");
+    parser.add_argument("-q", "--image-quality", action="store", type=int, default=DEFAULT_IMAGE_QUALITY, dest="imageQuality");
+    parser.add_argument("--scale", action="store", type=float, default=DEFAULT_IMAGE_SCALE, dest="imageScale");
+    parser.add_argument("-r", "--target-frame-rate", action="store", type=float, default=0.0, dest="targetFrameRate");
+    parser.add_argument("-w", "--encoder-workers", action="store", type=int, default=2, dest="encoderWorkers");
+    parser.add_argument("--decoder-workers", action="store", type=int, default=2, dest="decoderWorkers");
+    parser.add_argument("-s", "--queue-size", action="store", type=int, default=4, dest="queueSize");
+    parser.add_argument("-d", "--duration", action="store", type=float, default=10.0, dest="duration");
+    parser.add_argument("--delta", action="store_true", default=False, dest="delta");
+    parser.add_argument("--chunk-size", action="store", type=int, default=0, dest="chunkSize");
+    parser.add_argument("--tile-size", action="store", type=int, default=DEFAULT_TILE_SIZE, dest="tileSize");
+    parser.add_argument("--delta-threshold", action="store", type=float, default=DEFAULT_DELTA_THRESHOLD, dest="deltaThreshold");
+    parser.add_argument("--keyframe-interval", action="store", type=int, default=DEFAULT_KEYFRAME_INTERVAL, dest="keyframeInterval");
+
+    # Parse command line options
+    options = parser.parse_args();
+
+    if not getMessageCodec(options.deviceEventFormat).structured and (options.delta or options.chunkSize):
+        parser.error("The %s device event format cannot be used with --delta or --chunk-size." % options.deviceEventFormat);
+
+    if options.chunkSize < 0:
+        parser.error("--chunk-size should not be negative.");
+
+    if options.duration <= 0:
+        parser.error("--duration should be positive.");
+
+    return options;
+
+
+# -----------------------------------------------------------------------------
+# Main
+# -----------------------------------------------------------------------------
+
+# Parse command line options
+options = parseCommandLineOptions();
+
+try:
+    frameSource = openFrameSource(options.frameSource);
+except ValueError as exception:
+    print("Could not open the frame source: %s" % str(exception));
+
+    sys.exit(1);
+
+messageCodec = getMessageCodec(options.deviceEventFormat);
+
+# Run the broker in this process, so that the benchmark does not depend on the network
+broker, brokerLoop, brokerThread, brokerPort = startBroker();
+
+# Time each stage of the sender and of the receiver
+captureTimer    = StageCpuTimer("capture");
+encodeTimer     = StageCpuTimer("encode");
+publishTimer    = StageCpuTimer("publish");
+receiveTimer    = StageCpuTimer("receive");
+decodeTimer     = StageCpuTimer("decode");
+
+# Receive the device events as an application would. The ibmiotf application client is not used, so that the
+# benchmark runs with the Python versions it does not support.
+tileDeltaDecoder        = TileDeltaDecoder();
+keyframeRequestTimes    = {};
+latencyRecorder         = LatencyRecorder();
+receivedBytes           = [0];
+subscribedEvent         = threading.Event();
+
+decoderPool         = FrameDecoderPool(decodeTimer.wrap(decodeDeviceEventData), options.decoderWorkers);
+chunkReassembler    = ChunkReassembler(receiveTimer.wrap(reassembledPayloadCallback));
+
+appClient = paho.mqtt.client.Client(client_id="a:%s:benchmark" % ORGANIZATION_ID);
+
+appClient.on_connect    = lambda client, userData, flags, rc: client.subscribe(DEVICE_EVENTS_TOPIC);
+appClient.on_subscribe  = lambda client, userData, mid, grantedQos: subscribedEvent.set();
+appClient.on_message    = receiveTimer.wrap(receiveDeviceEvent);
+
+appClient.connect("127.0.0.1", brokerPort);
+appClient.loop_start();
+
+if not subscribedEvent.wait(CONNECT_TIMEOUT):
+    print("The receiver could not subscribe to the device events.");
+
+    sys.exit(1);
+
+decoderPool.start();
+chunkReassembler.start();
+
+# Send the images as send_images_to_wiotp.py does
+deviceClient = initDeviceClient(ORGANIZATION_ID, DEVICE_TYPE, DEVICE_ID, "token", "token", "127.0.0.1:%d" % brokerPort);
+
+tileDeltaEncoder = None;
+
+if options.delta:
+    tileDeltaEncoder = TileDeltaEncoder(options.tileSize, options.deltaThreshold, options.keyframeInterval,
+                                        options.imageCodec, options.imageQuality, messageCodec.binary);
+
+    # Delta encoding depends on the previous image, therefore images are encoded sequentially
+    options.encoderWorkers = 1;
+
+deviceClient.commandCallback = receivedCommandCallback;
+
+deviceClient.connect();
+
+benchmarkSequence   = itertools.count();
+chunkSplitter       = ChunkSplitter(options.chunkSize, messageCodec.binary) if options.chunkSize else None;
+
+pipeline = FramePipeline(
+    captureTimer.wrap(frameSource.read),
+    encodeTimer.wrap(lambda image: getDeviceEventPayload(image, options.imageCodec, options.imageQuality, tileDeltaEncoder,
+                                                         messageCodec, options.imageScale)),
+    publishTimer.wrap(publishDeviceEvent),
+    options.targetFrameRate, options.encoderWorkers, options.queueSize, options.delta
+);
+
+print("Running the pipeline for %.1f seconds: %s, %s %s (quality %d, scale %g)%s..." % (
+    options.duration, frameSource.describe(), options.deviceEventFormat, options.imageCodec, options.imageQuality,
+    options.imageScale, ", delta encoded" if options.delta else ""));
+
+brokerCpuTime   = getThreadCpuTime(brokerThread);
+startCpuTime    = time.process_time();
+startTime       = time.monotonic();
+
+pipeline.start();
+
+time.sleep(options.duration);
+
+pipeline.stop();
+
+# Wait for the events still in flight to be received and decoded
+drainDeadline = time.monotonic() + DRAIN_TIMEOUT;
+
+while time.monotonic() < drainDeadline and getPendingFrameCount() > 0:
+    time.sleep(DRAIN_INTERVAL);
+
+elapsedTime     = time.monotonic() - startTime;
+cpuTime         = time.process_time() - startCpuTime;
+
+if brokerCpuTime is not None:
+    brokerCpuTime = getThreadCpuTime(brokerThread) - brokerCpuTime;
+
+# Stop the sender, the receiver and the broker
+deviceClient.disconnect();
+
+appClient.loop_stop();
+appClient.disconnect();
+
+chunkReassembler.stop();
+decoderPool.stop();
+frameSource.close();
+
+stopBroker(broker, brokerLoop, brokerThread);
+
+# Report the throughput and the CPU time per frame
+decodedCount = decoderPool.decodedCount;
+
+print("Frames: captured %d, published %d, received %d, decoded %d, dropped %d, errors %d" % (
+    captureTimer.callCount, publishTimer.callCount, decoderPool.receivedCount, decodedCount,
+    # Nothing takes the decoded frames, hence only the payloads dropped from the decoder queues or skipped are counted
+    sum(payloadQueue.droppedCount for payloadQueue in decoderPool.payloadQueues) + decoderPool.skippedCount +
+    pipeline.captureQueue.droppedCount +
+    pipeline.publishQueue.droppedCount + pipeline.staleCount,
+    pipeline.errorCount + decoderPool.errorCount));
+
+if not decodedCount:
+    print("No frame went through the pipeline.");
+
+    sys.exit(1);
+
+print("End-to-end: %.1f fps, %.0f bytes per frame" % (decodedCount / elapsedTime, receivedBytes[0] / float(decoderPool.receivedCount)));
+print("CPU per decoded frame: %.2f ms in total, %s%s" % (
+    1000 * cpuTime / decodedCount,
+    ", ".join("%s %.2f ms" % (timer.name, 1000 * timer.cpuTime / decodedCount)
+              for timer in (captureTimer, encodeTimer, publishTimer, receiveTimer, decodeTimer)),
+    ", broker %.2f ms" % (1000 * brokerCpuTime / decodedCount) if brokerCpuTime is not None else ""));
+print(formatReportSummary(latencyRecorder.getReport()));
+
+if chunkReassembler.startedCount:
+    print(chunkReassembler.getStatisticsReport());
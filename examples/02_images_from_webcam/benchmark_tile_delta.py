@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir));
+
+from image_codecs import DEFAULT_IMAGE_CODEC, DEFAULT_IMAGE_QUALITY, IMAGE_CODECS, encodeImagePayload
+from tile_delta import DEFAULT_DELTA_THRESHOLD, DEFAULT_KEYFRAME_INTERVAL, DEFAULT_TILE_SIZE, KEYFRAME_KIND, TileDeltaDecoder, TileDeltaEncoder
+
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+# Seed used to generate the synthetic sequence
+SYNTHETIC_SEQUENCE_SEED = 42;
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def getSyntheticSequence(width, height, frameCount):
+    """
+        Get a synthetic sequence imitating a fixed webcam: a static scene with
+        sensor noise and a small moving object.
+
+        Args:
+            width:      An integer representing the width of the frames.
+            height:     An integer representing the height of the frames.
+            frameCount: An integer representing the number of frames.
+
+        Returns:
+            A generator of numpy.ndarray instances representing the frames.
+
+        Raises:
+            None.
+    """
+    randomState = numpy.random.RandomState(SYNTHETIC_SEQUENCE_SEED);
+    background  = cv2.GaussianBlur(randomState.randint(0, 256, (height, width, 3)).astype(numpy.uint8), (31, 31), 0);
+    objectSize  = max(4, min(width, height) // 8);
+
+    for index in range(frameCount):
+        frame = background.copy();
+
+        # Move the object along the diagonal of the scene
+        x = int((index * 3) % max(1, width - objectSize));
+        y = int((index * 2) % max(1, height - objectSize));
+
+        cv2.rectangle(frame, (x, y), (x + objectSize, y + objectSize), (0, 0, 255), -1);
+
+        # Add sensor noise
+        noise = randomState.randint(-2, 3, frame.shape);
+
+        yield numpy.clip(frame + noise, 0, 255).astype(numpy.uint8);
+
+def getVideoSequence(videoPath, frameCount, scale):
+    """
+        Get the frames of a recorded video.
+
+        Args:
+            videoPath:  A string instance representing the video file path.
+            frameCount: An integer representing the maximum number of frames.
+            scale:      A float representing the scale factor applied to the frames.
+
+        Returns:
+            A generator of numpy.ndarray instances representing the frames.
+
+        Raises:
+            None.
+    """
+    videoCapture = cv2.VideoCapture(videoPath);
+
+    try:
+        for _ in range(frameCount):
+            okMsg, frame = videoCapture.read();
+
+            if not okMsg:
+                break;
+
+            yield scaleImage(frame, scale);
+    finally:
+        videoCapture.release();
+
+def getDirectorySequence(imagesDir, frameCount, scale):
+    """
+        Get the frames stored as images in a directory, in file name order.
+
+        Args:
+            imagesDir:  A string instance representing the directory path.
+            frameCount: An integer representing the maximum number of frames.
+            scale:      A float representing the scale factor applied to the frames.
+
+        Returns:
+            A generator of numpy.ndarray instances representing the frames.
+
+        Raises:
+            None.
+    """
+    for fileName in sorted(os.listdir(imagesDir))[:frameCount]:
+        frame = cv2.imread(os.path.join(imagesDir, fileName), cv2.IMREAD_COLOR);
+
+        if frame is not None:
+            yield scaleImage(frame, scale);
+
+def scaleImage(image, scale):
+    """
+        Scale an image the same way as the webcam sender.
+
+        Args:
+            image: A numpy.ndarray instance representing the image.
+            scale: A float representing the scale factor.
+
+        Returns:
+            A numpy.ndarray instance representing the scaled image.
+
+        Raises:
+            None.
+    """
+    if scale == 1.0:
+        return image;
+
+    return cv2.resize(image, None, fx = scale, fy = scale, interpolation = cv2.INTER_CUBIC);
+
+def getPayloadSize(data):
+    """
+        Get the size in bytes of a JSON device event payload.
+
+        Args:
+            data: A dictionary instance representing the device event payload.
+
+        Returns:
+            An integer representing the payload size.
+
+        Raises:
+            None.
+    """
+    return len(json.dumps(data).encode("utf-8"));
+
+def parseCommandLineOptions():
+    """
+        Parse the given command line options.
+
+        Args:
+            None.
+
+        Returns:
+            options: A argparse.Namespace instance representing the parsed command line options.
+
+        Raises:
+            argparse.error if one of the command line options is invalid.
+    """
+    parser = argparse.ArgumentParser(description="Report bytes saved and reconstruction cost of tile delta encoding.");
+
+    parser.add_argument("-v", "--video", action="store", default=None, dest="videoPath");
+    parser.add_argument("-d", "--images-dir", action="store", default=None, dest="imagesDir");
+    parser.add_argument("-n", "--frames", action="store", type=int, default=300, dest="frameCount");
+    parser.add_argument("-x", "--scale", action="store", type=float, default=0.1, dest="scale");
+    parser.add_argument("-W", "--width", action="store", type=int, default=320, dest="width");
+    parser.add_argument("-H", "--height", action="store", type=int, default=240, dest="height");
+    parser.add_argument("-c", "--image-codec", action="store", choices=sorted(IMAGE_CODECS), default=DEFAULT_IMAGE_CODEC, dest="imageCodec");
+    parser.add_argument("-q", "--image-quality", action="store", type=int, default=DEFAULT_IMAGE_QUALITY, dest="imageQuality");
+    parser.add_argument("--tile-size", action="store", type=int, default=DEFAULT_TILE_SIZE, dest="tileSize");
+    parser.add_argument("--delta-threshold", action="store", type=float, default=DEFAULT_DELTA_THRESHOLD, dest="deltaThreshold");
+    parser.add_argument("--keyframe-interval", action="store", type=int, default=DEFAULT_KEYFRAME_INTERVAL, dest="keyframeInterval");
+
+    # Parse command line options
+    options = parser.parse_args();
+
+    return options;
+
+
+# -----------------------------------------------------------------------------
+# Main
+# -----------------------------------------------------------------------------
+
+# Parse command line options
+options = parseCommandLineOptions();
+
+# Select the recorded or synthetic sequence. The synthetic sequence is generated at its final size.
+if options.videoPath:
+    frames = getVideoSequence(options.videoPath, options.frameCount, options.scale);
+elif options.imagesDir:
+    frames = getDirectorySequence(options.imagesDir, options.frameCount, options.scale);
+else:
+    frames = getSyntheticSequence(options.width, options.height, options.frameCount);
+
+encoder = TileDeltaEncoder(options.tileSize, options.deltaThreshold, options.keyframeInterval,
+                           options.imageCodec, options.imageQuality);
+decoder = TileDeltaDecoder();
+
+frameCount          = 0;
+keyframeCount       = 0;
+changedTilesCount   = 0;
+tilesCount          = 0;
+fullBytes           = 0;
+deltaBytes          = 0;
+encodeTime          = 0.0;
+decodeTime          = 0.0;
+squaredErrors       = [];
+
+for frame in frames:
+    # Size of the frame sent as a full image
+    fullBytes += getPayloadSize(encodeImagePayload(frame, options.imageCodec, options.imageQuality));
+
+    # Size and cost of the frame sent as a delta
+    startTime   = time.perf_counter();
+    data        = encoder.encodePayload(frame);
+    encodeTime  += time.perf_counter() - startTime;
+
+    startTime       = time.perf_counter();
+    reconstructed   = decoder.decodePayload("benchmark", data);
+    decodeTime      += time.perf_counter() - startTime;
+
+    deltaBytes += getPayloadSize(data);
+
+    if data["kind"] == KEYFRAME_KIND:
+        keyframeCount += 1;
+    else:
+        changedTilesCount   += len(data["tiles"]);
+        tilesCount          += -(-frame.shape[0] // options.tileSize) * -(-frame.shape[1] // options.tileSize);
+
+    squaredErrors.append(numpy.mean((reconstructed.astype(numpy.float64) - frame) ** 2));
+    frameCount += 1;
+
+if not frameCount:
+    print("No frames available.");
+
+    sys.exit(1);
+
+meanSquaredError    = numpy.mean(squaredErrors);
+psnr                = 10 * numpy.log10(255.0 ** 2 / meanSquaredError) if meanSquaredError else float("inf");
+
+print("frames:                  %d (%d keyframes)" % (frameCount, keyframeCount));
+print("changed tiles:           %.1f%%" % (100.0 * changedTilesCount / tilesCount if tilesCount else 0.0));
+print("full frames:             %d bytes (%.0f bytes/frame)" % (fullBytes, fullBytes / float(frameCount)));
+print("delta frames:            %d bytes (%.0f bytes/frame)" % (deltaBytes, deltaBytes / float(frameCount)));
+print("bytes saved:             %.1f%% (%.1fx smaller)" % (100.0 * (fullBytes - deltaBytes) / fullBytes, fullBytes / float(deltaBytes)));
+print("encode time:             %.3f ms/frame" % (1000 * encodeTime / frameCount));
+print("reconstruction time:     %.3f ms/frame" % (1000 * decodeTime / frameCount));
+print("reconstruction PSNR:     %.1f dB" % psnr);
@@ -0,0 +1,194 @@
+import re
+
+from common.runtime import lazyImport
+
+cv2     = lazyImport("cv2");
+numpy   = lazyImport("numpy");
+
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+DEFAULT_CAMERA_INDEX    = 0;
+DEFAULT_CAPTURE_PROFILE = "default";
+
+# Start of image marker of a JPEG stream
+JPEG_START_MARKER = b"\xff\xd8";
+
+# Custom capture profiles, given as WIDTHxHEIGHT[@FPS][:FOURCC], e.g. 640x480@15:MJPG
+CAPTURE_PROFILE_PATTERN = re.compile(r"^(\d+)x(\d+)(?:@(\d+(?:\.\d+)?))?(?::(\w{4}))?$");
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+class CaptureProfile(object):
+    """
+        Resolution, frame rate and pixel format requested from the camera.
+
+        The settings are applied by the camera driver, hence a smaller
+        resolution costs no CPU time, unlike a resize of the captured frames.
+        With the MJPG pixel format the camera compresses the frames itself,
+        which allows forwarding them without decoding them (see openCamera).
+        A None setting keeps the value chosen by the driver.
+    """
+
+    def __init__(self, name, width = None, height = None, frameRate = None, fourcc = None):
+        """
+            Initialize the profile.
+
+            Args:
+                name:       A string instance representing the profile name.
+                width:      An integer representing the frame width in pixels, or None.
+                height:     An integer representing the frame height in pixels, or None.
+                frameRate:  A float representing the number of frames per second, or None.
+                fourcc:     A string instance representing the four character code of the pixel format, or None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self.name       = name;
+        self.width      = width;
+        self.height     = height;
+        self.frameRate  = frameRate;
+        self.fourcc     = fourcc;
+
+    def __str__(self):
+        return self.name;
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+# Capture profiles selectable by name
+CAPTURE_PROFILES = dict((profile.name, profile) for profile in (
+    CaptureProfile("default"),
+    CaptureProfile("mjpg-320x240-15", 320, 240, 15, "MJPG"),
+    CaptureProfile("mjpg-640x480-15", 640, 480, 15, "MJPG"),
+    CaptureProfile("mjpg-640x480-30", 640, 480, 30, "MJPG"),
+    CaptureProfile("mjpg-1280x720-30", 1280, 720, 30, "MJPG"),
+    CaptureProfile("yuyv-320x240-15", 320, 240, 15, "YUYV"),
+    CaptureProfile("yuyv-640x480-30", 640, 480, 30, "YUYV")
+));
+
+def getCaptureProfile(profileName):
+    """
+        Get a capture profile from its name or from a WIDTHxHEIGHT[@FPS][:FOURCC] specification.
+
+        Args:
+            profileName: A string instance representing the profile.
+
+        Returns:
+            A CaptureProfile instance.
+
+        Raises:
+            ValueError if the profile is unknown.
+    """
+    if profileName in CAPTURE_PROFILES:
+        return CAPTURE_PROFILES[profileName];
+
+    match = CAPTURE_PROFILE_PATTERN.match(profileName);
+
+    if match is None:
+        raise ValueError("Unknown capture profile: %s. Use one of %s or WIDTHxHEIGHT[@FPS][:FOURCC]." % (
+            profileName, ", ".join(sorted(CAPTURE_PROFILES))));
+
+    width, height, frameRate, fourcc = match.groups();
+
+    return CaptureProfile(profileName, int(width), int(height), float(frameRate) if frameRate else None,
+                          fourcc.upper() if fourcc else None);
+
+def openCamera(cameraIndex = DEFAULT_CAMERA_INDEX, profile = None, passthrough = False):
+    """
+        Open a camera and apply a capture profile.
+
+        In passthrough mode OpenCV is asked not to convert the frames to BGR,
+        so that the V4L2 backend returns the JPEG frames of an MJPG camera as
+        they were compressed by the camera (see readJpegFrame).
+
+        Args:
+            cameraIndex:    An integer representing the index of the camera.
+            profile:        An optional CaptureProfile instance.
+            passthrough:    A boolean indicating whether the frames are read without being decoded.
+
+        Returns:
+            A cv2.VideoCapture instance.
+
+        Raises:
+            ValueError if the camera could not be opened.
+    """
+    cameraClient = cv2.VideoCapture(cameraIndex);
+
+    if not cameraClient.isOpened():
+        raise ValueError("Could not open camera %d." % cameraIndex);
+
+    # The pixel format is set first, as it restricts the resolutions and frame rates offered by the camera
+    if profile is not None and profile.fourcc:
+        cameraClient.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*profile.fourcc));
+
+    if profile is not None and profile.width and profile.height:
+        cameraClient.set(cv2.CAP_PROP_FRAME_WIDTH, profile.width);
+        cameraClient.set(cv2.CAP_PROP_FRAME_HEIGHT, profile.height);
+
+    if profile is not None and profile.frameRate:
+        cameraClient.set(cv2.CAP_PROP_FPS, profile.frameRate);
+
+    if passthrough:
+        cameraClient.set(cv2.CAP_PROP_CONVERT_RGB, 0);
+
+    return cameraClient;
+
+def getCameraSettings(cameraClient):
+    """
+        Get a description of the settings actually applied by the camera, which may differ from the profile.
+
+        Args:
+            cameraClient: A cv2.VideoCapture instance.
+
+        Returns:
+            A string instance representing the resolution, frame rate and pixel format.
+
+        Raises:
+            None.
+    """
+    fourcc = int(cameraClient.get(cv2.CAP_PROP_FOURCC));
+
+    return "%dx%d @ %.1f fps, %s" % (
+        cameraClient.get(cv2.CAP_PROP_FRAME_WIDTH), cameraClient.get(cv2.CAP_PROP_FRAME_HEIGHT), cameraClient.get(cv2.CAP_PROP_FPS),
+        "".join(chr((fourcc >> shift) & 0xFF) for shift in (0, 8, 16, 24)) if fourcc else "unknown format"
+    );
+
+def readJpegFrame(cameraClient):
+    """
+        Read the next frame of a camera opened in passthrough mode, as compressed by the camera.
+
+        Args:
+            cameraClient: A cv2.VideoCapture instance returned by openCamera(..., passthrough=True).
+
+        Returns:
+            A bytes instance representing the JPEG frame, or None if no frame could be read.
+
+        Raises:
+            ValueError if the camera or its OpenCV backend does not deliver JPEG frames.
+    """
+    okMsg, buffer = cameraClient.read();
+
+    if not okMsg or buffer is None:
+        return None;
+
+    # The undecoded frame is returned as a single row of bytes
+    if buffer.dtype != numpy.uint8 or (buffer.ndim > 1 and buffer.shape[0] != 1) or buffer.size < 2:
+        raise ValueError("The camera does not deliver compressed frames, use an MJPG capture profile with the V4L2 backend.");
+
+    encodedImage = buffer.tobytes();
+
+    if not encodedImage.startswith(JPEG_START_MARKER):
+        raise ValueError("The camera does not deliver JPEG frames, use an MJPG capture profile.");
+
+    return encodedImage;
@@ -0,0 +1,519 @@
+import collections
+import random
+import threading
+import time
+import zlib
+
+from common.latency import getPercentile
+
+from frame_pipeline import DropOldestQueue
+from image_codecs import packImageBytes, unpackImageBytes
+
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+# Keys of the chunk device events: transfer id, chunk index, number of chunks, offset of the chunk
+# in the payload, payload size, CRC-32 of the payload and chunk bytes
+TRANSFER_ID_KEY     = "xfer";
+CHUNK_INDEX_KEY     = "idx";
+CHUNK_COUNT_KEY     = "n";
+CHUNK_OFFSET_KEY    = "off";
+PAYLOAD_SIZE_KEY    = "size";
+PAYLOAD_CRC_KEY     = "crc";
+CHUNK_DATA_KEY      = "data";
+
+# Number of payload bytes per chunk, below the 128 KB message size limit of the IBM Watson IoT Platform
+# once base64 encoded
+DEFAULT_CHUNK_SIZE = 64 * 1024;
+
+DEFAULT_REASSEMBLY_WORKERS      = 2;
+DEFAULT_REASSEMBLY_QUEUE_SIZE   = 1024;
+DEFAULT_MAX_IN_FLIGHT_BYTES     = 64 * 1024 * 1024;
+DEFAULT_TRANSFER_TIMEOUT        = 10.0;
+
+# Number of seconds between two searches for the transfers which timed out
+EVICTION_INTERVAL = 0.1;
+
+# Number of reassembly latencies kept to compute the percentiles
+LATENCY_SAMPLES = 1000;
+
+# Number of finished transfers remembered by each reassembly thread, so that their late chunks are ignored
+FINISHED_TRANSFERS = 1024;
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def isChunk(data):
+    """
+        Check whether device event data is a chunk created by ChunkSplitter.
+
+        Args:
+            data: The device event data.
+
+        Returns:
+            A boolean.
+
+        Raises:
+            None.
+    """
+    return isinstance(data, dict) and TRANSFER_ID_KEY in data;
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+class ChunkSplitter(object):
+    """
+        Splitter of the payloads exceeding the chunk size into chunk device
+        events, reassembled by ChunkReassembler.
+
+        Each chunk stores the transfer id of its payload, its index and
+        offset, the number of chunks, the payload size and the CRC-32 of the
+        payload, so that the receiver allocates the whole payload at the
+        first chunk it receives, whatever their order, and checks it once
+        complete. The transfer ids start at a random value so that the
+        transfers of a restarted sender do not mix with its previous ones.
+    """
+
+    def __init__(self, chunkSize = DEFAULT_CHUNK_SIZE, binary = False):
+        """
+            Initialize the splitter.
+
+            Args:
+                chunkSize:  An integer representing the maximum number of payload bytes per chunk.
+                binary:     A boolean indicating whether the device event format stores bytes as is,
+                            see image_codecs.packImageBytes.
+
+            Returns:
+                None.
+
+            Raises:
+                ValueError if the chunk size is not positive.
+        """
+        if chunkSize < 1:
+            raise ValueError("The chunk size should be positive.");
+
+        self.chunkSize      = chunkSize;
+        self.binary         = binary;
+        self.transferCount  = 0;
+        self.chunkCount     = 0;
+
+        self._transferId    = random.getrandbits(31);
+        self._lock          = threading.Lock();
+
+    def split(self, payload):
+        """
+            Split an encoded payload into the data of its chunk device events.
+
+            Args:
+                payload: A bytes instance representing the payload encoded by the codec of the device event format.
+
+            Returns:
+                A list of dictionary instances representing the chunks.
+
+            Raises:
+                None.
+        """
+        with self._lock:
+            transferId          = self._transferId;
+            self._transferId    = (self._transferId + 1) & 0x7FFFFFFF;
+
+        payloadCrc  = zlib.crc32(payload) & 0xFFFFFFFF;
+        chunkCount  = max(1, (len(payload) + self.chunkSize - 1) // self.chunkSize);
+        payloadView = memoryview(payload);
+        chunks      = [];
+
+        for index in range(chunkCount):
+            offset = index * self.chunkSize;
+
+            chunks.append({
+                TRANSFER_ID_KEY     : transferId,
+                CHUNK_INDEX_KEY     : index,
+                CHUNK_COUNT_KEY     : chunkCount,
+                CHUNK_OFFSET_KEY    : offset,
+                PAYLOAD_SIZE_KEY    : len(payload),
+                PAYLOAD_CRC_KEY     : payloadCrc,
+                CHUNK_DATA_KEY      : packImageBytes(bytes(payloadView[offset:offset + self.chunkSize]), self.binary)
+            });
+
+        self.transferCount  += 1;
+        self.chunkCount     += chunkCount;
+
+        return chunks;
+
+
+class ChunkTransfer(object):
+    """
+        Payload being reassembled from its chunks.
+    """
+
+    def __init__(self, buffer, size, chunkCount, payloadCrc, messageFormat):
+        """
+            Initialize the transfer.
+
+            Args:
+                buffer:         A bytearray instance of at least size bytes receiving the payload.
+                size:           An integer representing the payload size.
+                chunkCount:     An integer representing the number of chunks.
+                payloadCrc:     An integer representing the CRC-32 of the payload.
+                messageFormat:  A string instance representing the device event format of the chunks.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self.buffer         = buffer;
+        self.size           = size;
+        self.chunkCount     = chunkCount;
+        self.payloadCrc     = payloadCrc;
+        self.messageFormat  = messageFormat;
+        self.startTime      = time.monotonic();
+
+        self.receivedChunks = set();
+
+
+class ChunkReassembler(object):
+    """
+        Pool of threads reassembling the chunked payloads of the devices.
+
+        Each device is assigned to one thread by a stable hash, hence the
+        transfers of different devices are reassembled in parallel while the
+        chunks of a device are handled in order. The chunks are copied into a
+        buffer allocated once per transfer, at its full size, and taken from a
+        per-thread pool of released buffers when one is large enough.
+
+        The bytes of the incomplete transfers are capped: when a new transfer
+        would exceed the cap, the oldest incomplete transfers of its thread are
+        evicted, and the new transfer is rejected if that is not enough. The
+        transfers which are not complete within the timeout are evicted as
+        lost. The completed payloads are passed to the completion function on
+        the reassembly thread.
+    """
+
+    def __init__(self, completeFunction, reassemblyWorkers = DEFAULT_REASSEMBLY_WORKERS, queueSize = DEFAULT_REASSEMBLY_QUEUE_SIZE,
+                 maxInFlightBytes = DEFAULT_MAX_IN_FLIGHT_BYTES, transferTimeout = DEFAULT_TRANSFER_TIMEOUT):
+        """
+            Initialize the pool.
+
+            Args:
+                completeFunction:   A callable taking a device, a device event format and a bytes-like object
+                                    representing a reassembled payload. The object is only valid during the call.
+                reassemblyWorkers:  An integer representing the number of reassembly threads.
+                queueSize:          An integer representing the maximum number of chunks waiting to be handled by
+                                    each thread; the oldest chunk is dropped when a queue is full.
+                maxInFlightBytes:   An integer representing the maximum total size of the incomplete transfers.
+                transferTimeout:    A float representing the number of seconds after which an incomplete transfer is lost.
+
+            Returns:
+                None.
+
+            Raises:
+                ValueError if one of the arguments is invalid.
+        """
+        if reassemblyWorkers < 1:
+            raise ValueError("The number of reassembly workers should be positive.");
+
+        if maxInFlightBytes < 1 or transferTimeout <= 0:
+            raise ValueError("The in-flight bytes cap and the transfer timeout should be positive.");
+
+        self.completeFunction   = completeFunction;
+        self.reassemblyWorkers  = reassemblyWorkers;
+        self.maxInFlightBytes   = maxInFlightBytes;
+        self.transferTimeout    = transferTimeout;
+
+        self.chunkQueues        = [DropOldestQueue(queueSize) for _ in range(reassemblyWorkers)];
+
+        self.inFlightBytes      = 0;
+        self.startedCount       = 0;
+        self.completedCount     = 0;
+        self.timedOutCount      = 0;
+        self.evictedCount       = 0;
+        self.rejectedCount      = 0;
+        self.corruptedCount     = 0;
+        self.duplicateCount     = 0;
+        self.lateCount          = 0;
+        self.errorCount         = 0;
+
+        self._latencies         = collections.deque(maxlen=LATENCY_SAMPLES);
+        self._lock              = threading.Lock();
+        self._stopEvent         = threading.Event();
+        self._threads           = [];
+
+    @property
+    def droppedCount(self):
+        """
+            The number of chunks dropped from the full queues.
+        """
+        return sum(chunkQueue.droppedCount for chunkQueue in self.chunkQueues);
+
+    def start(self):
+        """
+            Start the reassembly threads.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self._stopEvent.clear();
+
+        self._threads = [threading.Thread(target=self._reassemble, args=(chunkQueue,), name="reassembler-%d" % index)
+                         for index, chunkQueue in enumerate(self.chunkQueues)];
+
+        for thread in self._threads:
+            thread.daemon = True;
+            thread.start();
+
+    def stop(self):
+        """
+            Stop the reassembly threads once they handled the queued chunks, and wait for them to finish.
+            The incomplete transfers are dropped.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self._stopEvent.set();
+
+        for chunkQueue in self.chunkQueues:
+            chunkQueue.close();
+
+        for thread in self._threads:
+            thread.join();
+
+        self._threads = [];
+
+    def submit(self, device, messageFormat, chunk):
+        """
+            Queue a received chunk for reassembly. This method never blocks.
+
+            Args:
+                device:         A string instance identifying the device which sent the chunk.
+                messageFormat:  A string instance representing the device event format of the chunk.
+                chunk:          A dictionary instance representing the chunk, see ChunkSplitter.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self.chunkQueues[zlib.crc32(device.encode("utf-8")) % self.reassemblyWorkers].put((device, messageFormat, chunk));
+
+    def getStatisticsReport(self):
+        """
+            Get a one line report of the transfer counters and of the reassembly latency, i.e. the time
+            between the first and the last chunk of the latest completed transfers.
+
+            Args:
+                None.
+
+            Returns:
+                A string instance representing the report.
+
+            Raises:
+                None.
+        """
+        with self._lock:
+            latencies       = sorted(self._latencies);
+            lostCount       = self.timedOutCount + self.evictedCount + self.rejectedCount + self.corruptedCount;
+            inFlightBytes   = self.inFlightBytes;
+
+        report = "transfers: completed %d, lost %d (timed out %d, evicted %d, rejected %d, corrupted %d) | chunks: dropped %d, duplicated %d, late %d | in flight %d KB | errors %d" % (
+            self.completedCount, lostCount, self.timedOutCount, self.evictedCount, self.rejectedCount, self.corruptedCount,
+            self.droppedCount, self.duplicateCount, self.lateCount, inFlightBytes // 1024, self.errorCount);
+
+        if latencies:
+            report += " | latency p50 %.1f ms, p95 %.1f ms, max %.1f ms" % (
+                1000 * getPercentile(latencies, 50), 1000 * getPercentile(latencies, 95), 1000 * latencies[-1]);
+
+        return report;
+
+    def _releaseTransfer(self, transfers, transferKey, bufferPool):
+        """Remove a transfer, returning its buffer to the pool and its bytes to the in-flight budget."""
+        transfer = transfers.pop(transferKey);
+
+        bufferPool.append(transfer.buffer);
+
+        with self._lock:
+            self.inFlightBytes -= transfer.size;
+
+        return transfer;
+
+    def _getBuffer(self, bufferPool, size):
+        """Take the smallest buffer of the pool holding size bytes, or allocate one."""
+        candidates = [buffer for buffer in bufferPool if len(buffer) >= size];
+
+        if not candidates:
+            return bytearray(size);
+
+        buffer = min(candidates, key=len);
+
+        bufferPool.remove(buffer);
+
+        return buffer;
+
+    def _startTransfer(self, transfers, bufferPool, finishedKeys, transferKey, messageFormat, chunk):
+        """Allocate a new transfer within the in-flight bytes cap, or return None if it is rejected."""
+        size = chunk[PAYLOAD_SIZE_KEY];
+
+        with self._lock:
+            self.startedCount += 1;
+
+            exceededBytes = self.inFlightBytes + size - self.maxInFlightBytes;
+
+        # Evict the oldest incomplete transfers of this thread to make room for the new one
+        for oldestKey in sorted(transfers, key=lambda key: transfers[key].startTime):
+            if exceededBytes <= 0:
+                break;
+
+            exceededBytes -= self._releaseTransfer(transfers, oldestKey, bufferPool).size;
+
+            finishedKeys.append(oldestKey);
+
+            with self._lock:
+                self.evictedCount += 1;
+
+        with self._lock:
+            if self.inFlightBytes + size > self.maxInFlightBytes:
+                self.rejectedCount += 1;
+
+                return None;
+
+            self.inFlightBytes += size;
+
+        # Keep the pool from growing beyond the buffers this thread ever needs at once
+        if len(bufferPool) > len(transfers) + 1:
+            bufferPool.remove(min(bufferPool, key=len));
+
+        transfers[transferKey] = ChunkTransfer(self._getBuffer(bufferPool, size), size, chunk[CHUNK_COUNT_KEY],
+                                               chunk[PAYLOAD_CRC_KEY], messageFormat);
+
+        return transfers[transferKey];
+
+    def _reassemble(self, chunkQueue):
+        """
+            Copy the chunks of the given queue into the buffers of their transfers and complete the transfers,
+            until the queue is closed and empty.
+        """
+        transfers           = {};
+        bufferPool          = [];
+        finishedKeys       = collections.deque(maxlen=FINISHED_TRANSFERS);
+        nextEvictionTime    = time.monotonic() + EVICTION_INTERVAL;
+
+        while True:
+            item = chunkQueue.get(EVICTION_INTERVAL);
+
+            # Evict the transfers which timed out
+            now = time.monotonic();
+
+            if now >= nextEvictionTime:
+                for transferKey in [key for key, transfer in transfers.items() if now - transfer.startTime > self.transferTimeout]:
+                    self._releaseTransfer(transfers, transferKey, bufferPool);
+
+                    finishedKeys.append(transferKey);
+
+                    with self._lock:
+                        self.timedOutCount += 1;
+
+                nextEvictionTime = now + EVICTION_INTERVAL;
+
+            if item is None:
+                if self._stopEvent.is_set():
+                    break;
+
+                continue;
+
+            device, messageFormat, chunk = item;
+
+            try:
+                transferKey = (device, chunk[TRANSFER_ID_KEY]);
+                transfer    = transfers.get(transferKey);
+
+                # The late chunks of a completed, rejected, evicted or timed out transfer are ignored
+                if transfer is None and transferKey in finishedKeys:
+                    with self._lock:
+                        self.lateCount += 1;
+
+                    continue;
+
+                if transfer is None:
+                    transfer = self._startTransfer(transfers, bufferPool, finishedKeys, transferKey, messageFormat, chunk);
+
+                if transfer is None:
+                    finishedKeys.append(transferKey);
+
+                    continue;
+
+                chunkIndex = chunk[CHUNK_INDEX_KEY];
+
+                if chunkIndex in transfer.receivedChunks:
+                    with self._lock:
+                        self.duplicateCount += 1;
+
+                    continue;
+
+                chunkData   = unpackImageBytes(chunk[CHUNK_DATA_KEY]);
+                offset      = chunk[CHUNK_OFFSET_KEY];
+
+                if offset < 0 or offset + len(chunkData) > transfer.size:
+                    raise ValueError("Chunk %d exceeds the payload size." % chunkIndex);
+
+                transfer.buffer[offset:offset + len(chunkData)] = chunkData;
+                transfer.receivedChunks.add(chunkIndex);
+            except (KeyError, TypeError, ValueError) as exception:
+                print("Could not reassemble chunk from %s: %s" % (device, str(exception)));
+
+                with self._lock:
+                    self.errorCount += 1;
+
+                continue;
+
+            if len(transfer.receivedChunks) < transfer.chunkCount:
+                continue;
+
+            # The transfer is complete, check its payload before passing it on
+            self._releaseTransfer(transfers, transferKey, bufferPool);
+
+            finishedKeys.append(transferKey);
+
+            payload = memoryview(transfer.buffer)[:transfer.size];
+
+            if zlib.crc32(payload) & 0xFFFFFFFF != transfer.payloadCrc:
+                with self._lock:
+                    self.corruptedCount += 1;
+
+                payload.release();
+
+                continue;
+
+            with self._lock:
+                self.completedCount += 1;
+
+                self._latencies.append(time.monotonic() - transfer.startTime);
+
+            try:
+                self.completeFunction(device, transfer.messageFormat, payload);
+            except Exception as exception:
+                print("Could not handle transfer from %s: %s" % (device, str(exception)));
+
+                with self._lock:
+                    self.errorCount += 1;
+            finally:
+                payload.release();
@@ -0,0 +1,694 @@
+import collections
+import threading
+import time
+
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+# Number of seconds the capture thread waits after a failed capture when frames are captured as fast as
+# possible, so that an unplugged camera does not keep a core busy
+CAPTURE_RETRY_INTERVAL = 0.05;
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+class DropOldestQueue(object):
+    """
+        Bounded, thread-safe FIFO queue which drops its oldest item instead of
+        blocking the producer when it is full.
+    """
+
+    def __init__(self, maxSize):
+        """
+            Initialize the queue.
+
+            Args:
+                maxSize: An integer representing the maximum number of queued items.
+
+            Returns:
+                None.
+
+            Raises:
+                ValueError if the maximum size is not positive.
+        """
+        if maxSize < 1:
+            raise ValueError("The queue size should be positive, not %d." % maxSize);
+
+        self.maxSize        = maxSize;
+        self.droppedCount   = 0;
+
+        self._items         = collections.deque();
+        self._condition     = threading.Condition(threading.Lock());
+        self._closed        = False;
+
+    def put(self, item):
+        """
+            Append an item to the queue, dropping the oldest item if the queue is full.
+
+            Args:
+                item: The item to be queued.
+
+            Returns:
+                The dropped item if the queue was full, None otherwise.
+
+            Raises:
+                None.
+        """
+        droppedItem = None;
+
+        with self._condition:
+            if len(self._items) >= self.maxSize:
+                droppedItem = self._items.popleft();
+
+                self.droppedCount += 1;
+
+            self._items.append(item);
+            self._condition.notify();
+
+        return droppedItem;
+
+    def get(self, timeout = None):
+        """
+            Remove and return the oldest item of the queue.
+
+            Args:
+                timeout: A float representing the maximum number of seconds to wait
+                         for an item, or None to wait until an item is available.
+
+            Returns:
+                The oldest item, or None if the timeout expired or the queue was closed.
+
+            Raises:
+                None.
+        """
+        with self._condition:
+            if timeout is None:
+                while not self._items and not self._closed:
+                    self._condition.wait();
+            elif not self._items and not self._closed:
+                self._condition.wait(timeout);
+
+            if not self._items:
+                return None;
+
+            return self._items.popleft();
+
+    def close(self):
+        """
+            Wake up all the consumers waiting for an item.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        with self._condition:
+            self._closed = True;
+            self._condition.notify_all();
+
+    def __len__(self):
+        with self._condition:
+            return len(self._items);
+
+
+class BlockingQueue(DropOldestQueue):
+    """
+        Bounded, thread-safe FIFO queue which blocks the producer when it is
+        full, for the items which must not be dropped. A closed queue no longer
+        blocks, and drops the items put into it.
+    """
+
+    def put(self, item):
+        """
+            Append an item to the queue, waiting for a free slot if the queue is full.
+
+            Args:
+                item: The item to be queued.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        with self._condition:
+            while len(self._items) >= self.maxSize and not self._closed:
+                self._condition.wait();
+
+            if self._closed:
+                self.droppedCount += 1;
+
+                return None;
+
+            self._items.append(item);
+            self._condition.notify_all();
+
+        return None;
+
+    def get(self, timeout = None):
+        """
+            Remove and return the oldest item of the queue, waking up the producers waiting for a free slot.
+
+            Args:
+                timeout: A float representing the maximum number of seconds to wait
+                         for an item, or None to wait until an item is available.
+
+            Returns:
+                The oldest item, or None if the timeout expired or the queue was closed.
+
+            Raises:
+                None.
+        """
+        item = DropOldestQueue.get(self, timeout);
+
+        with self._condition:
+            self._condition.notify_all();
+
+        return item;
+
+
+class StageStatistics(object):
+    """
+        Thread-safe throughput statistics of a pipeline stage.
+    """
+
+    def __init__(self, name):
+        """
+            Initialize the statistics.
+
+            Args:
+                name: A string instance representing the stage name.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self.name = name;
+
+        self._lock          = threading.Lock();
+        self._count         = 0;
+        self._busyTime      = 0.0;
+        self._lastCount     = 0;
+        self._lastBusyTime  = 0.0;
+        self._lastTime      = time.monotonic();
+
+    def record(self, duration):
+        """
+            Record an item processed by the stage.
+
+            Args:
+                duration: A float representing the processing time in seconds.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        with self._lock:
+            self._count     += 1;
+            self._busyTime  += duration;
+
+    def sample(self):
+        """
+            Get the throughput of the stage since the previous sample.
+
+            Args:
+                None.
+
+            Returns:
+                A (items per second, mean processing time in seconds) tuple.
+
+            Raises:
+                None.
+        """
+        with self._lock:
+            now         = time.monotonic();
+            count       = self._count - self._lastCount;
+            busyTime    = self._busyTime - self._lastBusyTime;
+            elapsedTime = max(now - self._lastTime, 1e-9);
+
+            self._lastCount     = self._count;
+            self._lastBusyTime  = self._busyTime;
+            self._lastTime      = now;
+
+        return count / elapsedTime, (busyTime / count if count else 0.0);
+
+
+class FramePipeline(object):
+    """
+        Pipeline made of a capture thread, a pool of encoder threads and a
+        publisher thread joined by bounded drop-oldest queues.
+
+        Frames are numbered when captured. As the encoders run in parallel, the
+        publisher drops any encoded frame older than the last published one so
+        that frames are always published in capture order.
+
+        When each payload depends on the previous one, as the delta encoded
+        images do, the payloads are chained: a single encoder waits for the
+        publisher instead of dropping its payloads, hence only the captured
+        frames are dropped once the publisher falls behind.
+    """
+
+    def __init__(self, captureFunction, encodeFunction, publishFunction, targetFrameRate = 0.0, encoderWorkers = 2, queueSize = 4,
+                 chainedPayloads = False):
+        """
+            Initialize the pipeline.
+
+            Args:
+                captureFunction:    A callable returning the next frame, or None if no frame could be captured.
+                encodeFunction:     A callable converting a frame into a device event payload.
+                publishFunction:    A callable publishing a device event payload.
+                targetFrameRate:    A float representing the maximum number of frames captured per second,
+                                    or 0 to capture frames as fast as the camera delivers them.
+                encoderWorkers:     An integer representing the number of encoder threads.
+                queueSize:          An integer representing the size of the capture and publish queues.
+                chainedPayloads:    A boolean indicating whether each payload depends on the previous one,
+                                    in which case no payload is dropped.
+
+            Returns:
+                None.
+
+            Raises:
+                ValueError if one of the arguments is invalid.
+        """
+        if targetFrameRate < 0:
+            raise ValueError("The target frame rate should not be negative.");
+
+        if encoderWorkers < 1:
+            raise ValueError("The number of encoder workers should be positive.");
+
+        if chainedPayloads and encoderWorkers != 1:
+            raise ValueError("The chained payloads should be encoded by a single encoder worker.");
+
+        self.captureFunction    = captureFunction;
+        self.encodeFunction     = encodeFunction;
+        self.publishFunction    = publishFunction;
+        self.targetFrameRate    = targetFrameRate;
+        self.encoderWorkers     = encoderWorkers;
+
+        self.captureQueue       = DropOldestQueue(queueSize);
+        self.publishQueue       = BlockingQueue(queueSize) if chainedPayloads else DropOldestQueue(queueSize);
+
+        self.captureStatistics  = StageStatistics("capture");
+        self.encodeStatistics   = StageStatistics("encode");
+        self.publishStatistics  = StageStatistics("publish");
+
+        self.staleCount         = 0;
+        self.errorCount         = 0;
+        self.latestFrame        = None;
+
+        self._countersLock      = threading.Lock();
+
+        self._stopEvent         = threading.Event();
+        self._threads           = [];
+
+    def start(self):
+        """
+            Start the pipeline threads.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self._stopEvent.clear();
+
+        self._threads = [threading.Thread(target=self._capture, name="capture")];
+        self._threads += [threading.Thread(target=self._encode, name="encoder-%d" % index) for index in range(self.encoderWorkers)];
+        self._threads += [threading.Thread(target=self._publish, name="publisher")];
+
+        for thread in self._threads:
+            thread.daemon = True;
+            thread.start();
+
+    def stop(self):
+        """
+            Stop the pipeline threads and wait for them to finish.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self._stopEvent.set();
+
+        self.captureQueue.close();
+        self.publishQueue.close();
+
+        for thread in self._threads:
+            thread.join();
+
+        self._threads = [];
+
+    def getStatisticsReport(self):
+        """
+            Get a one line report of the per-stage throughput and the queue depths
+            since the previous report.
+
+            Args:
+                None.
+
+            Returns:
+                A string instance representing the report.
+
+            Raises:
+                None.
+        """
+        stages = [];
+
+        for statistics in (self.captureStatistics, self.encodeStatistics, self.publishStatistics):
+            rate, meanTime = statistics.sample();
+
+            stages.append("%s %.1f fps (%.1f ms)" % (statistics.name, rate, meanTime * 1000));
+
+        return "%s | queues: capture %d/%d, publish %d/%d | dropped: capture %d, publish %d, stale %d | errors %d" % (
+            ", ".join(stages),
+            len(self.captureQueue), self.captureQueue.maxSize,
+            len(self.publishQueue), self.publishQueue.maxSize,
+            self.captureQueue.droppedCount, self.publishQueue.droppedCount, self.staleCount, self.errorCount
+        );
+
+    def _countError(self):
+        """
+            Count a frame which could not be captured, encoded or published.
+        """
+        with self._countersLock:
+            self.errorCount += 1;
+
+    def _capture(self):
+        """
+            Capture frames at the target frame rate and queue them for encoding.
+            The target frame rate may be changed while the pipeline runs.
+        """
+        nextDeadline    = time.monotonic();
+        sequenceNumber  = 0;
+
+        while not self._stopEvent.is_set():
+            framePeriod = 1.0 / self.targetFrameRate if self.targetFrameRate else 0.0;
+            startTime   = time.monotonic();
+            frame       = self.captureFunction();
+
+            if frame is None:
+                self._countError();
+
+                if not framePeriod:
+                    self._stopEvent.wait(CAPTURE_RETRY_INTERVAL);
+            else:
+                self.captureStatistics.record(time.monotonic() - startTime);
+
+                self.latestFrame = frame;
+                self.captureQueue.put((sequenceNumber, frame));
+
+                sequenceNumber += 1;
+
+            # Wait for the next capture deadline. If the capture is late skip the missed deadlines.
+            if framePeriod:
+                nextDeadline += framePeriod;
+                delay = nextDeadline - time.monotonic();
+
+                if delay > 0:
+                    self._stopEvent.wait(delay);
+                else:
+                    nextDeadline = time.monotonic();
+
+    def _encode(self):
+        """
+            Convert captured frames into device event payloads.
+        """
+        while not self._stopEvent.is_set():
+            item = self.captureQueue.get();
+
+            if item is None:
+                continue;
+
+            sequenceNumber, frame = item;
+
+            startTime = time.monotonic();
+
+            try:
+                payload = self.encodeFunction(frame);
+            except Exception as exception:
+                print("Could not encode frame %d: %s" % (sequenceNumber, str(exception)));
+
+                self._countError();
+
+                continue;
+
+            self.encodeStatistics.record(time.monotonic() - startTime);
+            self.publishQueue.put((sequenceNumber, payload));
+
+    def _publish(self):
+        """
+            Publish the encoded frames in capture order.
+        """
+        lastSequenceNumber = -1;
+
+        while not self._stopEvent.is_set():
+            item = self.publishQueue.get();
+
+            if item is None:
+                continue;
+
+            sequenceNumber, payload = item;
+
+            # Drop frames overtaken by a more recent frame encoded by another worker
+            if sequenceNumber < lastSequenceNumber:
+                self.staleCount += 1;
+
+                continue;
+
+            lastSequenceNumber = sequenceNumber;
+
+            startTime = time.monotonic();
+
+            try:
+                self.publishFunction(payload);
+            except Exception as exception:
+                print("Could not publish frame %d: %s" % (sequenceNumber, str(exception)));
+
+                self._countError();
+
+                continue;
+
+            self.publishStatistics.record(time.monotonic() - startTime);
+
+
+class FrameDecoderPool(object):
+    """
+        Pool of decoder threads filling a "latest frame" slot per device.
+
+        The device event callback only queues the received payloads, so that
+        decoding never delays the MQTT network thread. Each device is assigned
+        to one decoder thread, hence the payloads of a device are decoded in
+        the order they were received. A frame which is replaced in its slot
+        before being taken by the display loop, or a payload the decode
+        function skipped, is counted as dropped.
+    """
+
+    def __init__(self, decodeFunction, decoderWorkers = 2, queueSize = 16):
+        """
+            Initialize the pool.
+
+            Args:
+                decodeFunction: A callable converting a device and its device event payload into a frame,
+                                or returning None to skip the payload, e.g. a delta encoded image which
+                                cannot be applied until the next keyframe.
+                decoderWorkers: An integer representing the number of decoder threads.
+                queueSize:      An integer representing the maximum number of payloads waiting to be decoded
+                                by each decoder thread.
+
+            Returns:
+                None.
+
+            Raises:
+                ValueError if one of the arguments is invalid.
+        """
+        if decoderWorkers < 1:
+            raise ValueError("The number of decoder workers should be positive.");
+
+        self.decodeFunction     = decodeFunction;
+        self.decoderWorkers     = decoderWorkers;
+
+        self.payloadQueues      = [DropOldestQueue(queueSize) for _ in range(decoderWorkers)];
+
+        self.receivedCount      = 0;
+        self.decodedCount       = 0;
+        self.skippedCount       = 0;
+        self.takenCount         = 0;
+        self.errorCount         = 0;
+
+        self._slotsDroppedCount = 0;
+        self._latestFrames      = {};
+        self._lock              = threading.Lock();
+        self._stopEvent         = threading.Event();
+        self._threads           = [];
+
+    @property
+    def droppedCount(self):
+        """
+            The number of payloads dropped from the queues or skipped by the decode
+            function plus the number of decoded frames replaced before being taken.
+        """
+        return (sum(payloadQueue.droppedCount for payloadQueue in self.payloadQueues) + self.skippedCount +
+                self._slotsDroppedCount);
+
+    def start(self):
+        """
+            Start the decoder threads.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self._stopEvent.clear();
+
+        self._threads = [threading.Thread(target=self._decode, args=(payloadQueue,), name="decoder-%d" % index) for index, payloadQueue in enumerate(self.payloadQueues)];
+
+        for thread in self._threads:
+            thread.daemon = True;
+            thread.start();
+
+    def stop(self):
+        """
+            Stop the decoder threads once they decoded the queued payloads, and wait for them to finish.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self._stopEvent.set();
+
+        for payloadQueue in self.payloadQueues:
+            payloadQueue.close();
+
+        for thread in self._threads:
+            thread.join();
+
+        self._threads = [];
+
+    def submit(self, device, payload):
+        """
+            Queue a received payload for decoding. This method never blocks.
+
+            Args:
+                device:     A string instance identifying the device which sent the payload.
+                payload:    The device event payload.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        with self._lock:
+            self.receivedCount += 1;
+
+        self.payloadQueues[hash(device) % self.decoderWorkers].put((device, payload));
+
+    def takeLatestFrames(self):
+        """
+            Take the frames decoded since the previous call, at most one per device.
+
+            Args:
+                None.
+
+            Returns:
+                A dictionary instance mapping each device to its latest frame.
+
+            Raises:
+                None.
+        """
+        with self._lock:
+            latestFrames        = self._latestFrames;
+            self._latestFrames  = {};
+
+            self.takenCount += len(latestFrames);
+
+        return latestFrames;
+
+    def getStatisticsReport(self):
+        """
+            Get a one line report of the pool counters.
+
+            Args:
+                None.
+
+            Returns:
+                A string instance representing the report.
+
+            Raises:
+                None.
+        """
+        return "received %d, decoded %d, taken %d, dropped %d, errors %d | queues %d/%d" % (
+            self.receivedCount, self.decodedCount, self.takenCount, self.droppedCount, self.errorCount,
+            sum(len(payloadQueue) for payloadQueue in self.payloadQueues), sum(payloadQueue.maxSize for payloadQueue in self.payloadQueues)
+        );
+
+    def _decode(self, payloadQueue):
+        """
+            Decode the payloads of the given queue into the latest frame slot of their device,
+            until the queue is closed and empty.
+        """
+        while True:
+            item = payloadQueue.get();
+
+            if item is None:
+                if self._stopEvent.is_set():
+                    break;
+
+                continue;
+
+            device, payload = item;
+
+            try:
+                frame = self.decodeFunction(device, payload);
+            except Exception as exception:
+                print("Could not decode frame from %s: %s" % (device, str(exception)));
+
+                with self._lock:
+                    self.errorCount += 1;
+
+                continue;
+
+            if frame is None:
+                with self._lock:
+                    self.skippedCount += 1;
+
+                continue;
+
+            with self._lock:
+                self.decodedCount += 1;
+
+                if device in self._latestFrames:
+                    self._slotsDroppedCount += 1;
+
+                self._latestFrames[device] = frame;
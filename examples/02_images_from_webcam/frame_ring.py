@@ -0,0 +1,493 @@
+import os
+import struct
+import threading
+import time
+
+from common.runtime import lazyImport
+
+cv2                 = lazyImport("cv2");
+numpy               = lazyImport("numpy");
+resource_tracker    = lazyImport("multiprocessing.resource_tracker");
+shared_memory       = lazyImport("multiprocessing.shared_memory");
+
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+DEFAULT_FRAME_RING_SLOTS        = 8;
+DEFAULT_FRAME_RING_SLOT_SIZE    = 1280 * 720 * 3;
+
+# Ring header: magic, number of slots, frame capacity of a slot in bytes, sequence number of the latest frame
+RING_MAGIC          = b"FRG1";
+RING_HEADER         = struct.Struct("<4sIIQ");
+RING_HEADER_SIZE    = 64;
+
+# Slot header: sequence number (0 while the slot is written), timestamp, height, width, channels, device
+SLOT_HEADER         = struct.Struct("<QdIII64s4x");
+
+# Slots start on cache line boundaries
+SLOT_ALIGNMENT      = 64;
+
+# Video formats of the recorder: file extension and four character code of the codec
+RECORD_FORMATS = {
+    "mjpeg" : (".avi", "MJPG"),
+    "mp4"   : (".mp4", "mp4v")
+};
+
+DEFAULT_RECORD_FORMAT           = "mjpeg";
+DEFAULT_RECORD_SEGMENT_DURATION = 60.0;
+DEFAULT_RECORD_FRAME_RATE       = 10.0;
+
+# Number of seconds the recorder waits when no new frame is in the ring
+RECORD_POLL_INTERVAL = 0.01;
+
+# Names of the rings created by the writers of this process
+_writerRingNames = set();
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def getSlotStride(frameCapacity):
+    """
+        Get the number of bytes between the starts of two slots.
+
+        Args:
+            frameCapacity: An integer representing the maximum number of bytes of a frame.
+
+        Returns:
+            An integer.
+
+        Raises:
+            None.
+    """
+    slotSize = SLOT_HEADER.size + frameCapacity;
+
+    return (slotSize + SLOT_ALIGNMENT - 1) // SLOT_ALIGNMENT * SLOT_ALIGNMENT;
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+class FrameRingWriter(object):
+    """
+        Ring of decoded frames in a shared memory block, written by the image
+        receiver and read by other local processes (see FrameRingReader).
+
+        The block starts with a header holding the sequence number of the
+        latest frame, followed by a fixed number of slots. Each slot holds a
+        header (sequence number, timestamp, shape and device of its frame)
+        and the pixels of the frame. Frame n is written to slot n modulo the
+        number of slots, overwriting the oldest frame; the writer never waits
+        for the readers. The sequence number of a slot is cleared while the
+        slot is written, so that a reader can detect that a frame it reads was
+        overwritten in the meantime.
+    """
+
+    def __init__(self, name = None, slotCount = DEFAULT_FRAME_RING_SLOTS, frameCapacity = DEFAULT_FRAME_RING_SLOT_SIZE):
+        """
+            Create the shared memory block.
+
+            Args:
+                name:           A string instance representing the name of the block, or None for a generated name.
+                slotCount:      An integer representing the number of frames kept in the ring.
+                frameCapacity:  An integer representing the maximum number of bytes of a frame.
+
+            Returns:
+                None.
+
+            Raises:
+                ValueError if one of the arguments is invalid.
+                FileExistsError if a block with the same name already exists.
+        """
+        if slotCount < 1 or frameCapacity < 1:
+            raise ValueError("The number of slots and their size should be positive.");
+
+        self.slotCount          = slotCount;
+        self.frameCapacity      = frameCapacity;
+        self.sequenceNumber     = 0;
+        self.oversizedCount     = 0;
+
+        self._slotStride        = getSlotStride(frameCapacity);
+        self._lock              = threading.Lock();
+
+        self.sharedMemory       = shared_memory.SharedMemory(name, create=True, size=RING_HEADER_SIZE + slotCount * self._slotStride);
+
+        RING_HEADER.pack_into(self.sharedMemory.buf, 0, RING_MAGIC, slotCount, frameCapacity, 0);
+
+        _writerRingNames.add(self.sharedMemory.name);
+
+    @property
+    def name(self):
+        """
+            The name of the shared memory block, given to the readers.
+        """
+        return self.sharedMemory.name;
+
+    def write(self, device, frame, timestamp = None):
+        """
+            Copy a frame into the next slot of the ring.
+
+            Args:
+                device:     A string instance identifying the device which sent the frame.
+                frame:      A numpy.ndarray instance of bytes with 2 or 3 dimensions representing the frame.
+                timestamp:  A float representing the time at which the frame was received, now by default.
+
+            Returns:
+                An integer representing the sequence number of the frame, or None if it exceeds the slot size.
+
+            Raises:
+                None.
+        """
+        height, width   = frame.shape[:2];
+        channels        = frame.shape[2] if frame.ndim > 2 else 1;
+
+        with self._lock:
+            if frame.nbytes > self.frameCapacity:
+                self.oversizedCount += 1;
+
+                return None;
+
+            sequenceNumber  = self.sequenceNumber + 1;
+            slotOffset      = RING_HEADER_SIZE + (sequenceNumber - 1) % self.slotCount * self._slotStride;
+            buffer          = self.sharedMemory.buf;
+
+            # Mark the slot as being written, copy the pixels, then publish the slot and the ring header
+            SLOT_HEADER.pack_into(buffer, slotOffset, 0, 0.0, 0, 0, 0, b"");
+
+            numpy.ndarray(frame.shape, numpy.uint8, buffer, slotOffset + SLOT_HEADER.size)[...] = frame;
+
+            SLOT_HEADER.pack_into(buffer, slotOffset, sequenceNumber, timestamp if timestamp is not None else time.time(),
+                                  height, width, channels, device.encode("utf-8")[:64]);
+            RING_HEADER.pack_into(buffer, 0, RING_MAGIC, self.slotCount, self.frameCapacity, sequenceNumber);
+
+            self.sequenceNumber = sequenceNumber;
+
+        return sequenceNumber;
+
+    def close(self):
+        """
+            Close and remove the shared memory block. The readers attached to the block keep their mapping.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        _writerRingNames.discard(self.sharedMemory.name);
+
+        self.sharedMemory.close();
+        self.sharedMemory.unlink();
+
+
+class FrameRingReader(object):
+    """
+        Reader of a frame ring created by a FrameRingWriter, possibly in another process.
+
+        The frames are returned as numpy arrays mapped onto the shared memory,
+        without any copy. A frame may be overwritten by the writer while it is
+        used, once the writer went around the ring: isValid tells whether the
+        frame was still intact after it was used (or copied).
+    """
+
+    def __init__(self, name):
+        """
+            Attach to the shared memory block of a ring.
+
+            Args:
+                name: A string instance representing the name of the block.
+
+            Returns:
+                None.
+
+            Raises:
+                FileNotFoundError if the block does not exist.
+                ValueError if the block is not a frame ring.
+        """
+        self.sharedMemory = shared_memory.SharedMemory(name);
+
+        # The block belongs to the writer, which removes it, hence the resource tracker of another process must not
+        if self.sharedMemory.name not in _writerRingNames:
+            try:
+                resource_tracker.unregister(self.sharedMemory._name, "shared_memory");
+            except Exception:
+                pass;
+
+        magic, self.slotCount, self.frameCapacity, _ = RING_HEADER.unpack_from(self.sharedMemory.buf, 0);
+
+        if magic != RING_MAGIC:
+            self.sharedMemory.close();
+
+            raise ValueError("The shared memory block %s is not a frame ring." % name);
+
+        self._slotStride = getSlotStride(self.frameCapacity);
+
+    @property
+    def latestSequenceNumber(self):
+        """
+            The sequence number of the latest frame written to the ring, 0 if the ring is empty.
+        """
+        return RING_HEADER.unpack_from(self.sharedMemory.buf, 0)[3];
+
+    def read(self, sequenceNumber):
+        """
+            Get a frame of the ring, without copying it.
+
+            Args:
+                sequenceNumber: An integer representing the sequence number of the frame.
+
+            Returns:
+                A (sequence number, timestamp, device, frame) tuple whose frame is a numpy.ndarray instance
+                mapped onto the shared memory, or None if the frame is being written or was overwritten.
+
+            Raises:
+                None.
+        """
+        slotOffset = RING_HEADER_SIZE + (sequenceNumber - 1) % self.slotCount * self._slotStride;
+
+        slotSequenceNumber, timestamp, height, width, channels, device = SLOT_HEADER.unpack_from(self.sharedMemory.buf, slotOffset);
+
+        if sequenceNumber < 1 or slotSequenceNumber != sequenceNumber:
+            return None;
+
+        shape = (height, width, channels) if channels > 1 else (height, width);
+        frame = numpy.ndarray(shape, numpy.uint8, self.sharedMemory.buf, slotOffset + SLOT_HEADER.size);
+
+        return sequenceNumber, timestamp, device.rstrip(b"\0").decode("utf-8"), frame;
+
+    def readNext(self, lastSequenceNumber):
+        """
+            Get the oldest frame of the ring following a frame, skipping the frames which were overwritten.
+
+            Args:
+                lastSequenceNumber: An integer representing the sequence number of the previous frame read, 0 at first.
+
+            Returns:
+                A tuple as returned by read, or None if no newer frame is available.
+
+            Raises:
+                None.
+        """
+        latestSequenceNumber = self.latestSequenceNumber;
+
+        for sequenceNumber in range(max(lastSequenceNumber + 1, latestSequenceNumber - self.slotCount + 1), latestSequenceNumber + 1):
+            entry = self.read(sequenceNumber);
+
+            if entry is not None:
+                return entry;
+
+        return None;
+
+    def isValid(self, sequenceNumber):
+        """
+            Check whether a frame returned by read is still intact, i.e. was not overwritten since.
+
+            Args:
+                sequenceNumber: An integer representing the sequence number of the frame.
+
+            Returns:
+                A boolean.
+
+            Raises:
+                None.
+        """
+        slotOffset = RING_HEADER_SIZE + (sequenceNumber - 1) % self.slotCount * self._slotStride;
+
+        return SLOT_HEADER.unpack_from(self.sharedMemory.buf, slotOffset)[0] == sequenceNumber;
+
+    def close(self):
+        """
+            Detach from the shared memory block. The frames returned by read must not be used anymore.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                BufferError if a frame returned by read is still referenced.
+        """
+        self.sharedMemory.close();
+
+
+class FrameRingRecorder(object):
+    """
+        Thread writing the frames of a ring to rolling video segments, one
+        series of segments per device.
+
+        The frames are read from the ring as decoded by the receiver, hence
+        they are only compressed by the video codec. A new segment is started
+        once the current one covers the segment duration, or when the size of
+        the frames of its device changes.
+    """
+
+    def __init__(self, reader, directory, videoFormat = DEFAULT_RECORD_FORMAT, segmentDuration = DEFAULT_RECORD_SEGMENT_DURATION,
+                 frameRate = DEFAULT_RECORD_FRAME_RATE):
+        """
+            Initialize the recorder.
+
+            Args:
+                reader:             A FrameRingReader instance.
+                directory:          A string instance representing the directory of the segment files.
+                videoFormat:        A string instance representing the video format, see RECORD_FORMATS.
+                segmentDuration:    A float representing the number of seconds of frames per segment.
+                frameRate:          A float representing the frame rate stored in the segments.
+
+            Returns:
+                None.
+
+            Raises:
+                ValueError if one of the arguments is invalid.
+        """
+        if videoFormat not in RECORD_FORMATS:
+            raise ValueError("Unknown video format: %s." % videoFormat);
+
+        if segmentDuration <= 0 or frameRate <= 0:
+            raise ValueError("The segment duration and the frame rate should be positive.");
+
+        self.reader             = reader;
+        self.directory          = directory;
+        self.videoFormat        = videoFormat;
+        self.segmentDuration    = segmentDuration;
+        self.frameRate          = frameRate;
+
+        self.recordedCount      = 0;
+        self.skippedCount       = 0;
+        self.overwrittenCount   = 0;
+        self.segmentCount       = 0;
+
+        # Open segment of each device: (cv2.VideoWriter instance, frame size, timestamp of the first frame)
+        self._segments          = {};
+
+        self._stopEvent         = threading.Event();
+        self._thread            = None;
+
+        os.makedirs(directory, exist_ok=True);
+
+    def start(self):
+        """
+            Start recording the frames written to the ring from now on.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self._stopEvent.clear();
+
+        self._thread = threading.Thread(target=self._record, name="recorder");
+        self._thread.daemon = True;
+        self._thread.start();
+
+    def stop(self):
+        """
+            Stop recording and close the segments.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self._stopEvent.set();
+
+        if self._thread is not None:
+            self._thread.join();
+
+            self._thread = None;
+
+        for videoWriter, _, _ in self._segments.values():
+            videoWriter.release();
+
+        self._segments = {};
+
+    def getStatisticsReport(self):
+        """
+            Get a one line report of the recorder counters.
+
+            Args:
+                None.
+
+            Returns:
+                A string instance representing the report.
+
+            Raises:
+                None.
+        """
+        return "recorder: %d frames in %d segments | skipped %d, overwritten %d" % (
+            self.recordedCount, self.segmentCount, self.skippedCount, self.overwrittenCount);
+
+    def _openSegment(self, device, frameSize, timestamp):
+        """Start a new segment for the frames of a device."""
+        extension, fourcc = RECORD_FORMATS[self.videoFormat];
+
+        segmentPath = os.path.join(self.directory, "%s-%s-%03d%s" % (
+            device.replace(":", "-"), time.strftime("%Y%m%d-%H%M%S", time.localtime(timestamp)),
+            int(timestamp * 1000) % 1000, extension));
+
+        videoWriter = cv2.VideoWriter(segmentPath, cv2.VideoWriter_fourcc(*fourcc), self.frameRate, frameSize);
+
+        self._segments[device] = (videoWriter, frameSize, timestamp);
+        self.segmentCount += 1;
+
+        return videoWriter;
+
+    def _record(self):
+        """
+            Copy the new frames of the ring and append them to the segment of their device.
+        """
+        lastSequenceNumber = self.reader.latestSequenceNumber;
+
+        while not self._stopEvent.is_set():
+            entry = self.reader.readNext(lastSequenceNumber);
+
+            if entry is None:
+                self._stopEvent.wait(RECORD_POLL_INTERVAL);
+
+                continue;
+
+            sequenceNumber, timestamp, device, frame = entry;
+
+            self.skippedCount   += sequenceNumber - lastSequenceNumber - 1;
+            lastSequenceNumber  = sequenceNumber;
+
+            # Copy the frame out of the ring before encoding it, and discard it if it was overwritten meanwhile
+            frame = frame.copy();
+
+            if not self.reader.isValid(sequenceNumber):
+                self.overwrittenCount += 1;
+
+                continue;
+
+            if frame.ndim == 2:
+                frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR);
+
+            frameSize   = (frame.shape[1], frame.shape[0]);
+            segment     = self._segments.get(device);
+
+            if segment is None or segment[1] != frameSize or timestamp - segment[2] >= self.segmentDuration:
+                if segment is not None:
+                    segment[0].release();
+
+                videoWriter = self._openSegment(device, frameSize, timestamp);
+            else:
+                videoWriter = segment[0];
+
+            videoWriter.write(frame);
+
+            self.recordedCount += 1;
@@ -0,0 +1,342 @@
+import os
+import re
+
+from common.runtime import lazyImport
+
+from capture_profiles import DEFAULT_CAMERA_INDEX, getCameraSettings, openCamera, readJpegFrame
+
+cv2     = lazyImport("cv2");
+numpy   = lazyImport("numpy");
+
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+CAMERA_SOURCE           = "camera";
+VIDEO_SOURCE            = "video";
+IMAGES_SOURCE           = "images";
+SYNTHETIC_SOURCE        = "synthetic";
+
+DEFAULT_FRAME_SOURCE    = CAMERA_SOURCE;
+
+# Size and motion (pixels per frame) of the synthetic frames when not given
+DEFAULT_SYNTHETIC_WIDTH     = 640;
+DEFAULT_SYNTHETIC_HEIGHT    = 480;
+DEFAULT_SYNTHETIC_MOTION    = 4;
+
+# Seed used to generate the synthetic scene
+SYNTHETIC_SCENE_SEED = 42;
+
+# Number of noisy variants of the synthetic background, so that the sensor noise is not recomputed for every frame
+SYNTHETIC_NOISE_VARIANTS = 8;
+
+# Extensions of the images read from a directory
+IMAGE_EXTENSIONS = (".bmp", ".jpeg", ".jpg", ".png", ".tif", ".tiff", ".webp");
+
+# Synthetic source specifications, given as synthetic[:WIDTHxHEIGHT[@MOTION]]
+SYNTHETIC_SOURCE_PATTERN = re.compile(r"^(\d+)x(\d+)(?:@(\d+(?:\.\d+)?))?$");
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+class FrameSource(object):
+    """
+        Source of the frames captured by the image sender.
+
+        Subclasses implement read, which returns the next frame (a BGR
+        numpy.ndarray, or the bytes of a JPEG image for a camera in
+        passthrough mode), or None if no frame could be read. The sources
+        reading files loop over them, so that every source delivers an
+        endless stream paced by the frame pipeline.
+    """
+
+    def read(self):
+        """
+            Read the next frame.
+
+            Args:
+                None.
+
+            Returns:
+                A numpy.ndarray or bytes instance representing the frame, or None if no frame could be read.
+
+            Raises:
+                None.
+        """
+        raise NotImplementedError();
+
+    def close(self):
+        """
+            Release the resources of the source.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        pass;
+
+    def describe(self):
+        """
+            Get a description of the source.
+
+            Args:
+                None.
+
+            Returns:
+                A string instance.
+
+            Raises:
+                None.
+        """
+        raise NotImplementedError();
+
+
+class CameraFrameSource(FrameSource):
+    """
+        Frames captured by a camera, see capture_profiles.openCamera.
+    """
+
+    def __init__(self, cameraIndex = DEFAULT_CAMERA_INDEX, captureProfile = None, passthrough = False):
+        """
+            Open the camera.
+
+            Args:
+                cameraIndex:    An integer representing the index of the camera.
+                captureProfile: An optional CaptureProfile instance.
+                passthrough:    A boolean indicating whether the JPEG frames of the camera are read without being decoded.
+
+            Returns:
+                None.
+
+            Raises:
+                ValueError if the camera could not be opened or does not deliver JPEG frames in passthrough mode.
+        """
+        self.passthrough    = passthrough;
+        self.cameraClient   = openCamera(cameraIndex, captureProfile, passthrough);
+
+        # Check that the camera delivers compressed frames before they are captured by the pipeline
+        if passthrough:
+            readJpegFrame(self.cameraClient);
+
+    def read(self):
+        """Read the next frame of the camera."""
+        if self.passthrough:
+            try:
+                return readJpegFrame(self.cameraClient);
+            except ValueError:
+                return None;
+
+        okMsg, image = self.cameraClient.read();
+
+        return image if okMsg else None;
+
+    def close(self):
+        """Release the camera."""
+        self.cameraClient.release();
+
+    def describe(self):
+        """Describe the settings applied by the camera."""
+        return "camera (%s)" % getCameraSettings(self.cameraClient);
+
+
+class VideoFileFrameSource(FrameSource):
+    """
+        Frames of a recorded video, restarted from its beginning once it ends.
+    """
+
+    def __init__(self, videoPath):
+        """
+            Open the video.
+
+            Args:
+                videoPath: A string instance representing the video file path.
+
+            Returns:
+                None.
+
+            Raises:
+                ValueError if the video could not be opened.
+        """
+        self.videoPath      = videoPath;
+        self.videoCapture   = cv2.VideoCapture(videoPath);
+
+        if not self.videoCapture.isOpened():
+            raise ValueError("Could not open video %s." % videoPath);
+
+    def read(self):
+        """Read the next frame of the video, rewinding it at its end."""
+        okMsg, image = self.videoCapture.read();
+
+        if not okMsg:
+            self.videoCapture.set(cv2.CAP_PROP_POS_FRAMES, 0);
+
+            okMsg, image = self.videoCapture.read();
+
+        return image if okMsg else None;
+
+    def close(self):
+        """Release the video."""
+        self.videoCapture.release();
+
+    def describe(self):
+        """Describe the video and its size."""
+        return "video %s (%dx%d)" % (self.videoPath, self.videoCapture.get(cv2.CAP_PROP_FRAME_WIDTH),
+                                     self.videoCapture.get(cv2.CAP_PROP_FRAME_HEIGHT));
+
+
+class ImageDirectoryFrameSource(FrameSource):
+    """
+        Images stored in a directory, read in name order and repeated once all of them were read.
+    """
+
+    def __init__(self, imagesDir):
+        """
+            List the images of the directory.
+
+            Args:
+                imagesDir: A string instance representing the directory path.
+
+            Returns:
+                None.
+
+            Raises:
+                ValueError if the directory does not contain any image.
+        """
+        self.imagesDir  = imagesDir;
+        self.imagePaths = [os.path.join(imagesDir, name) for name in sorted(os.listdir(imagesDir))
+                           if name.lower().endswith(IMAGE_EXTENSIONS)];
+
+        self._index     = 0;
+
+        if not self.imagePaths:
+            raise ValueError("No image found in %s." % imagesDir);
+
+    def read(self):
+        """Read the next image of the directory."""
+        imagePath   = self.imagePaths[self._index % len(self.imagePaths)];
+        self._index += 1;
+
+        return cv2.imread(imagePath, cv2.IMREAD_COLOR);
+
+    def describe(self):
+        """Describe the directory and its number of images."""
+        return "images %s (%d images)" % (self.imagesDir, len(self.imagePaths));
+
+
+class SyntheticFrameSource(FrameSource):
+    """
+        Synthetic frames imitating a fixed webcam: a static scene with sensor
+        noise and an object moving by a given number of pixels per frame.
+
+        The noise is drawn once for a few variants of the background, so that
+        generating a frame costs little more than copying it and the source
+        does not distort the CPU measurements of the pipeline.
+    """
+
+    def __init__(self, width = DEFAULT_SYNTHETIC_WIDTH, height = DEFAULT_SYNTHETIC_HEIGHT, motion = DEFAULT_SYNTHETIC_MOTION):
+        """
+            Generate the scene.
+
+            Args:
+                width:  An integer representing the width of the frames.
+                height: An integer representing the height of the frames.
+                motion: A float representing the number of pixels the object moves per frame, 0 for a static scene.
+
+            Returns:
+                None.
+
+            Raises:
+                ValueError if the size is not positive.
+        """
+        if width < 1 or height < 1:
+            raise ValueError("The size of the synthetic frames should be positive.");
+
+        self.width      = width;
+        self.height     = height;
+        self.motion     = motion;
+
+        randomState     = numpy.random.RandomState(SYNTHETIC_SCENE_SEED);
+        background      = cv2.GaussianBlur(randomState.randint(0, 256, (height, width, 3)).astype(numpy.uint8), (31, 31), 0);
+
+        self._backgrounds = [
+            numpy.clip(background + randomState.randint(-2, 3, background.shape), 0, 255).astype(numpy.uint8)
+            for _ in range(SYNTHETIC_NOISE_VARIANTS)
+        ];
+
+        self._objectSize    = max(4, min(width, height) // 8);
+        self._index         = 0;
+
+    def read(self):
+        """Draw the next frame."""
+        frame   = self._backgrounds[self._index % len(self._backgrounds)].copy();
+        offset  = int(self._index * self.motion);
+
+        self._index += 1;
+
+        # Move the object along the diagonal of the scene
+        x = offset % max(1, self.width - self._objectSize);
+        y = (offset * 2 // 3) % max(1, self.height - self._objectSize);
+
+        cv2.rectangle(frame, (x, y), (x + self._objectSize, y + self._objectSize), (0, 0, 255), -1);
+
+        return frame;
+
+    def describe(self):
+        """Describe the size and motion of the frames."""
+        return "synthetic %dx%d, %g pixels per frame" % (self.width, self.height, self.motion);
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def openFrameSource(sourceSpecification = DEFAULT_FRAME_SOURCE, cameraIndex = DEFAULT_CAMERA_INDEX, captureProfile = None, passthrough = False):
+    """
+        Open a frame source given as "camera", "video:PATH", "images:DIR" or "synthetic[:WIDTHxHEIGHT[@MOTION]]".
+
+        Args:
+            sourceSpecification:    A string instance representing the source.
+            cameraIndex:            An integer representing the index of the camera.
+            captureProfile:         An optional CaptureProfile instance applied to the camera.
+            passthrough:            A boolean indicating whether the JPEG frames of the camera are read without being decoded.
+
+        Returns:
+            A FrameSource instance.
+
+        Raises:
+            ValueError if the specification is invalid or the source could not be opened.
+    """
+    kind, _, argument = sourceSpecification.partition(":");
+
+    if passthrough and kind != CAMERA_SOURCE:
+        raise ValueError("Only the camera source delivers JPEG frames which can be passed through.");
+
+    if kind == CAMERA_SOURCE and not argument:
+        return CameraFrameSource(cameraIndex, captureProfile, passthrough);
+
+    if kind == VIDEO_SOURCE and argument:
+        return VideoFileFrameSource(argument);
+
+    if kind == IMAGES_SOURCE and argument:
+        return ImageDirectoryFrameSource(argument);
+
+    if kind == SYNTHETIC_SOURCE:
+        if not argument:
+            return SyntheticFrameSource();
+
+        match = SYNTHETIC_SOURCE_PATTERN.match(argument);
+
+        if match is not None:
+            width, height, motion = match.groups();
+
+            return SyntheticFrameSource(int(width), int(height), float(motion) if motion else DEFAULT_SYNTHETIC_MOTION);
+
+    raise ValueError("Invalid frame source: %s. Use camera, video:PATH, images:DIR or synthetic[:WIDTHxHEIGHT[@MOTION]]." % sourceSpecification);
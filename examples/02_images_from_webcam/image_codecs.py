@@ -0,0 +1,248 @@
+import base64
+
+from common.runtime import lazyImport
+
+cv2     = lazyImport("cv2");
+numpy   = lazyImport("numpy");
+
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+# Image codecs supported by the webcam sender and receiver. Each entry maps the
+# codec name to the file extension understood by cv2.imencode and to the name
+# of the OpenCV parameter controlled by the quality knob (resolved when used,
+# so that cv2 is not imported to parse the command line).
+IMAGE_CODECS = {
+    "jpeg"  : (".jpg",  "IMWRITE_JPEG_QUALITY"),
+    "png"   : (".png",  "IMWRITE_PNG_COMPRESSION"),
+    "webp"  : (".webp", "IMWRITE_WEBP_QUALITY")
+};
+
+DEFAULT_IMAGE_CODEC     = "jpeg";
+DEFAULT_IMAGE_QUALITY   = 80;
+
+# Factor applied to the size of the captured images to reduce the size of the payload
+DEFAULT_IMAGE_SCALE = 0.1;
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def getImageCodecParameters(codecName, quality):
+    """
+        Get the cv2.imencode parameters corresponding to the given codec and quality.
+
+        PNG is lossless, therefore for PNG the quality (0-100) is mapped to the
+        zlib compression level (0-9): a higher quality trades CPU time for a
+        smaller payload.
+
+        Args:
+            codecName:  A string instance representing the codec name.
+            quality:    An integer between 0 and 100 representing the encode quality.
+
+        Returns:
+            A (extension, parameters) tuple to be passed to cv2.imencode.
+
+        Raises:
+            ValueError if the codec name or the quality is not supported.
+    """
+    if codecName not in IMAGE_CODECS:
+        raise ValueError("Unsupported image codec: %s. Supported codecs: %s." % (codecName, ", ".join(sorted(IMAGE_CODECS))));
+
+    if quality < 0 or quality > 100:
+        raise ValueError("The image quality should be between 0 and 100, not %d." % quality);
+
+    extension, parameterName = IMAGE_CODECS[codecName];
+
+    if codecName == "png":
+        parameterValue = quality * 9 // 100;
+    else:
+        parameterValue = quality;
+
+    return extension, [int(getattr(cv2, parameterName)), int(parameterValue)];
+
+def encodeImage(image, codecName = DEFAULT_IMAGE_CODEC, quality = DEFAULT_IMAGE_QUALITY):
+    """
+        Compress an image using the given codec.
+
+        Args:
+            image:      A numpy.ndarray instance representing the image.
+            codecName:  A string instance representing the codec name.
+            quality:    An integer between 0 and 100 representing the encode quality.
+
+        Returns:
+            A bytes instance representing the compressed image.
+
+        Raises:
+            ValueError if the codec is not supported or the image could not be encoded.
+    """
+    extension, parameters = getImageCodecParameters(codecName, quality);
+
+    okMsg, encodedImage = cv2.imencode(extension, image, parameters);
+
+    if not okMsg:
+        raise ValueError("Could not encode image using the %s codec." % codecName);
+
+    return encodedImage.tobytes();
+
+def decodeImage(encodedImage, reduction = 1):
+    """
+        Decompress an image encoded by encodeImage.
+
+        The codec is detected by OpenCV from the encoded image header. A JPEG
+        image decoded at a reduced size skips most of the decoding work, which
+        is much cheaper than decoding it at its full size and resizing it.
+
+        Args:
+            encodedImage:   A bytes instance representing the compressed image.
+            reduction:      An integer (1, 2, 4 or 8) by which the width and height of the image are divided.
+
+        Returns:
+            A numpy.ndarray instance representing the decoded image.
+
+        Raises:
+            ValueError if the image could not be decoded.
+    """
+    flags = cv2.IMREAD_COLOR if reduction == 1 else int(getattr(cv2, "IMREAD_REDUCED_COLOR_%d" % reduction));
+    image = cv2.imdecode(numpy.frombuffer(encodedImage, dtype = numpy.uint8), flags);
+
+    if image is None:
+        raise ValueError("Could not decode image.");
+
+    return image;
+
+def packImageBytes(encodedImage, binary = False):
+    """
+        Get the value storing a compressed image in a device event payload.
+
+        Args:
+            encodedImage:   A bytes instance representing the compressed image.
+            binary:         A boolean indicating whether the device event format stores bytes as is
+                            (MessagePack, CBOR). Otherwise the image is base64 encoded, as JSON requires.
+
+        Returns:
+            A bytes or string instance.
+
+        Raises:
+            None.
+    """
+    if binary:
+        return encodedImage;
+
+    return base64.b64encode(encodedImage).decode("ascii");
+
+def unpackImageBytes(value):
+    """
+        Get the compressed image stored by packImageBytes.
+
+        Args:
+            value: A bytes or string instance.
+
+        Returns:
+            A bytes instance representing the compressed image.
+
+        Raises:
+            ValueError if the value is not valid base64.
+    """
+    if isinstance(value, (bytes, bytearray)):
+        return value;
+
+    return base64.b64decode(value);
+
+def encodeImagePayload(image, codecName = DEFAULT_IMAGE_CODEC, quality = DEFAULT_IMAGE_QUALITY, binary = False):
+    """
+        Get a dictionary instance representing an image device event payload.
+
+        Args:
+            image:      A numpy.ndarray instance representing the image.
+            codecName:  A string instance representing the codec name.
+            quality:    An integer between 0 and 100 representing the encode quality.
+            binary:     A boolean indicating whether the compressed image is stored as bytes
+                        instead of base64 text, see packImageBytes.
+
+        Returns:
+            A dictionary instance representing the device event payload.
+
+        Raises:
+            ValueError if the codec is not supported or the image could not be encoded.
+    """
+    encodedImage = encodeImage(image, codecName, quality);
+
+    return {"img" : packImageBytes(encodedImage, binary), "codec" : codecName};
+
+def decodeImagePayload(data):
+    """
+        Get the image stored in a device event payload created by encodeImagePayload,
+        or sent as is using the raw device event format.
+
+        Args:
+            data: A dictionary or bytes instance representing the device event payload.
+
+        Returns:
+            A numpy.ndarray instance representing the decoded image.
+
+        Raises:
+            ValueError if the payload does not contain a valid image.
+    """
+    if isinstance(data, (bytes, bytearray)):
+        return decodeImage(data);
+
+    if "img" not in data:
+        raise ValueError(data.get("error", "The device event payload does not contain an image."));
+
+    return decodeImage(unpackImageBytes(data["img"]));
+
+def getDeviceEventPayload(image, imageCodec, imageQuality, tileDeltaEncoder = None, messageCodec = None, imageScale = DEFAULT_IMAGE_SCALE):
+    """
+        Get the device event payload of a captured image.
+
+        Args:
+           image:            A numpy.ndarray instance representing the captured image.
+           imageCodec:       A string instance representing the codec used to compress the image.
+           imageQuality:     An integer between 0 and 100 representing the encode quality.
+           tileDeltaEncoder: An optional TileDeltaEncoder instance used to only send the changed tiles.
+           messageCodec:     An optional MessageCodec instance of the device event format, JSON by default.
+           imageScale:       A float representing the factor applied to the image size.
+
+        Returns:
+            A dictionary instance representing the device event payload, or a bytes instance
+            representing the compressed image if the device event format is raw.
+
+        Raises:
+            ValueError if the image could not be encoded.
+    """
+    # Reduce the image size to reduce the size of the payload
+    imageScaled = cv2.resize(image, None, fx = imageScale, fy = imageScale, interpolation = cv2.INTER_CUBIC);
+
+    # Compress the image (or its changed tiles) and prepare device event payload
+    if tileDeltaEncoder is not None:
+        data = tileDeltaEncoder.encodePayload(imageScaled);
+    elif messageCodec is not None and not messageCodec.structured:
+        data = encodeImage(imageScaled, imageCodec, imageQuality);
+    else:
+        data = encodeImagePayload(imageScaled, imageCodec, imageQuality, messageCodec is not None and messageCodec.binary);
+
+    return data;
+
+def getPassthroughDeviceEventPayload(encodedImage, messageCodec = None):
+    """
+        Get the device event payload of a JPEG image compressed by the camera, without decoding it.
+
+        Args:
+           encodedImage: A bytes instance representing the JPEG image.
+           messageCodec: An optional MessageCodec instance of the device event format, JSON by default.
+
+        Returns:
+            A dictionary instance representing the device event payload, or the JPEG image
+            itself if the device event format is raw.
+
+        Raises:
+            None.
+    """
+    if messageCodec is not None and not messageCodec.structured:
+        return encodedImage;
+
+    return {"img" : packImageBytes(encodedImage, messageCodec is not None and messageCodec.binary), "codec" : "jpeg"};
@@ -1,13 +1,26 @@
 #!/usr/bin/env python
 
-import argparse
-import json
-import pickle
+import os
 import sys
+import time
 
-from cv2 import *
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir));
 
-import ibmiotf.application
+from common.event_dispatcher import LATEST_POLICY, DeviceEventHandlerIndex, ShardedEventDispatcher
+from common.event_log import openEventLog
+from common.latency import LatencyRecorder
+from common.message_codecs import getMessageCodec
+from common.metrics import STAGE_DURATION, startMetricsServer
+from common.profiler import startProfiler
+from common.runtime import APPLICATION_CLIENT, createArgumentParser, initAppClient, lazyImport, parseArguments
+
+from chunked_transfer import DEFAULT_MAX_IN_FLIGHT_BYTES, DEFAULT_REASSEMBLY_WORKERS, DEFAULT_TRANSFER_TIMEOUT, ChunkReassembler, isChunk
+from frame_pipeline import FrameDecoderPool
+from frame_ring import DEFAULT_FRAME_RING_SLOT_SIZE, DEFAULT_FRAME_RING_SLOTS, DEFAULT_RECORD_FORMAT, DEFAULT_RECORD_FRAME_RATE, DEFAULT_RECORD_SEGMENT_DURATION, RECORD_FORMATS, FrameRingReader, FrameRingRecorder, FrameRingWriter
+from image_codecs import decodeImagePayload
+from tile_delta import KEYFRAME_COMMAND, KEYFRAME_REQUEST_INTERVAL, KeyframeRequiredError, TileDeltaDecoder, isTileDeltaPayload
+
+cv2 = lazyImport("cv2");
 
 
 # -----------------------------------------------------------------------------
@@ -16,68 +29,161 @@ import ibmiotf.application
 
 OPENCV_WIN_NAME = "WebCamera";
 
+# Number of milliseconds the display loop waits for a key to be pressed
+DISPLAY_REFRESH_MS = 30;
+
 
 # -----------------------------------------------------------------------------
 # Functions
 # -----------------------------------------------------------------------------
 
-def initAppClient(organizationId, applicationId, authMethod, authKey, authToken):
+def receivedDeviceEventCallback(deviceEvent):
     """
-        Initialize the application client.
+        Callback executed when a device event is received.
+
+        The callback runs on a thread of the sharded event dispatcher, each
+        device being handled by a single shard, hence the events of a device
+        are handled in the order they were received. It only queues the event
+        data: the images are decoded by the decoder pool and displayed by the
+        main thread.
 
         Args:
-            organizationId: A string instance representing the organization id.
-            applicationId:  A string instance representing the application id.
-            authMethod:     A string instance representing the authentication method.
-            authKey:        A string instance representing the authentication key.
-            authToken:      A string instance representing the authentication token.
+            deviceEvent: The device event.
 
         Returns:
-            An instance of ibmiotf.application.Client representing the application client.
+            None.
 
         Raises:
             None.
     """
-    # Initialize the application client.
-    try:
-        appOptions = {
-            "org"           : organizationId, 
-            "id"            : applicationId, 
-            "auth-method"   : authMethod, 
-            "auth-key"      : authKey, 
-            "auth-token"    : authToken
-        };
-
-        print("Creating application client using options: %s" % str(appOptions));
+    # The chunks of the large payloads are reassembled before being decoded
+    if isChunk(deviceEvent.data):
+        chunkReassembler.submit(deviceEvent.device, deviceEvent.format, deviceEvent.data);
 
-        appClient = ibmiotf.application.Client(appOptions);
+        return;
 
-        return appClient;
-    except Exception as exception:
-        print("Failed to create application client: %s" % str(exception));
+    # Record the delivery latency of benchmark events
+    if latencyRecorder is not None:
+        latencyRecorder.recordPayload(deviceEvent.device, deviceEvent.data);
 
-        sys.exit(1);
+    decoderPool.submit(deviceEvent.device, deviceEvent.data);
 
-def receivedDeviceEventCallback(deviceEvent):
+def getDispatchKey(deviceEvent):
     """
-        Callback executed when a device event is received.
+        Get the key of the device events replacing each other in the dispatch queues
+        when the latest event of each device is kept.
 
         Args:
             deviceEvent: The device event.
 
+        Returns:
+            A string instance identifying the device, or None for the chunks of a large
+            payload, which are all needed to reassemble it, and for the delta encoded
+            images, each of which is applied to the image decoded before it.
+
+        Raises:
+            None.
+    """
+    if isChunk(deviceEvent.data) or isTileDeltaPayload(deviceEvent.data):
+        return None;
+
+    return deviceEvent.device;
+
+def reassembledPayloadCallback(device, messageFormat, payload):
+    """
+        Callback executed by the chunk reassembler when the payload of a chunked device event is complete.
+
+        Args:
+            device:         A string instance identifying the device.
+            messageFormat:  A string instance representing the device event format.
+            payload:        A bytes-like object representing the payload, only valid during the call.
+
+        Returns:
+            None.
+
+        Raises:
+            ValueError if the payload cannot be decoded.
+    """
+    data = getMessageCodec(messageFormat).decodePayload(payload);
+
+    # Record the delivery latency of benchmark events, including their reassembly
+    if latencyRecorder is not None:
+        latencyRecorder.recordPayload(device, data);
+
+    decoderPool.submit(device, data);
+
+def requestKeyframe(device):
+    """
+        Ask a device sending delta encoded images to send a keyframe.
+
+        Args:
+            device: A string instance identifying the device.
+
         Returns:
             None.
 
         Raises:
             None.
     """
-    print("Received device event %s at %s for %s." % (deviceEvent.event, deviceEvent.timestamp.isoformat(), deviceEvent.device));
+    now = time.monotonic();
+
+    # Do not flood the device while the keyframe is on its way
+    if now - keyframeRequestTimes.get(device, -KEYFRAME_REQUEST_INTERVAL) < KEYFRAME_REQUEST_INTERVAL:
+        return;
 
-    # Unpickle the received event data
-    image = pickle.loads(deviceEvent.data["img"]);
+    keyframeRequestTimes[device] = now;
 
-    # Display image
-    imshow(OPENCV_WIN_NAME, image);
+    deviceType, deviceId = device.split(":", 1);
+
+    appClient.publishCommand(deviceType, deviceId, KEYFRAME_COMMAND, "json", {});
+
+def decodeDeviceEventData(device, data):
+    """
+        Get the image stored in the event data received from a device.
+
+        Args:
+            device: A string instance identifying the device.
+            data:   A dictionary instance representing the device event payload.
+
+        Returns:
+            A numpy.ndarray instance representing the image, or None if the image is a delta which
+            cannot be applied until the next keyframe.
+
+        Raises:
+            ValueError if the payload does not contain a valid image.
+    """
+    # Delta encoded images are reconstructed into the canvas of the device. Once a delta is missing, the
+    # following deltas are skipped until the keyframe requested from the device is received.
+    if isTileDeltaPayload(data):
+        try:
+            image = tileDeltaDecoder.decodePayload(device, data);
+        except KeyframeRequiredError:
+            requestKeyframe(device);
+
+            return None;
+    else:
+        image = decodeImagePayload(data);
+
+    # Share every decoded image with the local consumers of the frame ring
+    if frameRingWriter is not None:
+        frameRingWriter.write(device, image);
+
+    return image;
+
+def getWindowName(device):
+    """
+        Get the name of the window in which the images of a device are displayed.
+
+        Args:
+            device: A string instance identifying the device.
+
+        Returns:
+            A string instance representing the window name.
+
+        Raises:
+            None.
+    """
+    return "%s %s" % (OPENCV_WIN_NAME, device);
 
 def parseCommandLineOptions():
     """
@@ -92,20 +198,30 @@ def parseCommandLineOptions():
         Raises:
             argparse.error if one of the required command line options is missing.
     """
-    parser = argparse.ArgumentParser();
-
-    parser.add_argument("-o", "--organization-id", action="store", required=True, dest="organizationId");
-    parser.add_argument("-p", "--application-id", action="store", required=True, dest="applicationId");
-    parser.add_argument("-m", "--auth-method", action="store", required=True, dest="authMethod");
-    parser.add_argument("-k", "--auth-key", action="store", required=True, dest="authKey");
-    parser.add_argument("-a", "--auth-token", action="store", required=True, dest="authToken");
-    parser.add_argument("-t", "--device-type", action="store", required=True, dest="deviceType");
-    parser.add_argument("-i", "--device-id", action="store", required=True, dest="deviceId");
-    parser.add_argument("-e", "--device-event-name", action="store", required=True, dest="deviceEventName");
-    parser.add_argument("-f", "--device-event-format", action="store", required=True, dest="deviceEventFormat");
+    parser = createArgumentParser(APPLICATION_CLIENT, "Receive images from the IBM Watson IoT Platform and display them.");
+
+    parser.add_argument("-w", "--decoder-workers", action="store", type=int, default=2, dest="decoderWorkers");
+    parser.add_argument("-s", "--queue-size", action="store", type=int, default=16, dest="queueSize");
+    parser.add_argument("--statistics-interval", action="store", type=float, default=5.0, dest="statisticsInterval");
+    parser.add_argument("--benchmark-report", action="store", default=None, dest="benchmarkReport");
+    parser.add_argument("--headless", action="store_true", default=False, dest="headless");
+    parser.add_argument("--duration", action="store", type=float, default=0.0, dest="duration");
+    parser.add_argument("--reassembly-workers", action="store", type=int, default=DEFAULT_REASSEMBLY_WORKERS, dest="reassemblyWorkers");
+    parser.add_argument("--max-in-flight-bytes", action="store", type=int, default=DEFAULT_MAX_IN_FLIGHT_BYTES, dest="maxInFlightBytes");
+    parser.add_argument("--transfer-timeout", action="store", type=float, default=DEFAULT_TRANSFER_TIMEOUT, dest="transferTimeout");
+    parser.add_argument("--frame-ring", action="store", default=None, dest="frameRing");
+    parser.add_argument("--frame-ring-slots", action="store", type=int, default=DEFAULT_FRAME_RING_SLOTS, dest="frameRingSlots");
+    parser.add_argument("--frame-ring-slot-size", action="store", type=int, default=DEFAULT_FRAME_RING_SLOT_SIZE, dest="frameRingSlotSize");
+    parser.add_argument("--record-dir", action="store", default=None, dest="recordDir");
+    parser.add_argument("--record-format", action="store", choices=sorted(RECORD_FORMATS), default=DEFAULT_RECORD_FORMAT, dest="recordFormat");
+    parser.add_argument("--record-segment-duration", action="store", type=float, default=DEFAULT_RECORD_SEGMENT_DURATION, dest="recordSegmentDuration");
+    parser.add_argument("--record-frame-rate", action="store", type=float, default=DEFAULT_RECORD_FRAME_RATE, dest="recordFrameRate");
+
+    # Only the latest image of a device is worth displaying once the receiver falls behind
+    parser.set_defaults(dispatchPolicy=LATEST_POLICY);
 
     # Parse command line options
-    options = parser.parse_args();
+    options = parseArguments(parser);
 
     return options;
 
@@ -117,12 +233,55 @@ def parseCommandLineOptions():
 # Parse the command line options
 options = parseCommandLineOptions();
 
+# Serve the metrics on a local HTTP endpoint, if requested
+metricsServer = startMetricsServer(options.metricsPort);
+
+# Profile the processing stages, and sample the functions of all the threads, if requested
+profiler = startProfiler(options.profile, options.profileOutput, options.profileInterval, options.profileSampling, options.profileTop);
+
 # Create application client
 appClient = initAppClient(options.organizationId, options.applicationId, options.authMethod, 
-                          options.authKey, options.authToken);
+                          options.authKey, options.authToken, options.broker);
+
+# Decode the received images in parallel
+tileDeltaDecoder        = TileDeltaDecoder();
+keyframeRequestTimes    = {};
+decoderPool             = FrameDecoderPool(STAGE_DURATION.labels("decode").wrap(decodeDeviceEventData), options.decoderWorkers, 
+                                           options.queueSize);
+
+# Share the decoded images with local processes through a shared memory ring, and record them, if requested
+frameRingWriter     = None;
+frameRingRecorder   = None;
+
+if options.frameRing or options.recordDir:
+    frameRingWriter = FrameRingWriter(options.frameRing, options.frameRingSlots, options.frameRingSlotSize);
 
-# Initialize the window in which the received images are displayed
-namedWindow(OPENCV_WIN_NAME, WND_PROP_FULLSCREEN);
+    print("Writing the decoded images to the frame ring %s." % frameRingWriter.name);
+
+if options.recordDir:
+    frameRingRecorder = FrameRingRecorder(FrameRingReader(frameRingWriter.name), options.recordDir, options.recordFormat,
+                                          options.recordSegmentDuration, options.recordFrameRate);
+
+    frameRingRecorder.start();
+
+# Reassemble the chunked payloads of the devices in parallel
+chunkReassembler = ChunkReassembler(reassembledPayloadCallback, options.reassemblyWorkers, maxInFlightBytes=options.maxInFlightBytes,
+                                    transferTimeout=options.transferTimeout);
+
+# Record the benchmark events if requested
+latencyRecorder = LatencyRecorder() if options.benchmarkReport else None;
+
+decoderPool.start();
+chunkReassembler.start();
+
+# Route the events of the subscribed devices to the callback
+handlerIndex = DeviceEventHandlerIndex();
+
+handlerIndex.addHandler(receivedDeviceEventCallback, options.deviceType, options.deviceId, options.deviceEventName);
+
+eventDispatcher = ShardedEventDispatcher(handlerIndex, options.dispatchShards, options.dispatchQueueSize, 
+                                         options.dispatchReportInterval, options.dispatchPolicy, options.dispatchSampleInterval,
+                                         getDispatchKey);
 
 # Connect application client
 appClient.connect();
@@ -131,17 +290,119 @@ appClient.connect();
 appClient.subscribeToDeviceEvents(options.deviceType, options.deviceId, options.deviceEventName, 
                                   options.deviceEventFormat);
 
-# Set the callback for device events
-appClient.deviceEventCallback = receivedDeviceEventCallback;
+# Dispatch the device events to their handlers, sharded by device. The time spent by the client thread
+# queuing the events is profiled, the handlers being timed by the dispatcher.
+deviceEventCallback = eventDispatcher.dispatch;
+
+if profiler is not None:
+    deviceEventCallback = profiler.wrap("dispatch", deviceEventCallback);
+
+# Log the received events, if requested
+eventLog = openEventLog(options.eventLog);
+
+if eventLog is not None:
+    deviceEventCallback = eventLog.wrapDeviceEventCallback(deviceEventCallback);
+
+appClient.deviceEventCallback = deviceEventCallback;
 
-# While the key 'q' was not pressed wait for new device events
-keyPressed = 0;
+# Time the display of the images and the wait for a key, if requested
+showImage   = lambda windowName, image: cv2.imshow(windowName, image);
+waitKey     = lambda delay: cv2.waitKey(delay);
 
-while chr(keyPressed & 255) != 'q':
-    keyPressed = waitKey(1000);
+if profiler is not None:
+    showImage   = profiler.wrap("display", showImage);
+    waitKey     = profiler.wrap("wait key", waitKey);
 
-# Destroy the window used to display images
-destroyWindow(OPENCV_WIN_NAME);
+# While the key 'q' was not pressed, the duration did not elapse and the receiver was not interrupted
+# display the latest image received from each device
+keyPressed      = 0;
+windowNames     = set();
+nextReportTime  = time.monotonic() + options.statisticsInterval;
+endTime         = time.monotonic() + options.duration if options.duration > 0 else None;
 
-# Disconnect device client
+try:
+    while chr(keyPressed & 255) != 'q' and (endTime is None or time.monotonic() < endTime):
+        for device, image in decoderPool.takeLatestFrames().items():
+            # The images are decoded but not displayed when running without display
+            if options.headless:
+                continue;
+
+            windowName = getWindowName(device);
+
+            # Initialize the window in which the images received from the device are displayed
+            if windowName not in windowNames:
+                cv2.namedWindow(windowName, cv2.WND_PROP_FULLSCREEN);
+
+                windowNames.add(windowName);
+
+            # Display image
+            showImage(windowName, image);
+
+        # Report the number of images received, decoded, taken by this loop and dropped
+        if time.monotonic() >= nextReportTime:
+            print(decoderPool.getStatisticsReport());
+
+            if chunkReassembler.startedCount:
+                print(chunkReassembler.getStatisticsReport());
+
+            if frameRingRecorder is not None:
+                print(frameRingRecorder.getStatisticsReport());
+
+            nextReportTime += options.statisticsInterval;
+
+        # Key presses are only received once a window exists
+        if windowNames:
+            keyPressed = waitKey(DISPLAY_REFRESH_MS);
+        else:
+            time.sleep(DISPLAY_REFRESH_MS / 1000.0);
+except KeyboardInterrupt:
+    pass;
+
+# Disconnect application client
 appClient.disconnect();
+
+# Write the logged events
+if eventLog is not None:
+    eventLog.close();
+
+    print(eventLog.getStatisticsReport());
+
+# Handle the queued events and report the dispatch statistics
+eventDispatcher.close();
+
+print(eventDispatcher.getStatisticsReport());
+
+# Stop reassembling and decoding images once the queued chunks and payloads are handled, in the order they flow
+chunkReassembler.stop();
+decoderPool.stop();
+
+print(decoderPool.getStatisticsReport());
+
+if chunkReassembler.startedCount:
+    print(chunkReassembler.getStatisticsReport());
+
+# Close the segments being recorded and remove the frame ring, once the last images are decoded
+if frameRingRecorder is not None:
+    frameRingRecorder.stop();
+    frameRingRecorder.reader.close();
+
+    print(frameRingRecorder.getStatisticsReport());
+
+if frameRingWriter is not None:
+    frameRingWriter.close();
+
+# Destroy the windows used to display images
+if windowNames:
+    cv2.destroyAllWindows();
+
+# Write the latency, loss and reordering report
+if latencyRecorder is not None:
+    latencyRecorder.writeReport(options.benchmarkReport);
+
+# Write the profile of the whole run
+if profiler is not None:
+    profiler.close();
+
+# Stop serving the metrics
+if metricsServer is not None:
+    metricsServer.close();
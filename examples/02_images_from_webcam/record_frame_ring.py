@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir));
+
+from frame_ring import DEFAULT_RECORD_FORMAT, DEFAULT_RECORD_FRAME_RATE, DEFAULT_RECORD_SEGMENT_DURATION, RECORD_FORMATS, FrameRingReader, FrameRingRecorder
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def parseCommandLineOptions():
+    """
+        Parse the given command line options.
+
+        Args:
+            None.
+
+        Returns:
+            options: A argparse.Namespace instance representing the parsed command line options.
+
+        Raises:
+            argparse.error if one of the command line options is invalid.
+    """
+    parser = argparse.ArgumentParser(description="Record the images written to a frame ring by receive_images_from_wiotp.py --frame-ring "
+                                                 "into rolling video segments.");
+
+    parser.add_argument("frameRing", action="store");
+    parser.add_argument("-d", "--record-dir", action="store", default="recordings", dest="recordDir");
+    parser.add_argument("--record-format", action="store", choices=sorted(RECORD_FORMATS), default=DEFAULT_RECORD_FORMAT, dest="recordFormat");
+    parser.add_argument("--record-segment-duration", action="store", type=float, default=DEFAULT_RECORD_SEGMENT_DURATION, dest="recordSegmentDuration");
+    parser.add_argument("--record-frame-rate", action="store", type=float, default=DEFAULT_RECORD_FRAME_RATE, dest="recordFrameRate");
+    parser.add_argument("--statistics-interval", action="store", type=float, default=5.0, dest="statisticsInterval");
+    parser.add_argument("--duration", action="store", type=float, default=0.0, dest="duration");
+
+    # Parse command line options
+    options = parser.parse_args();
+
+    return options;
+
+
+# -----------------------------------------------------------------------------
+# Main
+# -----------------------------------------------------------------------------
+
+# Parse command line options
+options = parseCommandLineOptions();
+
+# Attach to the frame ring of the receiver
+try:
+    frameRingReader = FrameRingReader(options.frameRing);
+except (OSError, ValueError) as exception:
+    print("Could not open the frame ring %s: %s" % (options.frameRing, str(exception)));
+
+    sys.exit(1);
+
+frameRingRecorder = FrameRingRecorder(frameRingReader, options.recordDir, options.recordFormat, options.recordSegmentDuration,
+                                      options.recordFrameRate);
+
+frameRingRecorder.start();
+
+# Record until the duration elapsed or the recorder is interrupted
+endTime = time.monotonic() + options.duration if options.duration > 0 else None;
+
+try:
+    while endTime is None or time.monotonic() < endTime:
+        time.sleep(options.statisticsInterval if endTime is None else max(0.0, min(options.statisticsInterval, endTime - time.monotonic())));
+
+        print(frameRingRecorder.getStatisticsReport());
+except KeyboardInterrupt:
+    pass;
+
+frameRingRecorder.stop();
+frameRingReader.close();
+
+print(frameRingRecorder.getStatisticsReport());
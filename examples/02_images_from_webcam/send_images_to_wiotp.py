@@ -1,13 +1,30 @@
 #!/usr/bin/env python
 
-import argparse
-import pickle
+import itertools
+import os
 import sys
+import time
 
-from cv2 import *
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir));
 
-import ibmiotf.device
+from common.event_log import openEventLog
+from common.latency import stampPayload
+from common.message_codecs import getMessageCodec
+from common.metrics import STAGE_DURATION, startMetricsServer
+from common.outbox import DEFAULT_OUTBOX_DRAIN_RATE, DEFAULT_OUTBOX_MAX_SIZE, DEFAULT_OUTBOX_SEGMENT_SIZE, openDeviceClientOutbox
+from common.profiler import startProfiler
+from common.runtime import DEVICE_CLIENT, createArgumentParser, initDeviceClient, lazyImport, parseArguments
+from common.windowed_publisher import openDeviceClientPublisher
 
+from adaptive_controller import DEFAULT_LATENCY_TARGET, DEFAULT_MIN_FRAME_RATE, DEFAULT_MIN_QUALITY, DEFAULT_MIN_SCALE, AdaptiveStreamController
+from capture_profiles import DEFAULT_CAMERA_INDEX, DEFAULT_CAPTURE_PROFILE, getCaptureProfile
+from chunked_transfer import CHUNK_DATA_KEY, ChunkSplitter
+from frame_pipeline import FramePipeline
+from frame_sources import CAMERA_SOURCE, DEFAULT_FRAME_SOURCE, openFrameSource
+from image_codecs import DEFAULT_IMAGE_CODEC, DEFAULT_IMAGE_QUALITY, DEFAULT_IMAGE_SCALE, IMAGE_CODECS, decodeImage, getDeviceEventPayload, getPassthroughDeviceEventPayload
+from tile_delta import DEFAULT_DELTA_THRESHOLD, DEFAULT_KEYFRAME_INTERVAL, DEFAULT_TILE_SIZE, KEYFRAME_COMMAND, TileDeltaEncoder
+
+cv2 = lazyImport("cv2");
 
 
 # -----------------------------------------------------------------------------
@@ -16,104 +33,156 @@ import ibmiotf.device
 
 OPENCV_WIN_NAME = "WebCamera";
 
+# Number of milliseconds the display loop waits for a key to be pressed
+DISPLAY_REFRESH_MS = 30;
+
+# Factor by which the JPEG frames forwarded in passthrough mode are reduced when decoded for display
+PASSTHROUGH_DISPLAY_REDUCTION = 2;
+
 
 # -----------------------------------------------------------------------------
 # Functions
 # -----------------------------------------------------------------------------
 
-def initCameraClient():
+def initFrameSource(sourceSpecification, cameraIndex = DEFAULT_CAMERA_INDEX, captureProfile = None, passthrough = False):
     """
-        Initialize the web camera client.
+        Initialize the source of the captured images.
 
         Args:
-            None.
+            sourceSpecification:    A string instance representing the frame source, see frame_sources.openFrameSource.
+            cameraIndex:            An integer representing the index of the camera.
+            captureProfile:         An optional CaptureProfile instance setting the resolution, frame rate and pixel format.
+            passthrough:            A boolean indicating whether the JPEG frames of the camera are forwarded without being decoded.
 
         Returns:
-            An instance of cv2.VideoCapture representing the camera client.
+            A FrameSource instance.
 
         Raises:
             None.
     """
     try:
-        cameraClient = VideoCapture(0);
+        frameSource = openFrameSource(sourceSpecification, cameraIndex, captureProfile, passthrough);
+
+        print("Frame source: %s" % frameSource.describe());
 
-        return cameraClient;
+        return frameSource;
     except Exception as exception:
-        print("Could not initialize the web camera: %s" % str(exception));
+        print("Could not initialize the frame source: %s" % str(exception));
 
         sys.exit(1);
 
-def initDeviceClient(organizationId, deviceTypeId, deviceId, authMethod, authToken):
+def publishDeviceEvent(data):
     """
-        Initialize the device client.
+        Publish a device event, embedding the benchmark fields in benchmark mode, splitting it
+        into chunks if it exceeds the chunk size and going through the windowed publisher and the outbox
+        if it is enabled.
 
         Args:
-            organizationId: A string instance representing the organization id.
-            deviceTypeId:   A string instance representing the device type id.
-            deviceId:       A string instance representing the device id.
-            authMethod:     A string instance representing the authentication method.
-            authToken:      A string instance representing the authentication token.
+            data: A dictionary instance representing the device event payload.
 
         Returns:
-            An instance of ibmiotf.device representing the device client.
+            None.
 
         Raises:
             None.
     """
-    # Initialize the device client.
-    try:
-        deviceOptions = {
-            "org"           : organizationId, 
-            "type"          : deviceTypeId, 
-            "id"            : deviceId, 
-            "auth-method"   : authMethod, 
-            "auth-token"    : authToken
-        };
+    if options.benchmark:
+        stampPayload(data, next(benchmarkSequence));
+
+    eventsData  = [data];
+    isChunked   = False;
+
+    # The payload is encoded once to be both split and measured
+    if chunkSplitter is not None or streamController is not None:
+        payload = messageCodec.encodePayload(data);
+
+        if not isinstance(payload, bytes):
+            payload = payload.encode("utf-8");
+
+        # The payloads exceeding the chunk size are published as a series of chunk events
+        if chunkSplitter is not None and len(payload) > chunkSplitter.chunkSize:
+            eventsData  = chunkSplitter.split(payload);
+            isChunked   = True;
+
+    # The adaptive controller measures the payload size and the time until the client sent the event
+    # (its last chunk). The size of the chunk events is that of their packed data, their other fields
+    # taking a few tens of bytes. The events stored in the outbox are counted as sent.
+    if streamController is not None:
+        if isChunked:
+            payloadSize = sum(len(eventData[CHUNK_DATA_KEY]) for eventData in eventsData);
+        else:
+            payloadSize = len(payload);
+
+        publishId = streamController.startPublish(payloadSize);
+
+        if outbox is not None:
+            streamController.completePublish(publishId);
+
+    for index, eventData in enumerate(eventsData):
+        if outbox is not None:
+            outbox.publish(options.deviceEventName, options.deviceEventFormat, eventData);
+        elif streamController is not None and index == len(eventsData) - 1:
+            publisher.publishEvent(options.deviceEventName, options.deviceEventFormat, eventData,
+                                   on_publish=lambda: streamController.completePublish(publishId));
+        else:
+            publisher.publishEvent(options.deviceEventName, options.deviceEventFormat, eventData);
+
+def applyStreamSettings(frameRate, imageScale, imageQuality):
+    """
+        Apply the settings chosen by the adaptive controller to the following images.
 
-        print("Creating device client using options: %s" % str(deviceOptions));
+        Args:
+            frameRate:      A float representing the number of images captured per second.
+            imageScale:     A float representing the factor applied to the image size.
+            imageQuality:   An integer between 0 and 100 representing the encode quality.
 
-        deviceClient = ibmiotf.device.Client(deviceOptions);
+        Returns:
+            None.
 
-        return deviceClient;
-    except Exception as exception:
-        print("Failed to create device client: %s" % str(exception));
+        Raises:
+            None.
+    """
+    options.imageScale      = imageScale;
+    options.imageQuality    = imageQuality;
 
-        sys.exit(1);
+    pipeline.targetFrameRate = frameRate;
+
+    if tileDeltaEncoder is not None:
+        tileDeltaEncoder.quality = imageQuality;
 
-def getDeviceEventPayload(cameraClient):
+def getOutboundQueueDepth():
     """
-        Get a dictionary instance representing the device event payload.
+        Get the number of images waiting to be sent.
 
         Args:
-           cameraClient: An instance of cv2.VideoCapture used to communicate with the local webcam. 
+            None.
 
         Returns:
-            A dictionary instance representing the device event payload.
+            An integer representing the number of images in the publish queue plus
+            the number of packets queued by the MQTT client.
 
         Raises:
             None.
     """
-    # Capture an image using the webcam
-    okMsg, image = cameraClient.read();
-
-    # If no error occurred
-    if okMsg:
-        # Show the image that will be sent
-        imshow(OPENCV_WIN_NAME, image);
+    # paho-mqtt does not expose its outgoing packet queue, which grows when the link is slower than the stream
+    return len(pipeline.publishQueue) + len(getattr(deviceClient.client, "_out_packet", ()));
 
-        # Reduce the image size by a factor of 10 to reduce the size of the payload
-        imageScaled = resize(image, None, fx = 0.1, fy = 0.1, interpolation = INTER_CUBIC);
-
-        # Serialize image using pickle
-        imgPayload = pickle.dumps(imageScaled);
-    else:
-        imgPayload = "Could not capture image from webcam.";
+def receivedCommandCallback(command):
+    """
+        Callback executed when a device command is received.
 
-    # Prepare device event payload
-    data = {"img" : imgPayload};
+        Args:
+            command: The device command.
 
-    return data;
+        Returns:
+            None.
 
+        Raises:
+            None.
+    """
+    # Send a keyframe when a receiver lost track of the delta encoded images
+    if command.command == KEYFRAME_COMMAND and tileDeltaEncoder is not None:
+        tileDeltaEncoder.requestKeyframe();
 
 def parseCommandLineOptions():
     """
@@ -128,18 +197,66 @@ def parseCommandLineOptions():
         Raises:
             arparse.error if one of the required command line options is missing.
     """
-    parser = argparse.ArgumentParser();
-
-    parser.add_argument("-o", "--organization-id", action="store", required=True, dest="organizationId");
-    parser.add_argument("-t", "--device-type", action="store", required=True, dest="deviceType");
-    parser.add_argument("-i", "--device-id", action="store", required=True, dest="deviceId");
-    parser.add_argument("-m", "--auth-method", action="store", required=True, dest="authMethod");
-    parser.add_argument("-a", "--auth-token", action="store", required=True, dest="authToken");
-    parser.add_argument("-e", "--device-event-name", action="store", required=True, dest="deviceEventName");
-    parser.add_argument("-f", "--device-event-format", action="store", required=True, dest="deviceEventFormat");
+    parser = createArgumentParser(DEVICE_CLIENT, "Send images captured by the web camera to the IBM Watson IoT Platform.");
+
+    parser.add_argument("--source", action="store", default=DEFAULT_FRAME_SOURCE, dest="frameSource");
+    parser.add_argument("--camera", action="store", type=int, default=DEFAULT_CAMERA_INDEX, dest="cameraIndex");
+    parser.add_argument("--capture-profile", action="store", default=DEFAULT_CAPTURE_PROFILE, dest="captureProfile");
+    parser.add_argument("--passthrough", action="store_true", default=False, dest="passthrough");
+    parser.add_argument("-c", "--image-codec", action="store", choices=sorted(IMAGE_CODECS), default=DEFAULT_IMAGE_CODEC, dest="imageCodec");
+    parser.add_argument("-q", "--image-quality", action="store", type=int, default=DEFAULT_IMAGE_QUALITY, dest="imageQuality");
+    parser.add_argument("-r", "--target-frame-rate", action="store", type=float, default=1.0, dest="targetFrameRate");
+    parser.add_argument("--scale", action="store", type=float, default=DEFAULT_IMAGE_SCALE, dest="imageScale");
+    parser.add_argument("-w", "--encoder-workers", action="store", type=int, default=2, dest="encoderWorkers");
+    parser.add_argument("-s", "--queue-size", action="store", type=int, default=4, dest="queueSize");
+    parser.add_argument("--statistics-interval", action="store", type=float, default=5.0, dest="statisticsInterval");
+    parser.add_argument("-d", "--delta", action="store_true", default=False, dest="delta");
+    parser.add_argument("--tile-size", action="store", type=int, default=DEFAULT_TILE_SIZE, dest="tileSize");
+    parser.add_argument("--delta-threshold", action="store", type=float, default=DEFAULT_DELTA_THRESHOLD, dest="deltaThreshold");
+    parser.add_argument("--keyframe-interval", action="store", type=int, default=DEFAULT_KEYFRAME_INTERVAL, dest="keyframeInterval");
+    parser.add_argument("--outbox", action="store", default=None, dest="outboxDirectory");
+    parser.add_argument("--outbox-max-size", action="store", type=int, default=DEFAULT_OUTBOX_MAX_SIZE, dest="outboxMaxSize");
+    parser.add_argument("--outbox-segment-size", action="store", type=int, default=DEFAULT_OUTBOX_SEGMENT_SIZE, dest="outboxSegmentSize");
+    parser.add_argument("--outbox-drain-rate", action="store", type=float, default=DEFAULT_OUTBOX_DRAIN_RATE, dest="outboxDrainRate");
+    parser.add_argument("--benchmark", action="store_true", default=False, dest="benchmark");
+    parser.add_argument("--adaptive", action="store_true", default=False, dest="adaptive");
+    parser.add_argument("--bandwidth-budget", action="store", type=int, default=0, dest="bandwidthBudget");
+    parser.add_argument("--min-frame-rate", action="store", type=float, default=DEFAULT_MIN_FRAME_RATE, dest="minFrameRate");
+    parser.add_argument("--min-scale", action="store", type=float, default=DEFAULT_MIN_SCALE, dest="minScale");
+    parser.add_argument("--min-quality", action="store", type=int, default=DEFAULT_MIN_QUALITY, dest="minQuality");
+    parser.add_argument("--latency-target", action="store", type=float, default=DEFAULT_LATENCY_TARGET, dest="latencyTarget");
+    parser.add_argument("--chunk-size", action="store", type=int, default=0, dest="chunkSize");
+    parser.add_argument("--headless", action="store_true", default=False, dest="headless");
+    parser.add_argument("--duration", action="store", type=float, default=0.0, dest="duration");
 
     # Parse command line options
-    options = parser.parse_args();
+    options = parseArguments(parser);
+
+    # The raw format only carries the compressed image, without any field
+    if not getMessageCodec(options.deviceEventFormat).structured and (options.delta or options.benchmark or options.chunkSize):
+        parser.error("The %s device event format cannot be used with --delta, --benchmark or --chunk-size." % options.deviceEventFormat);
+
+    if options.chunkSize < 0:
+        parser.error("--chunk-size should not be negative.");
+
+    try:
+        options.captureProfile = getCaptureProfile(options.captureProfile);
+    except ValueError as exception:
+        parser.error(str(exception));
+
+    # In passthrough mode the images are neither decoded nor encoded again
+    if options.passthrough and (options.delta or options.imageCodec != "jpeg"):
+        parser.error("--passthrough forwards the JPEG images of the camera, hence it cannot be used with --delta or another image codec.");
+
+    if options.passthrough and options.frameSource != CAMERA_SOURCE:
+        parser.error("--passthrough forwards the JPEG images of the camera, hence it requires the camera frame source.");
+
+    # The target frame rate, scale and quality are the upper bounds of the adaptive controller
+    if options.adaptive and not (0 < options.minFrameRate <= options.targetFrameRate):
+        parser.error("--adaptive requires 0 < --min-frame-rate <= --target-frame-rate.");
+
+    if options.adaptive and not (0 < options.minScale <= options.imageScale and 0 <= options.minQuality <= options.imageQuality <= 100):
+        parser.error("--adaptive requires 0 < --min-scale <= --scale and 0 <= --min-quality <= --image-quality <= 100.");
 
     return options;
 
@@ -151,34 +268,188 @@ def parseCommandLineOptions():
 # Parse command line options
 options = parseCommandLineOptions();
 
-# Create camera client
-cameraClient = initCameraClient();
+# Serve the metrics on a local HTTP endpoint, if requested
+metricsServer = startMetricsServer(options.metricsPort);
+
+# Profile the processing stages, and sample the functions of all the threads, if requested
+profiler = startProfiler(options.profile, options.profileOutput, options.profileInterval, options.profileSampling, options.profileTop);
+
+# Open the camera, video, image directory or synthetic source of the images
+frameSource = initFrameSource(options.frameSource, options.cameraIndex, options.captureProfile, options.passthrough);
 
 # Create device client
 deviceClient = initDeviceClient(options.organizationId, options.deviceType, options.deviceId, 
-                                options.authMethod, options.authToken);
+                                options.authMethod, options.authToken, options.broker);
 
-# Initialize the window in which the captured images are displayed
-namedWindow(OPENCV_WIN_NAME, WND_PROP_FULLSCREEN);
+# Initialize the window in which the captured images are displayed, unless running without display
+if not options.headless:
+    cv2.namedWindow(OPENCV_WIN_NAME, cv2.WND_PROP_FULLSCREEN);
+
+# Store the compressed images as bytes if the device event format allows it
+messageCodec = getMessageCodec(options.deviceEventFormat);
+
+# Create the delta encoder which only sends the changed tiles of the images
+tileDeltaEncoder = None;
+
+if options.delta:
+    tileDeltaEncoder = TileDeltaEncoder(options.tileSize, options.deltaThreshold, options.keyframeInterval, 
+                                        options.imageCodec, options.imageQuality, messageCodec.binary);
+
+    # Delta encoding depends on the previous image, therefore images are encoded sequentially
+    if options.encoderWorkers != 1:
+        print("Delta encoding uses a single encoder worker.");
+
+        options.encoderWorkers = 1;
+
+# Set the callback for device commands
+deviceClient.commandCallback = receivedCommandCallback;
 
 # Connect device client
 deviceClient.connect();
 
-# Send data whenever the user presses a key different from 'q'
-keyPressed = 0;
+# Log the published events, if requested
+eventLog = openEventLog(options.eventLog);
+
+# Publish the events at the requested quality of service, with a bounded number of events in flight
+publisher = openDeviceClientPublisher(deviceClient, options.publishWindow, options.qos, options.ackTimeout, eventLog);
+
+# Store the events in the outbox while disconnected, if requested
+outbox = None;
+
+if options.outboxDirectory:
+    outbox = openDeviceClientOutbox(deviceClient, options.outboxDirectory, options.outboxMaxSize,
+                                    options.outboxSegmentSize, options.outboxDrainRate, publisher);
+
+# Split the large payloads, e.g. of full resolution images, into chunks if requested
+chunkSplitter = ChunkSplitter(options.chunkSize, messageCodec.binary) if options.chunkSize else None;
+
+# Capture, encode and publish images in parallel stages
+benchmarkSequence = itertools.count();
+
+if options.passthrough:
+    encodeFunction = lambda encodedImage: getPassthroughDeviceEventPayload(encodedImage, messageCodec);
+else:
+    encodeFunction = lambda image: getDeviceEventPayload(image, options.imageCodec, options.imageQuality, tileDeltaEncoder, messageCodec, options.imageScale);
+
+# The capture and encode durations are recorded in the metrics. The delta encoded images are chained, hence
+# none of them is dropped once encoded.
+pipeline = FramePipeline(
+    STAGE_DURATION.labels("capture").wrap(frameSource.read),
+    STAGE_DURATION.labels("encode").wrap(encodeFunction),
+    publishDeviceEvent,
+    options.targetFrameRate, options.encoderWorkers, options.queueSize, options.delta
+);
+
+# Adjust the frame rate, scale and quality to the link, if requested
+streamController = None;
+
+if options.adaptive:
+    streamController = AdaptiveStreamController(
+        applyStreamSettings, getOutboundQueueDepth, options.bandwidthBudget,
+        options.targetFrameRate, options.imageScale, options.imageQuality, options.minFrameRate,
+        # The scale and quality of the images forwarded in passthrough mode are set by the camera
+        options.imageScale if options.passthrough else options.minScale,
+        options.imageQuality if options.passthrough else options.minQuality,
+        options.latencyTarget
+    );
+
+    streamController.start();
+
+pipeline.start();
+
+# Time the display of the images and the wait for a key, if requested
+showImage   = lambda windowName, image: cv2.imshow(windowName, image);
+waitKey     = lambda delay: cv2.waitKey(delay);
+
+if profiler is not None:
+    showImage   = profiler.wrap("display", showImage);
+    waitKey     = profiler.wrap("wait key", waitKey);
+
+# Show the captured images and report the pipeline statistics until the key 'q' is pressed, the duration
+# elapsed or the sender is interrupted
+keyPressed          = 0;
+displayedImage      = None;
+nextReportTime      = time.monotonic() + options.statisticsInterval;
+endTime             = time.monotonic() + options.duration if options.duration > 0 else None;
 
-while chr(keyPressed & 255) != 'q':
-    # Prepare data to be sent
-    data = getDeviceEventPayload(cameraClient);
+try:
+    while chr(keyPressed & 255) != 'q' and (endTime is None or time.monotonic() < endTime):
+        # Show the latest captured image
+        image = pipeline.latestFrame;
 
-    # Send data
-    deviceClient.publishEvent(options.deviceEventName, options.deviceEventFormat, data);
+        if not options.headless and image is not None and image is not displayedImage:
+            displayedImage = image;
 
-    # Wait for a new key to be pressed up to one second
-    keyPressed = waitKey(1000);
+            # Only the displayed JPEG images are decoded in passthrough mode, at a reduced size
+            if options.passthrough:
+                try:
+                    image = decodeImage(image, PASSTHROUGH_DISPLAY_REDUCTION);
+                except ValueError:
+                    image = None;
+
+            if image is not None:
+                showImage(OPENCV_WIN_NAME, image);
+
+        # Report the per-stage throughput and queue depths
+        if time.monotonic() >= nextReportTime:
+            print(pipeline.getStatisticsReport());
+
+            print(publisher.getStatisticsReport());
+
+            if streamController is not None:
+                print(streamController.getStatisticsReport());
+
+            if outbox is not None:
+                print(outbox.getStatisticsReport());
+
+            nextReportTime += options.statisticsInterval;
+
+        # Wait for a new key to be pressed, keys are only received by the window
+        if options.headless:
+            time.sleep(DISPLAY_REFRESH_MS / 1000.0);
+        else:
+            keyPressed = waitKey(DISPLAY_REFRESH_MS);
+except KeyboardInterrupt:
+    pass;
+
+# Stop adapting the settings and capturing images
+if streamController is not None:
+    streamController.stop();
+
+pipeline.stop();
+
+print(pipeline.getStatisticsReport());
+
+frameSource.close();
 
 # Destroy the window used to display images
-destroyWindow(OPENCV_WIN_NAME);
+if not options.headless:
+    cv2.destroyWindow(OPENCV_WIN_NAME);
+
+# Close the outbox, the events which were not forwarded are kept for the next run
+if outbox is not None:
+    outbox.close();
+
+    print(outbox.getStatisticsReport());
+
+# Wait for the acknowledgement of the events in flight
+publisher.flush();
+
+print(publisher.getStatisticsReport());
 
 # Disconnect device client
 deviceClient.disconnect();
+
+# Write the logged events
+if eventLog is not None:
+    eventLog.close();
+
+    print(eventLog.getStatisticsReport());
+
+# Write the profile of the whole run
+if profiler is not None:
+    profiler.close();
+
+# Stop serving the metrics
+if metricsServer is not None:
+    metricsServer.close();
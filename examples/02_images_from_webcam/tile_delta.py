@@ -0,0 +1,330 @@
+import math
+import threading
+
+from common.runtime import lazyImport
+from image_codecs import DEFAULT_IMAGE_CODEC, DEFAULT_IMAGE_QUALITY, decodeImage, encodeImage, packImageBytes, unpackImageBytes
+
+cv2     = lazyImport("cv2");
+numpy   = lazyImport("numpy");
+
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+DEFAULT_TILE_SIZE           = 16;
+DEFAULT_DELTA_THRESHOLD     = 4.0;
+DEFAULT_KEYFRAME_INTERVAL   = 30;
+
+# Payload kinds
+KEYFRAME_KIND   = "key";
+DELTA_KIND      = "delta";
+
+# Name of the device command used by receivers to request a keyframe
+KEYFRAME_COMMAND = "keyframe";
+
+# Minimum number of seconds between two keyframe requests sent to the same device
+KEYFRAME_REQUEST_INTERVAL = 1.0;
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def isTileDeltaPayload(data):
+    """
+        Check whether device event data is a keyframe or a delta created by TileDeltaEncoder.
+
+        Args:
+            data: The device event data.
+
+        Returns:
+            A boolean.
+
+        Raises:
+            None.
+    """
+    return isinstance(data, dict) and "kind" in data;
+
+def padImage(image, tileSize):
+    """
+        Pad an image on its bottom and right borders so that its size is a multiple of the tile size.
+
+        Args:
+            image:      A numpy.ndarray instance representing the image.
+            tileSize:   An integer representing the width and height of a tile.
+
+        Returns:
+            A numpy.ndarray instance representing the padded image.
+
+        Raises:
+            None.
+    """
+    height, width = image.shape[:2];
+
+    bottom  = -height % tileSize;
+    right   = -width % tileSize;
+
+    if bottom or right:
+        image = cv2.copyMakeBorder(image, 0, bottom, 0, right, cv2.BORDER_REPLICATE);
+
+    return numpy.ascontiguousarray(image);
+
+def getTilesView(image, tileSize):
+    """
+        Get a (rows, columns, tileSize, tileSize, channels) view of a padded image.
+
+        Args:
+            image:      A contiguous numpy.ndarray instance representing the padded image.
+            tileSize:   An integer representing the width and height of a tile.
+
+        Returns:
+            A numpy.ndarray view sharing the memory of the image.
+
+        Raises:
+            None.
+    """
+    height, width, channels = image.shape;
+
+    return image.reshape(height // tileSize, tileSize, width // tileSize, tileSize, channels).swapaxes(1, 2);
+
+def buildMosaic(tiles):
+    """
+        Arrange tiles in an almost square image so that they are compressed at once.
+
+        Args:
+            tiles: A (count, tileSize, tileSize, channels) numpy.ndarray instance.
+
+        Returns:
+            A numpy.ndarray instance representing the mosaic.
+
+        Raises:
+            None.
+    """
+    count, tileSize, _, channels = tiles.shape;
+
+    columns = int(math.ceil(math.sqrt(count)));
+    rows    = int(math.ceil(count / float(columns)));
+
+    mosaic          = numpy.zeros((rows * columns, tileSize, tileSize, channels), dtype = tiles.dtype);
+    mosaic[:count]  = tiles;
+
+    return mosaic.reshape(rows, columns, tileSize, tileSize, channels).swapaxes(1, 2).reshape(rows * tileSize, columns * tileSize, channels);
+
+def splitMosaic(mosaic, count, tileSize):
+    """
+        Get the tiles stored in a mosaic built by buildMosaic.
+
+        Args:
+            mosaic:     A numpy.ndarray instance representing the mosaic.
+            count:      An integer representing the number of tiles.
+            tileSize:   An integer representing the width and height of a tile.
+
+        Returns:
+            A (count, tileSize, tileSize, channels) numpy.ndarray instance.
+
+        Raises:
+            None.
+    """
+    return getTilesView(numpy.ascontiguousarray(mosaic), tileSize).reshape(-1, tileSize, tileSize, mosaic.shape[2])[:count];
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+class KeyframeRequiredError(ValueError):
+    """
+        Raised when a delta frame cannot be applied because the previous frame
+        of the device is missing.
+    """
+
+
+class TileDeltaEncoder(object):
+    """
+        Stateful encoder sending a full keyframe periodically and, in between,
+        only the tiles which changed beyond a threshold.
+
+        Changes are measured against the frame as reconstructed by the receiver,
+        so that compression artifacts do not accumulate between keyframes. The
+        encoder is sequential: frames have to be encoded in capture order.
+    """
+
+    def __init__(self, tileSize = DEFAULT_TILE_SIZE, threshold = DEFAULT_DELTA_THRESHOLD, keyframeInterval = DEFAULT_KEYFRAME_INTERVAL,
+                 codecName = DEFAULT_IMAGE_CODEC, quality = DEFAULT_IMAGE_QUALITY, binary = False):
+        """
+            Initialize the encoder.
+
+            Args:
+                tileSize:           An integer representing the width and height of a tile.
+                threshold:          A float representing the mean absolute pixel difference above which a tile is sent.
+                keyframeInterval:   An integer representing the number of frames between two keyframes, or 0 to
+                                    only send keyframes when requested.
+                codecName:          A string instance representing the codec used to compress the tiles.
+                quality:            An integer between 0 and 100 representing the encode quality.
+                binary:             A boolean indicating whether the compressed tiles are stored as bytes
+                                    instead of base64 text, see packImageBytes.
+
+            Returns:
+                None.
+
+            Raises:
+                ValueError if one of the arguments is invalid.
+        """
+        if tileSize < 1:
+            raise ValueError("The tile size should be positive, not %d." % tileSize);
+
+        self.tileSize           = tileSize;
+        self.threshold          = threshold;
+        self.keyframeInterval   = keyframeInterval;
+        self.codecName          = codecName;
+        self.quality            = quality;
+        self.binary             = binary;
+
+        self._reference             = None;
+        self._sequenceNumber        = -1;
+        self._framesSinceKeyframe   = 0;
+        self._keyframeRequested     = threading.Event();
+
+    def requestKeyframe(self):
+        """
+            Force the next encoded frame to be a keyframe. This method is thread-safe.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self._keyframeRequested.set();
+
+    def encodePayload(self, image):
+        """
+            Get a dictionary instance representing the device event payload of a frame.
+
+            Args:
+                image: A numpy.ndarray instance representing the frame.
+
+            Returns:
+                A dictionary instance representing the device event payload.
+
+            Raises:
+                ValueError if the image could not be encoded.
+        """
+        self._sequenceNumber += 1;
+
+        padded = padImage(image, self.tileSize);
+
+        isKeyframe = (
+            self._reference is None
+            or self._reference.shape != padded.shape
+            or self._keyframeRequested.is_set()
+            or (self.keyframeInterval and self._framesSinceKeyframe >= self.keyframeInterval)
+        );
+
+        data = {
+            "seq"   : self._sequenceNumber,
+            "shape" : list(image.shape[:2]),
+            "tile"  : self.tileSize,
+            "codec" : self.codecName
+        };
+
+        if isKeyframe:
+            self._keyframeRequested.clear();
+            self._framesSinceKeyframe = 0;
+
+            encodedImage    = encodeImage(image, self.codecName, self.quality);
+            self._reference = padImage(decodeImage(encodedImage), self.tileSize);
+
+            data["kind"]    = KEYFRAME_KIND;
+            data["img"]     = packImageBytes(encodedImage, self.binary);
+
+            return data;
+
+        self._framesSinceKeyframe += 1;
+
+        # Find the tiles whose mean absolute difference with the reconstructed frame exceeds the threshold
+        tileDifferences = getTilesView(cv2.absdiff(padded, self._reference), self.tileSize).mean(axis=(2, 3, 4));
+        changedTiles    = numpy.flatnonzero(tileDifferences > self.threshold);
+
+        data["kind"]    = DELTA_KIND;
+        data["tiles"]   = changedTiles.tolist();
+
+        if len(changedTiles):
+            columns = tileDifferences.shape[1];
+
+            # Compress the changed tiles at once and update the reconstructed frame
+            encodedMosaic   = encodeImage(buildMosaic(getTilesView(padded, self.tileSize)[changedTiles // columns, changedTiles % columns]), self.codecName, self.quality);
+            decodedTiles    = splitMosaic(decodeImage(encodedMosaic), len(changedTiles), self.tileSize);
+
+            getTilesView(self._reference, self.tileSize)[changedTiles // columns, changedTiles % columns] = decodedTiles;
+
+            data["img"] = packImageBytes(encodedMosaic, self.binary);
+
+        return data;
+
+
+class TileDeltaDecoder(object):
+    """
+        Decoder reconstructing the frames of each device into a persistent canvas.
+
+        The payloads of a given device have to be decoded in order, but
+        different devices can be decoded concurrently.
+    """
+
+    def __init__(self):
+        """
+            Initialize the decoder.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self._canvases = {};
+
+    def decodePayload(self, device, data):
+        """
+            Apply a device event payload created by TileDeltaEncoder to the canvas of the device.
+
+            Args:
+                device: A string instance identifying the device which sent the payload.
+                data:   A dictionary instance representing the device event payload.
+
+            Returns:
+                A numpy.ndarray instance representing a copy of the reconstructed frame.
+
+            Raises:
+                KeyframeRequiredError if the payload is a delta which does not follow the previous frame.
+                ValueError if the payload does not contain a valid image.
+        """
+        sequenceNumber  = data["seq"];
+        height, width   = data["shape"];
+        tileSize        = data["tile"];
+
+        if data["kind"] == KEYFRAME_KIND:
+            canvas = padImage(decodeImage(unpackImageBytes(data["img"])), tileSize);
+        else:
+            previousSequenceNumber, canvas = self._canvases.pop(device, (None, None));
+
+            if canvas is None or sequenceNumber != previousSequenceNumber + 1:
+                raise KeyframeRequiredError("Missing frame before delta frame %d." % sequenceNumber);
+
+            tiles = data["tiles"];
+
+            if tiles:
+                tiles   = numpy.asarray(tiles);
+                columns = canvas.shape[1] // tileSize;
+
+                getTilesView(canvas, tileSize)[tiles // columns, tiles % columns] = splitMosaic(decodeImage(unpackImageBytes(data["img"])), len(tiles), tileSize);
+
+        self._canvases[device] = (sequenceNumber, canvas);
+
+        return canvas[:height, :width].copy();
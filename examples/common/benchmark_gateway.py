@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir));
+
+from common.gateway_publisher import AttachedDevice, parseAttachedDevices
+from common.mqtt_lite import MqttBroker
+from common.runtime import initDeviceClient, initGatewayClient
+from common.windowed_publisher import QOS_LEVELS, openDeviceClientPublisher, openGatewayClientPublisher
+
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+# Gateway and devices publishing the benchmark events
+ORGANIZATION_ID     = "local";
+GATEWAY_TYPE        = "benchmark-gateway";
+GATEWAY_ID          = "gateway";
+DEVICE_TYPE         = "benchmark";
+DEVICE_ID_PREFIX    = "sensor-";
+DEVICE_EVENT_NAME   = "reading";
+
+# Scenarios run in a child process: a device client per device, or a gateway client for all the devices
+DEVICE_MODE     = "devices";
+GATEWAY_MODE    = "gateway";
+
+DEFAULT_DEVICE_COUNTS = [100, 1000];
+
+# Maximum number of device clients of a child process. The network loop of the MQTT client uses select(), which
+# does not handle the file descriptors above 1023, and each client holds a socket and a socket pair, hence a
+# process cannot connect more than about 340 clients.
+MAX_CLIENTS_PER_PROCESS = 250;
+
+# Maximum number of seconds to wait for the connections of a scenario to be closed before the next one
+DISCONNECTION_TIMEOUT = 30.0;
+
+# Number of seconds between two polls of the broker connection count
+POLL_INTERVAL = 0.01;
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def startBroker():
+    """
+        Start the in-process broker on a free port, in a background event loop.
+
+        Args:
+            None.
+
+        Returns:
+            A (MqttBroker instance, asyncio event loop, threading.Thread instance, port) tuple.
+
+        Raises:
+            OSError if the broker could not listen.
+    """
+    broker  = MqttBroker();
+    loop    = asyncio.new_event_loop();
+    port    = loop.run_until_complete(broker.start("127.0.0.1", 0));
+
+    brokerThread = threading.Thread(target=loop.run_forever, name="broker");
+    brokerThread.daemon = True;
+    brokerThread.start();
+
+    return broker, loop, brokerThread, port;
+
+def runScenario(mode, deviceCount, shard, shardCount, brokerPort):
+    """
+        Connect the clients of a scenario, publish an event per device at the requested rate for the
+        requested duration, and measure the connection time, CPU time, threads and memory of the process.
+
+        Args:
+            mode:           DEVICE_MODE or GATEWAY_MODE.
+            deviceCount:    An integer representing the number of devices of the scenario.
+            shard:          An integer representing the index of the shard of the devices run by the process.
+            shardCount:     An integer representing the number of processes the devices are sharded across.
+            brokerPort:     An integer representing the port of the broker.
+
+        Returns:
+            A dictionary instance representing the measures.
+
+        Raises:
+            None.
+    """
+    broker      = "127.0.0.1:%d" % brokerPort;
+    devices     = parseAttachedDevices(["%s:%s*%d" % (DEVICE_TYPE, DEVICE_ID_PREFIX, deviceCount)])[shard::shardCount];
+    clients     = [];
+    publishers  = [];
+    startTime   = time.monotonic();
+    startCpu    = time.process_time();
+
+    if mode == GATEWAY_MODE:
+        client      = initGatewayClient(ORGANIZATION_ID, GATEWAY_TYPE, GATEWAY_ID, "token", "token", broker);
+
+        client.connect();
+
+        publisher   = openGatewayClientPublisher(client, 0, options.qos);
+
+        clients.append(client);
+        publishers.append(publisher);
+
+        devicePublishers = [AttachedDevice(publisher, deviceType, deviceId) for deviceType, deviceId in devices];
+    else:
+        for deviceType, deviceId in devices:
+            client = initDeviceClient(ORGANIZATION_ID, deviceType, deviceId, "token", "token", broker);
+
+            client.connect();
+
+            clients.append(client);
+            publishers.append(openDeviceClientPublisher(client, 0, options.qos));
+
+        devicePublishers = publishers;
+
+    connectTime = time.monotonic() - startTime;
+    connectCpu  = time.process_time() - startCpu;
+    threadCount = threading.active_count();
+
+    # Publish a reading per device every tick, at absolute deadlines so that a slow tick does not delay the next ones
+    data        = {"data" : "x" * options.payloadSize};
+    startTime   = time.monotonic();
+    startCpu    = time.process_time();
+    endTime     = startTime + options.duration;
+
+    for tick in itertools.count():
+        deadline = startTime + tick / options.rate;
+
+        if deadline >= endTime:
+            break;
+
+        time.sleep(max(0.0, deadline - time.monotonic()));
+
+        for devicePublisher in devicePublishers:
+            devicePublisher.publishEvent(DEVICE_EVENT_NAME, "json", data);
+
+    for publisher in publishers:
+        publisher.flush();
+
+    elapsedTime = time.monotonic() - startTime;
+    steadyCpu   = time.process_time() - startCpu;
+
+    result = {
+        "connectTime"   : connectTime,
+        "connectCpu"    : connectCpu,
+        "steadyCpu"     : steadyCpu,
+        "elapsedTime"   : elapsedTime,
+        "threads"       : threadCount,
+        "maxRssKb"      : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "published"     : sum(publisher.publishedCount for publisher in publishers),
+        "acknowledged"  : sum(publisher.acknowledgedCount for publisher in publishers)
+    };
+
+    for client in clients:
+        client.disconnect();
+
+    return result;
+
+def measureScenario(mode, deviceCount, broker, brokerPort):
+    """
+        Run a scenario in child processes, the device clients being sharded across as many processes as
+        needed, and measure the peak number of broker connections meanwhile.
+
+        Args:
+            mode:           DEVICE_MODE or GATEWAY_MODE.
+            deviceCount:    An integer representing the number of devices.
+            broker:         The MqttBroker instance the child processes connect to.
+            brokerPort:     An integer representing the port of the broker.
+
+        Returns:
+            A dictionary instance representing the measures summed over the child processes, the longest
+            connection time and the peak number of connections, or None if the scenario failed.
+
+        Raises:
+            None.
+    """
+    # Start from a broker without connections, those of the previous scenario being closed asynchronously
+    endTime = time.monotonic() + DISCONNECTION_TIMEOUT;
+
+    while broker.connectionCount and time.monotonic() < endTime:
+        time.sleep(POLL_INTERVAL);
+
+    shardCount  = 1 if mode == GATEWAY_MODE else -(-deviceCount // MAX_CLIENTS_PER_PROCESS);
+    processes   = [];
+
+    # The clients log to stderr, and the child processes only write their measures to stdout
+    for shard in range(shardCount):
+        command = [sys.executable, os.path.abspath(__file__), "--mode", mode, "--devices", str(deviceCount),
+                   "--shard", str(shard), "--shards", str(shardCount), "--broker-port", str(brokerPort),
+                   "--rate", str(options.rate), "--duration", str(options.duration), "--qos", str(options.qos),
+                   "--payload-size", str(options.payloadSize)];
+
+        processes.append(subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL));
+
+    peakConnections = 0;
+
+    while any(process.poll() is None for process in processes):
+        peakConnections = max(peakConnections, broker.connectionCount);
+
+        time.sleep(POLL_INTERVAL);
+
+    results = [];
+
+    for process in processes:
+        output = process.stdout.read().decode("utf-8").strip();
+
+        process.stdout.close();
+
+        if process.returncode != 0 or not output:
+            print("The %s scenario with %d devices failed with exit code %d." % (mode, deviceCount, process.returncode));
+
+            return None;
+
+        results.append(json.loads(output.splitlines()[-1]));
+
+    result = {"processes" : shardCount, "connections" : peakConnections};
+
+    for key in ("connectTime", "elapsedTime"):
+        result[key] = max(shardResult[key] for shardResult in results);
+
+    for key in ("connectCpu", "steadyCpu", "threads", "maxRssKb", "published", "acknowledged"):
+        result[key] = sum(shardResult[key] for shardResult in results);
+
+    return result;
+
+def estimateProcessPerDevice(result, deviceCount):
+    """
+        Estimate the cost of a process per device from the measures of a single device process.
+
+        Args:
+            result:         A dictionary instance representing the measures of the single device process.
+            deviceCount:    An integer representing the number of devices.
+
+        Returns:
+            A dictionary instance representing the measures of deviceCount such processes.
+
+        Raises:
+            None.
+    """
+    estimate = dict(result);
+
+    for key in ("connectCpu", "steadyCpu", "threads", "maxRssKb", "published", "acknowledged", "processes", "connections"):
+        estimate[key] = result[key] * deviceCount;
+
+    return estimate;
+
+def printResult(deviceCount, label, result):
+    """Print a row of the comparison table."""
+    print("%-8d %-22s %9d %11d %8d %10.2f %11.2f %8.1f %12.3f %9.1f %10d" % (
+        deviceCount, label, result["processes"], result["connections"], result["threads"], result["connectTime"], result["connectCpu"],
+        100.0 * result["steadyCpu"] / result["elapsedTime"], 1000.0 * result["steadyCpu"] / max(result["published"], 1),
+        result["maxRssKb"] / 1024.0, result["acknowledged"]
+    ));
+
+def parseCommandLineOptions():
+    """
+        Parse the given command line options.
+
+        Args:
+            None.
+
+        Returns:
+            options: A argparse.Namespace instance representing the parsed command line options.
+
+        Raises:
+            argparse.error if one of the command line options is invalid.
+    """
+    parser = argparse.ArgumentParser(description="Compare the connections, CPU time and memory of a process per device, "
+                                                 "of a device client per device and of a gateway client publishing on "
+                                                 "behalf of all the devices.");
+
+    parser.add_argument("--devices", action="store", type=int, nargs="+", default=DEFAULT_DEVICE_COUNTS, dest="deviceCounts");
+    parser.add_argument("--rate", action="store", type=float, default=1.0, dest="rate");
+    parser.add_argument("--duration", action="store", type=float, default=10.0, dest="duration");
+    parser.add_argument("--qos", action="store", type=int, choices=QOS_LEVELS, default=0, dest="qos");
+    parser.add_argument("--payload-size", action="store", type=int, default=64, dest="payloadSize");
+
+    # Scenario run by a child process
+    parser.add_argument("--mode", action="store", choices=(DEVICE_MODE, GATEWAY_MODE), default=None, dest="mode");
+    parser.add_argument("--shard", action="store", type=int, default=0, dest="shard");
+    parser.add_argument("--shards", action="store", type=int, default=1, dest="shardCount");
+    parser.add_argument("--broker-port", action="store", type=int, default=0, dest="brokerPort");
+
+    # Parse command line options
+    options = parser.parse_args();
+
+    if any(deviceCount < 1 for deviceCount in options.deviceCounts):
+        parser.error("The numbers of devices should be positive.");
+
+    if options.rate <= 0 or options.duration <= 0:
+        parser.error("The rate and the duration should be positive.");
+
+    return options;
+
+
+# -----------------------------------------------------------------------------
+# Main
+# -----------------------------------------------------------------------------
+
+# Parse command line options
+options = parseCommandLineOptions();
+
+# Run a scenario, writing its measures as the last line of the output
+if options.mode is not None:
+    with open(os.devnull, "w") as devNull, contextlib.redirect_stdout(devNull):
+        result = runScenario(options.mode, options.deviceCounts[0], options.shard, options.shardCount, options.brokerPort);
+
+    print(json.dumps(result));
+
+    sys.exit(0);
+
+broker, brokerLoop, brokerThread, brokerPort = startBroker();
+
+print("Publishing %g events/s per device for %g s at QoS %d." % (options.rate, options.duration, options.qos));
+
+# A process per device is estimated from a single device process, since running a thousand interpreters takes a
+# thousand times the memory of one
+singleDeviceResult = measureScenario(DEVICE_MODE, 1, broker, brokerPort);
+
+print("%-8s %-22s %9s %11s %8s %10s %11s %8s %12s %9s %10s" % ("devices", "mode", "processes", "connections", "threads",
+                                                                "connect s", "connect cpu", "cpu %", "cpu ms/event",
+                                                                "rss MB", "acked"));
+
+for deviceCount in options.deviceCounts:
+    if singleDeviceResult is not None:
+        printResult(deviceCount, "process per device (*)", estimateProcessPerDevice(singleDeviceResult, deviceCount));
+
+    for mode, label in ((DEVICE_MODE, "client per device"), (GATEWAY_MODE, "gateway")):
+        result = measureScenario(mode, deviceCount, broker, brokerPort);
+
+        if result is not None:
+            printResult(deviceCount, label, result);
+
+print("(*) estimated from a single device process; the connection time is that of one process, the processes "
+      "starting in parallel.");
+
+asyncio.run_coroutine_threadsafe(broker.stop(), brokerLoop).result();
+
+brokerLoop.call_soon_threadsafe(brokerLoop.stop);
+brokerThread.join();
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+import argparse
+import base64
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir));
+
+from common.message_codecs import MESSAGE_CODECS
+
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+# Seed used to generate the fixed payloads
+TEST_PAYLOADS_SEED = 42;
+
+# Number of numbers of a batch event, as sent by send_random_numbers_to_wiotp.py --batch-size
+DEFAULT_BATCH_SIZE = 100;
+
+# Sizes of the compressed images: a webcam frame scaled down by 10 as sent by
+# send_images_to_wiotp.py, and a full 640x480 frame
+DEFAULT_IMAGE_SIZES = [2048, 40960];
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def getTestPayloads(batchSize, imageSizes):
+    """
+        Get the payload shapes of the sample applications.
+
+        Compressed images are incompressible, hence they are simulated by
+        random bytes of the same size.
+
+        Args:
+            batchSize:  An integer representing the number of numbers of a batch event.
+            imageSizes: A list of integers representing the sizes of the compressed images in bytes.
+
+        Returns:
+            A list of (name, structured data, bytes data) tuples. The bytes data is the compressed
+            image sent by the raw format, or None for the shapes the raw format cannot carry.
+
+        Raises:
+            None.
+    """
+    randomState = random.Random(TEST_PAYLOADS_SEED);
+
+    payloads = [
+        ("number", {"number" : randomState.randint(0, 1000000)}, None),
+        ("batch-%d" % batchSize, {
+            "numbers"   : [randomState.randint(0, 1000000) for _ in range(batchSize)],
+            "t0"        : 1500000000.123,
+            "dt"        : [index * 10 for index in range(batchSize)]
+        }, None)
+    ];
+
+    for imageSize in imageSizes:
+        encodedImage = bytes(randomState.getrandbits(8) for _ in range(imageSize));
+
+        payloads.append(("image-%dKB" % (imageSize // 1024), {"img" : encodedImage, "codec" : "jpeg"}, encodedImage));
+
+    return payloads;
+
+def getCodecData(codec, structuredData, bytesData):
+    """
+        Get the data a sender would publish using a codec.
+
+        Args:
+            codec:          A MessageCodec instance.
+            structuredData: A dictionary instance whose "img" value, if any, is a bytes instance.
+            bytesData:      A bytes instance, or None.
+
+        Returns:
+            The data to encode, or None if the codec cannot carry the payload shape.
+
+        Raises:
+            None.
+    """
+    if not codec.structured:
+        return bytesData;
+
+    # JSON cannot store bytes, therefore the images are base64 encoded
+    if not codec.binary and "img" in structuredData:
+        return dict(structuredData, img=base64.b64encode(structuredData["img"]).decode("ascii"));
+
+    return structuredData;
+
+def restoreImageBytes(data):
+    """
+        Get the compressed image bytes of decoded data, as a receiver would.
+
+        Args:
+            data: The data decoded by a codec.
+
+        Returns:
+            The data, whose base64 encoded image, if any, is decoded.
+
+        Raises:
+            None.
+    """
+    if isinstance(data, dict) and isinstance(data.get("img"), str):
+        data["img"] = base64.b64decode(data["img"]);
+
+    return data;
+
+def timeCall(function, number, repeat):
+    """
+        Get the best execution time of a function.
+
+        Args:
+            function:   A callable taking no arguments.
+            number:     An integer representing the number of calls per timed execution.
+            repeat:     An integer representing the number of timed executions.
+
+        Returns:
+            A float representing the best execution time of a call in microseconds.
+
+        Raises:
+            None.
+    """
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number * 1e6;
+
+def parseCommandLineOptions():
+    """
+        Parse the given command line options.
+
+        Args:
+            None.
+
+        Returns:
+            options: A argparse.Namespace instance representing the parsed command line options.
+
+        Raises:
+            argparse.error if one of the command line options is invalid.
+    """
+    parser = argparse.ArgumentParser(description="Report payload size and encode/decode time per device event format.");
+
+    parser.add_argument("-f", "--formats", action="store", nargs="+", choices=sorted(MESSAGE_CODECS), default=sorted(MESSAGE_CODECS), dest="formats");
+    parser.add_argument("-b", "--batch-size", action="store", type=int, default=DEFAULT_BATCH_SIZE, dest="batchSize");
+    parser.add_argument("-s", "--image-sizes", action="store", nargs="+", type=int, default=DEFAULT_IMAGE_SIZES, dest="imageSizes");
+    parser.add_argument("-n", "--number", action="store", type=int, default=1000, dest="number");
+    parser.add_argument("-r", "--repeat", action="store", type=int, default=5, dest="repeat");
+
+    # Parse command line options
+    options = parser.parse_args();
+
+    return options;
+
+
+# -----------------------------------------------------------------------------
+# Main
+# -----------------------------------------------------------------------------
+
+# Parse command line options
+options = parseCommandLineOptions();
+
+print("%-12s %-8s %10s %12s %12s %12s" % ("payload", "format", "bytes", "encode us", "decode us", "MB/s"));
+
+for payloadName, structuredData, bytesData in getTestPayloads(options.batchSize, options.imageSizes):
+    for formatName in options.formats:
+        codec = MESSAGE_CODECS[formatName];
+
+        if not codec.isAvailable():
+            print("%-12s %-8s %s is not installed" % (payloadName, formatName, codec.moduleName));
+
+            continue;
+
+        data = getCodecData(codec, structuredData, bytesData);
+
+        if data is None:
+            continue;
+
+        payload = codec.encodePayload(data);
+
+        if not isinstance(payload, bytes):
+            payload = payload.encode("utf-8");
+
+        # The base64 conversions of the images are part of the cost of the JSON format
+        encodeTime = timeCall(lambda: codec.encodePayload(getCodecData(codec, structuredData, bytesData)), options.number, options.repeat);
+        decodeTime = timeCall(lambda: restoreImageBytes(codec.decodePayload(payload)), options.number, options.repeat);
+
+        print("%-12s %-8s %10d %12.2f %12.2f %12.1f" % (payloadName, formatName, len(payload), encodeTime, decodeTime,
+                                                         len(payload) / (encodeTime + decodeTime)));
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import sys
+import threading
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir));
+
+from common.metrics import MetricsRegistry
+
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+# Event rate at which the recording overhead is reported
+DEFAULT_EVENT_RATE = 10000;
+
+# Maximum fraction of a core the recording of the metrics may use at the event rate
+DEFAULT_OVERHEAD_BUDGET = 0.02;
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def createHotPathFunctions(registry):
+    """
+        Get functions recording the metrics of a published and of a received event,
+        as the windowed publisher, the message codecs and the event dispatcher do.
+
+        Args:
+            registry: A MetricsRegistry instance.
+
+        Returns:
+            A dictionary instance mapping a name to a callable without argument.
+
+        Raises:
+            None.
+    """
+    eventsPublished = registry.counter("wiotp_events_published_total", "Device events published.", ("event",));
+    eventsReceived  = registry.counter("wiotp_events_received_total", "Device events received.", ("event",));
+    payloadBytes    = registry.counter("wiotp_payload_bytes_total", "Payload bytes.", ("direction", "format"));
+    stageDuration   = registry.histogram("wiotp_stage_duration_seconds", "Stage durations.", ("stage",));
+
+    publishDuration     = stageDuration.labels("publish");
+    ackDuration         = stageDuration.labels("acknowledge");
+    callbackDuration    = stageDuration.labels("callback");
+
+    def recordPublishedEvent():
+        """Record the metrics of a published event."""
+        payloadBytes.labels("out", "json").inc(120);
+        publishDuration.observe(2.5e-5);
+        eventsPublished.labels("event").inc();
+        ackDuration.observe(4e-4);
+
+    def recordReceivedEvent():
+        """Record the metrics of a received event."""
+        eventsReceived.labels("event").inc();
+        payloadBytes.labels("in", "json").inc(120);
+        callbackDuration.observe(1.5e-5);
+
+    noOperation = lambda: None;
+
+    return {
+        "no-op call"        : noOperation,
+        "counter inc"       : eventsPublished.labels("event").inc,
+        "labels + inc"      : lambda: eventsPublished.labels("event").inc(),
+        "histogram observe" : lambda: callbackDuration.observe(1.5e-5),
+        "wrapped call"      : stageDuration.labels("wrapped").wrap(noOperation),
+        "published event"   : recordPublishedEvent,
+        "received event"    : recordReceivedEvent
+    };
+
+def measureCallTime(function, repeat):
+    """
+        Measure the best time per call of a function.
+
+        Args:
+            function:   A callable without argument.
+            repeat:     An integer representing the number of calls per measurement.
+
+        Returns:
+            A float representing the number of seconds per call.
+
+        Raises:
+            None.
+    """
+    return min(timeit.repeat(function, number=repeat, repeat=5)) / repeat;
+
+def measureContendedRate(function, threadCount, duration):
+    """
+        Measure the total number of calls per second of a function called concurrently by several threads.
+
+        Args:
+            function:       A callable without argument.
+            threadCount:    An integer representing the number of threads.
+            duration:       A float representing the number of seconds of the measurement.
+
+        Returns:
+            A float representing the number of calls per second.
+
+        Raises:
+            None.
+    """
+    callCounts  = [0] * threadCount;
+    stopEvent   = threading.Event();
+
+    def callRepeatedly(index):
+        """Call the function until the measurement is over."""
+        count = 0;
+
+        while not stopEvent.is_set():
+            for _ in range(100):
+                function();
+
+            count += 100;
+
+        callCounts[index] = count;
+
+    threads = [threading.Thread(target=callRepeatedly, args=(index,)) for index in range(threadCount)];
+
+    for thread in threads:
+        thread.start();
+
+    time.sleep(duration);
+    stopEvent.set();
+
+    for thread in threads:
+        thread.join();
+
+    return sum(callCounts) / duration;
+
+def parseCommandLineOptions():
+    """
+        Parse the given command line options.
+
+        Args:
+            None.
+
+        Returns:
+            options: A argparse.Namespace instance representing the parsed command line options.
+
+        Raises:
+            argparse.error if one of the command line options is invalid.
+    """
+    parser = argparse.ArgumentParser(description="Measure the cost of recording the metrics of the sample applications.");
+
+    parser.add_argument("-n", "--repeat", action="store", type=int, default=100000, dest="repeat");
+    parser.add_argument("-r", "--rate", action="store", type=int, default=DEFAULT_EVENT_RATE, dest="eventRate");
+    parser.add_argument("--budget", action="store", type=float, default=DEFAULT_OVERHEAD_BUDGET, dest="overheadBudget");
+    parser.add_argument("--threads", action="store", type=int, default=4, dest="threadCount");
+    parser.add_argument("--duration", action="store", type=float, default=1.0, dest="duration");
+
+    # Parse command line options
+    options = parser.parse_args();
+
+    return options;
+
+
+# -----------------------------------------------------------------------------
+# Main
+# -----------------------------------------------------------------------------
+
+# Parse command line options
+options = parseCommandLineOptions();
+
+registry            = MetricsRegistry();
+hotPathFunctions    = createHotPathFunctions(registry);
+callTimes           = {};
+
+# Cost of each recording operation, and of the whole recording of a published and a received event
+print("%-20s %12s" % ("operation", "ns per call"));
+
+for name, function in hotPathFunctions.items():
+    callTimes[name] = measureCallTime(function, options.repeat);
+
+    print("%-20s %12.0f" % (name, 1e9 * callTimes[name]));
+
+# Fraction of a core spent recording the metrics at the event rate, by a sender and by a receiver
+print("");
+
+isWithinBudget = True;
+
+for name in ("published event", "received event"):
+    overhead        = callTimes[name] * options.eventRate;
+    isWithinBudget  = isWithinBudget and overhead <= options.overheadBudget;
+
+    print("%s metrics at %d events/s: %.3f%% of a core (budget %.1f%%)" % (
+        name.capitalize(), options.eventRate, 100.0 * overhead, 100.0 * options.overheadBudget));
+
+# Throughput of the recording when the dispatcher shards record concurrently
+contendedRate = measureContendedRate(hotPathFunctions["received event"], options.threadCount, options.duration);
+
+print("Received event metrics recorded by %d threads: %.0f events/s" % (options.threadCount, contendedRate));
+
+# Cost of a scrape of the endpoint
+renderTime = measureCallTime(registry.render, 100);
+
+print("Rendering %d bytes of metrics: %.2f ms" % (len(registry.render()), 1000.0 * renderTime));
+
+if not isWithinBudget:
+    sys.exit(1);
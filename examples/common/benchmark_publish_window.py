@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir));
+
+from common.latency import getPercentile
+from common.mqtt_lite import MqttBroker
+from common.runtime import initDeviceClient
+from common.windowed_publisher import DEFAULT_ACK_TIMEOUT, QOS_LEVELS, openDeviceClientPublisher
+
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+# Device publishing the benchmark events
+ORGANIZATION_ID     = "local";
+DEVICE_TYPE         = "benchmark";
+DEVICE_ID           = "publisher";
+DEVICE_EVENT_NAME   = "window";
+
+# Default number of events in flight of the MQTT client, restored for the runs without window
+CLIENT_MAX_INFLIGHT = 20;
+
+DEFAULT_WINDOW_SIZES = [0, 1, 8, 64, 256];
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def startBroker(bandwidthLimit):
+    """
+        Start the in-process broker on a free port, in a background event loop.
+
+        Args:
+            bandwidthLimit: An integer representing the maximum number of bytes per second read from the
+                            client, 0 for no limit.
+
+        Returns:
+            A (MqttBroker instance, asyncio event loop, threading.Thread instance, port) tuple.
+
+        Raises:
+            OSError if the broker could not listen.
+    """
+    broker  = MqttBroker(bandwidthLimit);
+    loop    = asyncio.new_event_loop();
+    port    = loop.run_until_complete(broker.start("127.0.0.1", 0));
+
+    brokerThread = threading.Thread(target=loop.run_forever, name="broker");
+    brokerThread.daemon = True;
+    brokerThread.start();
+
+    return broker, loop, brokerThread, port;
+
+def runWindow(deviceClient, qos, windowSize, eventCount, data):
+    """
+        Publish events as fast as the window allows and wait for their acknowledgements.
+
+        Args:
+            deviceClient:   A connected ibmiotf.device.Client instance.
+            qos:            An integer representing the quality of service of the events.
+            windowSize:     An integer representing the maximum number of events in flight, 0 for no limit.
+            eventCount:     An integer representing the number of events to publish.
+            data:           A dictionary instance representing the device event payload.
+
+        Returns:
+            A (WindowedPublisher instance, elapsed seconds, peak number of packets queued by the client) tuple.
+
+        Raises:
+            None.
+    """
+    deviceClient.client.max_inflight_messages_set(windowSize or CLIENT_MAX_INFLIGHT);
+
+    publisher       = openDeviceClientPublisher(deviceClient, windowSize, qos, DEFAULT_ACK_TIMEOUT);
+    queuedPackets   = getattr(deviceClient.client, "_out_packet", ());
+    peakQueued      = 0;
+    startTime       = time.monotonic();
+
+    for _ in range(eventCount):
+        publisher.publishEvent(DEVICE_EVENT_NAME, "json", data);
+
+        peakQueued = max(peakQueued, len(queuedPackets));
+
+    publisher.flush();
+
+    return publisher, time.monotonic() - startTime, peakQueued;
+
+def parseCommandLineOptions():
+    """
+        Parse the given command line options.
+
+        Args:
+            None.
+
+        Returns:
+            options: A argparse.Namespace instance representing the parsed command line options.
+
+        Raises:
+            argparse.error if one of the command line options is invalid.
+    """
+    parser = argparse.ArgumentParser(description="Measure the throughput, acknowledgement latency and blocked time of "
+                                                 "the windowed publisher for several window sizes.");
+
+    parser.add_argument("-n", "--events", action="store", type=int, default=5000, dest="eventCount");
+    parser.add_argument("--payload-size", action="store", type=int, default=256, dest="payloadSize");
+    parser.add_argument("--qos", action="store", type=int, nargs="+", choices=QOS_LEVELS, default=list(QOS_LEVELS), dest="qosLevels");
+    parser.add_argument("--windows", action="store", type=int, nargs="+", default=DEFAULT_WINDOW_SIZES, dest="windowSizes");
+    parser.add_argument("--bandwidth-limit", action="store", type=int, default=0, dest="bandwidthLimit");
+
+    # Parse command line options
+    options = parser.parse_args();
+
+    if any(windowSize < 0 for windowSize in options.windowSizes):
+        parser.error("The window sizes should not be negative.");
+
+    return options;
+
+
+# -----------------------------------------------------------------------------
+# Main
+# -----------------------------------------------------------------------------
+
+# Parse command line options
+options = parseCommandLineOptions();
+
+# Connect a device client to the in-process broker
+broker, brokerLoop, brokerThread, brokerPort = startBroker(options.bandwidthLimit);
+
+deviceClient = initDeviceClient(ORGANIZATION_ID, DEVICE_TYPE, DEVICE_ID, "token", "token", "127.0.0.1:%d" % brokerPort);
+
+deviceClient.connect();
+
+data = {"data" : "x" * options.payloadSize};
+
+print("%-4s %-10s %12s %10s %10s %10s %12s %14s" % ("qos", "window", "events/s", "p50 ms", "p99 ms", "max ms", "blocked %",
+                                                    "peak queued"));
+
+for qos in options.qosLevels:
+    for windowSize in options.windowSizes:
+        publisher, elapsedTime, peakQueued = runWindow(deviceClient, qos, windowSize, options.eventCount, data);
+
+        # The percentiles are those of the last acknowledgements, which reflect the steady state
+        latencies = publisher.getAckLatencies() or [0.0];
+
+        print("%-4d %-10s %12.0f %10.2f %10.2f %10.2f %12.1f %14d" % (
+            qos, windowSize or "unlimited", publisher.acknowledgedCount / elapsedTime,
+            1000.0 * getPercentile(latencies, 50), 1000.0 * getPercentile(latencies, 99), 1000.0 * latencies[-1],
+            100.0 * publisher.blockedTime / elapsedTime, peakQueued
+        ));
+
+        if publisher.acknowledgedCount != options.eventCount:
+            print(publisher.getStatisticsReport());
+
+deviceClient.disconnect();
+
+asyncio.run_coroutine_threadsafe(broker.stop(), brokerLoop).result();
+
+brokerLoop.call_soon_threadsafe(brokerLoop.stop);
+brokerThread.join();
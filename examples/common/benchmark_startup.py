@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir));
+
+from common.mqtt_lite import MqttBroker
+
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir);
+
+# Entry points of the sample applications: name, path relative to the examples folder and client type
+ENTRY_POINTS = [
+    ("starter-send",    "example_starter/python/send_data_to_wiotp.py",             "device"),
+    ("starter-receive", "example_starter/python/receive_data_from_wiotp.py",        "application"),
+    ("numbers-send",    "01_random_number/send_random_numbers_to_wiotp.py",         "device"),
+    ("numbers-receive", "01_random_number/receive_random_numbers_from_wiotp.py",     "application"),
+    ("images-send",     "02_images_from_webcam/send_images_to_wiotp.py",            "device"),
+    ("images-receive",  "02_images_from_webcam/receive_images_from_wiotp.py",       "application")
+];
+
+# Command line options identifying the clients on the local broker
+CLIENT_ARGUMENTS = {
+    "device"        : ["-o", "local", "-t", "benchmark", "-i", "device", "-m", "token", "-a", "token",
+                       "-e", "event", "-f", "json"],
+    "application"   : ["-o", "local", "-p", "benchmark", "-m", "apikey", "-k", "a-local-key", "-a", "token",
+                       "-t", "benchmark", "-i", "device", "-e", "event", "-f", "json"]
+};
+
+# Number of seconds between two polls of the broker connection count
+POLL_INTERVAL = 0.001;
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def measureCommandTime(command):
+    """
+        Measure the wall time of a command run to completion.
+
+        Args:
+            command: A list of strings representing the command.
+
+        Returns:
+            A float representing the number of seconds, or None if the command failed.
+
+        Raises:
+            None.
+    """
+    startTime   = time.perf_counter();
+    returnCode  = subprocess.call(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL);
+
+    if returnCode != 0:
+        return None;
+
+    return time.perf_counter() - startTime;
+
+async def measureConnectTime(command, broker, timeout):
+    """
+        Measure the time from the start of an entry point to its connection to the broker.
+
+        Args:
+            command:    A list of strings representing the command starting the entry point.
+            broker:     A MqttBroker instance the entry point connects to.
+            timeout:    A float representing the maximum number of seconds to wait for the connection.
+
+        Returns:
+            A float representing the number of seconds, or None if the entry point did not connect.
+
+        Raises:
+            None.
+    """
+    connectionCount = broker.connectionCount;
+    startTime       = time.perf_counter();
+    process         = await asyncio.create_subprocess_exec(*command, stdin=subprocess.PIPE,
+                                                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL);
+    connectTime     = None;
+
+    while time.perf_counter() - startTime < timeout and process.returncode is None:
+        if broker.connectionCount > connectionCount:
+            connectTime = time.perf_counter() - startTime;
+
+            break;
+
+        await asyncio.sleep(POLL_INTERVAL);
+
+    # Ask the entry point to quit, then kill it if it does not
+    if process.returncode is None:
+        try:
+            process.stdin.write(b"q\n");
+            process.stdin.close();
+
+            await asyncio.wait_for(process.wait(), 2.0);
+        except (asyncio.TimeoutError, ConnectionError):
+            process.kill();
+
+            await process.wait();
+
+    # Wait for the broker to notice the disconnection
+    while broker.connectionCount > connectionCount and time.perf_counter() - startTime < timeout + 5.0:
+        await asyncio.sleep(POLL_INTERVAL);
+
+    return connectTime;
+
+def formatMilliseconds(values):
+    """
+        Format the median and minimum of durations given in seconds.
+
+        Args:
+            values: A list of floats, which may contain None for failed runs.
+
+        Returns:
+            A string instance.
+
+        Raises:
+            None.
+    """
+    values = [value for value in values if value is not None];
+
+    if not values:
+        return "failed";
+
+    return "%.0f (min %.0f)" % (1000 * statistics.median(values), 1000 * min(values));
+
+async def runBenchmark(options):
+    """
+        Measure the startup time of the selected entry points and print a table.
+
+        Args:
+            options: A argparse.Namespace instance representing the parsed command line options.
+
+        Returns:
+            None.
+
+        Raises:
+            None.
+    """
+    broker  = MqttBroker();
+    port    = await broker.start("127.0.0.1", 0);
+
+    baseline = [measureCommandTime([sys.executable, "-c", "pass"]) for _ in range(options.repeat)];
+
+    print("Python interpreter startup: %s ms" % formatMilliseconds(baseline));
+    print("%-16s %20s %20s %20s" % ("entry point", "--help ms", "imports ms", "connected ms"));
+
+    for name, path, clientType in ENTRY_POINTS:
+        if options.entryPoints and name not in options.entryPoints:
+            continue;
+
+        script      = os.path.normpath(os.path.join(EXAMPLES_DIR, path));
+        helpTimes   = [measureCommandTime([sys.executable, script, "--help"]) for _ in range(options.repeat)];
+        importTimes = [helpTime - statistics.median(baseline) if helpTime is not None else None for helpTime in helpTimes];
+        connectTimes = [];
+
+        if not options.skipConnect:
+            command = [sys.executable, script, "--broker", "127.0.0.1:%d" % port] + CLIENT_ARGUMENTS[clientType];
+
+            for _ in range(options.repeat):
+                connectTimes.append(await measureConnectTime(command, broker, options.timeout));
+
+        print("%-16s %20s %20s %20s" % (name, formatMilliseconds(helpTimes), formatMilliseconds(importTimes),
+                                        formatMilliseconds(connectTimes) if connectTimes else "-"));
+
+    await broker.stop();
+
+def parseCommandLineOptions():
+    """
+        Parse the given command line options.
+
+        Args:
+            None.
+
+        Returns:
+            options: A argparse.Namespace instance representing the parsed command line options.
+
+        Raises:
+            argparse.error if one of the command line options is invalid.
+    """
+    parser = argparse.ArgumentParser(description="Measure the startup time of the sample application entry points.");
+
+    parser.add_argument("-r", "--repeat", action="store", type=int, default=5, dest="repeat");
+    parser.add_argument("--timeout", action="store", type=float, default=10.0, dest="timeout");
+    parser.add_argument("--entry-points", action="store", nargs="+", choices=[entryPoint[0] for entryPoint in ENTRY_POINTS],
+                        default=None, dest="entryPoints");
+    parser.add_argument("--skip-connect", action="store_true", default=False, dest="skipConnect");
+
+    # Parse command line options
+    options = parser.parse_args();
+
+    return options;
+
+
+# -----------------------------------------------------------------------------
+# Main
+# -----------------------------------------------------------------------------
+
+# Parse command line options
+options = parseCommandLineOptions();
+
+# Measure the startup time of the entry points
+asyncio.run(runBenchmark(options));
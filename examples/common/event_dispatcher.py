@@ -0,0 +1,587 @@
+import bisect
+import collections
+import itertools
+import threading
+import time
+import zlib
+
+from common.latency import getHistogramUpperBounds
+from common.metrics import EVENTS_RECEIVED, STAGE_DURATION
+
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+# Subscription topic level matching any device type, device id, event or format
+WILDCARD = "+";
+
+DEFAULT_DISPATCH_SHARDS             = 0;
+DEFAULT_DISPATCH_QUEUE_SIZE         = 1000;
+DEFAULT_DISPATCH_REPORT_INTERVAL    = 0.0;
+
+# Back-pressure policies of the shard queues: a blocking bounded FIFO, a bounded FIFO dropping its oldest
+# event, the latest event of each device and a blocking bounded FIFO of 1 in N events of each device
+BLOCK_POLICY        = "block";
+DROP_OLDEST_POLICY  = "drop-oldest";
+LATEST_POLICY       = "latest";
+SAMPLE_POLICY       = "sample";
+
+DISPATCH_POLICIES   = (BLOCK_POLICY, DROP_OLDEST_POLICY, LATEST_POLICY, SAMPLE_POLICY);
+
+DEFAULT_DISPATCH_POLICY             = BLOCK_POLICY;
+DEFAULT_DISPATCH_SAMPLE_INTERVAL    = 10;
+
+# Maximum number of (device type, device id, event) keys whose handlers are cached, and of
+# devices whose sampling counters are kept
+HANDLER_CACHE_SIZE = 65536;
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+class DeviceEventHandlerIndex(object):
+    """
+        Index of the device event handlers registered for (device type,
+        device id, event) patterns, where each level may be the WILDCARD.
+
+        The handlers matching a key are resolved once, by looking up the eight
+        wildcard combinations of the key, and then cached, so that routing an
+        event costs a single dictionary lookup whatever the number of patterns.
+        The handlers should be registered before events are dispatched.
+    """
+
+    def __init__(self):
+        """
+            Initialize an empty index.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self._handlers  = {};
+        self._cache     = {};
+
+    def addHandler(self, handler, deviceType = WILDCARD, deviceId = WILDCARD, event = WILDCARD):
+        """
+            Register a handler for the events matching a pattern.
+
+            Args:
+                handler:    A callable taking the device event as argument.
+                deviceType: A string instance representing the device type, or WILDCARD.
+                deviceId:   A string instance representing the device id, or WILDCARD.
+                event:      A string instance representing the event name, or WILDCARD.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self._handlers.setdefault((deviceType, deviceId, event), []).append(handler);
+        self._cache.clear();
+
+    def getHandlers(self, deviceType, deviceId, event):
+        """
+            Get the handlers of the events received from a device.
+
+            Args:
+                deviceType: A string instance representing the device type.
+                deviceId:   A string instance representing the device id.
+                event:      A string instance representing the event name.
+
+            Returns:
+                A tuple of callables, those of the most specific patterns first.
+
+            Raises:
+                None.
+        """
+        key         = (deviceType, deviceId, event);
+        handlers    = self._cache.get(key);
+
+        if handlers is not None:
+            return handlers;
+
+        handlers = [];
+
+        for pattern in itertools.product((deviceType, WILDCARD), (deviceId, WILDCARD), (event, WILDCARD)):
+            for handler in self._handlers.get(pattern, []):
+                if handler not in handlers:
+                    handlers.append(handler);
+
+        handlers = tuple(handlers);
+
+        # Keep the memory bounded when events are received from many short-lived devices
+        if len(self._cache) >= HANDLER_CACHE_SIZE:
+            self._cache.clear();
+
+        self._cache[key] = handlers;
+
+        return handlers;
+
+
+class BackPressureQueue(object):
+    """
+        Bounded, thread-safe FIFO queue of device events applying a
+        back-pressure policy once the consumer falls behind:
+
+        1. BLOCK_POLICY: a full queue blocks the producer.
+        2. DROP_OLDEST_POLICY: a full queue drops its oldest event.
+        3. LATEST_POLICY: a new event replaces the queued event of the same
+           key, by default its device, keeping its place in the queue. The
+           events without key are never replaced. A full queue drops its
+           oldest event.
+        4. SAMPLE_POLICY: only the first of every sampleInterval events of a
+           device is queued, and a full queue blocks the producer. The
+           sampling is deterministic, hence the sampled events do not depend
+           on the consumer speed.
+    """
+
+    def __init__(self, policy = DEFAULT_DISPATCH_POLICY, maxSize = DEFAULT_DISPATCH_QUEUE_SIZE,
+                 sampleInterval = DEFAULT_DISPATCH_SAMPLE_INTERVAL, keyFunction = None):
+        """
+            Initialize the queue.
+
+            Args:
+                policy:         One of the DISPATCH_POLICIES.
+                maxSize:        An integer representing the maximum number of queued events.
+                sampleInterval: An integer representing the number of events of a device per sampled event.
+                keyFunction:    An optional callable taking a device event and returning the key of the events
+                                replacing each other with the LATEST_POLICY, or None if the event should not be
+                                replaced. The device of the event is used if None.
+
+            Returns:
+                None.
+
+            Raises:
+                ValueError if the policy, the size or the sample interval is invalid.
+        """
+        if policy not in DISPATCH_POLICIES:
+            raise ValueError("Unknown dispatch policy %s." % policy);
+
+        if maxSize < 1:
+            raise ValueError("The dispatch queue size should be positive.");
+
+        if sampleInterval < 1:
+            raise ValueError("The dispatch sample interval should be positive.");
+
+        self.policy         = policy;
+        self.maxSize        = maxSize;
+        self.sampleInterval = sampleInterval;
+        self.keyFunction    = keyFunction if keyFunction is not None else (lambda deviceEvent: deviceEvent.device);
+
+        self.acceptedCount  = 0;
+        self.droppedCount   = 0;
+        self.blockedCount   = 0;
+        self.maxDepth       = 0;
+
+        self._items         = collections.OrderedDict();
+        self._sampleCounts  = {};
+        self._condition     = threading.Condition(threading.Lock());
+        self._closed        = False;
+
+    def __len__(self):
+        """
+            The number of queued events.
+        """
+        return len(self._items);
+
+    def put(self, deviceEvent):
+        """
+            Queue a device event according to the policy.
+
+            Args:
+                deviceEvent: The device event.
+
+            Returns:
+                A boolean indicating whether the event was queued.
+
+            Raises:
+                None.
+        """
+        with self._condition:
+            if self.policy == SAMPLE_POLICY:
+                # Keep the memory bounded when events are received from many short-lived devices
+                if len(self._sampleCounts) >= HANDLER_CACHE_SIZE:
+                    self._sampleCounts.clear();
+
+                sampleCount                             = self._sampleCounts.get(deviceEvent.device, 0);
+                self._sampleCounts[deviceEvent.device]  = sampleCount + 1;
+
+                if sampleCount % self.sampleInterval:
+                    self.droppedCount += 1;
+
+                    return False;
+
+            key = self.keyFunction(deviceEvent) if self.policy == LATEST_POLICY else None;
+
+            if key is not None and key in self._items:
+                self._items[key]    = deviceEvent;
+                self.acceptedCount  += 1;
+                self.droppedCount   += 1;
+
+                return True;
+
+            if len(self._items) >= self.maxSize:
+                if self.policy in (BLOCK_POLICY, SAMPLE_POLICY):
+                    self.blockedCount += 1;
+
+                    while len(self._items) >= self.maxSize and not self._closed:
+                        self._condition.wait();
+                else:
+                    self._items.popitem(last=False);
+
+                    self.droppedCount += 1;
+
+            # The events without key get a key of their own, hence they are never replaced
+            self._items[key if key is not None else object()] = deviceEvent;
+
+            self.acceptedCount  += 1;
+            self.maxDepth       = max(self.maxDepth, len(self._items));
+
+            self._condition.notify_all();
+
+        return True;
+
+    def get(self):
+        """
+            Remove and return the oldest queued event, waiting for one if the queue is empty.
+
+            Args:
+                None.
+
+            Returns:
+                The device event, or None once the queue is closed and empty.
+
+            Raises:
+                None.
+        """
+        with self._condition:
+            while not self._items and not self._closed:
+                self._condition.wait();
+
+            if not self._items:
+                return None;
+
+            _, deviceEvent = self._items.popitem(last=False);
+
+            self._condition.notify_all();
+
+            return deviceEvent;
+
+    def close(self):
+        """
+            Close the queue: the queued events are still returned by get, then None.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        with self._condition:
+            self._closed = True;
+
+            self._condition.notify_all();
+
+
+class DispatchShard(object):
+    """
+        Queue and worker statistics of a shard of the dispatcher.
+    """
+
+    def __init__(self, index, eventQueue = None):
+        """
+            Initialize the shard.
+
+            Args:
+                index:      An integer representing the shard index.
+                eventQueue: An optional BackPressureQueue instance, None if the events are handled by the producer.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self.index          = index;
+        self.queue          = eventQueue;
+        self.handledCount   = 0;
+        self.unhandledCount = 0;
+        self.errorCount     = 0;
+        self.busyTime       = 0.0;
+        self.maxLatency     = 0.0;
+
+        self._lock          = threading.Lock();
+        self._upperBounds   = getHistogramUpperBounds();
+        self._histogram     = [0] * (len(self._upperBounds) + 1);
+
+    def record(self, latency, failed):
+        """
+            Record an event handled by the shard.
+
+            Args:
+                latency:    A float representing the number of seconds spent in the handlers.
+                failed:     A boolean indicating whether a handler raised an exception.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        with self._lock:
+            self.handledCount   += 1;
+            self.errorCount     += failed;
+            self.busyTime       += latency;
+            self.maxLatency     = max(self.maxLatency, latency);
+
+            self._histogram[bisect.bisect_left(self._upperBounds, latency)] += 1;
+
+    def getLatencyPercentile(self, percentile):
+        """
+            Get the upper bound of the histogram bucket holding a handler latency percentile.
+
+            Args:
+                percentile: A number between 0 and 100.
+
+            Returns:
+                A float representing the latency in seconds.
+
+            Raises:
+                None.
+        """
+        with self._lock:
+            rank        = percentile / 100.0 * self.handledCount;
+            cumulative  = 0;
+
+            for upperBound, count in zip(self._upperBounds, self._histogram):
+                cumulative += count;
+
+                if count and cumulative >= rank:
+                    return min(upperBound, self.maxLatency);
+
+            return self.maxLatency;
+
+    def getReport(self):
+        """
+            Get a one line report of the shard.
+
+            Args:
+                None.
+
+            Returns:
+                A string instance representing the report.
+
+            Raises:
+                None.
+        """
+        if self.queue is None:
+            acceptedCount, droppedCount, depth, maxDepth = self.handledCount + self.unhandledCount, 0, 0, 0;
+        else:
+            acceptedCount, droppedCount, depth, maxDepth = (self.queue.acceptedCount, self.queue.droppedCount, len(self.queue),
+                                                            self.queue.maxDepth);
+
+        return "shard %d: accepted %d, dropped %d, processed %d, queue %d (max %d), errors %d, " \
+               "latency mean %.2f ms, p50 %.2f ms, p99 %.2f ms, max %.2f ms" % (
+            self.index, acceptedCount, droppedCount, self.handledCount + self.unhandledCount, depth, maxDepth, self.errorCount,
+            1000 * self.busyTime / self.handledCount if self.handledCount else 0.0,
+            1000 * self.getLatencyPercentile(50), 1000 * self.getLatencyPercentile(99), 1000 * self.maxLatency
+        );
+
+
+class ShardedEventDispatcher(object):
+    """
+        Dispatcher of the device events received by an application client to
+        the handlers of a DeviceEventHandlerIndex.
+
+        The events are spread over shardCount worker threads by a stable hash
+        of their device, so that the events of a device are handled in order
+        while a slow device only delays the devices of its shard. The queue of
+        each shard applies the back-pressure policy once its worker falls
+        behind: the default BLOCK_POLICY blocks the MQTT network thread, which
+        slows down the delivery instead of dropping events, while the other
+        policies drop events, see BackPressureQueue. With 0 shards and the
+        BLOCK_POLICY the handlers are called on the MQTT network thread; the
+        other policies need a queue, hence they use a single shard.
+    """
+
+    def __init__(self, handlerIndex, shardCount = DEFAULT_DISPATCH_SHARDS, queueSize = DEFAULT_DISPATCH_QUEUE_SIZE,
+                 reportInterval = DEFAULT_DISPATCH_REPORT_INTERVAL, policy = DEFAULT_DISPATCH_POLICY,
+                 sampleInterval = DEFAULT_DISPATCH_SAMPLE_INTERVAL, keyFunction = None):
+        """
+            Initialize the dispatcher and start its worker threads.
+
+            Args:
+                handlerIndex:   A DeviceEventHandlerIndex instance.
+                shardCount:     An integer representing the number of worker threads.
+                queueSize:      An integer representing the maximum number of events queued per shard.
+                reportInterval: A float representing the number of seconds between two printed statistics
+                                reports, or 0 to disable the periodic reports.
+                policy:         One of the DISPATCH_POLICIES applied by the shard queues.
+                sampleInterval: An integer representing the number of events of a device per handled event
+                                with the SAMPLE_POLICY.
+                keyFunction:    An optional callable returning the key of the events replacing each other with
+                                the LATEST_POLICY, see BackPressureQueue.
+
+            Returns:
+                None.
+
+            Raises:
+                ValueError if one of the arguments is invalid.
+        """
+        if shardCount < 0:
+            raise ValueError("The number of dispatch shards should not be negative.");
+
+        if queueSize < 1:
+            raise ValueError("The dispatch queue size should be positive.");
+
+        if policy not in DISPATCH_POLICIES:
+            raise ValueError("Unknown dispatch policy %s." % policy);
+
+        # Only the blocking policy can handle the events without queue
+        if not shardCount and policy != BLOCK_POLICY:
+            shardCount = 1;
+
+        self.handlerIndex   = handlerIndex;
+        self.shardCount     = shardCount;
+        self.reportInterval = reportInterval;
+        self.policy         = policy;
+
+        self._shards        = [DispatchShard(index, BackPressureQueue(policy, queueSize, sampleInterval, keyFunction) if shardCount else None)
+                               for index in range(max(1, shardCount))];
+        self._stopEvent     = threading.Event();
+        self._callbackDuration = STAGE_DURATION.labels("callback");
+        self._threads       = [threading.Thread(target=self._handleShardEvents, args=(shard,), name="dispatch-%d" % shard.index)
+                               for shard in self._shards[:shardCount]];
+
+        if reportInterval > 0:
+            self._threads.append(threading.Thread(target=self._printReports, name="dispatch-report"));
+
+        for thread in self._threads:
+            thread.daemon = True;
+            thread.start();
+
+    def dispatch(self, deviceEvent):
+        """
+            Dispatch a device event. Meant to be used as the deviceEventCallback of the application client.
+
+            Args:
+                deviceEvent: The device event.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        EVENTS_RECEIVED.labels(deviceEvent.event).inc();
+
+        shard = self._shards[zlib.crc32(deviceEvent.device.encode("utf-8")) % len(self._shards)];
+
+        if shard.queue is None:
+            self._handle(shard, deviceEvent);
+
+            return;
+
+        shard.queue.put(deviceEvent);
+
+    def close(self):
+        """
+            Handle the queued events and stop the worker threads.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        for shard in self._shards:
+            if shard.queue is not None:
+                shard.queue.close();
+
+        self._stopEvent.set();
+
+        for thread in self._threads:
+            thread.join();
+
+        self._threads = [];
+
+    def getStatisticsReport(self):
+        """
+            Get a report of the queue depth and handler latency of each shard.
+
+            Args:
+                None.
+
+            Returns:
+                A string instance representing the report, one line per shard.
+
+            Raises:
+                None.
+        """
+        queues = [shard.queue for shard in self._shards if shard.queue is not None];
+
+        lines = ["Dispatched events (%s policy): %d handled, %d without handler, %d dropped" % (
+            self.policy, sum(shard.handledCount for shard in self._shards), sum(shard.unhandledCount for shard in self._shards),
+            sum(eventQueue.droppedCount for eventQueue in queues))];
+
+        lines += ["  " + shard.getReport() for shard in self._shards];
+
+        return "\n".join(lines);
+
+    def _handle(self, shard, deviceEvent):
+        """Call the handlers of a device event and record their latency."""
+        handlers = self.handlerIndex.getHandlers(deviceEvent.deviceType, deviceEvent.deviceId, deviceEvent.event);
+
+        if not handlers:
+            shard.unhandledCount += 1;
+
+            return;
+
+        failed      = False;
+        startTime   = time.perf_counter();
+
+        for handler in handlers:
+            try:
+                handler(deviceEvent);
+            except Exception as exception:
+                print("Failed to handle device event %s for %s: %s" % (deviceEvent.event, deviceEvent.device, str(exception)));
+
+                failed = True;
+
+        latency = time.perf_counter() - startTime;
+
+        shard.record(latency, failed);
+        self._callbackDuration.observe(latency);
+
+    def _handleShardEvents(self, shard):
+        """
+            Handle the events queued for a shard until the dispatcher is closed.
+        """
+        while True:
+            deviceEvent = shard.queue.get();
+
+            if deviceEvent is None:
+                return;
+
+            self._handle(shard, deviceEvent);
+
+    def _printReports(self):
+        """
+            Print the statistics report periodically.
+        """
+        while not self._stopEvent.wait(self.reportInterval):
+            print(self.getStatisticsReport());
@@ -0,0 +1,426 @@
+import array
+import bisect
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+
+from common.message_codecs import getMessageCodec
+
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+# File header: magic and version of the format
+EVENT_LOG_MAGIC     = b"EVLG";
+EVENT_LOG_VERSION   = 1;
+EVENT_LOG_HEADER    = struct.Struct("<4sI");
+
+# Record header: payload length, epoch timestamp in microseconds and stream id. A stream is a
+# (device, event, format) triple, defined by a record of the DEFINITION_STREAM_ID stream holding
+# its JSON encoding, the streams being numbered in the order of their definitions.
+RECORD_HEADER           = struct.Struct("<IqI");
+DEFINITION_STREAM_ID    = 0xffffffff;
+
+# Size of the write buffer of the event log files
+EVENT_LOG_BUFFER_SIZE = 1024 * 1024;
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+class EventLogWriter(object):
+    """
+        Writer appending device events to a compact binary log: a sequence of
+        length-prefixed records holding the timestamp, the stream id and the
+        payload of an event as sent on the wire. The device, event and format
+        names of a stream are only written once, hence an event costs 16
+        bytes on top of its payload.
+
+        The records are buffered and written in bulk. A record torn by a crash
+        ends the log when it is read.
+    """
+
+    def __init__(self, path):
+        """
+            Create the log file, replacing an existing file.
+
+            Args:
+                path: A string instance representing the path of the log file.
+
+            Returns:
+                None.
+
+            Raises:
+                OSError if the file cannot be created.
+        """
+        self.path           = path;
+
+        self.eventCount     = 0;
+        self.byteCount      = EVENT_LOG_HEADER.size;
+
+        self._streamIds     = {};
+        self._lock          = threading.Lock();
+        self._file          = open(path, "wb", buffering=EVENT_LOG_BUFFER_SIZE);
+
+        self._file.write(EVENT_LOG_HEADER.pack(EVENT_LOG_MAGIC, EVENT_LOG_VERSION));
+
+    def write(self, device, event, msgFormat, payload, timestamp = None):
+        """
+            Append an event to the log.
+
+            Args:
+                device:     A string instance representing the "type:id" device key.
+                event:      A string instance representing the event name.
+                msgFormat:  A string instance representing the event format.
+                payload:    A bytes or string instance representing the encoded payload.
+                timestamp:  An optional float representing the epoch timestamp of the event, now if None.
+
+            Returns:
+                None.
+
+            Raises:
+                ValueError if the log is closed.
+        """
+        if not isinstance(payload, (bytes, bytearray)):
+            payload = payload.encode("utf-8");
+
+        timestampMicroseconds = int(1e6 * (time.time() if timestamp is None else timestamp));
+
+        with self._lock:
+            streamKey   = (device, event, msgFormat);
+            streamId    = self._streamIds.get(streamKey);
+
+            if streamId is None:
+                streamId    = len(self._streamIds);
+                definition  = json.dumps(streamKey).encode("utf-8");
+
+                self._file.write(RECORD_HEADER.pack(len(definition), timestampMicroseconds, DEFINITION_STREAM_ID) + definition);
+
+                self._streamIds[streamKey]  = streamId;
+                self.byteCount              += RECORD_HEADER.size + len(definition);
+
+            self._file.write(RECORD_HEADER.pack(len(payload), timestampMicroseconds, streamId));
+            self._file.write(payload);
+
+            self.eventCount += 1;
+            self.byteCount  += RECORD_HEADER.size + len(payload);
+
+    def wrapPublishFunction(self, publishFunction, device):
+        """
+            Wrap the publishEvent function of a device client such that the published events are logged.
+
+            Args:
+                publishFunction:    A callable taking the event, format, data, QoS and on_publish callback
+                                    arguments of ibmiotf.device.Client.publishEvent.
+                device:             A string instance representing the "type:id" key of the device.
+
+            Returns:
+                A callable taking the same arguments and returning the same value as the publish function.
+
+            Raises:
+                None.
+        """
+        def publishEvent(event, msgFormat, data, qos = 0, on_publish = None):
+            """Log the event, encoded using the codec of its format, and publish it."""
+            self.write(device, event, msgFormat, getMessageCodec(msgFormat).encodePayload(data));
+
+            return publishFunction(event, msgFormat, data, qos, on_publish);
+
+        return publishEvent;
+
+    def wrapDevicePublishFunction(self, publishFunction):
+        """
+            Wrap the publishDeviceEvent function of a gateway client such that the events it publishes
+            on behalf of its devices are logged under their "type:id" keys.
+
+            Args:
+                publishFunction:    A callable taking the device type, device id, event, format, data, QoS and
+                                    on_publish callback arguments of ibmiotf.gateway.Client.publishDeviceEvent.
+
+            Returns:
+                A callable taking the same arguments and returning the same value as the publish function.
+
+            Raises:
+                None.
+        """
+        def publishDeviceEvent(deviceType, deviceId, event, msgFormat, data, qos = 0, on_publish = None):
+            """Log the event, encoded using the codec of its format, and publish it."""
+            self.write("%s:%s" % (deviceType, deviceId), event, msgFormat, getMessageCodec(msgFormat).encodePayload(data));
+
+            return publishFunction(deviceType, deviceId, event, msgFormat, data, qos, on_publish);
+
+        return publishDeviceEvent;
+
+    def wrapDeviceEventCallback(self, callback):
+        """
+            Wrap the device event callback of an application client such that the received events are logged.
+
+            Args:
+                callback: A callable taking a device event.
+
+            Returns:
+                A callable taking a device event.
+
+            Raises:
+                None.
+        """
+        def deviceEventCallback(deviceEvent):
+            """Log the received event and call the callback."""
+            self.write(deviceEvent.device, deviceEvent.event, deviceEvent.format, deviceEvent.payload);
+
+            callback(deviceEvent);
+
+        return deviceEventCallback;
+
+    def close(self):
+        """
+            Write the buffered records and close the log file.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        with self._lock:
+            self._file.close();
+
+    def getStatisticsReport(self):
+        """
+            Get a report of the number of logged events and streams.
+
+            Args:
+                None.
+
+            Returns:
+                A string instance representing the report.
+
+            Raises:
+                None.
+        """
+        return "Event log %s: %d events of %d streams, %.1f kB" % (self.path, self.eventCount, len(self._streamIds),
+                                                                   self.byteCount / 1024.0);
+
+
+class EventLogReader(object):
+    """
+        Reader of a log written by EventLogWriter. The file is memory-mapped
+        and the offsets and timestamps of its events are indexed when it is
+        opened, by reading the record headers only, hence any event is read
+        in constant time and the first event at a given time is found by
+        binary search.
+    """
+
+    def __init__(self, path):
+        """
+            Map and index the log file.
+
+            Args:
+                path: A string instance representing the path of the log file.
+
+            Returns:
+                None.
+
+            Raises:
+                OSError if the file cannot be read.
+                ValueError if the file is not an event log.
+        """
+        self.path       = path;
+
+        # Device, event and format of each stream
+        self.streams    = [];
+
+        # Offset of the payload and epoch timestamp in microseconds of each event
+        self._offsets       = array.array("Q");
+        self._timestamps    = array.array("q");
+
+        self._file      = open(path, "rb");
+        self._map       = None;
+
+        size = os.fstat(self._file.fileno()).st_size;
+
+        if size < EVENT_LOG_HEADER.size:
+            self._file.close();
+
+            raise ValueError("%s is not an event log." % path);
+
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ);
+
+        magic, version = EVENT_LOG_HEADER.unpack_from(self._map, 0);
+
+        if magic != EVENT_LOG_MAGIC or version != EVENT_LOG_VERSION:
+            self.close();
+
+            raise ValueError("%s is not an event log of version %d." % (path, EVENT_LOG_VERSION));
+
+        self._indexRecords(size);
+
+    def __len__(self):
+        """Get the number of events of the log."""
+        return len(self._offsets);
+
+    def __getitem__(self, index):
+        """
+            Get an event of the log.
+
+            Args:
+                index: An integer representing the index of the event.
+
+            Returns:
+                A (timestamp, device, event, format, payload) tuple, the timestamp being an epoch timestamp
+                in seconds and the payload a bytes instance.
+
+            Raises:
+                IndexError if the index is out of range.
+        """
+        offset                      = self._offsets[index];
+        length, timestamp, streamId = RECORD_HEADER.unpack_from(self._map, offset - RECORD_HEADER.size);
+        device, event, msgFormat    = self.streams[streamId];
+
+        return timestamp / 1e6, device, event, msgFormat, self._map[offset:offset + length];
+
+    def __iter__(self):
+        """Iterate over the events of the log, in order."""
+        for index in range(len(self)):
+            yield self[index];
+
+    @property
+    def startTime(self):
+        """
+            The epoch timestamp in seconds of the first event, None if the log is empty.
+        """
+        return self._timestamps[0] / 1e6 if self._timestamps else None;
+
+    @property
+    def duration(self):
+        """
+            The number of seconds between the first and the last event.
+        """
+        return (self._timestamps[-1] - self._timestamps[0]) / 1e6 if self._timestamps else 0.0;
+
+    def getTimestamp(self, index):
+        """
+            Get the timestamp of an event without reading it.
+
+            Args:
+                index: An integer representing the index of the event.
+
+            Returns:
+                A float representing the epoch timestamp in seconds.
+
+            Raises:
+                IndexError if the index is out of range.
+        """
+        return self._timestamps[index] / 1e6;
+
+    def findIndex(self, timestamp):
+        """
+            Find the first event logged at or after a given time.
+
+            Args:
+                timestamp: A float representing an epoch timestamp in seconds.
+
+            Returns:
+                An integer representing the index of the event, the number of events if there is none.
+
+            Raises:
+                None.
+        """
+        return bisect.bisect_left(self._timestamps, int(1e6 * timestamp));
+
+    def close(self):
+        """
+            Unmap and close the log file.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        if self._map is not None and not self._map.closed:
+            self._map.close();
+
+        self._file.close();
+
+    def getSummary(self):
+        """
+            Get a summary of the events of the log.
+
+            Args:
+                None.
+
+            Returns:
+                A string instance representing the summary.
+
+            Raises:
+                None.
+        """
+        devices = set(device for device, _, _ in self.streams);
+
+        return "Event log %s: %d events of %d devices over %.1f s" % (self.path, len(self), len(devices), self.duration);
+
+    def _indexRecords(self, size):
+        """Index the events of the log and read the stream definitions, up to the first torn record."""
+        offset = EVENT_LOG_HEADER.size;
+
+        while offset + RECORD_HEADER.size <= size:
+            length, timestamp, streamId = RECORD_HEADER.unpack_from(self._map, offset);
+
+            offset += RECORD_HEADER.size;
+
+            if offset + length > size:
+                break;
+
+            if streamId == DEFINITION_STREAM_ID:
+                self.streams.append(tuple(json.loads(self._map[offset:offset + length].decode("utf-8"))));
+            elif streamId < len(self.streams):
+                self._offsets.append(offset);
+                self._timestamps.append(timestamp);
+            else:
+                raise ValueError("Invalid stream id %d at offset %d of %s." % (streamId, offset, self.path));
+
+            offset += length;
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def openEventLog(path):
+    """
+        Create an event log, if requested.
+
+        Args:
+            path: A string instance representing the path of the log file, None not to log the events.
+
+        Returns:
+            An EventLogWriter instance, or None if the events are not logged.
+
+        Raises:
+            None.
+    """
+    if not path:
+        return None;
+
+    try:
+        eventLog = EventLogWriter(path);
+    except OSError as exception:
+        print("Could not create the event log %s: %s" % (path, str(exception)));
+
+        return None;
+
+    print("Logging the events to %s." % path);
+
+    return eventLog;
@@ -0,0 +1,487 @@
+import array
+import base64
+import json
+import os
+import struct
+import sys
+import threading
+import time
+
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+DEFAULT_SINK_DIRECTORY      = "events";
+DEFAULT_SINK_SEGMENT_SIZE   = 64 * 1024 * 1024;
+DEFAULT_SINK_FLUSH_SIZE     = 1024 * 1024;
+DEFAULT_SINK_FLUSH_INTERVAL = 1.0;
+DEFAULT_SINK_FSYNC_INTERVAL = 5.0;
+DEFAULT_SINK_MAX_PENDING    = 100000;
+
+# Event sinks selectable from the command line
+EVENT_SINK_TYPES = ("columnar", "jsonl");
+
+# Columnar block header: magic, block length in bytes (header included) and number of events
+COLUMNAR_BLOCK_MAGIC    = b"EVB1";
+COLUMNAR_BLOCK_HEADER   = struct.Struct("<4sII");
+
+# Dictionary of the strings of a columnar block: length of its JSON encoding
+COLUMNAR_DICTIONARY_HEADER = struct.Struct("<I");
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def getLittleEndianBytes(values):
+    """
+        Get the little-endian representation of an array.array instance.
+
+        Args:
+            values: An array.array instance.
+
+        Returns:
+            A bytes instance.
+
+        Raises:
+            None.
+    """
+    if sys.byteorder != "little":
+        values = array.array(values.typecode, values);
+        values.byteswap();
+
+    return values.tobytes();
+
+def readLittleEndianArray(typecode, data, offset, count):
+    """
+        Read an array.array instance stored in little-endian order.
+
+        Args:
+            typecode:   A string instance representing the array.array type code.
+            data:       A bytes instance containing the array.
+            offset:     An integer representing the offset of the array in the data.
+            count:      An integer representing the number of items of the array.
+
+        Returns:
+            A (values, offset) tuple where offset is the offset following the array.
+
+        Raises:
+            None.
+    """
+    values  = array.array(typecode);
+    end     = offset + count * values.itemsize;
+
+    values.frombytes(data[offset:end]);
+
+    if sys.byteorder != "little":
+        values.byteswap();
+
+    return values, end;
+
+def readColumnarFile(path):
+    """
+        Read the events stored in a segment file written by ColumnarFileSink.
+
+        A block truncated by a crash ends the file.
+
+        Args:
+            path: A string instance representing the segment file path.
+
+        Returns:
+            A generator of (timestamp, device, event, format, payload) tuples.
+
+        Raises:
+            ValueError if the file is not a columnar event file.
+    """
+    with open(path, "rb") as segmentFile:
+        data = segmentFile.read();
+
+    offset = 0;
+
+    while offset + COLUMNAR_BLOCK_HEADER.size <= len(data):
+        magic, blockLength, count = COLUMNAR_BLOCK_HEADER.unpack_from(data, offset);
+
+        if magic != COLUMNAR_BLOCK_MAGIC:
+            raise ValueError("Invalid block at offset %d of %s." % (offset, path));
+
+        if offset + blockLength > len(data):
+            return;
+
+        position            = offset + COLUMNAR_BLOCK_HEADER.size;
+        dictionaryLength,   = COLUMNAR_DICTIONARY_HEADER.unpack_from(data, position);
+        position            += COLUMNAR_DICTIONARY_HEADER.size;
+        strings             = json.loads(data[position:position + dictionaryLength].decode("utf-8"));
+        position            += dictionaryLength;
+
+        timestamps, position    = readLittleEndianArray("d", data, position, count);
+        devices, position       = readLittleEndianArray("I", data, position, count);
+        events, position        = readLittleEndianArray("I", data, position, count);
+        formats, position       = readLittleEndianArray("I", data, position, count);
+        offsets, position       = readLittleEndianArray("I", data, position, count + 1);
+
+        for index in range(count):
+            yield (timestamps[index], strings[devices[index]], strings[events[index]], strings[formats[index]],
+                   data[position + offsets[index]:position + offsets[index + 1]]);
+
+        offset += blockLength;
+
+def createEventSink(sinkType, directory = DEFAULT_SINK_DIRECTORY, segmentSize = DEFAULT_SINK_SEGMENT_SIZE,
+                    flushSize = DEFAULT_SINK_FLUSH_SIZE, flushInterval = DEFAULT_SINK_FLUSH_INTERVAL,
+                    fsyncInterval = DEFAULT_SINK_FSYNC_INTERVAL):
+    """
+        Create an event sink of the given type.
+
+        Args:
+            sinkType:       A string instance among EVENT_SINK_TYPES.
+            directory:      A string instance representing the directory of the segment files.
+            segmentSize:    An integer representing the size in bytes from which a new segment file is started.
+            flushSize:      An integer representing the number of buffered payload bytes triggering a flush.
+            flushInterval:  A float representing the maximum number of seconds an event stays buffered.
+            fsyncInterval:  A float representing the minimum number of seconds between two fsync calls.
+
+        Returns:
+            A BufferedFileSink instance.
+
+        Raises:
+            ValueError if the sink type is unknown.
+            OSError if the directory cannot be used.
+    """
+    if sinkType == "columnar":
+        return ColumnarFileSink(directory, segmentSize, flushSize, flushInterval, fsyncInterval);
+
+    if sinkType == "jsonl":
+        return JsonLinesFileSink(directory, segmentSize, flushSize, flushInterval, fsyncInterval);
+
+    raise ValueError("Unknown event sink %s, expected one of %s." % (sinkType, ", ".join(EVENT_SINK_TYPES)));
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+class BufferedFileSink(object):
+    """
+        Append-only event sink buffering the events in memory and writing
+        them in bulk from a writer thread, so that write never blocks the
+        MQTT callback on the disk.
+
+        The buffer is flushed when it holds flushSize payload bytes or when
+        its oldest event is flushInterval seconds old. A new segment file is
+        started once the current one reaches segmentSize bytes, and the
+        segment files are synced to the disk at most once per fsyncInterval
+        seconds. When the writer cannot keep up, the events exceeding
+        maxPending buffered events are dropped and counted.
+
+        Subclasses define the file suffix and encode the flushed events.
+    """
+
+    fileSuffix = ".bin";
+
+    def __init__(self, directory = DEFAULT_SINK_DIRECTORY, segmentSize = DEFAULT_SINK_SEGMENT_SIZE,
+                 flushSize = DEFAULT_SINK_FLUSH_SIZE, flushInterval = DEFAULT_SINK_FLUSH_INTERVAL,
+                 fsyncInterval = DEFAULT_SINK_FSYNC_INTERVAL, maxPending = DEFAULT_SINK_MAX_PENDING):
+        """
+            Initialize the sink and start its writer thread.
+
+            Args:
+                directory:      A string instance representing the directory of the segment files.
+                segmentSize:    An integer representing the size in bytes from which a new segment file is started.
+                flushSize:      An integer representing the number of buffered payload bytes triggering a flush.
+                flushInterval:  A float representing the maximum number of seconds an event stays buffered.
+                fsyncInterval:  A float representing the minimum number of seconds between two fsync calls.
+                maxPending:     An integer representing the maximum number of buffered events.
+
+            Returns:
+                None.
+
+            Raises:
+                OSError if the directory cannot be used.
+        """
+        self.directory      = directory;
+        self.segmentSize    = segmentSize;
+        self.flushSize      = flushSize;
+        self.flushInterval  = flushInterval;
+        self.fsyncInterval  = fsyncInterval;
+        self.maxPending     = maxPending;
+
+        self.writtenEvents  = 0;
+        self.writtenBytes   = 0;
+        self.droppedEvents  = 0;
+        self.flushCount     = 0;
+        self.fsyncCount     = 0;
+        self.segmentCount   = 0;
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory);
+
+        self._events        = [];
+        self._bufferedBytes = 0;
+        self._deadline      = None;
+        self._closed        = False;
+        self._condition     = threading.Condition(threading.Lock());
+
+        self._segmentFile   = None;
+        self._segmentBytes  = 0;
+        self._lastFsyncTime = time.monotonic();
+
+        self._thread        = threading.Thread(target=self._writeBufferedEvents, name="sink");
+        self._thread.daemon = True;
+        self._thread.start();
+
+    def write(self, device, event, msgFormat, payload, timestamp = None):
+        """
+            Buffer an event. This method does not perform any I/O.
+
+            Args:
+                device:     A string instance identifying the device which sent the event.
+                event:      A string instance representing the event name.
+                msgFormat:  A string instance representing the event format.
+                payload:    A bytes instance representing the raw event payload.
+                timestamp:  A float representing the epoch receive time, or None to use the current time.
+
+            Returns:
+                A boolean indicating whether the event was buffered (False if it was dropped).
+
+            Raises:
+                None.
+        """
+        if timestamp is None:
+            timestamp = time.time();
+
+        with self._condition:
+            if len(self._events) >= self.maxPending:
+                self.droppedEvents += 1;
+
+                return False;
+
+            # Start the age timer of the buffer
+            if not self._events:
+                self._deadline = time.monotonic() + self.flushInterval;
+                self._condition.notify();
+
+            self._events.append((timestamp, device, event, msgFormat, payload));
+            self._bufferedBytes += len(payload);
+
+            if self._bufferedBytes >= self.flushSize:
+                self._deadline = time.monotonic();
+                self._condition.notify();
+
+        return True;
+
+    def close(self):
+        """
+            Write the buffered events, sync and close the current segment file.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        with self._condition:
+            self._closed = True;
+            self._condition.notify();
+
+        self._thread.join();
+
+    def getStatisticsReport(self):
+        """
+            Get a one line report of the sink counters.
+
+            Args:
+                None.
+
+            Returns:
+                A string instance representing the report.
+
+            Raises:
+                None.
+        """
+        with self._condition:
+            pendingEvents = len(self._events);
+
+        return "sink: %d events written (%d KB) in %d flushes, %d fsyncs, %d segments, %d pending, %d dropped" % (
+            self.writtenEvents, self.writtenBytes // 1024, self.flushCount, self.fsyncCount, self.segmentCount,
+            pendingEvents, self.droppedEvents
+        );
+
+    def encodeEvents(self, events):
+        """
+            Encode flushed events. Implemented by the subclasses.
+
+            Args:
+                events: A list of (timestamp, device, event, format, payload) tuples.
+
+            Returns:
+                A bytes instance appended to the current segment file.
+
+            Raises:
+                NotImplementedError.
+        """
+        raise NotImplementedError();
+
+    def _writeBufferedEvents(self):
+        """
+            Write the buffer when it is full or too old, until the sink is closed.
+        """
+        while True:
+            with self._condition:
+                while not self._closed and (self._deadline is None or time.monotonic() < self._deadline):
+                    self._condition.wait(None if self._deadline is None else self._deadline - time.monotonic());
+
+                events, self._events    = self._events, [];
+                self._bufferedBytes     = 0;
+                self._deadline          = None;
+                closed                  = self._closed;
+
+            if events:
+                try:
+                    self._writeEvents(events);
+                except (IOError, OSError) as exception:
+                    print("Failed to write %d events: %s" % (len(events), str(exception)));
+
+                    with self._condition:
+                        self.droppedEvents += len(events);
+
+            if closed:
+                self._closeSegment();
+
+                return;
+
+    def _writeEvents(self, events):
+        """Append encoded events to the current segment, rolling and syncing it as needed."""
+        data = self.encodeEvents(events);
+
+        if self._segmentFile is None or self._segmentBytes >= self.segmentSize:
+            self._closeSegment();
+            self._openSegment();
+
+        self._segmentFile.write(data);
+        self._segmentFile.flush();
+
+        self._segmentBytes  += len(data);
+        self.writtenBytes   += len(data);
+        self.writtenEvents  += len(events);
+        self.flushCount     += 1;
+
+        # Sync in groups: one fsync covers all the flushes of the interval
+        if time.monotonic() - self._lastFsyncTime >= self.fsyncInterval:
+            self._syncSegment();
+
+    def _openSegment(self):
+        """Start a new segment file named after the current time."""
+        path = os.path.join(self.directory, "events-%s-%04d%s" % (time.strftime("%Y%m%d-%H%M%S"), self.segmentCount,
+                                                                  self.fileSuffix));
+
+        self._segmentFile   = open(path, "ab");
+        self._segmentBytes  = 0;
+        self.segmentCount   += 1;
+
+    def _closeSegment(self):
+        """Sync and close the current segment file, if any."""
+        if self._segmentFile is not None:
+            self._syncSegment();
+            self._segmentFile.close();
+
+            self._segmentFile = None;
+
+    def _syncSegment(self):
+        """Sync the current segment file to the disk."""
+        os.fsync(self._segmentFile.fileno());
+
+        self._lastFsyncTime = time.monotonic();
+        self.fsyncCount     += 1;
+
+
+class ColumnarFileSink(BufferedFileSink):
+    """
+        Sink writing each flush as a self-contained columnar block: the
+        device, event and format strings are dictionary encoded, the receive
+        timestamps and dictionary codes are stored as little-endian arrays and
+        the raw payloads are concatenated after an array of offsets. The
+        files can be read using readColumnarFile.
+    """
+
+    fileSuffix = ".evb";
+
+    def encodeEvents(self, events):
+        """
+            Encode flushed events as a columnar block.
+
+            Args:
+                events: A list of (timestamp, device, event, format, payload) tuples.
+
+            Returns:
+                A bytes instance representing the block.
+
+            Raises:
+                None.
+        """
+        codes       = {};
+        timestamps  = array.array("d");
+        devices     = array.array("I");
+        names       = array.array("I");
+        formats     = array.array("I");
+        offsets     = array.array("I", [0]);
+        payloads    = [];
+        offset      = 0;
+
+        for timestamp, device, event, msgFormat, payload in events:
+            timestamps.append(timestamp);
+            devices.append(codes.setdefault(device, len(codes)));
+            names.append(codes.setdefault(event, len(codes)));
+            formats.append(codes.setdefault(msgFormat, len(codes)));
+
+            offset += len(payload);
+            offsets.append(offset);
+            payloads.append(payload);
+
+        dictionary  = json.dumps(sorted(codes, key=codes.get)).encode("utf-8");
+        body        = b"".join([COLUMNAR_DICTIONARY_HEADER.pack(len(dictionary)), dictionary,
+                                getLittleEndianBytes(timestamps), getLittleEndianBytes(devices),
+                                getLittleEndianBytes(names), getLittleEndianBytes(formats),
+                                getLittleEndianBytes(offsets)] + payloads);
+
+        return COLUMNAR_BLOCK_HEADER.pack(COLUMNAR_BLOCK_MAGIC, COLUMNAR_BLOCK_HEADER.size + len(body), len(events)) + body;
+
+
+class JsonLinesFileSink(BufferedFileSink):
+    """
+        Sink writing one JSON object per line, meant for debugging. JSON
+        payloads are embedded as is under "data", other payloads are base64
+        encoded under "payload".
+    """
+
+    fileSuffix = ".jsonl";
+
+    def encodeEvents(self, events):
+        """
+            Encode flushed events as JSON lines.
+
+            Args:
+                events: A list of (timestamp, device, event, format, payload) tuples.
+
+            Returns:
+                A bytes instance representing the lines.
+
+            Raises:
+                None.
+        """
+        lines = [];
+
+        for timestamp, device, event, msgFormat, payload in events:
+            prefix = '{"timestamp": %.6f, "device": %s, "event": %s, "format": %s, ' % (
+                timestamp, json.dumps(device), json.dumps(event), json.dumps(msgFormat));
+
+            # Line breaks can only be whitespace in a JSON document
+            if msgFormat == "json":
+                lines.append(prefix.encode("utf-8") + b'"data": ' + payload.replace(b"\n", b" ") + b"}\n");
+            else:
+                lines.append(prefix.encode("utf-8") + b'"payload": "' + base64.b64encode(payload) + b'"}\n');
+
+        return b"".join(lines);
+
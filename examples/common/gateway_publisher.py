@@ -0,0 +1,363 @@
+import os
+import re
+import threading
+import time
+
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+# Number of seconds after which the registration of a device which failed is attempted again
+REGISTRATION_RETRY_INTERVAL = 60.0;
+
+# Attached device specification: "type:id", or "type:prefix*N" for N devices prefix0 to prefixN-1
+ATTACHED_DEVICE_PATTERN = re.compile(r"^([^:/+#*]+):([^:/+#*]+)(?:\*([0-9]+))?$");
+
+# HTTP status of the registration of a device which already exists
+DEVICE_EXISTS_STATUS = 409;
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def parseAttachedDevices(specifications):
+    """
+        Parse the attached device specifications of a gateway.
+
+        A specification is either "type:id" for a single device, or "type:prefix*N" for N devices of
+        the given type whose ids are the prefix followed by a number zero-padded to the width of N - 1,
+        e.g. "sensor:probe-*100" for probe-00 to probe-99.
+
+        Args:
+            specifications: A list of string instances representing the specifications.
+
+        Returns:
+            A list of (device type, device id) tuples, in the order of the specifications and without duplicates.
+
+        Raises:
+            ValueError if one of the specifications is invalid.
+    """
+    devices = [];
+    seen    = set();
+
+    for specification in specifications:
+        match = ATTACHED_DEVICE_PATTERN.match(specification);
+
+        if match is None:
+            raise ValueError("%s is neither type:id nor type:prefix*N." % specification);
+
+        deviceType, deviceId, count = match.groups();
+
+        if count is None:
+            deviceIds = [deviceId];
+        elif int(count) < 1:
+            raise ValueError("The number of devices of %s should be positive." % specification);
+        else:
+            width       = len(str(int(count) - 1));
+            deviceIds   = ["%s%0*d" % (deviceId, width, index) for index in range(int(count))];
+
+        for deviceId in deviceIds:
+            if (deviceType, deviceId) not in seen:
+                seen.add((deviceType, deviceId));
+                devices.append((deviceType, deviceId));
+
+    return devices;
+
+def getGatewayRegisterFunction(gatewayClient):
+    """
+        Get a function registering a device with the IBM Watson IoT Platform through the REST API
+        client of a gateway, using the gateway credentials.
+
+        Args:
+            gatewayClient: A ibmiotf.gateway.Client instance.
+
+        Returns:
+            A callable taking a device type and a device id, raising ibmiotf.APIException if the device
+            could not be registered. A device which already exists counts as registered.
+
+        Raises:
+            None.
+    """
+    import ibmiotf;
+
+    def registerDevice(deviceType, deviceId):
+        """Register a device, unless it already exists."""
+        try:
+            gatewayClient.api.registerDevice(deviceType, deviceId);
+        except ibmiotf.APIException as exception:
+            if exception.httpCode != DEVICE_EXISTS_STATUS:
+                raise;
+
+    return registerDevice;
+
+def openDeviceRegistry(gatewayClient, cachePath = None):
+    """
+        Create the registry of the devices attached to a gateway.
+
+        Args:
+            gatewayClient:  A ibmiotf.gateway.Client instance.
+            cachePath:      An optional string instance representing the path of the file caching the
+                            registered devices across runs.
+
+        Returns:
+            A DeviceRegistry instance.
+
+        Raises:
+            None.
+    """
+    try:
+        registry = DeviceRegistry(getGatewayRegisterFunction(gatewayClient), cachePath);
+    except OSError as exception:
+        print("Could not open the device registry cache %s: %s" % (cachePath, str(exception)));
+
+        registry = DeviceRegistry(getGatewayRegisterFunction(gatewayClient));
+
+    print("Opened device registry with %d cached devices." % registry.cachedCount);
+
+    return registry;
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+class DeviceRegistry(object):
+    """
+        Cache of the devices a gateway registered with the IBM Watson IoT
+        Platform. A device is registered through the REST API the first time
+        it is seen, then kept in memory and appended to an optional cache
+        file, so that restarting a gateway with hundreds of attached devices
+        does not issue hundreds of requests. The registration of a device which
+        failed is attempted again at most once per retry interval, hence a
+        device rejected by the platform does not cost a request per event.
+    """
+
+    def __init__(self, registerFunction, cachePath = None, retryInterval = REGISTRATION_RETRY_INTERVAL):
+        """
+            Initialize the registry, loading the devices cached by the previous runs.
+
+            Args:
+                registerFunction:   A callable taking a device type and a device id, registering the device
+                                    and raising an exception if it could not be registered.
+                cachePath:          An optional string instance representing the path of the cache file,
+                                    holding a "type:id" line per registered device.
+                retryInterval:      A float representing the minimum number of seconds between two
+                                    registrations of a device which failed.
+
+            Returns:
+                None.
+
+            Raises:
+                OSError if the cache file cannot be read or created.
+        """
+        self.registerFunction   = registerFunction;
+        self.cachePath          = cachePath;
+        self.retryInterval      = retryInterval;
+
+        self.cachedCount        = 0;
+        self.registeredCount    = 0;
+        self.failedCount        = 0;
+
+        self._devices           = set();
+        self._failureTimes      = {};
+        self._lock              = threading.Lock();
+        self._cacheFile         = None;
+
+        if cachePath:
+            if os.path.exists(cachePath):
+                with open(cachePath, "r") as cacheFile:
+                    for line in cacheFile:
+                        deviceType, separator, deviceId = line.strip().partition(":");
+
+                        if separator:
+                            self._devices.add((deviceType, deviceId));
+
+            self.cachedCount    = len(self._devices);
+            self._cacheFile     = open(cachePath, "a");
+
+    def isRegistered(self, deviceType, deviceId):
+        """
+            Check whether a device was registered by this run or a previous one.
+
+            Args:
+                deviceType: A string instance representing the device type id.
+                deviceId:   A string instance representing the device id.
+
+            Returns:
+                A boolean indicating whether the device is registered.
+
+            Raises:
+                None.
+        """
+        return (deviceType, deviceId) in self._devices;
+
+    def register(self, deviceType, deviceId):
+        """
+            Register a device unless it is cached or its registration failed within the retry interval.
+
+            Args:
+                deviceType: A string instance representing the device type id.
+                deviceId:   A string instance representing the device id.
+
+            Returns:
+                A boolean indicating whether the device is registered.
+
+            Raises:
+                None.
+        """
+        device = (deviceType, deviceId);
+
+        with self._lock:
+            if device in self._devices:
+                return True;
+
+            failureTime = self._failureTimes.get(device);
+
+            if failureTime is not None and time.monotonic() - failureTime < self.retryInterval:
+                return False;
+
+        # The request is not sent with the lock held, a device registered twice meanwhile already exists
+        try:
+            self.registerFunction(deviceType, deviceId);
+        except Exception as exception:
+            print("Failed to register device %s:%s: %s" % (deviceType, deviceId, str(exception)));
+
+            with self._lock:
+                self._failureTimes[device]  = time.monotonic();
+                self.failedCount            += 1;
+
+            return False;
+
+        with self._lock:
+            if device not in self._devices:
+                self._devices.add(device);
+                self._failureTimes.pop(device, None);
+
+                self.registeredCount += 1;
+
+                if self._cacheFile is not None:
+                    self._cacheFile.write("%s:%s\n" % device);
+                    self._cacheFile.flush();
+
+        return True;
+
+    def registerDevices(self, devices):
+        """
+            Register the devices which are not cached, e.g. the attached devices when a gateway starts.
+
+            Args:
+                devices: An iterable of (device type, device id) tuples.
+
+            Returns:
+                An integer representing the number of devices which are not registered.
+
+            Raises:
+                None.
+        """
+        return sum(1 for deviceType, deviceId in devices if not self.register(deviceType, deviceId));
+
+    def close(self):
+        """
+            Close the cache file.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        with self._lock:
+            if self._cacheFile is not None:
+                self._cacheFile.close();
+
+                self._cacheFile = None;
+
+    def getStatisticsReport(self):
+        """
+            Get a one line report of the cached, registered and failed devices.
+
+            Args:
+                None.
+
+            Returns:
+                A string instance representing the report.
+
+            Raises:
+                None.
+        """
+        with self._lock:
+            return "device registry: %d cached, %d registered, %d failed registrations, %d devices known" % (
+                self.cachedCount, self.registeredCount, self.failedCount, len(self._devices));
+
+
+class AttachedDevice(object):
+    """
+        Device attached to a gateway, whose events are published on its
+        behalf through the windowed publisher of the gateway client. It has
+        the publishEvent method of the publishers of the device clients, hence
+        the code publishing the events of a device client publishes the events
+        of an attached device unchanged.
+
+        When a registry is given, the device is registered before its first
+        event is published. The event is published even if the registration
+        failed, since the platform may register the devices of a gateway
+        automatically.
+    """
+
+    def __init__(self, publisher, deviceType, deviceId, registry = None):
+        """
+            Initialize the device.
+
+            Args:
+                publisher:  A WindowedPublisher instance created by openGatewayClientPublisher.
+                deviceType: A string instance representing the device type id.
+                deviceId:   A string instance representing the device id.
+                registry:   An optional DeviceRegistry instance registering the device.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self.publisher      = publisher;
+        self.deviceType     = deviceType;
+        self.deviceId       = deviceId;
+        self.registry       = registry;
+
+        self._isRegistered  = registry is None;
+
+    @property
+    def key(self):
+        """
+            The "type:id" key of the device.
+        """
+        return "%s:%s" % (self.deviceType, self.deviceId);
+
+    def publishEvent(self, event, msgFormat, data, qos = None, on_publish = None):
+        """
+            Publish an event of the device once the window of the gateway publisher has a free slot.
+
+            Args:
+                event:      A string instance representing the event name.
+                msgFormat:  A string instance representing the event format.
+                data:       The device event data.
+                qos:        An optional integer representing the quality of service of the event, the
+                            default quality of service of the publisher if None.
+                on_publish: An optional callable without argument called once the event is acknowledged.
+
+            Returns:
+                A boolean indicating whether the event was published.
+
+            Raises:
+                ValueError if the quality of service is invalid.
+        """
+        if not self._isRegistered:
+            self._isRegistered = self.registry.register(self.deviceType, self.deviceId);
+
+        return self.publisher.publishDeviceEvent(self.deviceType, self.deviceId, event, msgFormat, data, qos, on_publish);
@@ -0,0 +1,313 @@
+import bisect
+import json
+import math
+import threading
+import time
+
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+# Keys of the benchmark fields embedded in the device event payloads
+BENCHMARK_SEQUENCE_KEY  = "benchSeq";
+BENCHMARK_SENT_AT_KEY   = "benchSentAt";
+BENCHMARK_COUNT_KEY     = "benchCount";
+
+# Latency histogram: logarithmic buckets from 10 microseconds to 100 seconds
+HISTOGRAM_MIN_LATENCY       = 1e-5;
+HISTOGRAM_DECADES           = 7;
+HISTOGRAM_BUCKETS_PER_DECADE = 10;
+
+# Percentiles reported by the latency recorder
+REPORTED_PERCENTILES = (50, 95, 99);
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def stampPayload(data, sequenceNumber, eventCount = None):
+    """
+        Embed a sequence number and a high-resolution send timestamp in a device event payload.
+
+        Args:
+            data:           A dictionary instance representing the device event payload.
+            sequenceNumber: An integer representing the sequence number of the event for its device.
+            eventCount:     An optional integer representing the number of benchmark events the device
+                            sends, embedded such that the receivers count the events lost at the end.
+
+        Returns:
+            The updated dictionary instance.
+
+        Raises:
+            None.
+    """
+    data[BENCHMARK_SEQUENCE_KEY]    = sequenceNumber;
+    data[BENCHMARK_SENT_AT_KEY]     = time.time();
+
+    if eventCount is not None:
+        data[BENCHMARK_COUNT_KEY] = eventCount;
+
+    return data;
+
+def getHistogramUpperBounds():
+    """
+        Get the upper bounds of the latency histogram buckets.
+
+        Args:
+            None.
+
+        Returns:
+            A list of floats representing the upper bounds in seconds, in increasing order.
+
+        Raises:
+            None.
+    """
+    return [HISTOGRAM_MIN_LATENCY * 10 ** (index / float(HISTOGRAM_BUCKETS_PER_DECADE))
+            for index in range(1, HISTOGRAM_DECADES * HISTOGRAM_BUCKETS_PER_DECADE + 1)];
+
+def getPercentile(sortedValues, percentile):
+    """
+        Get a percentile of sorted values using the nearest-rank method.
+
+        Args:
+            sortedValues:   A non-empty list of values sorted in increasing order.
+            percentile:     A number between 0 and 100.
+
+        Returns:
+            The value at the given percentile.
+
+        Raises:
+            None.
+    """
+    rank = int(math.ceil(percentile / 100.0 * len(sortedValues)));
+
+    return sortedValues[max(0, rank - 1)];
+
+def getDeliveryCounts(minSequenceNumber, maxSequenceNumber, sequenceNumbers, eventCount):
+    """
+        Get the number of events a device sent and the number of them which were received.
+
+        Args:
+            minSequenceNumber:  An integer representing the smallest sequence number received from the device.
+            maxSequenceNumber:  An integer representing the greatest sequence number received from the device.
+            sequenceNumbers:    A set instance representing the distinct sequence numbers received from the device.
+            eventCount:         An integer representing the number of events announced by the device, or None.
+
+        Returns:
+            An (expected count, unique count) tuple representing the number of events sent by the device
+            and the number of them which were received.
+
+        Raises:
+            None.
+    """
+    if eventCount is None:
+        return maxSequenceNumber - minSequenceNumber + 1, len(sequenceNumbers);
+
+    return eventCount, sum(1 for sequenceNumber in sequenceNumbers if 0 <= sequenceNumber < eventCount);
+
+def formatReportSummary(report):
+    """
+        Get a human readable summary of a latency report.
+
+        Args:
+            report: A dictionary instance returned by LatencyRecorder.getReport.
+
+        Returns:
+            A string instance representing the summary.
+
+        Raises:
+            None.
+    """
+    if not report["received"]:
+        return "No benchmark events received.";
+
+    latency = report["latencyMs"];
+
+    return ("Received %d events from %d devices: lost %d (%.2f%%), duplicated %d, reordered %d | "
+            "latency p50 %.2f ms, p95 %.2f ms, p99 %.2f ms, max %.2f ms") % (
+        report["received"], report["devices"], report["lost"], 100 * report["lossRate"], report["duplicated"], report["reordered"],
+        latency["p50"], latency["p95"], latency["p99"], latency["max"]
+    );
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+class LatencyRecorder(object):
+    """
+        Thread-safe recorder of the delivery latency, loss and reordering of
+        the benchmark events stamped by stampPayload.
+
+        The latency is the difference between the receive time and the send
+        timestamp, hence the sender and receiver clocks must be synchronized
+        (or the sender and receiver run on the same host).
+    """
+
+    def __init__(self):
+        """
+            Initialize the recorder.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self._lock              = threading.Lock();
+        self._latencies         = [];
+        self._devices           = {};
+        self._reorderedCount    = 0;
+        self._upperBounds       = getHistogramUpperBounds();
+        self._histogram         = [0] * (len(self._upperBounds) + 1);
+
+    def recordPayload(self, device, data, receivedAt = None):
+        """
+            Record a received device event payload if it contains benchmark fields.
+
+            Args:
+                device:     A string instance identifying the device which sent the event.
+                data:       A dictionary or bytes instance representing the device event payload.
+                receivedAt: A float representing the epoch receive time, or None to use the current time.
+
+            Returns:
+                A boolean indicating whether the payload contained benchmark fields.
+
+            Raises:
+                None.
+        """
+        if receivedAt is None:
+            receivedAt = time.time();
+
+        # Raw payloads (bytes) do not carry benchmark fields
+        if not isinstance(data, dict) or BENCHMARK_SEQUENCE_KEY not in data:
+            return False;
+
+        self.record(device, data[BENCHMARK_SEQUENCE_KEY], data[BENCHMARK_SENT_AT_KEY], receivedAt, data.get(BENCHMARK_COUNT_KEY));
+
+        return True;
+
+    def record(self, device, sequenceNumber, sentAt, receivedAt, eventCount = None):
+        """
+            Record a received benchmark event.
+
+            Args:
+                device:         A string instance identifying the device which sent the event.
+                sequenceNumber: An integer representing the sequence number of the event.
+                sentAt:         A float representing the epoch send time.
+                receivedAt:     A float representing the epoch receive time.
+                eventCount:     An optional integer representing the number of events announced by the device.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        latency = receivedAt - sentAt;
+
+        with self._lock:
+            self._latencies.append(latency);
+            self._histogram[bisect.bisect_left(self._upperBounds, latency)] += 1;
+
+            deviceState = self._devices.get(device);
+
+            if deviceState is None:
+                self._devices[device] = [sequenceNumber, sequenceNumber, {sequenceNumber}, 1, eventCount];
+
+                return;
+
+            # An event is reordered when an event with a greater sequence number arrived before it
+            if sequenceNumber < deviceState[1]:
+                self._reorderedCount += 1;
+
+            deviceState[0] = min(deviceState[0], sequenceNumber);
+            deviceState[1] = max(deviceState[1], sequenceNumber);
+            deviceState[2].add(sequenceNumber);
+            deviceState[3] += 1;
+
+            if eventCount is not None:
+                deviceState[4] = max(deviceState[4] or 0, eventCount);
+
+    def getReport(self):
+        """
+            Get a report of the events recorded so far.
+
+            The number of lost events of a device is computed against the
+            number of events it announced, whose sequence numbers start at 0,
+            so that the events lost at the start and at the end of the stream
+            are counted. The devices which announced no count are checked
+            between the smallest and greatest sequence numbers received.
+
+            Args:
+                None.
+
+            Returns:
+                A dictionary instance representing the report.
+
+            Raises:
+                None.
+        """
+        with self._lock:
+            latencies       = sorted(self._latencies);
+            histogram       = list(self._histogram);
+            deliveryCounts  = [getDeliveryCounts(state[0], state[1], state[2], state[4]) for state in self._devices.values()];
+            expectedCount   = sum(counts[0] for counts in deliveryCounts);
+            uniqueCount     = sum(counts[1] for counts in deliveryCounts);
+            duplicatedCount = sum(state[3] - len(state[2]) for state in self._devices.values());
+            receivedCount   = sum(state[3] for state in self._devices.values());
+            deviceCount     = len(self._devices);
+            reorderedCount  = self._reorderedCount;
+
+        report = {
+            "received"      : receivedCount,
+            "devices"       : deviceCount,
+            "lost"          : expectedCount - uniqueCount,
+            "lossRate"      : (expectedCount - uniqueCount) / float(expectedCount) if expectedCount else 0.0,
+            "duplicated"    : duplicatedCount,
+            "reordered"     : reorderedCount,
+            "latencyMs"     : {},
+            "histogram"     : []
+        };
+
+        if latencies:
+            for percentile in REPORTED_PERCENTILES:
+                report["latencyMs"]["p%d" % percentile] = 1000 * getPercentile(latencies, percentile);
+
+            report["latencyMs"]["min"]  = 1000 * latencies[0];
+            report["latencyMs"]["max"]  = 1000 * latencies[-1];
+            report["latencyMs"]["mean"] = 1000 * sum(latencies) / len(latencies);
+
+        # The last bucket counts the latencies above the greatest upper bound
+        for upperBound, count in zip(self._upperBounds + [float("inf")], histogram):
+            if count:
+                report["histogram"].append({"leMs" : 1000 * upperBound if upperBound != float("inf") else "inf", "count" : count});
+
+        return report;
+
+    def writeReport(self, reportPath):
+        """
+            Write the report as JSON and print its summary.
+
+            Args:
+                reportPath: A string instance representing the report file path.
+
+            Returns:
+                A dictionary instance representing the report.
+
+            Raises:
+                IOError if the report could not be written.
+        """
+        report = self.getReport();
+
+        with open(reportPath, "w") as reportFile:
+            json.dump(report, reportFile, indent=4, sort_keys=True);
+
+        print(formatReportSummary(report));
+
+        return report;
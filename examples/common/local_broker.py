@@ -0,0 +1,69 @@
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+# Port of an unencrypted MQTT broker. ibmiotf only disables TLS for this port.
+LOCAL_BROKER_PORT = 1883;
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def parseBrokerAddress(broker):
+    """
+        Parse a broker address given as "host" or "host:port".
+
+        Args:
+            broker: A string instance representing the broker address.
+
+        Returns:
+            A (host, port) tuple.
+
+        Raises:
+            ValueError if the port is not a number.
+    """
+    host, _, port = broker.partition(":");
+
+    return host, int(port) if port else LOCAL_BROKER_PORT;
+
+def getLocalBrokerClientOptions(clientOptions):
+    """
+        Get the options of an ibmiotf client which will connect to a local,
+        unencrypted broker instead of the IBM Watson IoT Platform.
+
+        Args:
+            clientOptions: A dictionary instance representing the ibmiotf client options.
+
+        Returns:
+            A copy of the options with TLS disabled.
+
+        Raises:
+            None.
+    """
+    clientOptions           = dict(clientOptions);
+    clientOptions["port"]   = LOCAL_BROKER_PORT;
+
+    return clientOptions;
+
+def redirectClientToBroker(client, broker):
+    """
+        Point an ibmiotf client at a local broker.
+
+        ibmiotf derives the broker host from the organization id, therefore the
+        host is overridden once the client has been created with the options
+        returned by getLocalBrokerClientOptions.
+
+        Args:
+            client: An ibmiotf.device.Client or ibmiotf.application.Client instance.
+            broker: A string instance representing the broker address as "host" or "host:port".
+
+        Returns:
+            The client.
+
+        Raises:
+            ValueError if the broker address is invalid.
+    """
+    client.address, client.port = parseBrokerAddress(broker);
+
+    return client;
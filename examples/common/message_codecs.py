@@ -0,0 +1,259 @@
+import datetime
+import importlib.util
+import json
+
+from common.metrics import PAYLOAD_BYTES
+from common.runtime import lazyImport
+
+cbor2   = lazyImport("cbor2");
+ibmiotf = lazyImport("ibmiotf");
+msgpack = lazyImport("msgpack");
+
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+# Device event formats
+JSON_FORMAT         = "json";
+MESSAGEPACK_FORMAT  = "msgpack";
+CBOR_FORMAT         = "cbor";
+RAW_FORMAT          = "raw";
+
+DEFAULT_MESSAGE_FORMAT = JSON_FORMAT;
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+class MessageCodec(object):
+    """
+        Codec converting device event data to and from MQTT payloads.
+
+        The encode and decode methods implement the interface of the ibmiotf
+        message encoder modules, so that a codec can be registered on a client
+        using setMessageEncoderModule. Subclasses implement encodePayload and
+        decodePayload, which are also used without any client, e.g. by the
+        outbox and the benchmarks.
+    """
+
+    # Format name of the device events using the codec
+    name        = None;
+
+    # Whether the codec serializes dictionaries (False if it only carries bytes)
+    structured  = True;
+
+    # Whether bytes values are stored as is (False if they have to be base64 encoded first)
+    binary      = True;
+
+    # Name of the module required by the codec, or None if it only uses the standard library
+    moduleName  = None;
+
+    def encode(self, data = None, timestamp = None):
+        """
+            Convert device event data into a MQTT payload, as the ibmiotf clients expect.
+
+            Args:
+                data:       The device event data.
+                timestamp:  A datetime.datetime instance, which is not stored in the payload.
+
+            Returns:
+                A bytes or string instance representing the payload.
+
+            Raises:
+                TypeError if the data cannot be encoded by the codec.
+        """
+        payload = self.encodePayload(data);
+
+        PAYLOAD_BYTES.labels("out", self.name).inc(len(payload));
+
+        return payload;
+
+    def decode(self, message):
+        """
+            Convert a received MQTT message into an ibmiotf.Message instance, as the ibmiotf clients expect.
+
+            The timestamp of the message is the time at which it is received.
+
+            Args:
+                message: A paho.mqtt.client.MQTTMessage instance.
+
+            Returns:
+                A ibmiotf.Message instance.
+
+            Raises:
+                ibmiotf.InvalidEventException if the payload cannot be decoded.
+        """
+        PAYLOAD_BYTES.labels("in", self.name).inc(len(message.payload));
+
+        try:
+            data = self.decodePayload(message.payload);
+        except Exception as exception:
+            raise ibmiotf.InvalidEventException("Unable to decode %s payload: %s" % (self.name, str(exception)));
+
+        return ibmiotf.Message(data, datetime.datetime.now(datetime.timezone.utc));
+
+    def encodePayload(self, data):
+        """
+            Convert device event data into a payload.
+
+            Args:
+                data: The device event data.
+
+            Returns:
+                A bytes or string instance representing the payload.
+
+            Raises:
+                TypeError if the data cannot be encoded by the codec.
+        """
+        raise NotImplementedError();
+
+    def decodePayload(self, payload):
+        """
+            Convert a payload created by encodePayload back into device event data.
+
+            Args:
+                payload: A bytes instance representing the payload.
+
+            Returns:
+                The device event data.
+
+            Raises:
+                ValueError if the payload is invalid.
+        """
+        raise NotImplementedError();
+
+    def isAvailable(self):
+        """
+            Check whether the module required by the codec is installed, without importing it.
+
+            Args:
+                None.
+
+            Returns:
+                A boolean.
+
+            Raises:
+                None.
+        """
+        return self.moduleName is None or importlib.util.find_spec(self.moduleName) is not None;
+
+
+class JsonCodec(MessageCodec):
+    """
+        Compact JSON codec, the only format of the original sample applications.
+    """
+
+    name    = JSON_FORMAT;
+    binary  = False;
+
+    def encodePayload(self, data):
+        """Serialize the data as JSON without whitespace."""
+        return json.dumps(data, separators=(",", ":"));
+
+    def decodePayload(self, payload):
+        """Parse a UTF-8 JSON payload."""
+        return json.loads(str(payload, "utf-8") if isinstance(payload, (bytes, bytearray, memoryview)) else payload);
+
+
+class MessagePackCodec(MessageCodec):
+    """
+        MessagePack codec, storing bytes values without base64 overhead.
+    """
+
+    name        = MESSAGEPACK_FORMAT;
+    moduleName  = "msgpack";
+
+    def encodePayload(self, data):
+        """Serialize the data as MessagePack."""
+        return msgpack.packb(data, use_bin_type=True);
+
+    def decodePayload(self, payload):
+        """Parse a MessagePack payload."""
+        return msgpack.unpackb(payload, raw=False);
+
+
+class CborCodec(MessageCodec):
+    """
+        CBOR (RFC 8949) codec, storing bytes values without base64 overhead.
+    """
+
+    name        = CBOR_FORMAT;
+    moduleName  = "cbor2";
+
+    def encodePayload(self, data):
+        """Serialize the data as CBOR."""
+        return cbor2.dumps(data);
+
+    def decodePayload(self, payload):
+        """Parse a CBOR payload."""
+        return cbor2.loads(payload);
+
+
+class RawCodec(MessageCodec):
+    """
+        Passthrough codec publishing bytes data as is, e.g. a compressed image.
+    """
+
+    name        = RAW_FORMAT;
+    structured  = False;
+
+    def encodePayload(self, data):
+        """Check that the data is a bytes-like object."""
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            raise TypeError("The %s format only carries bytes, not %s." % (self.name, type(data).__name__));
+
+        return bytes(data);
+
+    def decodePayload(self, payload):
+        """Return the payload bytes."""
+        return bytes(payload);
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+# Codecs available to the senders and receivers, by format name
+MESSAGE_CODECS = dict((codec.name, codec) for codec in (JsonCodec(), MessagePackCodec(), CborCodec(), RawCodec()));
+
+def getMessageCodec(messageFormat):
+    """
+        Get the codec of a device event format.
+
+        Args:
+            messageFormat: A string instance representing the format name.
+
+        Returns:
+            A MessageCodec instance.
+
+        Raises:
+            ValueError if the format is unknown or if the module required by its codec is not installed.
+    """
+    codec = MESSAGE_CODECS.get(messageFormat);
+
+    if codec is None:
+        raise ValueError("Unsupported device event format: %s. Supported formats: %s." % (messageFormat, ", ".join(sorted(MESSAGE_CODECS))));
+
+    if not codec.isAvailable():
+        raise ValueError("The %s format requires the %s module (pip install %s)." % (messageFormat, codec.moduleName, codec.moduleName));
+
+    return codec;
+
+def registerMessageCodecs(client):
+    """
+        Register the codecs whose modules are installed on an ibmiotf client.
+
+        Args:
+            client: An ibmiotf device, gateway or application client.
+
+        Returns:
+            None.
+
+        Raises:
+            None.
+    """
+    for codec in MESSAGE_CODECS.values():
+        if codec.isAvailable():
+            client.setMessageEncoderModule(codec.name, codec);
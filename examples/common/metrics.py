@@ -0,0 +1,771 @@
+import bisect
+import math
+import threading
+import time
+
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+COUNTER_TYPE    = "counter";
+GAUGE_TYPE      = "gauge";
+HISTOGRAM_TYPE  = "histogram";
+
+# Upper bounds in seconds of the duration histogram buckets, from 10 microseconds to 10 seconds
+DURATION_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0,
+                    2.5, 5.0, 10.0);
+
+# Address of the metrics endpoint, only reachable from the local host
+METRICS_HOST = "127.0.0.1";
+METRICS_PATH = "/metrics";
+
+# Content type of the Prometheus text exposition format
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8";
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+class ThreadCells(object):
+    """
+        Per-thread cells of a metric. Each thread only updates its own cell,
+        hence the hot paths record without taking a lock, and the cells are
+        summed when the metrics are collected.
+    """
+
+    def __init__(self, createCell):
+        """
+            Initialize the cells.
+
+            Args:
+                createCell: A callable without argument returning a new mutable cell.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self.createCell = createCell;
+        self.cells      = [];
+
+        # The hot paths read the cell of their thread from local.cell directly, and only call get if it is missing
+        self.local      = threading.local();
+
+        self._lock      = threading.Lock();
+
+    def get(self):
+        """
+            Get the cell of the calling thread, creating it if needed.
+
+            Args:
+                None.
+
+            Returns:
+                The cell.
+
+            Raises:
+                None.
+        """
+        try:
+            return self.local.cell;
+        except AttributeError:
+            cell            = self.createCell();
+            self.local.cell = cell;
+
+            with self._lock:
+                self.cells.append(cell);
+
+            return cell;
+
+    def getAll(self):
+        """
+            Get the cells of all the threads, including the threads which exited.
+
+            Args:
+                None.
+
+            Returns:
+                A list of cells.
+
+            Raises:
+                None.
+        """
+        with self._lock:
+            return list(self.cells);
+
+
+class Counter(object):
+    """
+        Monotonically increasing value of a metric family for one set of label values.
+    """
+
+    def __init__(self):
+        """
+            Initialize the counter to 0.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self._cells = ThreadCells(lambda: [0]);
+        self._local = self._cells.local;
+
+    @property
+    def value(self):
+        """
+            The counter value.
+        """
+        return sum(cell[0] for cell in self._cells.getAll());
+
+    def inc(self, amount = 1):
+        """
+            Increase the counter.
+
+            Args:
+                amount: A non-negative number added to the counter.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        try:
+            self._local.cell[0] += amount;
+        except AttributeError:
+            self._cells.get()[0] += amount;
+
+    def getSamples(self, name, labels):
+        """
+            Get the samples of the counter.
+
+            Args:
+                name:   A string instance representing the metric family name.
+                labels: A string instance representing the formatted labels.
+
+            Returns:
+                A list of (name, formatted labels, value) tuples.
+
+            Raises:
+                None.
+        """
+        return [(name, labels, self.value)];
+
+
+class Gauge(object):
+    """
+        Value of a metric family for one set of label values which can go up
+        and down, or which is computed by a function when the metrics are
+        collected, e.g. a queue depth or the connection state of a client.
+    """
+
+    def __init__(self):
+        """
+            Initialize the gauge to 0.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self.value      = 0;
+        self.function   = None;
+
+        self._lock      = threading.Lock();
+
+    def set(self, value):
+        """
+            Set the gauge value.
+
+            Args:
+                value: A number.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self.value = value;
+
+    def inc(self, amount = 1):
+        """
+            Increase the gauge value.
+
+            Args:
+                amount: A number added to the gauge, negative to decrease it.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        with self._lock:
+            self.value += amount;
+
+    def setFunction(self, function):
+        """
+            Compute the gauge value using a function each time the metrics are collected.
+
+            Args:
+                function: A callable without argument returning a number.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self.function = function;
+
+    def getSamples(self, name, labels):
+        """
+            Get the samples of the gauge. A failing function gives a NaN value.
+
+            Args:
+                name:   A string instance representing the metric family name.
+                labels: A string instance representing the formatted labels.
+
+            Returns:
+                A list of (name, formatted labels, value) tuples.
+
+            Raises:
+                None.
+        """
+        if self.function is None:
+            return [(name, labels, self.value)];
+
+        try:
+            value = float(self.function());
+        except Exception:
+            value = math.nan;
+
+        return [(name, labels, value)];
+
+
+class Histogram(object):
+    """
+        Distribution of the values observed by a metric family for one set of
+        label values, counted in fixed buckets. The buckets are only made
+        cumulative when the metrics are collected, hence an observation costs
+        a binary search and the update of the cell of the calling thread.
+    """
+
+    def __init__(self, upperBounds = DURATION_BUCKETS):
+        """
+            Initialize an empty histogram.
+
+            Args:
+                upperBounds: A sequence of floats representing the bucket upper bounds, in increasing order.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self.upperBounds    = tuple(upperBounds);
+
+        # Cell of a thread: the count of each bucket and the sum of the values
+        self._cells         = ThreadCells(lambda: [[0] * (len(self.upperBounds) + 1), 0.0]);
+        self._local         = self._cells.local;
+
+    def observe(self, value):
+        """
+            Record a value.
+
+            Args:
+                value: A number, e.g. a duration in seconds.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        try:
+            cell = self._local.cell;
+        except AttributeError:
+            cell = self._cells.get();
+
+        cell[0][bisect.bisect_left(self.upperBounds, value)] += 1;
+        cell[1] += value;
+
+    def wrap(self, function):
+        """
+            Wrap a function such that the duration of each of its calls is observed, in seconds.
+
+            Args:
+                function: A callable.
+
+            Returns:
+                A callable taking the same arguments and returning the same value as the function.
+
+            Raises:
+                None.
+        """
+        def timedFunction(*args, **kwargs):
+            """Call the wrapped function and observe its duration."""
+            startTime = time.perf_counter();
+
+            try:
+                return function(*args, **kwargs);
+            finally:
+                self.observe(time.perf_counter() - startTime);
+
+        return timedFunction;
+
+    def getSnapshot(self):
+        """
+            Get the number of values observed in each bucket and their sum.
+
+            Args:
+                None.
+
+            Returns:
+                A (list of integers, float) tuple representing the non-cumulative bucket counts, the last one
+                counting the values above the last upper bound, and the sum of the values.
+
+            Raises:
+                None.
+        """
+        counts  = [0] * (len(self.upperBounds) + 1);
+        total   = 0.0;
+
+        for bucketCounts, valueSum in self._cells.getAll():
+            counts  = [count + bucketCount for count, bucketCount in zip(counts, list(bucketCounts))];
+            total   += valueSum;
+
+        return counts, total;
+
+    def getSamples(self, name, labels):
+        """
+            Get the cumulative bucket, sum and count samples of the histogram.
+
+            Args:
+                name:   A string instance representing the metric family name.
+                labels: A string instance representing the formatted labels.
+
+            Returns:
+                A list of (name, formatted labels, value) tuples.
+
+            Raises:
+                None.
+        """
+        counts, total = self.getSnapshot();
+
+        samples     = [];
+        cumulative  = 0;
+        separator   = "," if labels else "";
+
+        for upperBound, bucketCount in zip(self.upperBounds + (math.inf,), counts):
+            cumulative += bucketCount;
+
+            samples.append((name + "_bucket", '%s%sle="%s"' % (labels, separator, formatValue(upperBound)), cumulative));
+
+        samples.append((name + "_sum", labels, total));
+        samples.append((name + "_count", labels, cumulative));
+
+        return samples;
+
+
+class MetricFamily(object):
+    """
+        Metric of a given name, type and label names, holding one counter,
+        gauge or histogram per set of label values.
+    """
+
+    def __init__(self, name, description, metricType, labelNames = (), upperBounds = DURATION_BUCKETS):
+        """
+            Initialize the family.
+
+            Args:
+                name:           A string instance representing the metric name.
+                description:    A string instance describing the metric.
+                metricType:     COUNTER_TYPE, GAUGE_TYPE or HISTOGRAM_TYPE.
+                labelNames:     A tuple of strings representing the label names.
+                upperBounds:    A sequence of floats representing the bucket upper bounds of the histograms.
+
+            Returns:
+                None.
+
+            Raises:
+                ValueError if the type is unknown.
+        """
+        if metricType not in (COUNTER_TYPE, GAUGE_TYPE, HISTOGRAM_TYPE):
+            raise ValueError("Unknown metric type %s." % metricType);
+
+        self.name           = name;
+        self.description    = description;
+        self.metricType     = metricType;
+        self.labelNames     = tuple(labelNames);
+        self.upperBounds    = tuple(upperBounds);
+
+        self._children      = {};
+        self._lock          = threading.Lock();
+
+    def labels(self, *labelValues):
+        """
+            Get the metric of a set of label values, creating it if needed. The
+            hot paths should keep the returned metric rather than looking it up
+            for each event.
+
+            Args:
+                labelValues: The label values, one per label name.
+
+            Returns:
+                A Counter, Gauge or Histogram instance.
+
+            Raises:
+                ValueError if the number of label values does not match the label names.
+        """
+        child = self._children.get(labelValues);
+
+        if child is not None:
+            return child;
+
+        if len(labelValues) != len(self.labelNames):
+            raise ValueError("The %s metric expects %d label values." % (self.name, len(self.labelNames)));
+
+        with self._lock:
+            child = self._children.get(labelValues);
+
+            if child is None:
+                if self.metricType == COUNTER_TYPE:
+                    child = Counter();
+                elif self.metricType == GAUGE_TYPE:
+                    child = Gauge();
+                else:
+                    child = Histogram(self.upperBounds);
+
+                self._children[labelValues] = child;
+
+        return child;
+
+    def getChildren(self):
+        """
+            Get the metrics of the family.
+
+            Args:
+                None.
+
+            Returns:
+                A list of (tuple of label values, Counter, Gauge or Histogram instance) tuples, sorted by label values.
+
+            Raises:
+                None.
+        """
+        with self._lock:
+            return sorted(self._children.items());
+
+    def render(self):
+        """
+            Render the family in the Prometheus text exposition format.
+
+            Args:
+                None.
+
+            Returns:
+                A list of strings representing the lines.
+
+            Raises:
+                None.
+        """
+        lines = ["# HELP %s %s" % (self.name, self.description.replace("\\", "\\\\").replace("\n", "\\n")),
+                 "# TYPE %s %s" % (self.name, self.metricType)];
+
+        for labelValues, child in self.getChildren():
+            labels = ",".join('%s="%s"' % (labelName, formatLabelValue(labelValue))
+                              for labelName, labelValue in zip(self.labelNames, labelValues));
+
+            for name, sampleLabels, value in child.getSamples(self.name, labels):
+                lines.append("%s%s %s" % (name, "{%s}" % sampleLabels if sampleLabels else "", formatValue(value)));
+
+        return lines;
+
+
+class MetricsRegistry(object):
+    """
+        Registry of the metric families exposed by a process.
+    """
+
+    def __init__(self):
+        """
+            Initialize an empty registry.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self._families  = {};
+        self._lock      = threading.Lock();
+
+    def counter(self, name, description, labelNames = ()):
+        """
+            Get a counter family, registering it if needed.
+
+            Args:
+                name:           A string instance representing the metric name, ending with _total.
+                description:    A string instance describing the metric.
+                labelNames:     A tuple of strings representing the label names.
+
+            Returns:
+                A MetricFamily instance.
+
+            Raises:
+                ValueError if a metric of another type is registered under the name.
+        """
+        return self._register(name, description, COUNTER_TYPE, labelNames, DURATION_BUCKETS);
+
+    def gauge(self, name, description, labelNames = ()):
+        """
+            Get a gauge family, registering it if needed.
+
+            Args:
+                name:           A string instance representing the metric name.
+                description:    A string instance describing the metric.
+                labelNames:     A tuple of strings representing the label names.
+
+            Returns:
+                A MetricFamily instance.
+
+            Raises:
+                ValueError if a metric of another type is registered under the name.
+        """
+        return self._register(name, description, GAUGE_TYPE, labelNames, DURATION_BUCKETS);
+
+    def histogram(self, name, description, labelNames = (), upperBounds = DURATION_BUCKETS):
+        """
+            Get a histogram family, registering it if needed.
+
+            Args:
+                name:           A string instance representing the metric name.
+                description:    A string instance describing the metric.
+                labelNames:     A tuple of strings representing the label names.
+                upperBounds:    A sequence of floats representing the bucket upper bounds, in increasing order.
+
+            Returns:
+                A MetricFamily instance.
+
+            Raises:
+                ValueError if a metric of another type is registered under the name.
+        """
+        return self._register(name, description, HISTOGRAM_TYPE, labelNames, upperBounds);
+
+    def render(self):
+        """
+            Render the registered metrics in the Prometheus text exposition format.
+
+            Args:
+                None.
+
+            Returns:
+                A string instance representing the metrics.
+
+            Raises:
+                None.
+        """
+        with self._lock:
+            families = sorted(self._families.items());
+
+        lines = [];
+
+        for _, family in families:
+            lines += family.render();
+
+        return "\n".join(lines) + "\n";
+
+    def _register(self, name, description, metricType, labelNames, upperBounds):
+        """Get the family of a name, registering it if needed."""
+        with self._lock:
+            family = self._families.get(name);
+
+            if family is None:
+                family = MetricFamily(name, description, metricType, labelNames, upperBounds);
+
+                self._families[name] = family;
+            elif family.metricType != metricType or family.labelNames != tuple(labelNames):
+                raise ValueError("The %s metric is already registered with another type or labels." % name);
+
+            return family;
+
+
+class MetricsServer(object):
+    """
+        HTTP server exposing the metrics of a registry on the local host, in
+        the Prometheus text exposition format, from a daemon thread.
+    """
+
+    def __init__(self, registry, port, host = METRICS_HOST):
+        """
+            Start serving the metrics.
+
+            Args:
+                registry:   A MetricsRegistry instance.
+                port:       An integer representing the TCP port, 0 to pick a free port.
+                host:       A string instance representing the address to listen on.
+
+            Returns:
+                None.
+
+            Raises:
+                OSError if the server cannot listen.
+        """
+        import http.server;
+
+        class MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+            """Handler serving the metrics on METRICS_PATH."""
+
+            def do_GET(handler):
+                """Send the rendered metrics, or 404 for the other paths."""
+                if handler.path.split("?", 1)[0] != METRICS_PATH:
+                    handler.send_error(404);
+
+                    return;
+
+                body = registry.render().encode("utf-8");
+
+                handler.send_response(200);
+                handler.send_header("Content-Type", METRICS_CONTENT_TYPE);
+                handler.send_header("Content-Length", str(len(body)));
+                handler.end_headers();
+                handler.wfile.write(body);
+
+            def log_message(handler, format, *args):
+                """Do not log the scrapes."""
+                pass;
+
+        self.registry       = registry;
+        self._server        = http.server.ThreadingHTTPServer((host, port), MetricsRequestHandler);
+        self._server.daemon_threads = True;
+
+        self.port           = self._server.server_address[1];
+
+        self._thread        = threading.Thread(target=self._server.serve_forever, name="metrics");
+        self._thread.daemon = True;
+        self._thread.start();
+
+    def close(self):
+        """
+            Stop serving the metrics.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self._server.shutdown();
+        self._server.server_close();
+        self._thread.join();
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def formatValue(value):
+    """
+        Format a sample value or bucket bound as Prometheus expects it.
+
+        Args:
+            value: A number.
+
+        Returns:
+            A string instance.
+
+        Raises:
+            None.
+    """
+    if math.isnan(value):
+        return "NaN";
+
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf";
+
+    if isinstance(value, int) or (abs(value) < 1e15 and value == int(value)):
+        return "%d" % value;
+
+    return repr(float(value));
+
+def formatLabelValue(value):
+    """
+        Escape a label value as Prometheus expects it.
+
+        Args:
+            value: The label value, converted to a string.
+
+        Returns:
+            A string instance.
+
+        Raises:
+            None.
+    """
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n");
+
+def startMetricsServer(port, registry = None):
+    """
+        Serve the metrics of the sample applications on a local HTTP endpoint, if requested.
+
+        Args:
+            port:       An integer representing the TCP port, 0 to disable the endpoint.
+            registry:   An optional MetricsRegistry instance, METRICS_REGISTRY if None.
+
+        Returns:
+            A MetricsServer instance, or None if the endpoint is disabled.
+
+        Raises:
+            None.
+    """
+    if not port:
+        return None;
+
+    try:
+        server = MetricsServer(registry if registry is not None else METRICS_REGISTRY, port);
+    except OSError as exception:
+        print("Could not serve the metrics on port %d: %s" % (port, str(exception)));
+
+        return None;
+
+    print("Serving the metrics on http://%s:%d%s" % (METRICS_HOST, server.port, METRICS_PATH));
+
+    return server;
+
+
+# -----------------------------------------------------------------------------
+# Metrics
+# -----------------------------------------------------------------------------
+
+# Registry shared by the sample applications, and the metrics recorded by the common modules and scripts
+METRICS_REGISTRY = MetricsRegistry();
+
+EVENTS_PUBLISHED    = METRICS_REGISTRY.counter("wiotp_events_published_total", "Device events published by the client.", ("event",));
+EVENTS_RECEIVED     = METRICS_REGISTRY.counter("wiotp_events_received_total", "Device events received by the client.", ("event",));
+PAYLOAD_BYTES       = METRICS_REGISTRY.counter("wiotp_payload_bytes_total", "Device event payload bytes encoded for publication or "
+                                               "decoded on reception.", ("direction", "format"));
+STAGE_DURATION      = METRICS_REGISTRY.histogram("wiotp_stage_duration_seconds", "Duration of the processing stages of the device events.",
+                                                 ("stage",));
+CLIENT_CONNECTED    = METRICS_REGISTRY.gauge("wiotp_client_connected", "Whether the client is connected to the broker.", ("client",));
+SCHEDULE_LATENESS   = METRICS_REGISTRY.histogram("wiotp_schedule_lateness_seconds", "Delay of the ticks of the rate schedulers after "
+                                                 "their deadline.");
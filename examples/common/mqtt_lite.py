@@ -0,0 +1,627 @@
+import asyncio
+import struct
+import time
+
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+# MQTT 3.1.1 control packet types
+CONNECT     = 1;
+CONNACK     = 2;
+PUBLISH     = 3;
+PUBACK      = 4;
+PUBREC      = 5;
+PUBREL      = 6;
+PUBCOMP     = 7;
+SUBSCRIBE   = 8;
+SUBACK      = 9;
+PINGREQ     = 12;
+PINGRESP    = 13;
+DISCONNECT  = 14;
+
+# Number of bytes a broker buffers for a slow subscriber before dropping its messages
+MAX_SUBSCRIBER_BUFFER_SIZE = 4 * 1024 * 1024;
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def encodeRemainingLength(length):
+    """
+        Encode the remaining length of an MQTT packet.
+
+        Args:
+            length: An integer representing the number of bytes following the fixed header.
+
+        Returns:
+            A bytes instance representing the variable length encoding.
+
+        Raises:
+            None.
+    """
+    encodedLength = bytearray();
+
+    while True:
+        length, digit = divmod(length, 128);
+
+        encodedLength.append(digit | 0x80 if length else digit);
+
+        if not length:
+            return bytes(encodedLength);
+
+def encodeString(value):
+    """
+        Encode a UTF-8 string prefixed by its length.
+
+        Args:
+            value: A string or bytes instance.
+
+        Returns:
+            A bytes instance representing the encoded string.
+
+        Raises:
+            None.
+    """
+    if not isinstance(value, bytes):
+        value = value.encode("utf-8");
+
+    return struct.pack("!H", len(value)) + value;
+
+def encodePacket(packetType, flags, body):
+    """
+        Encode an MQTT packet.
+
+        Args:
+            packetType: An integer representing the control packet type.
+            flags:      An integer representing the fixed header flags.
+            body:       A bytes instance representing the variable header and the payload.
+
+        Returns:
+            A bytes instance representing the packet.
+
+        Raises:
+            None.
+    """
+    return bytes(bytearray([(packetType << 4) | flags])) + encodeRemainingLength(len(body)) + body;
+
+def encodeConnectPacket(clientId, username = None, password = None, keepAlive = 60, cleanSession = True):
+    """
+        Encode an MQTT 3.1.1 CONNECT packet.
+
+        Args:
+            clientId:       A string instance representing the client id.
+            username:       An optional string instance representing the user name.
+            password:       An optional string instance representing the password.
+            keepAlive:      An integer representing the keep alive interval in seconds.
+            cleanSession:   A boolean indicating whether the broker should discard the previous session.
+
+        Returns:
+            A bytes instance representing the packet.
+
+        Raises:
+            None.
+    """
+    connectFlags    = (0x02 if cleanSession else 0) | (0x80 if username is not None else 0) | (0x40 if password is not None else 0);
+    body            = encodeString("MQTT") + struct.pack("!BBH", 4, connectFlags, keepAlive) + encodeString(clientId);
+
+    if username is not None:
+        body += encodeString(username);
+
+    if password is not None:
+        body += encodeString(password);
+
+    return encodePacket(CONNECT, 0, body);
+
+def decodeConnectClientId(body):
+    """
+        Get the client id of an MQTT 3.1.1 CONNECT packet.
+
+        Args:
+            body: A bytes instance representing the variable header and the payload of the packet.
+
+        Returns:
+            A string instance representing the client id.
+
+        Raises:
+            struct.error if the packet is truncated.
+    """
+    protocolNameLength, = struct.unpack_from("!H", body);
+    offset              = 2 + protocolNameLength + 4;
+    clientIdLength,     = struct.unpack_from("!H", body, offset);
+
+    return body[offset + 2:offset + 2 + clientIdLength].decode("utf-8");
+
+def getDeviceTopicPrefix(clientId):
+    """
+        Get the prefix of the application topics of the events and commands of a device client.
+
+        The IBM Watson IoT Platform publishes the event a device sends on
+        iot-2/evt/E/fmt/F to the applications as iot-2/type/T/id/I/evt/E/fmt/F,
+        and the commands the applications send to the latter form to the device
+        as iot-2/cmd/C/fmt/F.
+
+        Args:
+            clientId: A string instance representing the client id, "d:org:type:id" for a device.
+
+        Returns:
+            A string instance representing the "iot-2/type/T/id/I/" prefix, or None if the client is not a device.
+
+        Raises:
+            None.
+    """
+    parts = clientId.split(":");
+
+    if len(parts) != 4 or parts[0] != "d":
+        return None;
+
+    return "iot-2/type/%s/id/%s/" % (parts[2], parts[3]);
+
+def encodePublishPacket(topic, payload, qos = 0, packetId = 0, retain = False):
+    """
+        Encode an MQTT PUBLISH packet.
+
+        Args:
+            topic:      A string instance representing the topic.
+            payload:    A bytes instance representing the message payload.
+            qos:        An integer representing the quality of service (0, 1 or 2).
+            packetId:   An integer representing the packet id, ignored for QoS 0.
+            retain:     A boolean indicating whether the broker should retain the message.
+
+        Returns:
+            A bytes instance representing the packet.
+
+        Raises:
+            None.
+    """
+    body = encodeString(topic);
+
+    if qos:
+        body += struct.pack("!H", packetId);
+
+    return encodePacket(PUBLISH, (qos << 1) | (1 if retain else 0), body + payload);
+
+def decodePublishPacket(flags, body):
+    """
+        Decode the body of an MQTT PUBLISH packet.
+
+        Args:
+            flags:  An integer representing the fixed header flags.
+            body:   A bytes instance representing the variable header and the payload.
+
+        Returns:
+            A (topic, payload, qos, packetId) tuple.
+
+        Raises:
+            None.
+    """
+    qos             = (flags >> 1) & 0x03;
+    topicLength,    = struct.unpack_from("!H", body);
+    topic           = body[2:2 + topicLength].decode("utf-8");
+    offset          = 2 + topicLength;
+    packetId        = 0;
+
+    if qos:
+        packetId,   = struct.unpack_from("!H", body, offset);
+        offset      += 2;
+
+    return topic, body[offset:], qos, packetId;
+
+async def readPacket(reader):
+    """
+        Read an MQTT packet from a stream.
+
+        Args:
+            reader: An asyncio.StreamReader instance.
+
+        Returns:
+            A (packetType, flags, body) tuple.
+
+        Raises:
+            asyncio.IncompleteReadError if the stream is closed.
+            ValueError if the remaining length is malformed.
+    """
+    header          = (await reader.readexactly(1))[0];
+    remainingLength = 0;
+
+    for shift in (0, 7, 14, 21):
+        digit           = (await reader.readexactly(1))[0];
+        remainingLength |= (digit & 0x7F) << shift;
+
+        if not digit & 0x80:
+            break;
+    else:
+        raise ValueError("Malformed MQTT remaining length.");
+
+    body = await reader.readexactly(remainingLength) if remainingLength else b"";
+
+    return header >> 4, header & 0x0F, body;
+
+def topicMatches(topicFilter, topic):
+    """
+        Check whether a topic matches an MQTT topic filter containing '+' and '#' wildcards.
+
+        Args:
+            topicFilter:    A string instance representing the topic filter.
+            topic:          A string instance representing the topic.
+
+        Returns:
+            A boolean indicating whether the topic matches the filter.
+
+        Raises:
+            None.
+    """
+    filterLevels    = topicFilter.split("/");
+    topicLevels     = topic.split("/");
+
+    for index, filterLevel in enumerate(filterLevels):
+        if filterLevel == "#":
+            return True;
+
+        if index >= len(topicLevels) or (filterLevel != "+" and filterLevel != topicLevels[index]):
+            return False;
+
+    return len(filterLevels) == len(topicLevels);
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+class MqttConnection(object):
+    """
+        Minimal asyncio MQTT 3.1.1 client connection publishing QoS 0 messages.
+
+        It is much lighter than one paho client (and its network thread) per
+        connection, which makes it possible to simulate thousands of devices
+        in a single process.
+    """
+
+    def __init__(self):
+        """
+            Initialize the connection.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self.messagesSent   = 0;
+        self.bytesSent      = 0;
+
+        self._reader        = None;
+        self._writer        = None;
+        self._tasks         = [];
+
+    async def connect(self, host, port, clientId, username = None, password = None, keepAlive = 60):
+        """
+            Open the connection and wait for the broker acknowledgement.
+
+            Args:
+                host:       A string instance representing the broker host.
+                port:       An integer representing the broker port.
+                clientId:   A string instance representing the client id.
+                username:   An optional string instance representing the user name.
+                password:   An optional string instance representing the password.
+                keepAlive:  An integer representing the keep alive interval in seconds.
+
+            Returns:
+                None.
+
+            Raises:
+                ConnectionError if the broker refused the connection.
+        """
+        self._reader, self._writer = await asyncio.open_connection(host, port);
+
+        self._writer.write(encodeConnectPacket(clientId, username, password, keepAlive));
+
+        packetType, flags, body = await readPacket(self._reader);
+
+        if packetType != CONNACK or len(body) < 2 or body[1] != 0:
+            self._writer.close();
+
+            raise ConnectionError("The broker refused the connection of %s (return code %s)." % (clientId, body[1] if len(body) > 1 else "?"));
+
+        self._tasks = [asyncio.ensure_future(self._ping(keepAlive)), asyncio.ensure_future(self._discardIncomingPackets())];
+
+    def publish(self, topic, payload):
+        """
+            Queue a QoS 0 message for sending.
+
+            Args:
+                topic:      A string instance representing the topic.
+                payload:    A bytes instance representing the message payload.
+
+            Returns:
+                An integer representing the number of bytes queued.
+
+            Raises:
+                None.
+        """
+        packet = encodePublishPacket(topic, payload);
+
+        self._writer.write(packet);
+
+        self.messagesSent   += 1;
+        self.bytesSent      += len(packet);
+
+        return len(packet);
+
+    async def drain(self):
+        """
+            Wait until the queued messages are handed to the operating system
+            when the write buffer is above its high water mark.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                ConnectionError if the connection was lost.
+        """
+        await self._writer.drain();
+
+    async def disconnect(self):
+        """
+            Send a DISCONNECT packet and close the connection.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        for task in self._tasks:
+            task.cancel();
+
+        if self._writer is not None:
+            try:
+                self._writer.write(encodePacket(DISCONNECT, 0, b""));
+
+                await self._writer.drain();
+            except ConnectionError:
+                pass;
+
+            self._writer.close();
+
+    async def _ping(self, keepAlive):
+        """
+            Send PINGREQ packets so that the broker keeps the connection open.
+        """
+        while True:
+            await asyncio.sleep(keepAlive / 2.0);
+
+            self._writer.write(encodePacket(PINGREQ, 0, b""));
+
+    async def _discardIncomingPackets(self):
+        """
+            Consume the packets sent by the broker (PINGRESP).
+        """
+        try:
+            while True:
+                await readPacket(self._reader);
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass;
+
+
+class MqttBroker(object):
+    """
+        In-process MQTT 3.1.1 broker standing in for the IBM Watson IoT Platform
+        in local tests.
+
+        It accepts any client, acknowledges QoS 1 and 2 publications, and
+        forwards messages to the matching subscribers at QoS 0. Like the
+        platform, it maps the event and command topics of the device clients
+        to the application topics (see getDeviceTopicPrefix). Retained
+        messages, wills and persistent sessions are not supported.
+
+        A bandwidth limit simulates a constrained uplink: the broker stops
+        reading from a client whose packets exceed the limit, so that the
+        client's socket buffers fill up and its publications are delayed as
+        they would be on a slow link.
+    """
+
+    def __init__(self, bandwidthLimit = 0):
+        """
+            Initialize the broker.
+
+            Args:
+                bandwidthLimit: An integer representing the maximum number of bytes per second read from
+                                each client, or 0 for no limit.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self.connectionCount    = 0;
+        self.messagesReceived   = 0;
+        self.bytesReceived      = 0;
+        self.messagesForwarded  = 0;
+        self.messagesDropped    = 0;
+        self.bandwidthLimit     = bandwidthLimit;
+
+        self._server            = None;
+        self._subscriptions     = {};
+        self._devicePrefixes    = {};
+        self._clientTasks       = set();
+
+    async def start(self, host = "127.0.0.1", port = 1883):
+        """
+            Start accepting connections.
+
+            Args:
+                host: A string instance representing the address to listen on.
+                port: An integer representing the port to listen on, or 0 to pick a free port.
+
+            Returns:
+                An integer representing the port the broker listens on.
+
+            Raises:
+                OSError if the address is already in use.
+        """
+        self._server = await asyncio.start_server(self._handleClient, host, port);
+
+        return self._server.sockets[0].getsockname()[1];
+
+    async def stop(self):
+        """
+            Stop accepting connections and close the server.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self._server.close();
+
+        # Close the connections of the clients which did not disconnect
+        for task in list(self._clientTasks):
+            task.cancel();
+
+        await asyncio.gather(*self._clientTasks, return_exceptions=True);
+        await self._server.wait_closed();
+
+    async def _handleClient(self, reader, writer):
+        """
+            Serve the packets of a client until it disconnects.
+        """
+        task = asyncio.current_task();
+
+        self._clientTasks.add(task);
+
+        connected = False;
+
+        try:
+            packetType, flags, body = await readPacket(reader);
+
+            if packetType != CONNECT:
+                return;
+
+            connected = True;
+
+            devicePrefix = getDeviceTopicPrefix(decodeConnectClientId(body));
+
+            if devicePrefix is not None:
+                self._devicePrefixes[writer] = devicePrefix;
+
+            writer.write(encodePacket(CONNACK, 0, b"\x00\x00"));
+
+            self.connectionCount += 1;
+
+            readyTime = time.monotonic();
+
+            while True:
+                packetType, flags, body = await readPacket(reader);
+
+                # Hold the next read until the packet would have crossed the simulated link
+                if self.bandwidthLimit:
+                    now         = time.monotonic();
+                    readyTime   = max(readyTime, now) + (len(body) + 2) / self.bandwidthLimit;
+
+                    if readyTime > now:
+                        await asyncio.sleep(readyTime - now);
+
+                if packetType == PUBLISH:
+                    self._forward(writer, flags, body);
+                elif packetType == PUBREL:
+                    writer.write(encodePacket(PUBCOMP, 0, body[:2]));
+                elif packetType == SUBSCRIBE:
+                    self._subscribe(writer, body);
+                elif packetType == PINGREQ:
+                    writer.write(encodePacket(PINGRESP, 0, b""));
+                elif packetType == DISCONNECT:
+                    break;
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError, struct.error, asyncio.CancelledError):
+            pass;
+        finally:
+            if connected:
+                self.connectionCount -= 1;
+
+            # Only the clients which subscribed to topics are indexed
+            self._subscriptions.pop(writer, None);
+            self._devicePrefixes.pop(writer, None);
+
+            self._clientTasks.discard(task);
+
+            writer.close();
+
+    def _forward(self, writer, flags, body):
+        """
+            Acknowledge a published message and forward it to the matching subscribers.
+        """
+        topic, payload, qos, packetId = decodePublishPacket(flags, body);
+
+        self.messagesReceived   += 1;
+        self.bytesReceived      += len(body);
+
+        if qos == 1:
+            writer.write(encodePacket(PUBACK, 0, struct.pack("!H", packetId)));
+        elif qos == 2:
+            writer.write(encodePacket(PUBREC, 0, struct.pack("!H", packetId)));
+
+        # The events of a device are published to the applications under its type and id
+        devicePrefix = self._devicePrefixes.get(writer);
+
+        if devicePrefix is not None and topic.startswith("iot-2/") and not topic.startswith("iot-2/type/"):
+            topic = devicePrefix + topic[len("iot-2/"):];
+
+        packets = {};
+
+        for subscriber, topicFilters in self._subscriptions.items():
+            # The commands sent to a device are published to it without its type and id
+            subscriberTopic = topic;
+            devicePrefix    = self._devicePrefixes.get(subscriber);
+
+            if devicePrefix is not None and topic.startswith(devicePrefix):
+                subscriberTopic = "iot-2/" + topic[len(devicePrefix):];
+
+            if not any(topicMatches(topicFilter, subscriberTopic) for topicFilter in topicFilters):
+                continue;
+
+            # Drop the messages of subscribers which do not keep up
+            if subscriber.transport.get_write_buffer_size() > MAX_SUBSCRIBER_BUFFER_SIZE:
+                self.messagesDropped += 1;
+
+                continue;
+
+            if subscriberTopic not in packets:
+                packets[subscriberTopic] = encodePublishPacket(subscriberTopic, payload);
+
+            subscriber.write(packets[subscriberTopic]);
+
+            self.messagesForwarded += 1;
+
+    def _subscribe(self, writer, body):
+        """
+            Register the topic filters of a SUBSCRIBE packet and acknowledge them at QoS 0.
+        """
+        packetId,   = struct.unpack_from("!H", body);
+        offset      = 2;
+        grantedQos  = bytearray();
+
+        while offset < len(body):
+            filterLength,   = struct.unpack_from("!H", body, offset);
+            topicFilter     = body[offset + 2:offset + 2 + filterLength].decode("utf-8");
+            offset          += 3 + filterLength;
+
+            self._subscriptions.setdefault(writer, []).append(topicFilter);
+            grantedQos.append(0);
+
+        writer.write(encodePacket(SUBACK, 0, struct.pack("!H", packetId) + bytes(grantedQos)));
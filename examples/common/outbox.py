@@ -0,0 +1,628 @@
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+from common.message_codecs import getMessageCodec
+
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+DEFAULT_OUTBOX_SEGMENT_SIZE = 1024 * 1024;
+DEFAULT_OUTBOX_MAX_SIZE     = 64 * 1024 * 1024;
+DEFAULT_OUTBOX_DRAIN_RATE   = 50.0;
+
+# Record header: payload length and CRC32 of the payload. A zero length marks
+# the end of the records written to a segment.
+RECORD_HEADER       = struct.Struct("<II");
+
+# Read cursor: segment index and offset of the next record to forward
+CURSOR_FORMAT       = struct.Struct("<QQ");
+CURSOR_FILE_NAME    = "cursor";
+
+SEGMENT_FILE_SUFFIX = ".seg";
+
+# Number of seconds the forwarder waits before retrying when disconnected
+RETRY_INTERVAL      = 0.5;
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def openZeroFilledFile(path, size):
+    """
+        Open a file for reading and writing, creating it or extending it with
+        zeros to the given size if needed.
+
+        Args:
+            path:   A string instance representing the file path.
+            size:   An integer representing the minimum file size in bytes.
+
+        Returns:
+            A file object opened in binary mode.
+
+        Raises:
+            OSError if the file cannot be opened.
+    """
+    fileHandle = open(path, "r+b" if os.path.exists(path) else "w+b");
+
+    if os.fstat(fileHandle.fileno()).st_size < size:
+        fileHandle.truncate(size);
+
+    return fileHandle;
+
+def encodeOutboxRecord(event, msgFormat, data):
+    """
+        Serialize a device event into an outbox record: a JSON header holding
+        the event name and format, a newline and the payload encoded using the
+        codec of the format.
+
+        Args:
+            event:      A string instance representing the event name.
+            msgFormat:  A string instance representing the event format.
+            data:       The device event data.
+
+        Returns:
+            A bytes instance representing the record.
+
+        Raises:
+            ValueError if the format is not supported.
+            TypeError if the data cannot be encoded using the codec of the format.
+    """
+    payload = getMessageCodec(msgFormat).encodePayload(data);
+
+    if not isinstance(payload, bytes):
+        payload = payload.encode("utf-8");
+
+    return json.dumps([event, msgFormat]).encode("utf-8") + b"\n" + payload;
+
+def decodeOutboxRecord(record):
+    """
+        Deserialize an outbox record created by encodeOutboxRecord.
+
+        The records stored before the payloads were encoded using the codec of
+        their format, a single JSON array holding the event name, format and
+        data, are still accepted: they never contain a newline.
+
+        Args:
+            record: A bytes instance representing the record.
+
+        Returns:
+            A (event, msgFormat, data) tuple.
+
+        Raises:
+            ValueError if the record is invalid.
+    """
+    header, separator, payload = record.partition(b"\n");
+    header = json.loads(header.decode("utf-8"));
+
+    if not separator:
+        event, msgFormat, data = header;
+
+        return event, msgFormat, data;
+
+    event, msgFormat = header;
+
+    return event, msgFormat, getMessageCodec(msgFormat).decodePayload(payload);
+
+def openDeviceClientOutbox(deviceClient, directory, maxSize = DEFAULT_OUTBOX_MAX_SIZE,
+                           segmentSize = DEFAULT_OUTBOX_SEGMENT_SIZE, drainRate = DEFAULT_OUTBOX_DRAIN_RATE, publisher = None):
+    """
+        Open a store-and-forward outbox publishing the events of an ibmiotf device client.
+
+        Args:
+            deviceClient:   A ibmiotf.device.Client instance.
+            directory:      A string instance representing the directory of the outbox segment files.
+            maxSize:        An integer representing the maximum disk usage of the outbox in bytes.
+            segmentSize:    An integer representing the size of a segment file in bytes.
+            drainRate:      A float representing the maximum number of stored events forwarded per second.
+            publisher:      An optional WindowedPublisher instance through which the events of the client
+                            are published.
+
+        Returns:
+            A StoreAndForwardOutbox instance.
+
+        Raises:
+            ValueError if one of the sizes or the drain rate is invalid.
+            OSError if the directory cannot be used.
+    """
+    ringFile = SegmentRingFile(directory, segmentSize, maxSize);
+
+    print("Opened outbox %s with %d pending events." % (directory, ringFile.pendingCount));
+
+    publishFunction = publisher.publishEvent if publisher is not None else deviceClient.publishEvent;
+
+    return StoreAndForwardOutbox(publishFunction, deviceClient.client.is_connected, ringFile, drainRate);
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+class SegmentRingFile(object):
+    """
+        Persistent FIFO of byte records stored in fixed-size memory-mapped
+        segment files. When the maximum number of segments is reached the
+        oldest segment is evicted, hence the disk usage is bounded by
+        maxSize. Consumed segments are deleted.
+
+        The read cursor is kept in a small memory-mapped file, therefore the
+        records which were not consumed are replayed after a restart. The ring
+        is not thread-safe.
+    """
+
+    def __init__(self, directory, segmentSize = DEFAULT_OUTBOX_SEGMENT_SIZE, maxSize = DEFAULT_OUTBOX_MAX_SIZE):
+        """
+            Open the ring stored in a directory, creating it if needed.
+
+            Args:
+                directory:      A string instance representing the directory of the segment files.
+                segmentSize:    An integer representing the size of a segment file in bytes.
+                maxSize:        An integer representing the maximum total size of the segment files in bytes.
+
+            Returns:
+                None.
+
+            Raises:
+                ValueError if the sizes are invalid.
+                OSError if the directory cannot be used.
+        """
+        if segmentSize <= RECORD_HEADER.size:
+            raise ValueError("The segment size should be greater than %d bytes." % RECORD_HEADER.size);
+
+        if maxSize < 2 * segmentSize:
+            raise ValueError("The maximum size should hold at least two segments.");
+
+        self.directory      = directory;
+        self.segmentSize    = segmentSize;
+        self.maxSegments    = maxSize // segmentSize;
+
+        self.pendingCount   = 0;
+        self.evictedCount   = 0;
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory);
+
+        self._cursorFile    = openZeroFilledFile(os.path.join(directory, CURSOR_FILE_NAME), CURSOR_FORMAT.size);
+        self._cursorMap     = mmap.mmap(self._cursorFile.fileno(), CURSOR_FORMAT.size);
+
+        segmentIndexes          = sorted(int(name[:-len(SEGMENT_FILE_SUFFIX)]) for name in os.listdir(directory)
+                                         if name.endswith(SEGMENT_FILE_SUFFIX));
+        readIndex, readOffset   = CURSOR_FORMAT.unpack_from(self._cursorMap);
+
+        # Resume from the oldest segment if the segment of the cursor was evicted
+        if not segmentIndexes:
+            segmentIndexes = [readIndex];
+        elif readIndex < segmentIndexes[0] or readIndex > segmentIndexes[-1]:
+            readIndex, readOffset = segmentIndexes[0], 0;
+
+        # Delete the segments consumed before the ring was closed
+        for index in segmentIndexes:
+            if index < readIndex:
+                os.remove(self._getSegmentPath(index));
+
+        self._firstIndex    = readIndex;
+        self._readIndex     = readIndex;
+        self._readOffset    = readOffset;
+        self._read          = self._openSegment(readIndex);
+        self._writeIndex    = segmentIndexes[-1];
+        self._write         = self._read if readIndex == self._writeIndex else self._openSegment(self._writeIndex);
+
+        # Count the pending records and find the end of the last segment
+        for index in range(readIndex, self._writeIndex + 1):
+            if index == readIndex:
+                segment = self._read;
+            elif index == self._writeIndex:
+                segment = self._write;
+            else:
+                segment = self._openSegment(index);
+
+            self._writeOffset, count    = self._scanSegment(segment[1], readOffset if index == readIndex else 0);
+            self.pendingCount           += count;
+
+            if segment is not self._read and segment is not self._write:
+                self._closeSegment(segment);
+
+        self._storeCursor();
+
+    @property
+    def size(self):
+        """
+            The number of bytes used by the segment files.
+        """
+        return (self._writeIndex - self._firstIndex + 1) * self.segmentSize;
+
+    def append(self, record):
+        """
+            Append a record, rolling to a new segment when the current one is
+            full and evicting the oldest segment when the ring is full.
+
+            Args:
+                record: A bytes instance representing the record.
+
+            Returns:
+                None.
+
+            Raises:
+                ValueError if the record does not fit in a segment.
+        """
+        recordSize = RECORD_HEADER.size + len(record);
+
+        if recordSize > self.segmentSize:
+            raise ValueError("A record of %d bytes does not fit in a segment of %d bytes." % (len(record), self.segmentSize));
+
+        if self._writeOffset + recordSize > self.segmentSize:
+            self._rollSegment();
+
+        segmentMap  = self._write[1];
+        offset      = self._writeOffset;
+
+        # Write the header last, so that a partially written record is never read
+        segmentMap[offset + RECORD_HEADER.size:offset + recordSize] = record;
+        RECORD_HEADER.pack_into(segmentMap, offset, len(record), zlib.crc32(record) & 0xffffffff);
+
+        if offset + recordSize + RECORD_HEADER.size <= self.segmentSize:
+            RECORD_HEADER.pack_into(segmentMap, offset + recordSize, 0, 0);
+
+        self._writeOffset   += recordSize;
+        self.pendingCount   += 1;
+
+    def peek(self):
+        """
+            Get the oldest pending record without consuming it.
+
+            Args:
+                None.
+
+            Returns:
+                A bytes instance representing the record, or None if the ring is empty.
+
+            Raises:
+                None.
+        """
+        while self.pendingCount:
+            record = self._readRecord(self._read[1], self._readOffset);
+
+            if record is not None:
+                return record;
+
+            # The current segment is consumed
+            if self._readIndex == self._writeIndex:
+                break;
+
+            self._deleteSegment(self._readIndex);
+            self._readIndex, self._readOffset = self._readIndex + 1, 0;
+            self._read = self._write if self._readIndex == self._writeIndex else self._openSegment(self._readIndex);
+            self._storeCursor();
+
+        self.pendingCount = 0;
+
+        return None;
+
+    def advance(self):
+        """
+            Consume the record returned by the last call to peek.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        length, _           = RECORD_HEADER.unpack_from(self._read[1], self._readOffset);
+        self._readOffset    += RECORD_HEADER.size + length;
+        self.pendingCount   -= 1;
+
+        self._storeCursor();
+
+    def flush(self):
+        """
+            Write the memory-mapped segment and cursor pages to the disk.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self._write[1].flush();
+        self._cursorMap.flush();
+
+    def close(self):
+        """
+            Flush and close the segment and cursor files.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self.flush();
+
+        if self._read is not self._write:
+            self._closeSegment(self._read);
+
+        self._closeSegment(self._write);
+        self._cursorMap.close();
+        self._cursorFile.close();
+
+    def _rollSegment(self):
+        """Start a new write segment, evicting the oldest segment if the ring is full."""
+        if self._writeIndex - self._firstIndex + 1 >= self.maxSegments:
+            self._evictOldestSegment();
+
+        self._write[1].flush();
+
+        if self._write is not self._read:
+            self._closeSegment(self._write);
+
+        self._writeIndex    += 1;
+        self._writeOffset   = 0;
+        self._write         = self._openSegment(self._writeIndex);
+
+    def _evictOldestSegment(self):
+        """Delete the oldest segment, discarding its pending records."""
+        if self._readIndex == self._firstIndex:
+            _, count            = self._scanSegment(self._read[1], self._readOffset);
+            self.pendingCount   -= count;
+            self.evictedCount   += count;
+
+            self._deleteSegment(self._firstIndex);
+            self._readIndex, self._readOffset = self._firstIndex, 0;
+            self._read = self._openSegment(self._readIndex) if self._readIndex != self._writeIndex else self._write;
+            self._storeCursor();
+        else:
+            self._deleteSegment(self._firstIndex);
+
+    def _deleteSegment(self, index):
+        """Delete a segment file, which should be the oldest one."""
+        if index == self._readIndex:
+            self._closeSegment(self._read);
+
+        os.remove(self._getSegmentPath(index));
+
+        self._firstIndex = index + 1;
+
+    def _readRecord(self, segmentMap, offset):
+        """Get the record at an offset of a segment, or None at the end of the segment."""
+        if offset + RECORD_HEADER.size > self.segmentSize:
+            return None;
+
+        length, checksum = RECORD_HEADER.unpack_from(segmentMap, offset);
+
+        if length == 0 or offset + RECORD_HEADER.size + length > self.segmentSize:
+            return None;
+
+        record = segmentMap[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + length];
+
+        # A record torn by a crash ends the segment
+        if zlib.crc32(record) & 0xffffffff != checksum:
+            return None;
+
+        return record;
+
+    def _scanSegment(self, segmentMap, offset):
+        """Get the end offset and the number of records of a segment from an offset."""
+        count = 0;
+
+        while True:
+            record = self._readRecord(segmentMap, offset);
+
+            if record is None:
+                return offset, count;
+
+            offset  += RECORD_HEADER.size + len(record);
+            count   += 1;
+
+    def _storeCursor(self):
+        """Store the read cursor in its memory-mapped file."""
+        CURSOR_FORMAT.pack_into(self._cursorMap, 0, self._readIndex, self._readOffset);
+
+    def _getSegmentPath(self, index):
+        """Get the path of a segment file."""
+        return os.path.join(self.directory, "%010d%s" % (index, SEGMENT_FILE_SUFFIX));
+
+    def _openSegment(self, index):
+        """Open and map a segment file, creating it if needed."""
+        segmentFile = openZeroFilledFile(self._getSegmentPath(index), self.segmentSize);
+
+        return segmentFile, mmap.mmap(segmentFile.fileno(), self.segmentSize);
+
+    def _closeSegment(self, segment):
+        """Unmap and close a segment file."""
+        segmentFile, segmentMap = segment;
+
+        if not segmentMap.closed:
+            segmentMap.close();
+            segmentFile.close();
+
+
+class StoreAndForwardOutbox(object):
+    """
+        Publisher storing the device events in a SegmentRingFile while the
+        device client is disconnected and forwarding them in order, at a
+        limited rate, once it is connected again.
+
+        Events are published directly while the client is connected and the
+        ring is empty. Otherwise they are appended to the ring, so that they
+        are never published out of order.
+    """
+
+    def __init__(self, publishFunction, isConnectedFunction, ringFile, drainRate = DEFAULT_OUTBOX_DRAIN_RATE):
+        """
+            Initialize the outbox and start its forwarder thread.
+
+            Args:
+                publishFunction:        A callable taking an event name, a format and a payload and
+                                        returning whether the event was published.
+                isConnectedFunction:    A callable returning whether the device client is connected.
+                ringFile:               A SegmentRingFile instance storing the pending events.
+                drainRate:              A float representing the maximum number of stored events forwarded per second.
+
+            Returns:
+                None.
+
+            Raises:
+                ValueError if the drain rate is not positive.
+        """
+        if drainRate <= 0:
+            raise ValueError("The drain rate should be positive.");
+
+        self.publishFunction        = publishFunction;
+        self.isConnectedFunction    = isConnectedFunction;
+        self.ringFile               = ringFile;
+        self.drainRate              = drainRate;
+
+        self.publishedCount = 0;
+        self.storedCount    = 0;
+        self.forwardedCount = 0;
+        self.discardedCount = 0;
+
+        self._lock          = threading.Lock();
+        self._stopEvent     = threading.Event();
+        self._pendingEvent  = threading.Event();
+
+        if ringFile.pendingCount:
+            self._pendingEvent.set();
+
+        self._thread        = threading.Thread(target=self._forwardStoredEvents, name="outbox");
+        self._thread.daemon = True;
+        self._thread.start();
+
+    def publish(self, event, msgFormat, data):
+        """
+            Publish a device event, or store it if it cannot be published now.
+
+            Args:
+                event:      A string instance representing the event name.
+                msgFormat:  A string instance representing the event format.
+                data:       The device event data, which can be encoded using the codec of the format.
+
+            Returns:
+                None.
+
+            Raises:
+                ValueError if the event is too large to be stored.
+        """
+        with self._lock:
+            if not self.ringFile.pendingCount and self.isConnectedFunction() and self.publishFunction(event, msgFormat, data):
+                self.publishedCount += 1;
+
+                return;
+
+            self.ringFile.append(encodeOutboxRecord(event, msgFormat, data));
+
+            self.storedCount += 1;
+
+        self._pendingEvent.set();
+
+    def close(self):
+        """
+            Stop the forwarder thread and close the ring. The events which
+            were not forwarded are forwarded the next time the ring is opened.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self._stopEvent.set();
+        self._pendingEvent.set();
+        self._thread.join();
+
+        with self._lock:
+            self.ringFile.close();
+
+    def getStatisticsReport(self):
+        """
+            Get a one line report of the outbox counters.
+
+            Args:
+                None.
+
+            Returns:
+                A string instance representing the report.
+
+            Raises:
+                None.
+        """
+        with self._lock:
+            return "outbox: %d published, %d stored, %d forwarded, %d discarded, %d evicted, %d pending (%d KB on disk)" % (
+                self.publishedCount, self.storedCount, self.forwardedCount, self.discardedCount, self.ringFile.evictedCount,
+                self.ringFile.pendingCount, self.ringFile.size // 1024
+            );
+
+    def _forwardStoredEvents(self):
+        """
+            Forward the stored events in order, no faster than the drain rate. A record which cannot
+            be decoded or published is discarded, so that it does not block the following ones.
+        """
+        period      = 1.0 / self.drainRate;
+        nextTime    = time.monotonic();
+
+        while not self._stopEvent.is_set():
+            self._pendingEvent.wait();
+
+            if self._stopEvent.is_set():
+                return;
+
+            if not self.isConnectedFunction():
+                self._stopEvent.wait(RETRY_INTERVAL);
+
+                continue;
+
+            with self._lock:
+                record = self.ringFile.peek();
+
+                if record is None:
+                    self._pendingEvent.clear();
+
+                    continue;
+
+                try:
+                    event, msgFormat, data = decodeOutboxRecord(record);
+
+                    isForwarded = self.publishFunction(event, msgFormat, data);
+                except Exception as exception:
+                    print("Discarding outbox record: %s" % str(exception));
+
+                    self.ringFile.advance();
+
+                    self.discardedCount += 1;
+
+                    continue;
+
+                if isForwarded:
+                    self.ringFile.advance();
+
+                    self.forwardedCount += 1;
+
+            if not isForwarded:
+                self._stopEvent.wait(RETRY_INTERVAL);
+
+                continue;
+
+            # Pace the replay, without bursting after a long idle period
+            nextTime = max(nextTime, time.monotonic()) + period;
+
+            self._stopEvent.wait(max(0.0, nextTime - time.monotonic()));
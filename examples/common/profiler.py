@@ -0,0 +1,523 @@
+import datetime
+import math
+import os
+import sys
+import threading
+import time
+
+from common.metrics import STAGE_DURATION
+
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+# File to which the profile is appended, and number of seconds between two dumps
+DEFAULT_PROFILE_OUTPUT      = "wiotp_profile.txt";
+DEFAULT_PROFILE_INTERVAL    = 10.0;
+
+# Number of functions listed by a dump of the sampling profiler
+DEFAULT_PROFILE_TOP = 20;
+
+# Number of seconds between two samples of the thread stacks (100 Hz)
+DEFAULT_SAMPLING_INTERVAL = 0.01;
+
+# Fraction of the sampling interval below which the CPU time used by a thread is the one of a wake-up from a
+# wait, the sample of the thread being then idle
+IDLE_CPU_FRACTION = 0.05;
+
+# (file name, function name) of the standard library functions in which the threads block
+IDLE_FUNCTIONS = frozenset([("threading.py", "wait"), ("selectors.py", "select")]);
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+class SamplingProfiler(object):
+    """
+        Statistical profiler periodically sampling the stacks of all the
+        threads of the process from a daemon thread. Unlike cProfile, which
+        only follows the thread which enabled it, it sees the pipeline,
+        dispatch and MQTT client threads, and its cost does not depend on the
+        number of function calls.
+
+        A function is counted once per sample in which it is on the stack of a
+        thread (total), and once more if it is the running function (self).
+        The samples of the threads blocked in a wait of the standard library,
+        and where the CPU time of the threads can be read (Unix) of those which
+        barely ran since the previous sample, are counted as idle instead,
+        hence the threads waiting for events or for the network do not hide
+        the functions using the CPU.
+    """
+
+    def __init__(self, samplingInterval = DEFAULT_SAMPLING_INTERVAL):
+        """
+            Initialize the profiler without sampling.
+
+            Args:
+                samplingInterval: A float representing the number of seconds between two samples.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self.samplingInterval   = samplingInterval;
+
+        self.sampleCount        = 0;
+        self.idleSampleCount    = 0;
+        self.sampledTime        = 0.0;
+
+        self._selfCounts        = {};
+        self._totalCounts       = {};
+        self._threadIds         = set();
+        self._lock              = threading.Lock();
+        self._stopEvent         = threading.Event();
+        self._thread            = None;
+
+    @property
+    def isSampling(self):
+        """
+            Whether the profiler is sampling the stacks.
+        """
+        return self._thread is not None and self._thread.is_alive();
+
+    def start(self, duration):
+        """
+            Sample the stacks for a bounded duration.
+
+            Args:
+                duration: A float representing the number of seconds during which the stacks are sampled.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self._thread        = threading.Thread(target=self._sampleStacks, args=(duration,), name="sampling-profiler");
+        self._thread.daemon = True;
+        self._thread.start();
+
+    def stop(self):
+        """
+            Stop sampling the stacks.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self._stopEvent.set();
+
+        if self._thread is not None:
+            self._thread.join();
+
+    def getTopFunctions(self, count):
+        """
+            Get the functions found in the most samples.
+
+            Args:
+                count: An integer representing the maximum number of functions.
+
+            Returns:
+                A list of (function description, self samples, total samples) tuples, by decreasing
+                number of self samples then total samples.
+
+            Raises:
+                None.
+        """
+        with self._lock:
+            counts = [(self._selfCounts.get(code, 0), totalCount, code) for code, totalCount in self._totalCounts.items()];
+
+        counts.sort(key=lambda functionCounts: functionCounts[:2], reverse=True);
+
+        return [(describeCode(code), selfCount, totalCount) for selfCount, totalCount, code in counts[:count]];
+
+    def getReport(self, count):
+        """
+            Get a report of the functions found in the most samples.
+
+            Args:
+                count: An integer representing the maximum number of functions.
+
+            Returns:
+                A string instance representing the report.
+
+            Raises:
+                None.
+        """
+        with self._lock:
+            sampleCount     = self.sampleCount;
+            idleSampleCount = self.idleSampleCount;
+            threadCount     = len(self._threadIds);
+
+        lines = ["Top functions (%d samples of %d threads over %.1f s, %d idle samples not counted%s)" % (
+                     sampleCount, threadCount, self.sampledTime, idleSampleCount, ", sampling" if self.isSampling else ""),
+                 "%8s %8s  %s" % ("self %", "total %", "function")];
+
+        for description, selfCount, totalCount in self.getTopFunctions(count):
+            lines.append("%8.1f %8.1f  %s" % (100.0 * selfCount / sampleCount, 100.0 * totalCount / sampleCount, description));
+
+        return "\n".join(lines);
+
+    def _sampleStacks(self, duration):
+        """
+            Sample the stacks of the other threads until the duration elapsed or the profiler is stopped.
+        """
+        ownThreadId = threading.get_ident();
+        startTime   = time.monotonic();
+        cpuTimes    = {};
+        idleCpuTime = IDLE_CPU_FRACTION * self.samplingInterval;
+
+        while not self._stopEvent.wait(self.samplingInterval):
+            frames = sys._current_frames();
+
+            with self._lock:
+                for threadId, frame in frames.items():
+                    if threadId == ownThreadId:
+                        continue;
+
+                    self._threadIds.add(threadId);
+
+                    cpuTime         = getThreadCpuTime(threadId);
+                    lastCpuTime     = cpuTimes.get(threadId);
+
+                    cpuTimes[threadId] = cpuTime;
+
+                    code = frame.f_code;
+
+                    if ((os.path.basename(code.co_filename), code.co_name) in IDLE_FUNCTIONS or
+                        (cpuTime is not None and lastCpuTime is not None and cpuTime - lastCpuTime < idleCpuTime)):
+                        self.idleSampleCount += 1;
+
+                        continue;
+
+                    self.sampleCount += 1;
+
+                    self._selfCounts[code] = self._selfCounts.get(code, 0) + 1;
+
+                    # Recursive functions are only counted once per stack
+                    stackCodes = set();
+
+                    while frame is not None:
+                        code = frame.f_code;
+
+                        if code not in stackCodes:
+                            stackCodes.add(code);
+
+                            self._totalCounts[code] = self._totalCounts.get(code, 0) + 1;
+
+                        frame = frame.f_back;
+
+            # The frames would otherwise be kept alive until the next sample
+            del frames, frame;
+
+            self.sampledTime = time.monotonic() - startTime;
+
+            if self.sampledTime >= duration:
+                return;
+
+
+class StageProfiler(object):
+    """
+        Profiler of the processing stages of a sample application. The stages
+        are timed by the histograms of the stage duration metric, hence the
+        stages already recorded by the common modules (publish, acknowledge,
+        callback, capture, encode, decode) are profiled without further
+        instrumentation, and `wrap` times the other hot functions.
+
+        The calls, total time and approximate percentiles of each stage over
+        the last interval are appended periodically to a text file, followed by
+        the top functions of the sampling profiler if it was requested, and
+        the whole run is summarized when the profiler is closed.
+    """
+
+    def __init__(self, outputPath, dumpInterval = DEFAULT_PROFILE_INTERVAL, samplingDuration = 0.0, topCount = DEFAULT_PROFILE_TOP,
+                 stageFamily = STAGE_DURATION):
+        """
+            Open the profile file and start dumping the profile periodically.
+
+            Args:
+                outputPath:         A string instance representing the path of the file to which the profile is appended.
+                dumpInterval:       A float representing the number of seconds between two dumps.
+                samplingDuration:   A float representing the number of seconds during which the stacks of the threads
+                                    are sampled from the start, 0 not to sample them.
+                topCount:           An integer representing the number of functions listed by the dumps.
+                stageFamily:        A MetricFamily instance of histograms, labeled by stage, timing the stages.
+
+            Returns:
+                None.
+
+            Raises:
+                IOError if the profile file cannot be opened.
+        """
+        self.outputPath         = outputPath;
+        self.dumpInterval       = dumpInterval;
+        self.topCount           = topCount;
+        self.stageFamily        = stageFamily;
+
+        self._file              = open(outputPath, "a");
+        self._lock              = threading.Lock();
+        self._stopEvent         = threading.Event();
+
+        self._writeHeader();
+
+        self._startTime         = time.monotonic();
+        self._startSnapshots    = self._takeSnapshots();
+        self._lastDumpTime      = self._startTime;
+        self._lastSnapshots     = self._startSnapshots;
+
+        self.samplingProfiler   = None;
+
+        if samplingDuration > 0:
+            self.samplingProfiler = SamplingProfiler();
+            self.samplingProfiler.start(samplingDuration);
+
+        self._thread            = threading.Thread(target=self._dumpPeriodically, name="profiler");
+        self._thread.daemon     = True;
+        self._thread.start();
+
+    def wrap(self, stage, function):
+        """
+            Wrap a function such that the duration of each of its calls is recorded in a stage.
+
+            Args:
+                stage:      A string instance representing the stage name.
+                function:   A callable.
+
+            Returns:
+                A callable taking the same arguments and returning the same value as the function.
+
+            Raises:
+                None.
+        """
+        return self.stageFamily.labels(stage).wrap(function);
+
+    def dump(self):
+        """
+            Append the stage breakdown since the last dump, and the top functions, to the profile file.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        with self._lock:
+            dumpTime    = time.monotonic();
+            snapshots   = self._takeSnapshots();
+
+            self._write("Profile over %.1f s" % (dumpTime - self._lastDumpTime), self._lastSnapshots, snapshots,
+                        dumpTime - self._lastDumpTime);
+
+            self._lastDumpTime  = dumpTime;
+            self._lastSnapshots = snapshots;
+
+    def close(self):
+        """
+            Stop the periodic dumps and the sampling, append the profile of the whole run and close the file.
+
+            Args:
+                None.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self._stopEvent.set();
+        self._thread.join();
+
+        if self.samplingProfiler is not None:
+            self.samplingProfiler.stop();
+
+        with self._lock:
+            dumpTime = time.monotonic();
+
+            self._write("Profile of the whole run over %.1f s" % (dumpTime - self._startTime), self._startSnapshots,
+                        self._takeSnapshots(), dumpTime - self._startTime);
+
+            self._file.close();
+
+        print("Wrote the profile to %s." % self.outputPath);
+
+    def _takeSnapshots(self):
+        """Get the bucket counts and duration sum of each stage."""
+        return dict((",".join(labelValues), histogram.getSnapshot()) for labelValues, histogram in self.stageFamily.getChildren());
+
+    def _write(self, title, startSnapshots, endSnapshots, elapsedTime):
+        """Append the stage breakdown between two snapshots, and the top functions, to the profile file."""
+        lines = ["=== %s at %s ===" % (title, datetime.datetime.now().isoformat(timespec="seconds")),
+                 "%-16s %10s %10s %10s %8s %10s %10s %10s" % ("stage", "calls", "calls/s", "total s", "busy %", "mean ms",
+                                                             "p50 ms <=", "p99 ms <=")];
+
+        for stage, (endCounts, endSum) in sorted(endSnapshots.items()):
+            startCounts, startSum = startSnapshots.get(stage, ([0] * len(endCounts), 0.0));
+
+            counts      = [endCount - startCount for endCount, startCount in zip(endCounts, startCounts)];
+            callCount   = sum(counts);
+            totalTime   = endSum - startSum;
+
+            if not callCount:
+                continue;
+
+            # The stages run concurrently by several threads can be busy more than 100% of the time
+            lines.append("%-16s %10d %10.1f %10.3f %8.1f %10.3f %10s %10s" % (
+                stage, callCount, callCount / elapsedTime, totalTime, 100.0 * totalTime / elapsedTime, 1000.0 * totalTime / callCount,
+                formatBucketBound(estimatePercentile(self.stageFamily.upperBounds, counts, 50)),
+                formatBucketBound(estimatePercentile(self.stageFamily.upperBounds, counts, 99))
+            ));
+
+        if self.samplingProfiler is not None:
+            lines.append(self.samplingProfiler.getReport(self.topCount));
+
+        self._file.write("\n".join(lines) + "\n\n");
+        self._file.flush();
+
+    def _writeHeader(self):
+        """Append the program, platform and command line of the profiled run to the profile file."""
+        import platform;
+
+        self._file.write("### %s started at %s, Python %s on %s, %s CPUs\n### %s\n\n" % (
+            os.path.basename(sys.argv[0]), datetime.datetime.now().isoformat(timespec="seconds"), platform.python_version(),
+            platform.platform(), os.cpu_count(), " ".join(sys.argv[1:])
+        ));
+        self._file.flush();
+
+    def _dumpPeriodically(self):
+        """
+            Dump the profile periodically until the profiler is closed.
+        """
+        while not self._stopEvent.wait(self.dumpInterval):
+            self.dump();
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def describeCode(code):
+    """
+        Describe the function of a code object by its name, module file and line.
+
+        Args:
+            code: A code object.
+
+        Returns:
+            A string instance, e.g. "publishEvent (common/windowed_publisher.py:120)".
+
+        Raises:
+            None.
+    """
+    # The directory of the file is kept to tell the common modules from the sample scripts, but not the whole path
+    # which depends on the host
+    fileName = os.path.join(os.path.basename(os.path.dirname(code.co_filename)), os.path.basename(code.co_filename));
+
+    return "%s (%s:%d)" % (code.co_name, fileName, code.co_firstlineno);
+
+def getThreadCpuTime(threadId):
+    """
+        Get the CPU time used by a thread.
+
+        Args:
+            threadId: An integer representing the thread identifier, as returned by threading.get_ident.
+
+        Returns:
+            A float representing the number of seconds, or None if the CPU time of the threads cannot be read.
+
+        Raises:
+            None.
+    """
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(threadId));
+    except (AttributeError, OSError, OverflowError):
+        return None;
+
+def estimatePercentile(upperBounds, counts, percentile):
+    """
+        Estimate a percentile of the values counted in histogram buckets.
+
+        Args:
+            upperBounds:    A sequence of floats representing the bucket upper bounds, in increasing order.
+            counts:         A list of integers representing the non-cumulative bucket counts, the last one
+                            counting the values above the last upper bound.
+            percentile:     A number between 0 and 100.
+
+        Returns:
+            A float representing the upper bound of the bucket holding the percentile, math.inf if above
+            the last upper bound.
+
+        Raises:
+            None.
+    """
+    rank        = percentile / 100.0 * sum(counts);
+    cumulative  = 0;
+
+    for upperBound, count in zip(tuple(upperBounds) + (math.inf,), counts):
+        cumulative += count;
+
+        if count and cumulative >= rank:
+            return upperBound;
+
+    return math.inf;
+
+def formatBucketBound(upperBound):
+    """
+        Format a bucket upper bound in milliseconds.
+
+        Args:
+            upperBound: A float representing the upper bound in seconds.
+
+        Returns:
+            A string instance.
+
+        Raises:
+            None.
+    """
+    if math.isinf(upperBound):
+        return "inf";
+
+    return "%g" % (1000.0 * upperBound);
+
+def startProfiler(enabled, outputPath, dumpInterval, samplingDuration, topCount):
+    """
+        Profile the processing stages of a sample application, if requested.
+
+        Args:
+            enabled:            A boolean indicating whether the profiling is requested.
+            outputPath:         A string instance representing the path of the file to which the profile is appended.
+            dumpInterval:       A float representing the number of seconds between two dumps.
+            samplingDuration:   A float representing the number of seconds during which the stacks of the threads
+                                are sampled from the start, 0 not to sample them.
+            topCount:           An integer representing the number of functions listed by the dumps.
+
+        Returns:
+            A StageProfiler instance, or None if the profiling is disabled.
+
+        Raises:
+            None.
+    """
+    if not enabled:
+        return None;
+
+    try:
+        profiler = StageProfiler(outputPath, dumpInterval, samplingDuration, topCount);
+    except (IOError, OSError) as exception:
+        print("Could not write the profile to %s: %s" % (outputPath, str(exception)));
+
+        return None;
+
+    print("Writing the profile to %s every %g s." % (outputPath, dumpInterval));
+
+    return profiler;
@@ -0,0 +1,226 @@
+import collections
+import math
+import time
+
+from common.latency import REPORTED_PERCENTILES, getPercentile
+from common.metrics import SCHEDULE_LATENESS
+
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+# Policies of the ticks missed by a caller which fell behind the schedule: fire them at once, such that the
+# number of ticks matches the rate over the run, or drop them and resume at the next deadline
+CATCH_UP_POLICY     = "catch-up";
+SKIP_POLICY         = "skip";
+SCHEDULE_POLICIES   = (CATCH_UP_POLICY, SKIP_POLICY);
+
+DEFAULT_SCHEDULE_POLICY = CATCH_UP_POLICY;
+
+# Number of seconds before a deadline from which the scheduler spins instead of sleeping, the sleeps of the
+# operating system waking up tens of microseconds late
+DEFAULT_SPIN_THRESHOLD = 0.0002;
+
+# Number of tick delays kept to compute the jitter percentiles
+JITTER_SAMPLES = 10000;
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+class RateScheduler(object):
+    """
+        Timer firing ticks at a fixed rate, from below one per second to
+        several thousands per second. The deadline of the tick n is the start
+        time plus n periods on the monotonic clock, hence the time spent
+        handling a tick, or a tick fired late, does not push the following
+        deadlines back and the rate does not drift.
+
+        The scheduler sleeps until shortly before each deadline and spins for
+        the remaining time, since a sleep may wake up late. When the caller
+        falls behind by a period or more, the missed ticks are fired at once
+        or skipped, depending on the policy. The delay of each tick after its
+        deadline, i.e. its jitter, and the achieved rate are reported.
+    """
+
+    def __init__(self, rate, policy = DEFAULT_SCHEDULE_POLICY, spinThreshold = DEFAULT_SPIN_THRESHOLD):
+        """
+            Initialize the scheduler.
+
+            Args:
+                rate:           A float representing the number of ticks per second.
+                policy:         CATCH_UP_POLICY or SKIP_POLICY.
+                spinThreshold:  A float representing the number of seconds before a deadline from which
+                                the scheduler spins instead of sleeping, 0 to only sleep.
+
+            Returns:
+                None.
+
+            Raises:
+                ValueError if the rate, the policy or the spin threshold is invalid.
+        """
+        if not rate > 0 or math.isinf(rate):
+            raise ValueError("The rate should be positive.");
+
+        if policy not in SCHEDULE_POLICIES:
+            raise ValueError("Unknown schedule policy %s." % policy);
+
+        if spinThreshold < 0:
+            raise ValueError("The spin threshold should not be negative.");
+
+        self.rate           = rate;
+        self.policy         = policy;
+        self.spinThreshold  = spinThreshold;
+
+        self.firedCount     = 0;
+        self.skippedCount   = 0;
+        self.behindCount    = 0;
+        self.maxLateness    = 0.0;
+
+        self._startTime     = None;
+        self._firstTickTime = None;
+        self._lastTickTime  = None;
+        self._latenesses    = collections.deque(maxlen=JITTER_SAMPLES);
+
+        # Running mean and sum of squared deviations of the intervals between ticks (Welford's algorithm)
+        self._intervalCount = 0;
+        self._intervalMean  = 0.0;
+        self._intervalM2    = 0.0;
+
+        self._lateness      = SCHEDULE_LATENESS.labels();
+
+    def ticks(self, count = None):
+        """
+            Wait for the successive ticks of a schedule starting now.
+
+            Args:
+                count: An optional integer representing the number of deadlines of the schedule, the
+                       skipped ticks included, None for no limit.
+
+            Returns:
+                A generator of integers representing the index of each fired tick.
+
+            Raises:
+                None.
+        """
+        self._startTime = time.monotonic();
+
+        index = 0;
+
+        while count is None or index < count:
+            deadline    = self._getDeadline(index);
+            now         = time.monotonic();
+
+            if now < deadline:
+                self._sleepUntil(deadline);
+
+                now = time.monotonic();
+            elif now - deadline >= 1.0 / self.rate:
+                self.behindCount += 1;
+
+                # Resume at the last deadline which is not a period behind
+                if self.policy == SKIP_POLICY:
+                    missedCount = int((now - deadline) * self.rate);
+
+                    if count is not None:
+                        missedCount = min(missedCount, count - index);
+
+                    index               += missedCount;
+                    self.skippedCount   += missedCount;
+
+                    if count is not None and index >= count:
+                        break;
+
+                    deadline = self._getDeadline(index);
+
+            self._recordTick(now, now - deadline);
+
+            yield index;
+
+            index += 1;
+
+    def getAchievedRate(self):
+        """
+            Get the number of ticks fired per second between the first and the last tick.
+
+            Args:
+                None.
+
+            Returns:
+                A float representing the achieved rate, 0 if less than two ticks were fired.
+
+            Raises:
+                None.
+        """
+        if self.firedCount < 2:
+            return 0.0;
+
+        return (self.firedCount - 1) / max(self._lastTickTime - self._firstTickTime, 1e-9);
+
+    def getStatisticsReport(self):
+        """
+            Get a one line report of the achieved rate, the skipped ticks and the tick jitter.
+
+            Args:
+                None.
+
+            Returns:
+                A string instance representing the report.
+
+            Raises:
+                None.
+        """
+        report = "scheduler (%g ticks/s, %s): %d fired, %d skipped, %d behind, achieved %.2f ticks/s" % (
+            self.rate, self.policy, self.firedCount, self.skippedCount, self.behindCount, self.getAchievedRate()
+        );
+
+        latenesses = sorted(self._latenesses);
+
+        if latenesses:
+            report += ", jitter %s max %.3f ms" % (
+                " ".join("p%d %.3f" % (percentile, 1000.0 * getPercentile(latenesses, percentile))
+                         for percentile in REPORTED_PERCENTILES),
+                1000.0 * self.maxLateness
+            );
+
+        if self._intervalCount > 1:
+            report += ", interval mean %.3f sd %.3f ms" % (
+                1000.0 * self._intervalMean, 1000.0 * math.sqrt(self._intervalM2 / (self._intervalCount - 1))
+            );
+
+        return report;
+
+    def _getDeadline(self, index):
+        """Get the deadline of a tick, computed from its index so that the rounding errors do not accumulate."""
+        return self._startTime + index / self.rate;
+
+    def _sleepUntil(self, deadline):
+        """Sleep until shortly before the deadline, then spin until the deadline."""
+        remainingTime = deadline - time.monotonic();
+
+        if remainingTime > self.spinThreshold:
+            time.sleep(remainingTime - self.spinThreshold);
+
+        while time.monotonic() < deadline:
+            pass;
+
+    def _recordTick(self, tickTime, lateness):
+        """Record the delay of a fired tick after its deadline and the interval since the previous tick."""
+        self.firedCount     += 1;
+        self.maxLateness    = max(self.maxLateness, lateness);
+
+        self._latenesses.append(lateness);
+        self._lateness.observe(lateness);
+
+        if self._lastTickTime is None:
+            self._firstTickTime = tickTime;
+        else:
+            interval            = tickTime - self._lastTickTime;
+            self._intervalCount += 1;
+            delta               = interval - self._intervalMean;
+            self._intervalMean  += delta / self._intervalCount;
+            self._intervalM2    += delta * (interval - self._intervalMean);
+
+        self._lastTickTime = tickTime;
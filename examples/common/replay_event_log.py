@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+
+import collections
+import itertools
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir));
+
+from common.event_log import EventLogReader, openEventLog
+from common.gateway_publisher import AttachedDevice, openDeviceRegistry
+from common.latency import BENCHMARK_SEQUENCE_KEY, stampPayload
+from common.message_codecs import getMessageCodec
+from common.metrics import startMetricsServer
+from common.profiler import startProfiler
+from common.runtime import DEVICE_CLIENT, addGatewayArguments, createArgumentParser, initDeviceClient, initGatewayClient, parseArguments
+from common.windowed_publisher import openDeviceClientPublisher, openGatewayClientPublisher
+
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+# Factor applied to the pace of the logged events, 0 to replay them as fast as possible
+DEFAULT_REPLAY_SPEED = 1.0;
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def getDeviceEventData(msgFormat, payload, benchmarkSequence):
+    """
+        Get the data of a logged device event, with fresh benchmark fields if it carries some.
+
+        The benchmark fields of the logged events hold their original sequence number and send time,
+        hence they are replaced such that the receivers measure the latency and loss of the replay.
+
+        Args:
+            msgFormat:          A string instance representing the logged event format.
+            payload:            A bytes instance representing the logged payload.
+            benchmarkSequence:  An iterator of the sequence numbers of the device publishing the event.
+
+        Returns:
+            The device event data.
+
+        Raises:
+            ValueError if the payload is invalid.
+    """
+    data = getMessageCodec(msgFormat).decodePayload(payload);
+
+    if isinstance(data, dict) and BENCHMARK_SEQUENCE_KEY in data:
+        stampPayload(data, next(benchmarkSequence));
+
+    return data;
+
+def getDevicePublisher(device):
+    """
+        Get the publisher of the replayed events of a logged device.
+
+        A device client publishes all the events as its own device, while a gateway client
+        publishes the events of each logged device on its behalf.
+
+        Args:
+            device: A string instance representing the "type:id" key of the logged device.
+
+        Returns:
+            The WindowedPublisher instance of the device client, or an AttachedDevice instance.
+
+        Raises:
+            None.
+    """
+    if not options.gateway:
+        return publisher;
+
+    devicePublisher = devicePublishers.get(device);
+
+    if devicePublisher is None:
+        deviceType, _, deviceId     = device.partition(":");
+        devicePublisher             = AttachedDevice(publisher, deviceType, deviceId, deviceRegistry);
+        devicePublishers[device]    = devicePublisher;
+
+    return devicePublisher;
+
+def replayEvents(reader, startIndex, endIndex):
+    """
+        Publish a range of the logged events through the publisher, at the requested speed.
+
+        Each event is published at its logged time relative to the first event of the range divided by
+        the speed. The events which are late, because publishing is slower than the logged pace, are
+        published at once without skipping any.
+
+        Args:
+            reader:     An EventLogReader instance.
+            startIndex: An integer representing the index of the first event.
+            endIndex:   An integer representing the index following the last event.
+
+        Returns:
+            A generator of floats representing, for each published event, the number of seconds it
+            was published late.
+
+        Raises:
+            None.
+    """
+    firstTimestamp  = reader.getTimestamp(startIndex);
+    startTime       = time.monotonic();
+
+    for index in range(startIndex, endIndex):
+        lag = 0.0;
+
+        if options.replaySpeed > 0:
+            delay = startTime + (reader.getTimestamp(index) - firstTimestamp) / options.replaySpeed - time.monotonic();
+
+            if delay > 0:
+                time.sleep(delay);
+            else:
+                lag = -delay;
+
+        _, device, event, msgFormat, payload    = reader[index];
+        devicePublisher                         = getDevicePublisher(device);
+
+        try:
+            data = getDeviceEventData(msgFormat, payload, benchmarkSequences[devicePublisher]);
+        except ValueError as exception:
+            print("Skipping the invalid event %d: %s" % (index, str(exception)));
+
+            continue;
+
+        devicePublisher.publishEvent(options.deviceEventName or event, options.deviceEventFormat or msgFormat, data);
+
+        yield lag;
+
+def parseCommandLineOptions():
+    """
+        Parse the given command line options.
+
+        Args:
+            None.
+
+        Returns:
+            options: A argparse.Namespace instance representing the parsed command line options.
+
+        Raises:
+            argparse.error if one of the required command line options is missing.
+    """
+    parser = createArgumentParser(DEVICE_CLIENT, "Replay the device events of an event log through a device client, at their "
+                                                 "original pace, N times faster or as fast as possible.");
+
+    parser.add_argument("replayLog", action="store");
+    parser.add_argument("-s", "--speed", action="store", type=float, default=DEFAULT_REPLAY_SPEED, dest="replaySpeed");
+    parser.add_argument("--start-offset", action="store", type=float, default=0.0, dest="startOffset");
+    parser.add_argument("--replay-duration", action="store", type=float, default=0.0, dest="replayDuration");
+    parser.add_argument("--repeat", action="store", type=int, default=1, dest="repeatCount");
+    parser.add_argument("--statistics-interval", action="store", type=float, default=5.0, dest="statisticsInterval");
+
+    addGatewayArguments(parser);
+
+    # The logged event names and formats are replayed, unless they are overridden
+    for action in parser._actions:
+        if action.dest in ("deviceEventName", "deviceEventFormat"):
+            action.required = False;
+
+    # Parse command line options
+    options = parseArguments(parser);
+
+    if options.replaySpeed < 0:
+        parser.error("The replay speed should not be negative.");
+
+    if options.repeatCount < 1:
+        parser.error("The number of repetitions should be positive.");
+
+    # The events are published on behalf of the logged devices
+    if options.attachedDevices:
+        parser.error("The attached devices of the replay are the logged devices.");
+
+    return options;
+
+
+# -----------------------------------------------------------------------------
+# Main
+# -----------------------------------------------------------------------------
+
+# Parse command line options
+options = parseCommandLineOptions();
+
+# Map and index the event log
+try:
+    reader = EventLogReader(options.replayLog);
+except (OSError, ValueError) as exception:
+    print("Could not open the event log %s: %s" % (options.replayLog, str(exception)));
+
+    sys.exit(1);
+
+print(reader.getSummary());
+
+# Select the events logged in the requested time range
+startIndex  = 0;
+endIndex    = len(reader);
+
+if len(reader):
+    startIndex = reader.findIndex(reader.startTime + options.startOffset);
+
+    if options.replayDuration > 0:
+        endIndex = reader.findIndex(reader.startTime + options.startOffset + options.replayDuration);
+
+if startIndex >= endIndex:
+    print("No event to replay.");
+
+    sys.exit(1);
+
+# Serve the metrics on a local HTTP endpoint, if requested
+metricsServer = startMetricsServer(options.metricsPort);
+
+# Profile the processing stages, and sample the functions of all the threads, if requested
+profiler = startProfiler(options.profile, options.profileOutput, options.profileInterval, options.profileSampling, options.profileTop);
+
+# Create device client, or a gateway client publishing the events of the logged devices
+if options.gateway:
+    client = initGatewayClient(options.organizationId, options.deviceType, options.deviceId,
+                               options.authMethod, options.authToken, options.broker);
+else:
+    client = initDeviceClient(options.organizationId, options.deviceType, options.deviceId,
+                              options.authMethod, options.authToken, options.broker);
+
+# Connect client
+client.connect();
+
+# Log the replayed events, if requested
+eventLog = openEventLog(options.eventLog);
+
+# Publish the events at the requested quality of service, with a bounded number of events in flight
+deviceRegistry      = None;
+devicePublishers    = {};
+
+if options.gateway:
+    publisher = openGatewayClientPublisher(client, options.publishWindow, options.qos, options.ackTimeout, eventLog);
+
+    # Register the logged devices which are not cached, if requested
+    if options.registerDevices:
+        deviceRegistry = openDeviceRegistry(client, options.deviceRegistry);
+
+        deviceRegistry.registerDevices(sorted(set(tuple(device.split(":", 1)) for device, _, _ in reader.streams)));
+else:
+    publisher = openDeviceClientPublisher(client, options.publishWindow, options.qos, options.ackTimeout, eventLog);
+
+# Replay the events, as many times as requested, until they are all published or the replay is interrupted
+benchmarkSequences  = collections.defaultdict(itertools.count);
+replayedCount       = 0;
+maxLag              = 0.0;
+replayStartTime     = time.monotonic();
+nextReportTime      = replayStartTime + options.statisticsInterval;
+
+print("Replaying %d events %s." % (endIndex - startIndex, "as fast as possible" if options.replaySpeed == 0 else
+                                   "at %g times their original pace" % options.replaySpeed));
+
+try:
+    for _ in range(options.repeatCount):
+        for lag in replayEvents(reader, startIndex, endIndex):
+            replayedCount   += 1;
+            maxLag          = max(maxLag, lag);
+
+            # Report the replay rate and the publisher statistics
+            if time.monotonic() >= nextReportTime:
+                print("Replayed %d events, %.1f events/s, %.3f s late at most" % (
+                    replayedCount, replayedCount / (time.monotonic() - replayStartTime), maxLag));
+                print(publisher.getStatisticsReport());
+
+                nextReportTime += options.statisticsInterval;
+except KeyboardInterrupt:
+    pass;
+
+# Wait for the acknowledgement of the events in flight
+publisher.flush();
+
+elapsedTime = time.monotonic() - replayStartTime;
+
+print("Replayed %d events in %.2f s, %.1f events/s, %.3f s late at most" % (replayedCount, elapsedTime, replayedCount / elapsedTime, maxLag));
+print(publisher.getStatisticsReport());
+
+# Disconnect client
+client.disconnect();
+
+if deviceRegistry is not None:
+    deviceRegistry.close();
+
+    print(deviceRegistry.getStatisticsReport());
+
+reader.close();
+
+if eventLog is not None:
+    eventLog.close();
+
+    print(eventLog.getStatisticsReport());
+
+# Write the profile of the whole run
+if profiler is not None:
+    profiler.close();
+
+# Stop serving the metrics
+if metricsServer is not None:
+    metricsServer.close();
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir));
+
+from common.local_broker import LOCAL_BROKER_PORT
+from common.mqtt_lite import MqttBroker
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+async def runBroker(host, port, reportInterval, bandwidthLimit = 0):
+    """
+        Run the in-process broker and periodically print its counters.
+
+        Args:
+            host:           A string instance representing the address to listen on.
+            port:           An integer representing the port to listen on.
+            reportInterval: A float representing the number of seconds between two reports.
+            bandwidthLimit: An integer representing the maximum number of bytes per second read from
+                            each client, or 0 for no limit.
+
+        Returns:
+            None.
+
+        Raises:
+            OSError if the address is already in use.
+    """
+    broker = MqttBroker(bandwidthLimit);
+    port   = await broker.start(host, port);
+
+    print("Local broker listening on %s:%d." % (host, port));
+
+    if bandwidthLimit:
+        print("Reading at most %d bytes per second from each client." % bandwidthLimit);
+
+    while True:
+        await asyncio.sleep(reportInterval);
+
+        print("%d connections, %d messages received, %d forwarded, %d dropped" % (
+            broker.connectionCount, broker.messagesReceived, broker.messagesForwarded, broker.messagesDropped));
+
+def parseCommandLineOptions():
+    """
+        Parse the given command line options.
+
+        Args:
+            None.
+
+        Returns:
+            options: A argparse.Namespace instance representing the parsed command line options.
+
+        Raises:
+            argparse.error if one of the command line options is invalid.
+    """
+    parser = argparse.ArgumentParser(description="Run a minimal MQTT broker standing in for the IBM Watson IoT Platform.");
+
+    parser.add_argument("--host", action="store", default="127.0.0.1", dest="host");
+    parser.add_argument("--port", action="store", type=int, default=LOCAL_BROKER_PORT, dest="port");
+    parser.add_argument("--report-interval", action="store", type=float, default=10.0, dest="reportInterval");
+    parser.add_argument("--bandwidth-limit", action="store", type=int, default=0, dest="bandwidthLimit");
+
+    # Parse command line options
+    options = parser.parse_args();
+
+    return options;
+
+
+# -----------------------------------------------------------------------------
+# Main
+# -----------------------------------------------------------------------------
+
+# Parse command line options
+options = parseCommandLineOptions();
+
+# Run the broker until interrupted
+try:
+    asyncio.run(runBroker(options.host, options.port, options.reportInterval, options.bandwidthLimit));
+except KeyboardInterrupt:
+    pass;
@@ -0,0 +1,462 @@
+import argparse
+import importlib
+import json
+import sys
+
+from common.event_dispatcher import (DEFAULT_DISPATCH_POLICY, DEFAULT_DISPATCH_QUEUE_SIZE, DEFAULT_DISPATCH_REPORT_INTERVAL, 
+                                     DEFAULT_DISPATCH_SAMPLE_INTERVAL, DEFAULT_DISPATCH_SHARDS, DISPATCH_POLICIES, WILDCARD)
+from common.gateway_publisher import parseAttachedDevices
+from common.local_broker import getLocalBrokerClientOptions, redirectClientToBroker
+from common.metrics import CLIENT_CONNECTED
+from common.profiler import DEFAULT_PROFILE_INTERVAL, DEFAULT_PROFILE_OUTPUT, DEFAULT_PROFILE_TOP
+from common.windowed_publisher import DEFAULT_ACK_TIMEOUT, DEFAULT_PUBLISH_WINDOW, DEFAULT_QOS, QOS_LEVELS
+
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+# Kinds of IBM Watson IoT Platform clients created by the sample applications
+DEVICE_CLIENT       = "device";
+APPLICATION_CLIENT  = "application";
+GATEWAY_CLIENT      = "gateway";
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+class LazyModule(object):
+    """
+        Proxy of a module which is only imported when one of its attributes
+        is first accessed. The attributes are then cached on the proxy, so
+        that later accesses cost the same as on the module itself.
+    """
+
+    def __init__(self, name):
+        """
+            Initialize the proxy without importing the module.
+
+            Args:
+                name: A string instance representing the absolute module name.
+
+            Returns:
+                None.
+
+            Raises:
+                None.
+        """
+        self.__dict__["_moduleName"] = name;
+
+    def __getattr__(self, attribute):
+        """Import the module and get one of its attributes."""
+        value = getattr(importlib.import_module(self._moduleName), attribute);
+
+        self.__dict__[attribute] = value;
+
+        return value;
+
+    def __repr__(self):
+        """Get a representation of the proxy."""
+        return "<lazy module %s>" % self._moduleName;
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def lazyImport(name):
+    """
+        Get a module, deferring its import until it is first used.
+
+        Heavy dependencies such as cv2, numpy and ibmiotf are imported this way
+        so that `--help` or a command line error does not pay for them.
+
+        Args:
+            name: A string instance representing the absolute module name.
+
+        Returns:
+            The module if it was already imported, otherwise a LazyModule instance.
+
+        Raises:
+            None.
+    """
+    if name in sys.modules:
+        return sys.modules[name];
+
+    return LazyModule(name);
+
+def initDeviceClient(organizationId, deviceTypeId, deviceId, authMethod, authToken, broker = None):
+    """
+        Initialize the device client.
+
+        Args:
+            organizationId: A string instance representing the organization id.
+            deviceTypeId:   A string instance representing the device type id.
+            deviceId:       A string instance representing the device id.
+            authMethod:     A string instance representing the authentication method.
+            authToken:      A string instance representing the authentication token.
+            broker:         An optional string instance representing the "host:port" address of a local
+                            broker to connect to instead of the IBM Watson IoT Platform.
+
+        Returns:
+            An instance of ibmiotf.device representing the device client.
+
+        Raises:
+            None.
+    """
+    # Initialize the device client.
+    try:
+        import ibmiotf.device;
+
+        from common.message_codecs import registerMessageCodecs;
+
+        deviceOptions = {
+            "org"           : organizationId,
+            "type"          : deviceTypeId,
+            "id"            : deviceId,
+            "auth-method"   : authMethod,
+            "auth-token"    : authToken
+        };
+
+        if broker:
+            deviceOptions = getLocalBrokerClientOptions(deviceOptions);
+
+        print("Creating device client using options: %s" % str(deviceOptions));
+
+        deviceClient = ibmiotf.device.Client(deviceOptions);
+
+        registerMessageCodecs(deviceClient);
+
+        if broker:
+            redirectClientToBroker(deviceClient, broker);
+
+        CLIENT_CONNECTED.labels(DEVICE_CLIENT).setFunction(deviceClient.client.is_connected);
+
+        return deviceClient;
+    except Exception as exception:
+        print("Failed to create device client: %s" % str(exception));
+
+        sys.exit(1);
+
+def initGatewayClient(organizationId, gatewayTypeId, gatewayId, authMethod, authToken, broker = None):
+    """
+        Initialize the gateway client, which publishes the events of its attached devices through a single connection.
+
+        Args:
+            organizationId: A string instance representing the organization id.
+            gatewayTypeId:  A string instance representing the gateway type id.
+            gatewayId:      A string instance representing the gateway id.
+            authMethod:     A string instance representing the authentication method.
+            authToken:      A string instance representing the authentication token.
+            broker:         An optional string instance representing the "host:port" address of a local
+                            broker to connect to instead of the IBM Watson IoT Platform.
+
+        Returns:
+            An instance of ibmiotf.gateway.Client representing the gateway client.
+
+        Raises:
+            None.
+    """
+    # Initialize the gateway client.
+    try:
+        import ibmiotf.gateway;
+
+        from common.message_codecs import registerMessageCodecs;
+
+        gatewayOptions = {
+            "org"           : organizationId,
+            "type"          : gatewayTypeId,
+            "id"            : gatewayId,
+            "auth-method"   : authMethod,
+            "auth-token"    : authToken
+        };
+
+        if broker:
+            gatewayOptions = getLocalBrokerClientOptions(gatewayOptions);
+
+        print("Creating gateway client using options: %s" % str(gatewayOptions));
+
+        gatewayClient = ibmiotf.gateway.Client(gatewayOptions);
+
+        registerMessageCodecs(gatewayClient);
+
+        if broker:
+            redirectClientToBroker(gatewayClient, broker);
+
+        CLIENT_CONNECTED.labels(GATEWAY_CLIENT).setFunction(gatewayClient.client.is_connected);
+
+        return gatewayClient;
+    except Exception as exception:
+        print("Failed to create gateway client: %s" % str(exception));
+
+        sys.exit(1);
+
+def initAppClient(organizationId, applicationId, authMethod, authKey, authToken, broker = None):
+    """
+        Initialize the application client.
+
+        Args:
+            organizationId: A string instance representing the organization id.
+            applicationId:  A string instance representing the application id.
+            authMethod:     A string instance representing the authentication method.
+            authKey:        A string instance representing the authentication key.
+            authToken:      A string instance representing the authentication token.
+            broker:         An optional string instance representing the "host:port" address of a local
+                            broker to connect to instead of the IBM Watson IoT Platform.
+
+        Returns:
+            An instance of ibmiotf.application.Client representing the application client.
+
+        Raises:
+            None.
+    """
+    # Initialize the application client.
+    try:
+        import ibmiotf.application;
+
+        from common.message_codecs import registerMessageCodecs;
+
+        appOptions = {
+            "org"           : organizationId,
+            "id"            : applicationId,
+            "auth-method"   : authMethod,
+            "auth-key"      : authKey,
+            "auth-token"    : authToken
+        };
+
+        if broker:
+            appOptions = getLocalBrokerClientOptions(appOptions);
+
+        print("Creating application client using options: %s" % str(appOptions));
+
+        appClient = ibmiotf.application.Client(appOptions);
+
+        registerMessageCodecs(appClient);
+
+        if broker:
+            redirectClientToBroker(appClient, broker);
+
+        CLIENT_CONNECTED.labels(APPLICATION_CLIENT).setFunction(appClient.client.is_connected);
+
+        return appClient;
+    except Exception as exception:
+        print("Failed to create application client: %s" % str(exception));
+
+        sys.exit(1);
+
+def createArgumentParser(clientType, description = None):
+    """
+        Create a command line parser holding the options shared by the
+        sample applications using the given kind of client.
+
+        Args:
+            clientType:     DEVICE_CLIENT or APPLICATION_CLIENT.
+            description:    An optional string instance describing the sample application.
+
+        Returns:
+            A argparse.ArgumentParser instance to which the application-specific options can be added.
+
+        Raises:
+            ValueError if the client type is unknown.
+    """
+    from common.message_codecs import MESSAGE_CODECS;
+
+    parser = argparse.ArgumentParser(description=description);
+
+    parser.add_argument("--config", action="store", default=None, dest="configFile");
+
+    if clientType == DEVICE_CLIENT:
+        parser.add_argument("-o", "--organization-id", action="store", required=True, dest="organizationId");
+        parser.add_argument("-t", "--device-type", action="store", required=True, dest="deviceType");
+        parser.add_argument("-i", "--device-id", action="store", required=True, dest="deviceId");
+        parser.add_argument("-m", "--auth-method", action="store", required=True, dest="authMethod");
+        parser.add_argument("-a", "--auth-token", action="store", required=True, dest="authToken");
+    elif clientType == APPLICATION_CLIENT:
+        parser.add_argument("-o", "--organization-id", action="store", required=True, dest="organizationId");
+        parser.add_argument("-p", "--application-id", action="store", required=True, dest="applicationId");
+        parser.add_argument("-m", "--auth-method", action="store", required=True, dest="authMethod");
+        parser.add_argument("-k", "--auth-key", action="store", required=True, dest="authKey");
+        parser.add_argument("-a", "--auth-token", action="store", required=True, dest="authToken");
+        parser.add_argument("-t", "--device-type", action="store", default=WILDCARD, dest="deviceType");
+        parser.add_argument("-i", "--device-id", action="store", default=WILDCARD, dest="deviceId");
+        parser.add_argument("-e", "--device-event-name", action="store", default=WILDCARD, dest="deviceEventName");
+        parser.add_argument("-f", "--device-event-format", action="store", default=WILDCARD, dest="deviceEventFormat");
+        parser.add_argument("--dispatch-shards", action="store", type=int, default=DEFAULT_DISPATCH_SHARDS, dest="dispatchShards");
+        parser.add_argument("--dispatch-queue-size", action="store", type=int, default=DEFAULT_DISPATCH_QUEUE_SIZE, dest="dispatchQueueSize");
+        parser.add_argument("--dispatch-report-interval", action="store", type=float, default=DEFAULT_DISPATCH_REPORT_INTERVAL, 
+                            dest="dispatchReportInterval");
+        parser.add_argument("--dispatch-policy", action="store", choices=DISPATCH_POLICIES, default=DEFAULT_DISPATCH_POLICY, dest="dispatchPolicy");
+        parser.add_argument("--dispatch-sample-interval", action="store", type=int, default=DEFAULT_DISPATCH_SAMPLE_INTERVAL, 
+                            dest="dispatchSampleInterval");
+    else:
+        raise ValueError("Unknown client type %s." % clientType);
+
+    if clientType == DEVICE_CLIENT:
+        parser.add_argument("-e", "--device-event-name", action="store", required=True, dest="deviceEventName");
+        parser.add_argument("-f", "--device-event-format", action="store", choices=sorted(MESSAGE_CODECS), required=True, 
+                            dest="deviceEventFormat");
+        parser.add_argument("--qos", action="store", type=int, choices=QOS_LEVELS, default=DEFAULT_QOS, dest="qos");
+        parser.add_argument("--publish-window", action="store", type=int, default=DEFAULT_PUBLISH_WINDOW, dest="publishWindow");
+        parser.add_argument("--ack-timeout", action="store", type=float, default=DEFAULT_ACK_TIMEOUT, dest="ackTimeout");
+
+    parser.add_argument("--broker", action="store", default=None, dest="broker");
+    parser.add_argument("--event-log", action="store", default=None, dest="eventLog");
+    parser.add_argument("--metrics-port", action="store", type=int, default=0, dest="metricsPort");
+    parser.add_argument("--profile", action="store_true", default=False, dest="profile");
+    parser.add_argument("--profile-output", action="store", default=DEFAULT_PROFILE_OUTPUT, dest="profileOutput");
+    parser.add_argument("--profile-interval", action="store", type=float, default=DEFAULT_PROFILE_INTERVAL, dest="profileInterval");
+    parser.add_argument("--profile-sampling", action="store", type=float, default=0.0, dest="profileSampling");
+    parser.add_argument("--profile-top", action="store", type=int, default=DEFAULT_PROFILE_TOP, dest="profileTop");
+
+    return parser;
+
+def addGatewayArguments(parser):
+    """
+        Add the options of the gateway mode to the command line parser of a device sender.
+
+        With --gateway, the -t and -i options give the gateway type and id, and the events are published
+        on behalf of the devices given by --attached-devices through a single gateway connection.
+
+        Args:
+            parser: A argparse.ArgumentParser instance returned by createArgumentParser(DEVICE_CLIENT).
+
+        Returns:
+            The parser.
+
+        Raises:
+            None.
+    """
+    parser.add_argument("--gateway", action="store_true", default=False, dest="gateway");
+    parser.add_argument("--attached-devices", action="store", nargs="+", default=None, dest="attachedDevices");
+    parser.add_argument("--register-devices", action="store_true", default=False, dest="registerDevices");
+    parser.add_argument("--device-registry", action="store", default=None, dest="deviceRegistry");
+
+    return parser;
+
+def loadConfigFile(configPath, parser):
+    """
+        Load a JSON configuration file holding default command line option values.
+
+        The keys of the configuration object are the long option names without
+        the leading dashes (e.g. "organization-id") or the option destinations
+        (e.g. "organizationId").
+
+        Args:
+            configPath: A string instance representing the configuration file path.
+            parser:     A argparse.ArgumentParser instance defining the options.
+
+        Returns:
+            A dictionary instance mapping the option destinations to their values.
+
+        Raises:
+            IOError if the file cannot be read.
+            ValueError if the file is not a JSON object or contains an unknown option.
+    """
+    with open(configPath, "r") as configFile:
+        config = json.load(configFile);
+
+    if not isinstance(config, dict):
+        raise ValueError("The configuration should be a JSON object.");
+
+    actions = {};
+
+    for action in parser._actions:
+        actions[action.dest] = action;
+
+        for optionString in action.option_strings:
+            if optionString.startswith("--"):
+                actions[optionString[2:]] = action;
+
+    values = {};
+
+    for key, value in config.items():
+        action = actions.get(key);
+
+        if action is None or action.dest in ("help", "configFile"):
+            raise ValueError("Unknown option %s." % key);
+
+        values[action.dest] = value;
+
+    return values;
+
+def parseArguments(parser, arguments = None):
+    """
+        Parse the command line options, using the values of the configuration
+        file given by --config as defaults. The options given on the command
+        line take precedence over the configuration file.
+
+        Args:
+            parser:     A argparse.ArgumentParser instance returned by createArgumentParser.
+            arguments:  An optional list of strings to parse instead of sys.argv.
+
+        Returns:
+            options: A argparse.Namespace instance representing the parsed command line options.
+
+        Raises:
+            argparse.error if the configuration file is invalid, if one of the required command line options is missing or if
+            the module of the device event format is not installed.
+    """
+    configParser = argparse.ArgumentParser(add_help=False);
+
+    configParser.add_argument("--config", action="store", default=None, dest="configFile");
+
+    configOptions, _ = configParser.parse_known_args(arguments);
+
+    if configOptions.configFile:
+        try:
+            values = loadConfigFile(configOptions.configFile, parser);
+        except (IOError, OSError, ValueError) as exception:
+            parser.error("Invalid configuration file %s: %s" % (configOptions.configFile, str(exception)));
+
+        # The options given in the configuration file are no longer required on the command line
+        for action in parser._actions:
+            if action.dest in values:
+                action.required = False;
+
+        parser.set_defaults(**values);
+
+    options = parser.parse_args(arguments);
+
+    # Check that the module of a binary device event format is installed
+    if getattr(options, "deviceEventFormat", None) not in (None, WILDCARD):
+        from common.message_codecs import getMessageCodec;
+
+        try:
+            getMessageCodec(options.deviceEventFormat);
+        except ValueError as exception:
+            parser.error(str(exception));
+
+    # Check the sampling of the received device events
+    if getattr(options, "dispatchSampleInterval", 1) < 1:
+        parser.error("The dispatch sample interval should be positive.");
+
+    # Check the window of the device event publisher
+    if getattr(options, "publishWindow", 0) < 0:
+        parser.error("The publish window should not be negative.");
+
+    if getattr(options, "ackTimeout", DEFAULT_ACK_TIMEOUT) <= 0:
+        parser.error("The acknowledgement timeout should be positive.");
+
+    # Expand the devices attached to the gateway
+    if getattr(options, "attachedDevices", None):
+        try:
+            options.attachedDevices = parseAttachedDevices(options.attachedDevices);
+        except ValueError as exception:
+            parser.error("Invalid attached device: %s" % str(exception));
+
+    if not getattr(options, "gateway", True) and (options.attachedDevices or options.registerDevices or options.deviceRegistry):
+        parser.error("The attached devices and their registration only apply to the gateway mode.");
+
+    # The devices are registered through the REST API of the IBM Watson IoT Platform
+    if getattr(options, "registerDevices", False) and options.broker:
+        parser.error("The devices cannot be registered through a local broker.");
+
+    # Check the periodic dumps and the sampling window of the profiler
+    if options.profileInterval <= 0:
+        parser.error("The profile interval should be positive.");
+
+    if options.profileSampling < 0 or options.profileTop < 1:
+        parser.error("The profile sampling duration should not be negative and the number of profiled functions should be positive.");
+
+    return options;
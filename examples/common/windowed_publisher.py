@@ -0,0 +1,396 @@
+import collections
+import threading
+import time
+
+from common.latency import REPORTED_PERCENTILES, getPercentile
+from common.metrics import EVENTS_PUBLISHED, STAGE_DURATION
+
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+# Quality of service levels of the MQTT publications
+QOS_LEVELS = (0, 1, 2);
+
+DEFAULT_QOS = 0;
+
+# Maximum number of events published but not acknowledged, 0 for no limit
+DEFAULT_PUBLISH_WINDOW = 0;
+
+# Number of seconds after which an event which was not acknowledged releases its window slot
+DEFAULT_ACK_TIMEOUT = 30.0;
+
+# Number of acknowledgement latencies kept to compute the percentiles
+LATENCY_SAMPLES = 1000;
+
+# Maximum number of seconds a blocked publication waits before checking the expired events
+EXPIRY_CHECK_INTERVAL = 0.5;
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def openDeviceClientPublisher(deviceClient, windowSize = DEFAULT_PUBLISH_WINDOW, qos = DEFAULT_QOS,
+                              ackTimeout = DEFAULT_ACK_TIMEOUT, eventLog = None):
+    """
+        Create a windowed publisher of the events of an ibmiotf device client.
+
+        The in-flight limit of the MQTT client is raised to the window size,
+        otherwise the QoS 1 and 2 events beyond its default limit of 20 would
+        be queued by the client instead of being sent.
+
+        Args:
+            deviceClient:   A ibmiotf.device.Client instance.
+            windowSize:     An integer representing the maximum number of events in flight, 0 for no limit.
+            qos:            An integer representing the default quality of service of the events.
+            ackTimeout:     A float representing the number of seconds after which an event which was not
+                            acknowledged releases its window slot.
+            eventLog:       An optional EventLogWriter instance to which the published events are appended.
+
+        Returns:
+            A WindowedPublisher instance.
+
+        Raises:
+            ValueError if the window size, the quality of service or the timeout is invalid.
+    """
+    if windowSize > 0:
+        deviceClient.client.max_inflight_messages_set(windowSize);
+
+    publishFunction = deviceClient.publishEvent;
+
+    # The client id of a device is "d:org:type:id"
+    if eventLog is not None:
+        publishFunction = eventLog.wrapPublishFunction(publishFunction, deviceClient.clientId.split(":", 2)[2]);
+
+    return WindowedPublisher(publishFunction, windowSize, qos, ackTimeout);
+
+def openGatewayClientPublisher(gatewayClient, windowSize = DEFAULT_PUBLISH_WINDOW, qos = DEFAULT_QOS,
+                               ackTimeout = DEFAULT_ACK_TIMEOUT, eventLog = None):
+    """
+        Create a windowed publisher of the events an ibmiotf gateway client publishes on behalf of
+        its attached devices, through WindowedPublisher.publishDeviceEvent.
+
+        The events of all the attached devices share the window, since they share the connection.
+
+        Args:
+            gatewayClient:  A ibmiotf.gateway.Client instance.
+            windowSize:     An integer representing the maximum number of events in flight, 0 for no limit.
+            qos:            An integer representing the default quality of service of the events.
+            ackTimeout:     A float representing the number of seconds after which an event which was not
+                            acknowledged releases its window slot.
+            eventLog:       An optional EventLogWriter instance to which the published events are appended.
+
+        Returns:
+            A WindowedPublisher instance.
+
+        Raises:
+            ValueError if the window size, the quality of service or the timeout is invalid.
+    """
+    if windowSize > 0:
+        gatewayClient.client.max_inflight_messages_set(windowSize);
+
+    publishFunction = gatewayClient.publishDeviceEvent;
+
+    if eventLog is not None:
+        publishFunction = eventLog.wrapDevicePublishFunction(publishFunction);
+
+    return WindowedPublisher(publishFunction, windowSize, qos, ackTimeout);
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+class WindowedPublisher(object):
+    """
+        Publisher keeping at most a window of events in flight, i.e. published
+        but not acknowledged, and measuring their acknowledgement latency.
+
+        An event is acknowledged when the on_publish callback of the client
+        fires: once it is written to the socket at QoS 0, once the broker sent
+        PUBACK at QoS 1 and PUBCOMP at QoS 2. A publication blocks while the
+        window is full; the time spent blocked is reported together with the
+        latency percentiles, so that the window size can be tuned against the
+        throughput. The acknowledgements lost across a reconnection would
+        shrink the window forever, hence the events which are not acknowledged
+        within the timeout release their slot.
+    """
+
+    def __init__(self, publishFunction, windowSize = DEFAULT_PUBLISH_WINDOW, qos = DEFAULT_QOS, ackTimeout = DEFAULT_ACK_TIMEOUT):
+        """
+            Initialize the publisher.
+
+            Args:
+                publishFunction:    A callable taking an event name, a format, a payload, a quality of service and
+                                    an on_publish callback, and returning whether the event was published, e.g.
+                                    ibmiotf.device.Client.publishEvent. The publish function of the events published
+                                    with publishDeviceEvent takes the device type and id first, e.g.
+                                    ibmiotf.gateway.Client.publishDeviceEvent.
+                windowSize:         An integer representing the maximum number of events in flight, 0 for no limit.
+                qos:                An integer representing the default quality of service of the events.
+                ackTimeout:         A float representing the number of seconds after which an event which was not
+                                    acknowledged releases its window slot.
+
+            Returns:
+                None.
+
+            Raises:
+                ValueError if the window size, the quality of service or the timeout is invalid.
+        """
+        if windowSize < 0:
+            raise ValueError("The publish window should not be negative.");
+
+        if qos not in QOS_LEVELS:
+            raise ValueError("The quality of service should be 0, 1 or 2.");
+
+        if ackTimeout <= 0:
+            raise ValueError("The acknowledgement timeout should be positive.");
+
+        self.publishFunction    = publishFunction;
+        self.windowSize         = windowSize;
+        self.qos                = qos;
+        self.ackTimeout         = ackTimeout;
+
+        self.publishedCount     = 0;
+        self.acknowledgedCount  = 0;
+        self.failedCount        = 0;
+        self.expiredCount       = 0;
+        self.lateCount          = 0;
+        self.maxInFlightCount   = 0;
+        self.blockedCount       = 0;
+        self.blockedTime        = 0.0;
+
+        self._condition         = threading.Condition();
+        self._inFlight          = collections.OrderedDict();
+        self._nextToken         = 0;
+        self._ackLatencies      = collections.deque(maxlen=LATENCY_SAMPLES);
+        self._startTime         = time.monotonic();
+
+        self._publishDuration   = STAGE_DURATION.labels("publish");
+        self._ackDuration       = STAGE_DURATION.labels("acknowledge");
+
+    @property
+    def inFlightCount(self):
+        """
+            The number of events published but not acknowledged.
+        """
+        return len(self._inFlight);
+
+    def publishEvent(self, event, msgFormat, data, qos = None, on_publish = None):
+        """
+            Publish a device event once the window has a free slot.
+
+            Args:
+                event:      A string instance representing the event name.
+                msgFormat:  A string instance representing the event format.
+                data:       The device event data.
+                qos:        An optional integer representing the quality of service of the event, the
+                            default quality of service of the publisher if None.
+                on_publish: An optional callable without argument called once the event is acknowledged.
+
+            Returns:
+                A boolean indicating whether the event was published.
+
+            Raises:
+                ValueError if the quality of service is invalid.
+        """
+        return self._publish(event, qos, on_publish, (event, msgFormat, data));
+
+    def publishDeviceEvent(self, deviceType, deviceId, event, msgFormat, data, qos = None, on_publish = None):
+        """
+            Publish an event on behalf of a device once the window has a free slot. The publish
+            function must take the device type and id first, like ibmiotf.gateway.Client.publishDeviceEvent.
+
+            Args:
+                deviceType: A string instance representing the device type id.
+                deviceId:   A string instance representing the device id.
+                event:      A string instance representing the event name.
+                msgFormat:  A string instance representing the event format.
+                data:       The device event data.
+                qos:        An optional integer representing the quality of service of the event, the
+                            default quality of service of the publisher if None.
+                on_publish: An optional callable without argument called once the event is acknowledged.
+
+            Returns:
+                A boolean indicating whether the event was published.
+
+            Raises:
+                ValueError if the quality of service is invalid.
+        """
+        return self._publish(event, qos, on_publish, (deviceType, deviceId, event, msgFormat, data));
+
+    def flush(self, timeout = None):
+        """
+            Wait until the events in flight are acknowledged or expired.
+
+            Args:
+                timeout: An optional float representing the maximum number of seconds to wait, the
+                         acknowledgement timeout if None.
+
+            Returns:
+                A boolean indicating whether no event is in flight anymore.
+
+            Raises:
+                None.
+        """
+        endTime = time.monotonic() + (self.ackTimeout if timeout is None else timeout);
+
+        with self._condition:
+            while True:
+                self._expireEvents();
+
+                remainingTime = endTime - time.monotonic();
+
+                if not self._inFlight or remainingTime <= 0:
+                    return not self._inFlight;
+
+                self._condition.wait(min(EXPIRY_CHECK_INTERVAL, remainingTime));
+
+    def getAckLatencies(self):
+        """
+            Get the latest acknowledgement latencies.
+
+            Args:
+                None.
+
+            Returns:
+                A list of floats representing the latencies in seconds, in increasing order.
+
+            Raises:
+                None.
+        """
+        with self._condition:
+            return sorted(self._ackLatencies);
+
+    def getStatisticsReport(self):
+        """
+            Get a one line report of the publisher counters, acknowledgement latencies and blocked time.
+
+            Args:
+                None.
+
+            Returns:
+                A string instance representing the report.
+
+            Raises:
+                None.
+        """
+        latencies = self.getAckLatencies();
+
+        with self._condition:
+            elapsedTime = max(time.monotonic() - self._startTime, 1e-9);
+
+            report = "publisher (qos %d, window %s): %d published, %d acknowledged, %d failed, %d expired, %d late, " \
+                     "%d in flight (max %d), blocked %d times for %.2f s (%.1f%%)" % (
+                self.qos, self.windowSize or "unlimited", self.publishedCount, self.acknowledgedCount,
+                self.failedCount, self.expiredCount, self.lateCount, len(self._inFlight), self.maxInFlightCount,
+                self.blockedCount, self.blockedTime, 100.0 * self.blockedTime / elapsedTime
+            );
+
+        if latencies:
+            report += ", ack latency %s max %.1f ms" % (
+                " ".join("p%d %.1f" % (percentile, 1000.0 * getPercentile(latencies, percentile))
+                         for percentile in REPORTED_PERCENTILES),
+                1000.0 * latencies[-1]
+            );
+
+        return report;
+
+    def _publish(self, event, qos, on_publish, publishArguments):
+        """Publish an event, given the leading arguments of the publish function, once the window has a free slot."""
+        qos = self.qos if qos is None else qos;
+
+        if qos not in QOS_LEVELS:
+            raise ValueError("The quality of service should be 0, 1 or 2.");
+
+        with self._condition:
+            # Expire the events whose acknowledgement was lost whatever the window size, otherwise
+            # the events in flight of an unlimited window would grow without bound
+            self._expireEvents();
+
+            # Wait for an acknowledgement, releasing the slots of the expired events meanwhile
+            if self.windowSize and len(self._inFlight) >= self.windowSize:
+                blockedStartTime = time.monotonic();
+
+                while len(self._inFlight) >= self.windowSize:
+                    self._expireEvents();
+
+                    if len(self._inFlight) >= self.windowSize:
+                        self._condition.wait(EXPIRY_CHECK_INTERVAL);
+
+                self.blockedCount   += 1;
+                self.blockedTime    += time.monotonic() - blockedStartTime;
+
+            token                   = self._nextToken;
+            self._nextToken         += 1;
+            self._inFlight[token]   = time.monotonic();
+            self.maxInFlightCount   = max(self.maxInFlightCount, len(self._inFlight));
+
+        # The client may acknowledge the event before returning, hence the lock must not be held
+        startTime = time.perf_counter();
+
+        try:
+            isPublished = self.publishFunction(*publishArguments, qos,
+                                               on_publish=lambda: self._acknowledgeEvent(token, on_publish));
+        except Exception:
+            self._releaseEvent(token);
+
+            raise;
+
+        self._publishDuration.observe(time.perf_counter() - startTime);
+
+        if not isPublished:
+            self._releaseEvent(token);
+
+            return False;
+
+        with self._condition:
+            self.publishedCount += 1;
+
+        EVENTS_PUBLISHED.labels(event).inc();
+
+        return True;
+
+    def _acknowledgeEvent(self, token, on_publish):
+        """Release the window slot of an acknowledged event and record its latency."""
+        with self._condition:
+            sendTime = self._inFlight.pop(token, None);
+
+            if sendTime is None:
+                self.lateCount += 1;
+            else:
+                ackLatency              = time.monotonic() - sendTime;
+                self.acknowledgedCount  += 1;
+                self._ackLatencies.append(ackLatency);
+                self._ackDuration.observe(ackLatency);
+
+            self._expireEvents();
+
+            self._condition.notify_all();
+
+        if on_publish is not None:
+            on_publish();
+
+    def _releaseEvent(self, token):
+        """Release the window slot of an event which could not be published."""
+        with self._condition:
+            if self._inFlight.pop(token, None) is not None:
+                self.failedCount += 1;
+
+                self._condition.notify_all();
+
+    def _expireEvents(self):
+        """Release the window slots of the events which were not acknowledged within the timeout."""
+        expiryTime = time.monotonic() - self.ackTimeout;
+
+        while self._inFlight:
+            token, sendTime = next(iter(self._inFlight.items()));
+
+            if sendTime > expiryTime:
+                break;
+
+            del self._inFlight[token];
+
+            self.expiredCount += 1;
@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir));
+
+from common.local_broker import parseBrokerAddress
+from common.message_codecs import DEFAULT_MESSAGE_FORMAT, MESSAGE_CODECS, getMessageCodec
+from common.mqtt_lite import MqttBroker, MqttConnection
+
+
+# -----------------------------------------------------------------------------
+# Constants
+# -----------------------------------------------------------------------------
+
+# Payload template equivalent to the example given in send_data_to_wiotp.getDeviceEventPayload
+DEFAULT_PAYLOAD_TEMPLATE = '{"number" : "$random"}';
+
+# Values substituted for the placeholders of the payload template
+PAYLOAD_PLACEHOLDERS = {
+    "$deviceId"     : lambda deviceId, sequenceNumber: deviceId,
+    "$seq"          : lambda deviceId, sequenceNumber: sequenceNumber,
+    "$timestamp"    : lambda deviceId, sequenceNumber: time.time(),
+    "$random"       : lambda deviceId, sequenceNumber: random.randint(0, 1000000)
+};
+
+
+# -----------------------------------------------------------------------------
+# Classes
+# -----------------------------------------------------------------------------
+
+class LoadStatistics(object):
+    """
+        Counters shared by the virtual devices. All the virtual devices run on
+        the same event loop, hence no locking is needed.
+    """
+
+    def __init__(self):
+        self.connectedDevices   = 0;
+        self.failedConnections  = 0;
+        self.messagesSent       = 0;
+        self.payloadBytesSent   = 0;
+        self.wireBytesSent      = 0;
+
+
+# -----------------------------------------------------------------------------
+# Functions
+# -----------------------------------------------------------------------------
+
+def compilePayloadTemplate(template):
+    """
+        Compile a JSON payload template into a function generating payloads.
+
+        String values equal to one of the placeholders $deviceId, $seq,
+        $timestamp or $random are replaced by the corresponding value each
+        time a payload is generated.
+
+        Args:
+            template: The decoded JSON payload template.
+
+        Returns:
+            A callable taking a device id and a sequence number and returning the payload.
+
+        Raises:
+            None.
+    """
+    if isinstance(template, dict):
+        fields = [(key, compilePayloadTemplate(value)) for key, value in template.items()];
+
+        return lambda deviceId, sequenceNumber: dict((key, field(deviceId, sequenceNumber)) for key, field in fields);
+
+    if isinstance(template, list):
+        items = [compilePayloadTemplate(value) for value in template];
+
+        return lambda deviceId, sequenceNumber: [item(deviceId, sequenceNumber) for item in items];
+
+    if isinstance(template, str) and template in PAYLOAD_PLACEHOLDERS:
+        return PAYLOAD_PLACEHOLDERS[template];
+
+    return lambda deviceId, sequenceNumber: template;
+
+def parseRampUpSchedule(schedule, deviceCount):
+    """
+        Get the start delay of each virtual device from a ramp-up schedule.
+
+        The schedule is a list of "seconds:devices" points. The number of
+        running devices is interpolated linearly between two points, e.g.
+        ["0:0", "60:1000"] starts 1000 devices evenly over one minute and
+        ["0:100", "30:100", "30:500"] starts 100 devices, then 400 more after
+        30 seconds.
+
+        Args:
+            schedule:       A list of strings representing the schedule points, or None to start all the devices at once.
+            deviceCount:    An integer representing the number of virtual devices.
+
+        Returns:
+            A list of floats representing the start delay in seconds of each device.
+
+        Raises:
+            ValueError if the schedule is malformed or does not start all the devices.
+    """
+    if not schedule:
+        return [0.0] * deviceCount;
+
+    points = [];
+
+    for point in schedule:
+        seconds, devices = point.split(":");
+
+        points.append((float(seconds), int(devices)));
+
+    if points[0][0] != 0:
+        points.insert(0, (0.0, 0));
+
+    if points[-1][1] < deviceCount:
+        raise ValueError("The ramp-up schedule only starts %d of the %d devices." % (points[-1][1], deviceCount));
+
+    startDelays = [];
+
+    for (startTime, startDevices), (endTime, endDevices) in zip([(0.0, 0)] + points, points):
+        for index in range(max(startDevices, len(startDelays)), min(endDevices, deviceCount)):
+            startDelays.append(startTime + (index + 1 - startDevices) * (endTime - startTime) / float(endDevices - startDevices));
+
+    return startDelays;
+
+async def runVirtualDevice(deviceId, startDelay, options, renderPayload, connectSemaphore, statistics):
+    """
+        Connect a virtual device and publish events at the configured rate until cancelled.
+
+        Args:
+            deviceId:           A string instance representing the device id.
+            startDelay:         A float representing the number of seconds to wait before connecting.
+            options:            A argparse.Namespace instance representing the parsed command line options.
+            renderPayload:      A callable returned by compilePayloadTemplate.
+            connectSemaphore:   An asyncio.Semaphore instance limiting the number of concurrent connection attempts.
+            statistics:         A LoadStatistics instance.
+
+        Returns:
+            None.
+
+        Raises:
+            None.
+    """
+    await asyncio.sleep(startDelay);
+
+    connection  = MqttConnection();
+    clientId    = "d:%s:%s:%s" % (options.organizationId, options.deviceType, deviceId);
+    topic       = "iot-2/evt/%s/fmt/%s" % (options.deviceEventName, options.deviceEventFormat);
+    codec       = getMessageCodec(options.deviceEventFormat);
+
+    async with connectSemaphore:
+        try:
+            await connection.connect(options.brokerHost, options.brokerPort, clientId, "use-token-auth", options.authToken);
+        except (OSError, asyncio.IncompleteReadError) as exception:
+            print("Failed to connect device %s: %s" % (deviceId, str(exception)));
+
+            statistics.failedConnections += 1;
+
+            return;
+
+    statistics.connectedDevices += 1;
+
+    loop            = asyncio.get_event_loop();
+    period          = 1.0 / options.rate;
+    sequenceNumber  = 0;
+
+    # Spread the events of the devices over the period to avoid synchronized bursts
+    nextTime = loop.time() + random.random() * period;
+
+    try:
+        while True:
+            await asyncio.sleep(max(0.0, nextTime - loop.time()));
+
+            payload = codec.encodePayload(renderPayload(deviceId, sequenceNumber));
+
+            if not isinstance(payload, bytes):
+                payload = payload.encode("utf-8");
+
+            statistics.wireBytesSent    += connection.publish(topic, payload);
+            statistics.payloadBytesSent += len(payload);
+            statistics.messagesSent     += 1;
+
+            sequenceNumber  += 1;
+            nextTime        += period;
+
+            await connection.drain();
+    except ConnectionError as exception:
+        print("Device %s disconnected: %s" % (deviceId, str(exception)));
+    finally:
+        statistics.connectedDevices -= 1;
+
+        await connection.disconnect();
+
+async def reportStatistics(options, statistics, startTime):
+    """
+        Periodically print the achieved aggregate message and byte rates.
+
+        Args:
+            options:    A argparse.Namespace instance representing the parsed command line options.
+            statistics: A LoadStatistics instance.
+            startTime:  A float representing the event loop time at which the test started.
+
+        Returns:
+            None.
+
+        Raises:
+            None.
+    """
+    loop            = asyncio.get_event_loop();
+    lastTime        = startTime;
+    lastMessages    = 0;
+    lastBytes       = 0;
+
+    while True:
+        await asyncio.sleep(options.reportInterval);
+
+        now             = loop.time();
+        elapsedTime     = now - lastTime;
+        messageRate     = (statistics.messagesSent - lastMessages) / elapsedTime;
+        byteRate        = (statistics.wireBytesSent - lastBytes) / elapsedTime;
+
+        print("%6.1f s: %d devices connected (%d failed), target %.0f msg/s, achieved %.0f msg/s, %.1f KB/s" % (
+            now - startTime, statistics.connectedDevices, statistics.failedConnections,
+            statistics.connectedDevices * options.rate, messageRate, byteRate / 1024
+        ));
+
+        lastTime        = now;
+        lastMessages    = statistics.messagesSent;
+        lastBytes       = statistics.wireBytesSent;
+
+async def runLoadTest(options):
+    """
+        Run the virtual devices for the configured duration and print a summary.
+
+        Args:
+            options: A argparse.Namespace instance representing the parsed command line options.
+
+        Returns:
+            None.
+
+        Raises:
+            None.
+    """
+    broker = None;
+
+    # Start the in-process broker on a free port
+    if options.inProcessBroker:
+        broker              = MqttBroker();
+        options.brokerHost  = "127.0.0.1";
+        options.brokerPort  = await broker.start(options.brokerHost, 0);
+
+        print("Started in-process broker on port %d." % options.brokerPort);
+
+    renderPayload       = compilePayloadTemplate(json.loads(options.payloadTemplate));
+    startDelays         = parseRampUpSchedule(options.rampUpSchedule, options.deviceCount);
+    connectSemaphore    = asyncio.Semaphore(options.connectConcurrency);
+    statistics          = LoadStatistics();
+
+    startTime   = asyncio.get_event_loop().time();
+    tasks       = [asyncio.ensure_future(runVirtualDevice("%s%d" % (options.deviceIdPrefix, index), startDelay, options,
+                                                          renderPayload, connectSemaphore, statistics))
+                   for index, startDelay in enumerate(startDelays)];
+    reporter    = asyncio.ensure_future(reportStatistics(options, statistics, startTime));
+
+    await asyncio.sleep(options.duration);
+
+    reporter.cancel();
+
+    for task in tasks:
+        task.cancel();
+
+    await asyncio.gather(*tasks, return_exceptions=True);
+
+    elapsedTime = asyncio.get_event_loop().time() - startTime;
+
+    print("Sent %d messages (%d payload bytes, %d bytes on the wire) in %.1f s: %.0f msg/s, %.1f KB/s." % (
+        statistics.messagesSent, statistics.payloadBytesSent, statistics.wireBytesSent, elapsedTime,
+        statistics.messagesSent / elapsedTime, statistics.wireBytesSent / elapsedTime / 1024
+    ));
+
+    if broker is not None:
+        print("The in-process broker received %d messages." % broker.messagesReceived);
+
+        await broker.stop();
+
+def parseCommandLineOptions():
+    """
+        Parse the given command line options.
+
+        Args:
+            None.
+
+        Returns:
+            options: A argparse.Namespace instance representing the parsed command line options.
+
+        Raises:
+            argparse.error if one of the required command line options is missing.
+    """
+    parser = argparse.ArgumentParser(description="Simulate many virtual devices publishing events to an MQTT broker.");
+
+    parser.add_argument("-o", "--organization-id", action="store", default="local", dest="organizationId");
+    parser.add_argument("-t", "--device-type", action="store", required=True, dest="deviceType");
+    parser.add_argument("-a", "--auth-token", action="store", default=None, dest="authToken");
+    parser.add_argument("-e", "--device-event-name", action="store", required=True, dest="deviceEventName");
+    parser.add_argument("-f", "--device-event-format", action="store", default=DEFAULT_MESSAGE_FORMAT, 
+                        choices=sorted(name for name, codec in MESSAGE_CODECS.items() if codec.structured), dest="deviceEventFormat");
+    parser.add_argument("-b", "--broker", action="store", default="localhost:1883", dest="broker");
+    parser.add_argument("--in-process-broker", action="store_true", default=False, dest="inProcessBroker");
+    parser.add_argument("-n", "--devices", action="store", type=int, default=100, dest="deviceCount");
+    parser.add_argument("--device-id-prefix", action="store", default="virtual-", dest="deviceIdPrefix");
+    parser.add_argument("-r", "--rate", action="store", type=float, default=1.0, dest="rate");
+    parser.add_argument("--ramp-up", action="store", nargs="+", default=None, dest="rampUpSchedule");
+    parser.add_argument("-d", "--duration", action="store", type=float, default=60.0, dest="duration");
+    parser.add_argument("--payload-template", action="store", default=DEFAULT_PAYLOAD_TEMPLATE, dest="payloadTemplate");
+    parser.add_argument("--report-interval", action="store", type=float, default=5.0, dest="reportInterval");
+    parser.add_argument("--connect-concurrency", action="store", type=int, default=100, dest="connectConcurrency");
+
+    # Parse command line options
+    options = parser.parse_args();
+
+    if options.rate <= 0:
+        parser.error("The rate should be positive.");
+
+    options.brokerHost, options.brokerPort = parseBrokerAddress(options.broker);
+
+    try:
+        getMessageCodec(options.deviceEventFormat);
+    except ValueError as exception:
+        parser.error(str(exception));
+
+    return options;
+
+
+# -----------------------------------------------------------------------------
+# Main
+# -----------------------------------------------------------------------------
+
+# Parse command line options
+options = parseCommandLineOptions();
+
+# Run the virtual devices
+asyncio.run(runLoadTest(options));
@@ -1,52 +1,23 @@
 #!/usr/bin/env python
 
-import argparse
+import os
 import sys
 
-import ibmiotf.application
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir));
+
+from common.event_dispatcher import DeviceEventHandlerIndex, ShardedEventDispatcher
+from common.event_log import openEventLog
+from common.event_sink import (DEFAULT_SINK_DIRECTORY, DEFAULT_SINK_FLUSH_INTERVAL, DEFAULT_SINK_FLUSH_SIZE, 
+                               DEFAULT_SINK_FSYNC_INTERVAL, DEFAULT_SINK_SEGMENT_SIZE, EVENT_SINK_TYPES, createEventSink)
+from common.metrics import startMetricsServer
+from common.profiler import startProfiler
+from common.runtime import APPLICATION_CLIENT, createArgumentParser, initAppClient, parseArguments
 
 
 # -----------------------------------------------------------------------------
 # Functions
 # -----------------------------------------------------------------------------
 
-def initAppClient(organizationId, applicationId, authMethod, authKey, authToken):
-    """
-        Initialize the application client.
-
-        Args:
-            organizationId: A string instance representing the organization id.
-            applicationId:  A string instance representing the application id.
-            authMethod:     A string instance representing the authentication method.
-            authKey:        A string instance representing the authentication key.
-            authToken:      A string instance representing the authentication token.
-
-        Returns:
-            An instance of ibmiotf.application.Client representing the application client.
-
-        Raises:
-            None.
-    """
-    # Initialize the application client.
-    try:
-        appOptions = {
-            "org"           : organizationId, 
-            "id"            : applicationId, 
-            "auth-method"   : authMethod, 
-            "auth-key"      : authKey, 
-            "auth-token"    : authToken
-        };
-
-        print("Creating application client using options: %s" % str(appOptions));
-
-        appClient = ibmiotf.application.Client(appOptions);
-
-        return appClient;
-    except Exception as exception:
-        print("Failed to create application client: %s" % str(exception));
-
-        sys.exit(1);
-
 def receivedDeviceEventCallback(deviceEvent):
     """
         Callback executed when a device event is received.
@@ -60,6 +31,12 @@ def receivedDeviceEventCallback(deviceEvent):
         Raises:
             None.
     """
+    # Persist the event instead of printing it, if requested
+    if eventSink is not None:
+        eventSink.write(deviceEvent.device, deviceEvent.event, deviceEvent.format, deviceEvent.payload);
+
+        return;
+
     print("Received device event %s at %s for %s." % (deviceEvent.event, deviceEvent.timestamp.isoformat(), deviceEvent.device));
 
     # TODO: Process the event data as required for your application.
@@ -81,20 +58,17 @@ def parseCommandLineOptions():
         Raises:
             argparse.error if one of the required command line options is missing.
     """
-    parser = argparse.ArgumentParser();
-
-    parser.add_argument("-o", "--organization-id", action="store", required=True, dest="organizationId");
-    parser.add_argument("-p", "--application-id", action="store", required=True, dest="applicationId");
-    parser.add_argument("-m", "--auth-method", action="store", required=True, dest="authMethod");
-    parser.add_argument("-k", "--auth-key", action="store", required=True, dest="authKey");
-    parser.add_argument("-a", "--auth-token", action="store", required=True, dest="authToken");
-    parser.add_argument("-t", "--device-type", action="store", required=True, dest="deviceType");
-    parser.add_argument("-i", "--device-id", action="store", required=True, dest="deviceId");
-    parser.add_argument("-e", "--device-event-name", action="store", required=True, dest="deviceEventName");
-    parser.add_argument("-f", "--device-event-format", action="store", required=True, dest="deviceEventFormat");
+    parser = createArgumentParser(APPLICATION_CLIENT);
+
+    parser.add_argument("--sink", action="store", choices=EVENT_SINK_TYPES, default=None, dest="sinkType");
+    parser.add_argument("--sink-directory", action="store", default=DEFAULT_SINK_DIRECTORY, dest="sinkDirectory");
+    parser.add_argument("--sink-segment-size", action="store", type=int, default=DEFAULT_SINK_SEGMENT_SIZE, dest="sinkSegmentSize");
+    parser.add_argument("--sink-flush-size", action="store", type=int, default=DEFAULT_SINK_FLUSH_SIZE, dest="sinkFlushSize");
+    parser.add_argument("--sink-flush-interval", action="store", type=float, default=DEFAULT_SINK_FLUSH_INTERVAL, dest="sinkFlushInterval");
+    parser.add_argument("--sink-fsync-interval", action="store", type=float, default=DEFAULT_SINK_FSYNC_INTERVAL, dest="sinkFsyncInterval");
 
     # Parse command line options
-    options = parser.parse_args();
+    options = parseArguments(parser);
 
     return options;
 
@@ -106,9 +80,30 @@ def parseCommandLineOptions():
 # Parse the command line options
 options = parseCommandLineOptions();
 
+# Serve the metrics on a local HTTP endpoint, if requested
+metricsServer = startMetricsServer(options.metricsPort);
+
+# Profile the processing stages, and sample the functions of all the threads, if requested
+profiler = startProfiler(options.profile, options.profileOutput, options.profileInterval, options.profileSampling, options.profileTop);
+
 # Create application client
 appClient = initAppClient(options.organizationId, options.applicationId, options.authMethod, 
-                          options.authKey, options.authToken);
+                          options.authKey, options.authToken, options.broker);
+
+# Write the received events to the event sink, if requested
+eventSink = None;
+
+if options.sinkType:
+    eventSink = createEventSink(options.sinkType, options.sinkDirectory, options.sinkSegmentSize, 
+                                options.sinkFlushSize, options.sinkFlushInterval, options.sinkFsyncInterval);
+
+# Route the events of the subscribed devices to the callback
+handlerIndex = DeviceEventHandlerIndex();
+
+handlerIndex.addHandler(receivedDeviceEventCallback, options.deviceType, options.deviceId, options.deviceEventName);
+
+eventDispatcher = ShardedEventDispatcher(handlerIndex, options.dispatchShards, options.dispatchQueueSize, 
+                                         options.dispatchReportInterval, options.dispatchPolicy, options.dispatchSampleInterval);
 
 # Connect application client
 appClient.connect();
@@ -117,11 +112,48 @@ appClient.connect();
 appClient.subscribeToDeviceEvents(options.deviceType, options.deviceId, options.deviceEventName, 
                                   options.deviceEventFormat);
 
-# Set the callback for device events
-appClient.deviceEventCallback = receivedDeviceEventCallback;
+# Dispatch the device events to their handlers, sharded by device. The time spent by the client thread
+# queuing the events is profiled, the handlers being timed by the dispatcher.
+deviceEventCallback = eventDispatcher.dispatch;
+
+if profiler is not None:
+    deviceEventCallback = profiler.wrap("dispatch", deviceEventCallback);
+
+# Log the received events, if requested
+eventLog = openEventLog(options.eventLog);
+
+if eventLog is not None:
+    deviceEventCallback = eventLog.wrapDeviceEventCallback(deviceEventCallback);
+
+appClient.deviceEventCallback = deviceEventCallback;
 
 # While a key was not pressed wait for new device events
 sys.stdin.readline();
 
 # Disconnect device client
 appClient.disconnect();
+
+# Write the logged events
+if eventLog is not None:
+    eventLog.close();
+
+    print(eventLog.getStatisticsReport());
+
+# Handle the queued events and report the dispatch statistics
+eventDispatcher.close();
+
+print(eventDispatcher.getStatisticsReport());
+
+# Write the buffered events
+if eventSink is not None:
+    eventSink.close();
+
+    print(eventSink.getStatisticsReport());
+
+# Write the profile of the whole run
+if profiler is not None:
+    profiler.close();
+
+# Stop serving the metrics
+if metricsServer is not None:
+    metricsServer.close();
@@ -1,52 +1,23 @@
 #!/usr/bin/env python
 
-import argparse
+import os
 import sys
 
-import ibmiotf.device
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir));
+
+from common.event_log import openEventLog
+from common.gateway_publisher import AttachedDevice, openDeviceRegistry
+from common.message_codecs import getMessageCodec
+from common.metrics import startMetricsServer
+from common.profiler import startProfiler
+from common.runtime import DEVICE_CLIENT, addGatewayArguments, createArgumentParser, initDeviceClient, initGatewayClient, parseArguments
+from common.windowed_publisher import openDeviceClientPublisher, openGatewayClientPublisher
 
 
 # -----------------------------------------------------------------------------
 # Functions
 # -----------------------------------------------------------------------------
 
-def initDeviceClient(organizationId, deviceTypeId, deviceId, authMethod, authToken):
-    """
-        Initialize the device client.
-
-        Args:
-            organizationId: A string instance representing the organization id.
-            deviceTypeId:   A string instance representing the device type id.
-            deviceId:       A string instance representing the device id.
-            authMethod:     A string instance representing the authentication method.
-            authToken:      A string instance representing the authentication token.
-
-        Returns:
-            An instance of ibmiotf.device representing the device client.
-
-        Raises:
-            None.
-    """
-    # Initialize the device client.
-    try:
-        deviceOptions = {
-            "org"           : organizationId, 
-            "type"          : deviceTypeId, 
-            "id"            : deviceId, 
-            "auth-method"   : authMethod, 
-            "auth-token"    : authToken
-        };
-
-        print("Creating device client using options: %s" % str(deviceOptions));
-
-        deviceClient = ibmiotf.device.Client(deviceOptions);
-
-        return deviceClient;
-    except Exception as exception:
-        print("Failed to create device client: %s" % str(exception));
-
-        sys.exit(1);
-
 def getDeviceEventPayload():
     """
         Get a dictionary instance representing the device event payload.
@@ -79,18 +50,19 @@ def parseCommandLineOptions():
         Raises:
             arparse.error if one of the required command line options is missing.
     """
-    parser = argparse.ArgumentParser();
+    parser = createArgumentParser(DEVICE_CLIENT);
 
-    parser.add_argument("-o", "--organization-id", action="store", required=True, dest="organizationId");
-    parser.add_argument("-t", "--device-type", action="store", required=True, dest="deviceType");
-    parser.add_argument("-i", "--device-id", action="store", required=True, dest="deviceId");
-    parser.add_argument("-m", "--auth-method", action="store", required=True, dest="authMethod");
-    parser.add_argument("-a", "--auth-token", action="store", required=True, dest="authToken");
-    parser.add_argument("-e", "--device-event-name", action="store", required=True, dest="deviceEventName");
-    parser.add_argument("-f", "--device-event-format", action="store", required=True, dest="deviceEventFormat");
+    addGatewayArguments(parser);
 
     # Parse command line options
-    options = parser.parse_args();
+    options = parseArguments(parser);
+
+    if options.gateway and not options.attachedDevices:
+        parser.error("The gateway mode needs at least one attached device.");
+
+    # The device event payloads are dictionaries, which the raw format cannot carry
+    if not getMessageCodec(options.deviceEventFormat).structured:
+        parser.error("The %s device event format only carries bytes." % options.deviceEventFormat);
 
     return options;
 
@@ -102,20 +74,80 @@ def parseCommandLineOptions():
 # Parse command line options
 options = parseCommandLineOptions();
 
-# Create device client
-deviceClient = initDeviceClient(options.organizationId, options.deviceType, options.deviceId, 
-                                options.authMethod, options.authToken);
+# Serve the metrics on a local HTTP endpoint, if requested
+metricsServer = startMetricsServer(options.metricsPort);
 
-# Connect device client
-deviceClient.connect();
+# Profile the processing stages, and sample the functions of all the threads, if requested
+profiler = startProfiler(options.profile, options.profileOutput, options.profileInterval, options.profileSampling, options.profileTop);
+
+# Create device client, or a gateway client publishing the events of the attached devices
+if options.gateway:
+    client = initGatewayClient(options.organizationId, options.deviceType, options.deviceId, 
+                               options.authMethod, options.authToken, options.broker);
+else:
+    client = initDeviceClient(options.organizationId, options.deviceType, options.deviceId, 
+                              options.authMethod, options.authToken, options.broker);
+
+# Connect client
+client.connect();
+
+# Log the published events, if requested
+eventLog = openEventLog(options.eventLog);
+
+# Publish the events at the requested quality of service, with a bounded number of events in flight
+deviceRegistry = None;
+
+if options.gateway:
+    publisher = openGatewayClientPublisher(client, options.publishWindow, options.qos, options.ackTimeout, eventLog);
+
+    # Register the attached devices which are not cached, if requested
+    if options.registerDevices:
+        deviceRegistry = openDeviceRegistry(client, options.deviceRegistry);
+
+        deviceRegistry.registerDevices(options.attachedDevices);
+
+    devicePublishers = [AttachedDevice(publisher, deviceType, deviceId, deviceRegistry) 
+                        for deviceType, deviceId in options.attachedDevices];
+else:
+    publisher           = openDeviceClientPublisher(client, options.publishWindow, options.qos, options.ackTimeout, eventLog);
+    devicePublishers    = [publisher];
+
+# Time the payload creation, the publication being timed by the publisher
+if profiler is not None:
+    getDeviceEventPayload = profiler.wrap("payload", getDeviceEventPayload);
 
 # Send data whenever the user presses a key different from 'q'
 while sys.stdin.readline() != "q\n":
-    # Prepare data to be sent
-    data = getDeviceEventPayload();
+    # Send data, on behalf of each attached device in gateway mode
+    for devicePublisher in devicePublishers:
+        # Prepare data to be sent
+        data = getDeviceEventPayload();
+
+        # Send data
+        devicePublisher.publishEvent(options.deviceEventName, options.deviceEventFormat, data);
+
+# Wait for the acknowledgement of the events in flight
+publisher.flush();
+
+# Disconnect client
+client.disconnect();
+
+# Close the device registry cache
+if deviceRegistry is not None:
+    deviceRegistry.close();
+
+    print(deviceRegistry.getStatisticsReport());
+
+# Write the logged events
+if eventLog is not None:
+    eventLog.close();
+
+    print(eventLog.getStatisticsReport());
 
-    # Send data
-    deviceClient.publishEvent(options.deviceEventName, options.deviceEventFormat, data);
+# Write the profile of the whole run
+if profiler is not None:
+    profiler.close();
 
-# Disconnect device client
-deviceClient.disconnect();
+# Stop serving the metrics
+if metricsServer is not None:
+    metricsServer.close();